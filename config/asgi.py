@@ -1,10 +1,17 @@
 """
 ASGI config for config project.
+
+Страницы портала учащегося (главная, обращения, консультации, чат) — async-представления:
+под ASGI-сервером они не держат поток на время запросов к БД. Запуск, например:
+  uvicorn config.asgi:application --host 0.0.0.0 --port 8000
 """
 import os
 
 from django.core.asgi import get_asgi_application
 
+from config import warmup
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+warmup.start()
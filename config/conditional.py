@@ -0,0 +1,69 @@
+"""
+Условные ответы HTML-страниц: ETag и Last-Modified из версии показанных данных. Повторный заход и
+переход «назад» получают 304 — без выборки связанных строк и рендеринга шаблона.
+
+Версия объекта — updated_at строки; триггеры БД (миграции 0021, 0022) меняют её при любой записи,
+в том числе в дочерних таблицах (участники, заметки, вложения). Кроме версии объекта ETag учитывает
+пользователя, адрес, CSRF-секрет (формы на странице), дату (бейджи «сегодня») и версию навбара.
+"""
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from config.context_processors import user_profile_version
+
+
+def _timestamp(value):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return int(value.timestamp())
+
+
+def page_etag(request, parts):
+    # Секрет, которым будут подписаны формы страницы: при первом заходе он создаётся здесь, а не при рендеринге
+    get_token(request)
+    common = (
+        request.user.pk, request.get_full_path(), request.META['CSRF_COOKIE'], timezone.now().date(),
+        *user_profile_version(request),
+    )
+    raw = '|'.join(map(str, (*common, *parts)))
+    return '"%s"' % hashlib.sha1(raw.encode()).hexdigest()
+
+
+def conditional_page(version):
+    """
+    Декоратор GET-представления страницы. version(request, *args, **kwargs) — кортеж значений, от которых
+    зависит страница (datetime среди них дают Last-Modified), или None: объекта нет, отвечает само
+    представление (обычно 404). Страница с непоказанными сообщениями (messages) всегда рендерится.
+    """
+    def decorator(view):
+        @wraps(view)
+        def _wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+                return view(request, *args, **kwargs)
+            parts = version(request, *args, **kwargs)
+            if parts is None:
+                return view(request, *args, **kwargs)
+            etag = page_etag(request, parts)
+            moments = [_timestamp(part) for part in parts if isinstance(part, datetime)]
+            last_modified = max(moments) if moments else None
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified)
+            response['ETag'] = etag
+            # Браузер хранит страницу, но перед показом всегда спрашивает сервер
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return _wrapped
+    return decorator
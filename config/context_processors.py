@@ -4,6 +4,8 @@ def user_profile(request):
         unread_student_chat_messages = 0
         if request.user.role_name in ('psychologist', 'admin'):
             from django.db.models import OuterRef, Exists
+            from django.conf import settings
+            from consultations import partitions
             from consultations.models import ChatMessage, ChatMessageRead
             qs = (
                 ChatMessage.objects
@@ -13,12 +15,17 @@ def user_profile(request):
                     read_by_me=Exists(
                         ChatMessageRead.objects.filter(
                             message_id=OuterRef('pk'),
+                            message_created_at=OuterRef('created_at'),
                             user_id=request.user.id,
                         )
                     )
                 )
                 .filter(read_by_me=False)
             )
+            since = partitions.recent_since(settings.CHAT_RECENT_MONTHS)
+            if since is not None:
+                # Счётчик в навбаре на каждой странице: только секции окна, а не вся история чатов
+                qs = qs.filter(created_at__gte=since)
             if request.user.role_name == 'psychologist':
                 qs = qs.filter(chat__psychologist_id=request.user.id)
             unread_student_chat_messages = qs.count()
@@ -27,3 +34,28 @@ def user_profile(request):
             'unread_student_chat_messages': unread_student_chat_messages,
         }
     return {'user_profile': None, 'unread_student_chat_messages': 0}
+
+
+def user_profile_version(request):
+    """
+    Версия данных user_profile для условных ответов (config/conditional.py): счётчик непрочитанного
+    меняется с новым сообщением (оно сохраняет updated_at чата) и с отметками прочтения пользователя.
+    """
+    if not request.user.is_authenticated or request.user.role_name not in ('psychologist', 'admin'):
+        return ()
+    from django.db.models import Max, Subquery
+    from django.conf import settings
+    from consultations import partitions
+    from consultations.models import ChatMessageRead, StudentPsychologistChat
+    chats = StudentPsychologistChat.objects.all()
+    if request.user.role_name == 'psychologist':
+        chats = chats.filter(psychologist_id=request.user.id)
+    reads = ChatMessageRead.objects.filter(user_id=request.user.id)
+    since = partitions.recent_since(settings.CHAT_RECENT_MONTHS)
+    if since is not None:
+        reads = reads.filter(message_created_at__gte=since)
+    state = chats.aggregate(
+        chats=Max('updated_at'),
+        reads=Max(Subquery(reads.order_by('-read_at').values('read_at')[:1])),
+    )
+    return state['chats'], state['reads']
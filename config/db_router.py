@@ -0,0 +1,247 @@
+"""
+Чтение отчётов и выгрузок с реплики БД (алиас replica, включается настройками REPLICA_DB_*).
+Реплику используют только представления с ReplicaReadMixin и только пока это безопасно:
+- после собственной записи пользователя (в этом же запросе или в течение REPLICA_STICKY_SECONDS
+  после изменяющего запроса — метка в cookie) чтение идёт с основной БД;
+- внутри транзакции на основной БД — тоже с основной;
+- если реплика недоступна или отстаёт больше REPLICA_MAX_LAG_SECONDS, она на REPLICA_CHECK_SECONDS
+  считается выключенной; ошибка реплики посреди запроса — повтор представления на основной БД.
+Запись и миграции всегда идут в default.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db_pin'
+STATE_CHANGING_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_state = ContextVar('replica_state', default=None)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def replica_alias():
+    """Алиас реплики, если она настроена, иначе None."""
+    alias = _setting('REPLICA_DB_ALIAS', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+class _RequestState:
+    """Состояние маршрутизации одного HTTP-запроса."""
+
+    def __init__(self):
+        self.use_replica = False
+        self.wrote = False
+        self.replica_reads = 0
+
+
+# ——— Проверка реплики ———
+
+class _ReplicaHealth:
+    """Кэш состояния реплики в процессе: проверка не чаще раза в REPLICA_CHECK_SECONDS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._healthy = False
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at and now - self._checked_at < _setting('REPLICA_CHECK_SECONDS', 10):
+                return self._healthy
+            self._checked_at = now
+        healthy = self._check(alias)
+        with self._lock:
+            self._healthy = healthy
+        return healthy
+
+    def mark_down(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            self._healthy = False
+
+    def _check(self, alias):
+        try:
+            lag = replica_lag(alias)
+        except DatabaseError as e:
+            logger.warning('Реплика %s недоступна, чтение идёт с основной БД: %s', alias, e)
+            return False
+        if lag is not None and lag > _setting('REPLICA_MAX_LAG_SECONDS', 30):
+            logger.warning('Реплика %s отстаёт на %.1f с, чтение идёт с основной БД', alias, lag)
+            return False
+        return True
+
+
+health = _ReplicaHealth()
+
+
+def replica_lag(alias):
+    """
+    Отставание реплики в секундах. 0 — реплика догнала основную БД или это не standby
+    (например, вторая локальная БД для проверки); None — оценить нельзя.
+    """
+    conn = connections[alias]
+    conn.ensure_connection()
+    if conn.vendor != 'postgresql':
+        return 0.0
+    with conn.cursor() as c:
+        c.execute(
+            """
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+            END
+            """
+        )
+        value = c.fetchone()[0]
+    return float(value) if value is not None else None
+
+
+# ——— Роутер ———
+
+class ReplicaRouter:
+    """DATABASE_ROUTERS: чтение с реплики только внутри read_from_replica(), всё остальное — default."""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.wrote:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        alias = replica_alias()
+        if alias is None:
+            return None
+        state.replica_reads += 1
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            # Дальше в этом запросе пользователь должен видеть свою запись
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия default: объекты с обеих БД относятся к одним таблицам
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica_alias():
+            return False
+        return None
+
+
+def _is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+@contextmanager
+def read_from_replica(request=None):
+    """Чтение ORM внутри блока идёт с реплики, если она настроена, здорова и пользователь не «прикреплён»."""
+    state = _state.get()
+    owned = state is None
+    if owned:
+        state = _RequestState()
+        token = _state.set(state)
+    previous = state.use_replica
+    alias = replica_alias()
+    state.use_replica = bool(
+        alias
+        and not (request is not None and _is_pinned(request))
+        and health.is_healthy(alias)
+    )
+    try:
+        yield state
+    finally:
+        state.use_replica = previous
+        if owned:
+            _state.reset(token)
+
+
+class ReplicaReadMixin:
+    """
+    Для представлений только на чтение (отчёты, выгрузки). Ставится после миксина доступа,
+    чтобы проверка прав читала пользователя с основной БД. Ответ рендерится внутри блока,
+    поэтому ленивые querysets шаблона тоже читают с реплики.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with read_from_replica(request) as state:
+            if not state.use_replica:
+                return super().dispatch(request, *args, **kwargs)
+            try:
+                response = super().dispatch(request, *args, **kwargs)
+                if hasattr(response, 'render') and not response.is_rendered:
+                    response.render()
+                return response
+            except DatabaseError:
+                if not state.replica_reads or state.wrote:
+                    raise
+                logger.exception('Ошибка чтения с реплики, повтор на основной БД: %s', request.path)
+                health.mark_down()
+                state.use_replica = False
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ReplicaPinMiddleware:
+    """
+    После изменяющего запроса ставит cookie db_pin: следующие REPLICA_STICKY_SECONDS секунд
+    этот пользователь читает с основной БД (реплика могла ещё не получить его изменения).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if replica_alias() is None:
+            return self.get_response(request)
+        state = _RequestState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._pin(request, response, state)
+
+    async def __acall__(self, request):
+        if replica_alias() is None:
+            return await self.get_response(request)
+        state = _RequestState()
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._pin(request, response, state)
+
+    def _pin(self, request, response, state):
+        if state.wrote or request.method in STATE_CHANGING_METHODS:
+            sticky = _setting('REPLICA_STICKY_SECONDS', 10)
+            response.set_cookie(
+                PIN_COOKIE, f'{time.time() + sticky:.0f}', max_age=sticky,
+                httponly=True, samesite='Lax', secure=request.is_secure(),
+            )
+        return response
@@ -0,0 +1,300 @@
+"""
+Профилирование HTTP-запросов: число SQL-запросов и время БД (через connection.execute_wrapper),
+самые медленные запросы, повторяющиеся «отпечатки» SQL (кандидаты N+1) и время рендеринга шаблонов.
+Запросы сверх бюджета пишутся в лог; агрегаты по имени URL периодически сбрасываются в таблицу
+request_profiles, откуда их показывает страница администратора; время ответа и SQL передаются
+также в config.metrics (эндпоинт /metrics).
+"""
+import atexit
+import heapq
+import logging
+import re
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection, connections
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger('instrumentation')
+
+SLOWEST_KEPT = 5
+SQL_TEXT_LIMIT = 2000
+
+_current = ContextVar('request_stats', default=None)
+
+_FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,?)+\)', re.I), 'IN (…)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def fingerprint(sql):
+    """SQL без литералов и с одинаковыми IN-списками: один отпечаток на «одинаковый» запрос."""
+    for pattern, replacement in _FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class RequestStats:
+    """Счётчики одного HTTP-запроса; экземпляр служит и обёрткой execute_wrapper."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.slowest = []
+        self.fingerprints = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.queries += 1
+            self.db_ms += elapsed
+            item = (elapsed, sql.strip()[:SQL_TEXT_LIMIT])
+            if len(self.slowest) < SLOWEST_KEPT:
+                heapq.heappush(self.slowest, item)
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, item)
+            fp = fingerprint(sql)
+            count, total = self.fingerprints.get(fp, (0, 0.0))
+            self.fingerprints[fp] = (count + 1, total + elapsed)
+
+    def repeated(self, threshold):
+        """Отпечатки, выполненные не менее threshold раз: [(отпечаток, число, мс)], самые частые первыми."""
+        rows = [(fp, count, total) for fp, (count, total) in self.fingerprints.items() if count >= threshold]
+        return sorted(rows, key=lambda row: -row[1])
+
+    def slowest_statements(self):
+        return sorted(self.slowest, reverse=True)
+
+
+# ——— Время рендеринга шаблонов ———
+
+class _TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_ms += (time.perf_counter() - started) * 1000
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Бэкенд шаблонов Django, который добавляет время рендеринга к статистике текущего запроса."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name).template, self)
+
+
+# ——— Агрегаты по имени URL ———
+
+class ProfileBuffer:
+    """Агрегаты процесса по (имя URL, метод); раз в INSTRUMENTATION_FLUSH_SECONDS добавляются в request_profiles."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._last_flush = time.monotonic()
+
+    def add(self, url_name, method, total_ms, stats, over_budget, repeated):
+        key = (url_name, method)
+        slowest = stats.slowest_statements()[:1]
+        top = repeated[:1]
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                row = self._rows[key] = {
+                    'requests': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'db_ms': 0.0, 'queries': 0, 'max_queries': 0,
+                    'template_ms': 0.0, 'over_budget': 0, 'n_plus_one': 0,
+                    'slowest_sql': None, 'slowest_sql_ms': 0.0, 'top_fingerprint': None, 'top_fingerprint_count': 0,
+                }
+            row['requests'] += 1
+            row['total_ms'] += total_ms
+            row['max_ms'] = max(row['max_ms'], total_ms)
+            row['db_ms'] += stats.db_ms
+            row['queries'] += stats.queries
+            row['max_queries'] = max(row['max_queries'], stats.queries)
+            row['template_ms'] += stats.template_ms
+            row['over_budget'] += int(over_budget)
+            row['n_plus_one'] += int(bool(repeated))
+            if slowest and slowest[0][0] > row['slowest_sql_ms']:
+                row['slowest_sql_ms'], row['slowest_sql'] = slowest[0]
+            if top and top[0][1] > row['top_fingerprint_count']:
+                row['top_fingerprint'], row['top_fingerprint_count'] = top[0][0][:SQL_TEXT_LIMIT], top[0][1]
+
+    def pending(self):
+        with self._lock:
+            return {key: dict(row) for key, row in self._rows.items()}
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= _setting('INSTRUMENTATION_FLUSH_SECONDS', 60):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, {}
+            self._last_flush = time.monotonic()
+        if not rows:
+            return
+        try:
+            save_profiles(rows)
+        except Exception:
+            logger.exception('Не удалось сохранить профили запросов')
+
+
+_UPSERT_SQL = """
+INSERT INTO request_profiles (
+    url_name, method, day, requests, total_ms, max_ms, db_ms, queries, max_queries, template_ms,
+    over_budget, n_plus_one, slowest_sql, slowest_sql_ms, top_fingerprint, top_fingerprint_count
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (url_name, method, day) DO UPDATE SET
+    requests = request_profiles.requests + EXCLUDED.requests,
+    total_ms = request_profiles.total_ms + EXCLUDED.total_ms,
+    max_ms = {greatest}(request_profiles.max_ms, EXCLUDED.max_ms),
+    db_ms = request_profiles.db_ms + EXCLUDED.db_ms,
+    queries = request_profiles.queries + EXCLUDED.queries,
+    max_queries = {greatest}(request_profiles.max_queries, EXCLUDED.max_queries),
+    template_ms = request_profiles.template_ms + EXCLUDED.template_ms,
+    over_budget = request_profiles.over_budget + EXCLUDED.over_budget,
+    n_plus_one = request_profiles.n_plus_one + EXCLUDED.n_plus_one,
+    slowest_sql = CASE WHEN EXCLUDED.slowest_sql_ms > request_profiles.slowest_sql_ms
+        THEN EXCLUDED.slowest_sql ELSE request_profiles.slowest_sql END,
+    slowest_sql_ms = {greatest}(request_profiles.slowest_sql_ms, EXCLUDED.slowest_sql_ms),
+    top_fingerprint = CASE WHEN EXCLUDED.top_fingerprint_count > request_profiles.top_fingerprint_count
+        THEN EXCLUDED.top_fingerprint ELSE request_profiles.top_fingerprint END,
+    top_fingerprint_count = {greatest}(request_profiles.top_fingerprint_count, EXCLUDED.top_fingerprint_count)
+"""
+
+
+def save_profiles(rows):
+    """Добавляет агрегаты к строкам request_profiles за текущий день (upsert по имени URL и методу)."""
+    greatest = 'MAX' if connection.vendor == 'sqlite' else 'GREATEST'
+    sql = _UPSERT_SQL.format(greatest=greatest)
+    day = timezone.localdate() if settings.USE_TZ else timezone.now().date()
+    with connection.cursor() as c:
+        c.executemany(sql, [
+            [
+                url_name, method, day, row['requests'], row['total_ms'], row['max_ms'], row['db_ms'],
+                row['queries'], row['max_queries'], row['template_ms'], row['over_budget'], row['n_plus_one'],
+                row['slowest_sql'], row['slowest_sql_ms'], row['top_fingerprint'], row['top_fingerprint_count'],
+            ]
+            for (url_name, method), row in rows.items()
+        ])
+
+
+profile_buffer = ProfileBuffer()
+atexit.register(profile_buffer.flush)
+
+
+# ——— Middleware ———
+
+def _url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match and match.view_name else '—'
+
+
+class SQLInstrumentationMiddleware:
+    """
+    Профилирует каждый запрос; включается INSTRUMENTATION_ENABLED. Работает и под WSGI, и под ASGI:
+    в async-цепочке запись профиля (может обратиться к БД) выполняется через sync_to_async.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not _setting('INSTRUMENTATION_ENABLED', True):
+            started = time.perf_counter()
+            response = self.get_response(request)
+            metrics.observe_request(
+                _url_name(request), request.method, response.status_code, time.perf_counter() - started,
+            )
+            return response
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+        self._record(request, response, total_ms, stats)
+        return response
+
+    async def __acall__(self, request):
+        if not _setting('INSTRUMENTATION_ENABLED', True):
+            started = time.perf_counter()
+            response = await self.get_response(request)
+            metrics.observe_request(
+                _url_name(request), request.method, response.status_code, time.perf_counter() - started,
+            )
+            return response
+        # Соединения и ContextVar общие для event loop и потоков sync_to_async этого запроса
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(stats))
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+        await sync_to_async(self._record)(request, response, total_ms, stats)
+        return response
+
+    def _record(self, request, response, total_ms, stats):
+        url_name = _url_name(request)
+        repeated = stats.repeated(_setting('INSTRUMENTATION_REPEAT_THRESHOLD', 10))
+        problems = []
+        if stats.queries > _setting('INSTRUMENTATION_QUERY_BUDGET', 50):
+            problems.append(f'SQL-запросов: {stats.queries}')
+        if stats.db_ms > _setting('INSTRUMENTATION_DB_TIME_BUDGET_MS', 300):
+            problems.append(f'время БД: {stats.db_ms:.0f} мс')
+        if total_ms > _setting('INSTRUMENTATION_TIME_BUDGET_MS', 1000):
+            problems.append(f'время ответа: {total_ms:.0f} мс')
+        if repeated:
+            problems.append(f'повторяющихся запросов: {len(repeated)}')
+        if problems:
+            details = [f'{request.method} {request.path} [{url_name}] {response.status_code}: ' + ', '.join(problems)]
+            details += [f'  N+1 ×{count} ({total:.0f} мс): {fp[:300]}' for fp, count, total in repeated[:3]]
+            details += [f'  медленный ({ms:.0f} мс): {sql[:300]}' for ms, sql in stats.slowest_statements()[:2]]
+            logger.warning('\n'.join(details))
+        profile_buffer.add(url_name, request.method, total_ms, stats, bool(problems), repeated)
+        profile_buffer.maybe_flush()
+        metrics.observe_request(
+            url_name, request.method, response.status_code, total_ms / 1000, stats.queries, stats.db_ms / 1000,
+        )
@@ -0,0 +1,461 @@
+"""
+Метрики в текстовом формате Prometheus без внешних библиотек. Каждый процесс WSGI копит счётчики
+и гистограммы в памяти и периодически записывает их в METRICS_DIR/<pid>-<старт>.json; эндпоинт
+/metrics суммирует файлы всех процессов, поэтому ответ не зависит от того, какой воркер его отдал.
+Файлы завершившихся процессов сворачиваются в archive.json, чтобы счётчики не уменьшались.
+Показатели состояния (непрочитанные сообщения, обращения по статусам, идущий бэкап) считаются при запросе.
+"""
+import atexit
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+logger = logging.getLogger('metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+ARCHIVE_FILENAME = 'archive.json'
+LOCK_FILENAME = '.archive.lock'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+JOB_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class Metric:
+    def __init__(self, name, kind, help_text, labels=(), buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) if buckets else None
+
+
+REGISTRY = {}
+
+
+def _register(name, kind, help_text, labels=(), buckets=None):
+    REGISTRY[name] = Metric(name, kind, help_text, labels, buckets)
+    return name
+
+
+HTTP_REQUESTS = _register(
+    'app_http_requests_total', 'counter', 'HTTP-запросы по имени URL, методу и коду ответа.',
+    ('view', 'method', 'status'),
+)
+HTTP_LATENCY = _register(
+    'app_http_request_duration_seconds', 'histogram', 'Время ответа по имени URL и методу.',
+    ('view', 'method'), LATENCY_BUCKETS,
+)
+DB_QUERIES = _register('app_db_queries_total', 'counter', 'SQL-запросы, выполненные при обработке HTTP-запросов.', ('view',))
+DB_TIME = _register(
+    'app_db_request_duration_seconds', 'histogram', 'Суммарное время SQL за один HTTP-запрос.',
+    ('view',), DB_TIME_BUCKETS,
+)
+EXPORT_DURATION = _register(
+    'app_export_duration_seconds', 'histogram', 'Время формирования выгрузок PDF/Excel.', ('export', 'status'), LATENCY_BUCKETS,
+)
+JOB_DURATION = _register(
+    'app_backup_job_duration_seconds', 'histogram', 'Длительность резервного копирования и проверки восстановления.',
+    ('operation', 'result'), JOB_BUCKETS,
+)
+CACHE_REQUESTS = _register('app_cache_requests_total', 'counter', 'Обращения к кэшам по результату (hit/miss).', ('cache', 'result'))
+# Пул соединений (config/postgresql_pool): показатели процесса суммируются по живым процессам
+DB_POOL_CONNECTIONS = _register(
+    'app_db_pool_connections', 'gauge', 'Соединения пула: открытые (size), свободные (idle), предел (max).', ('db', 'state'),
+)
+DB_POOL_WAITING = _register('app_db_pool_waiting', 'gauge', 'Запросы, ждущие свободного соединения пула.', ('db',))
+DB_POOL_REQUESTS = _register('app_db_pool_requests_total', 'counter', 'Выдачи соединений из пула.', ('db',))
+DB_POOL_WAIT_TIME = _register('app_db_pool_wait_seconds_total', 'counter', 'Суммарное ожидание соединения из пула.', ('db',))
+DB_POOL_ERRORS = _register(
+    'app_db_pool_errors_total', 'counter',
+    'Ошибки пула: таймаут ожидания, ошибка подключения, потерянное и возвращённое сломанным соединение.', ('db', 'kind'),
+)
+
+# Функции collector(store), которые дополняют значения процесса перед записью в файл (например, статистикой пула)
+_collectors = []
+
+
+def register_collector(func):
+    if func not in _collectors:
+        _collectors.append(func)
+    return func
+
+
+# ——— Значения процесса ———
+
+class _Store:
+    """Счётчики и гистограммы текущего процесса. Ключ — (метрика, значения меток)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        self.filename = f'{os.getpid()}-{int(time.time())}.json'
+        self.pid = os.getpid()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            self.dirty = True
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self.values[(name, labels)] = value
+            self.dirty = True
+
+    def observe(self, name, labels, value):
+        buckets = REGISTRY[name].buckets
+        key = (name, labels)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            entry['buckets'][index] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+            self.dirty = True
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                [name, list(labels), value if not isinstance(value, dict) else dict(value, buckets=list(value['buckets']))]
+                for (name, labels), value in self.values.items()
+            ]
+
+
+_store = _Store()
+
+
+def _current_store():
+    """После fork (gunicorn --preload) у воркера должен быть свой файл и пустые значения."""
+    global _store
+    if _store.pid != os.getpid():
+        _store = _Store()
+    return _store
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def _labels(metric_name, values):
+    return tuple(str(values.get(label, '')) for label in REGISTRY[metric_name].labels)
+
+
+def inc(metric_name, amount=1, **labels):
+    if enabled():
+        store = _current_store()
+        store.inc(metric_name, _labels(metric_name, labels), amount)
+        _maybe_flush(store)
+
+
+def observe(metric_name, value, **labels):
+    if enabled():
+        store = _current_store()
+        store.observe(metric_name, _labels(metric_name, labels), value)
+        _maybe_flush(store)
+
+
+def record_cache(cache, hit):
+    """Учитывает обращение к кэшу; доля попаданий выводится метрикой app_cache_hit_ratio."""
+    inc(CACHE_REQUESTS, cache=cache, result='hit' if hit else 'miss')
+
+
+def observe_request(view, method, status, seconds, queries=None, db_seconds=None):
+    """Вызывается middleware профилирования после каждого запроса."""
+    if not enabled():
+        return
+    store = _current_store()
+    store.inc(HTTP_REQUESTS, (view, method, str(status)))
+    store.observe(HTTP_LATENCY, (view, method), seconds)
+    if queries is not None:
+        store.inc(DB_QUERIES, (view,), queries)
+        store.observe(DB_TIME, (view,), db_seconds or 0.0)
+    # Выгрузки PDF/Excel формируются синхронно, их время — это время ответа представлений export_*
+    if view.split(':')[-1].startswith('export_'):
+        store.observe(EXPORT_DURATION, (view.split(':')[-1], str(status)), seconds)
+    _maybe_flush(store)
+
+
+# ——— Файлы процессов ———
+
+def get_metrics_dir():
+    path = Path(getattr(settings, 'METRICS_DIR', settings.BASE_DIR / 'metrics'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _write_json(path, data):
+    tmp_path = path.with_name(path.name + f'.{os.getpid()}.tmp')
+    tmp_path.write_text(json.dumps(data), encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+def _maybe_flush(store):
+    if time.monotonic() - store.last_flush >= getattr(settings, 'METRICS_FLUSH_SECONDS', 5):
+        flush()
+
+
+def flush():
+    """Записывает значения текущего процесса в его файл (целиком, атомарной заменой)."""
+    store = _current_store()
+    for collector in _collectors:
+        try:
+            collector(store)
+        except Exception:
+            logger.exception('Ошибка сборщика метрик %s', collector)
+    if not store.dirty:
+        return
+    store.dirty = False
+    store.last_flush = time.monotonic()
+    try:
+        _write_json(get_metrics_dir() / store.filename, {'pid': store.pid, 'values': store.snapshot()})
+    except OSError:
+        store.dirty = True
+        logger.exception('Не удалось записать метрики процесса')
+
+
+atexit.register(flush)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _read_json(path):
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(total, values):
+    for name, labels, value in values:
+        if name not in REGISTRY:
+            continue
+        key = (name, tuple(labels))
+        if isinstance(value, dict):
+            entry = total.get(key)
+            if entry is None or len(entry['buckets']) != len(value['buckets']):
+                total[key] = {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+            else:
+                entry['buckets'] = [a + b for a, b in zip(entry['buckets'], value['buckets'])]
+                entry['sum'] += value['sum']
+                entry['count'] += value['count']
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def _counters_only(values):
+    """Показатели (gauge) завершившегося процесса больше не действуют — в сумму идут только счётчики."""
+    return [item for item in values if item[0] in REGISTRY and REGISTRY[item[0]].kind != 'gauge']
+
+
+def _as_list(total):
+    return [[name, list(labels), value] for (name, labels), value in total.items()]
+
+
+def _archive_dead(metrics_dir, dead_files):
+    """Переносит значения завершившихся процессов в archive.json (под файловой блокировкой)."""
+    lock_path = metrics_dir / LOCK_FILENAME
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        # Блокировку оставил упавший процесс — снимаем, свёртка будет при следующем запросе
+        try:
+            if time.time() - lock_path.stat().st_mtime > 60:
+                lock_path.unlink(missing_ok=True)
+        except OSError:
+            pass
+        return
+    os.close(fd)
+    try:
+        archive = {}
+        _merge(archive, (_read_json(metrics_dir / ARCHIVE_FILENAME) or {}).get('values', []))
+        for path in dead_files:
+            data = _read_json(path)
+            if data:
+                _merge(archive, _counters_only(data.get('values', [])))
+        _write_json(metrics_dir / ARCHIVE_FILENAME, {'values': _as_list(archive)})
+        for path in dead_files:
+            path.unlink(missing_ok=True)
+    finally:
+        lock_path.unlink(missing_ok=True)
+
+
+def collect():
+    """Сумма значений всех процессов (живых и архивных)."""
+    flush()
+    metrics_dir = get_metrics_dir()
+    total = {}
+    dead = []
+    for path in metrics_dir.glob('*-*.json'):
+        data = _read_json(path)
+        if not data:
+            continue
+        # В Windows os.kill(pid, 0) завершает процесс, поэтому проверяем живость только в POSIX
+        if os.name == 'posix' and not _pid_alive(int(data.get('pid', 0))):
+            dead.append(path)
+            _merge(total, _counters_only(data.get('values', [])))
+            continue
+        _merge(total, data.get('values', []))
+    _merge(total, (_read_json(metrics_dir / ARCHIVE_FILENAME) or {}).get('values', []))
+    if dead:
+        _archive_dead(metrics_dir, dead)
+    return total
+
+
+# ——— Показатели состояния ———
+
+def collect_gauges():
+    """[(имя, справка, [(метки, значение)])] — считается из БД и файлов состояния на момент запроса."""
+    from django.db.models import Count, Exists, OuterRef
+    from consultations import backups, partitions
+    from consultations.attachments import store_usage
+    from consultations.models import ChatMessage, ChatMessageRead, Request
+
+    gauges = []
+    requests = Request.objects.values('status__name').annotate(n=Count('id')).order_by()
+    gauges.append((
+        'app_requests', 'Обращения по статусам.',
+        [({'status': row['status__name'] or ''}, row['n']) for row in requests],
+    ))
+    # Непрочитанные — в окне CHAT_RECENT_MONTHS, как и в самих чатах: старые секции chat_messages не читаются
+    messages = ChatMessage.objects.all()
+    since = partitions.recent_since(settings.CHAT_RECENT_MONTHS)
+    if since is not None:
+        messages = messages.filter(created_at__gte=since)
+    unread_by_staff = (
+        messages.filter(author__role__name='student')
+        .annotate(read=Exists(ChatMessageRead.objects.filter(
+            message_id=OuterRef('pk'), message_created_at=OuterRef('created_at'),
+            user_id=OuterRef('chat__psychologist_id'),
+        )))
+        .filter(read=False)
+        .count()
+    )
+    unread_by_students = (
+        messages.exclude(author__role__name='student')
+        .annotate(read=Exists(ChatMessageRead.objects.filter(
+            message_id=OuterRef('pk'), message_created_at=OuterRef('created_at'),
+            user__student_id=OuterRef('chat__student_id'),
+        )))
+        .filter(read=False)
+        .count()
+    )
+    gauges.append((
+        'app_chat_unread_messages', 'Непрочитанные сообщения в чатах за CHAT_RECENT_MONTHS месяцев (по адресату).',
+        [({'recipient': 'psychologist'}, unread_by_staff), ({'recipient': 'student'}, unread_by_students)],
+    ))
+    status = backups.read_status()
+    running = status.get('state') == 'running'
+    gauges.append((
+        'app_backup_jobs_running', 'Идущие фоновые операции с резервными копиями (бэкап/проверка).',
+        [({'operation': status.get('operation') or 'backup'}, int(running))],
+    ))
+    gauges.append(('app_attachment_store_bytes', 'Объём хранилища вложений (уникальные файлы).', [({}, store_usage())]))
+    return gauges
+
+
+# ——— Вывод ———
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def render(total, gauges):
+    lines = []
+    by_metric = {}
+    for (name, labels), value in total.items():
+        by_metric.setdefault(name, []).append((labels, value))
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for labels, value in sorted(by_metric.get(name, []), key=lambda item: item[0]):
+            pairs = list(zip(metric.labels, labels))
+            if metric.kind != 'histogram':
+                lines.append(f'{name}{_format_labels(pairs)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(pairs + [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(pairs)} {_number(value["sum"])}')
+            lines.append(f'{name}_count{_format_labels(pairs)} {value["count"]}')
+
+    cache_totals = {}
+    for labels, value in by_metric.get(CACHE_REQUESTS, []):
+        hits, lookups = cache_totals.get(labels[0], (0, 0))
+        cache_totals[labels[0]] = (hits + (value if labels[1] == 'hit' else 0), lookups + value)
+    lines.append('# HELP app_cache_hit_ratio Доля попаданий в кэш за время работы.')
+    lines.append('# TYPE app_cache_hit_ratio gauge')
+    for cache, (hits, lookups) in sorted(cache_totals.items()):
+        lines.append(f'app_cache_hit_ratio{_format_labels([("cache", cache)])} {_number(hits / lookups if lookups else 0.0)}')
+
+    for name, help_text, samples in gauges:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in samples:
+            lines.append(f'{name}{_format_labels(sorted(labels.items()))} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _client_allowed(request):
+    """Доступ по токену (Authorization: Bearer …) или по IP из METRICS_ALLOWED_IPS; без настроек — закрыто."""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer ') and hmac.compare_digest(header[7:].strip(), token):
+            return True
+    try:
+        client = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    for network in getattr(settings, 'METRICS_ALLOWED_IPS', ()):
+        try:
+            if client in ipaddress.ip_network(network, strict=False):
+                return True
+        except ValueError:
+            logger.warning('Некорректная сеть в METRICS_ALLOWED_IPS: %s', network)
+    return False
+
+
+def metrics_view(request):
+    if not enabled() or not _client_allowed(request):
+        # Не раскрываем наличие эндпоинта
+        raise Http404
+    gauges = []
+    try:
+        gauges = collect_gauges()
+    except Exception:
+        logger.exception('Не удалось получить показатели состояния для /metrics')
+    response = HttpResponse(render(collect(), gauges), content_type=CONTENT_TYPE)
+    response['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,289 @@
+"""
+Keyset-пагинация списков. Страница выбирается условием по значениям сортировки крайней строки
+соседней страницы (?after= / ?before=), а не OFFSET: стоимость не растёт с номером страницы, а вставка
+строк между запросами не сдвигает страницы. Последняя колонка сортировки должна быть уникальной (id).
+
+Общее число строк показывается только для списка без фильтров: в PostgreSQL — оценка pg_class.reltuples
+(для больших таблиц), иначе — точный COUNT, закэшированный на PAGINATION_COUNT_CACHE_SECONDS.
+"""
+import base64
+import binascii
+import json
+from datetime import date, time
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import F, Q
+
+CURSOR_PARAMS = ('after', 'before', 'page')
+
+
+class KeysetPaginator:
+    """Для шаблонов и ListView: размер страницы и общее число строк (None — не считалось)."""
+
+    def __init__(self, per_page, count=None, count_is_estimate=False):
+        self.per_page = per_page
+        self.count = count
+        self.count_is_estimate = count_is_estimate
+
+
+class KeysetPage:
+    """Страница keyset-пагинации: строки и ссылки на соседние страницы с сохранением фильтров."""
+
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, query, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.query = query
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _url(self, **cursor):
+        parts = [self.query] + [f'{key}={value}' for key, value in cursor.items()]
+        return '?' + '&'.join(part for part in parts if part)
+
+    @property
+    def first_url(self):
+        return self._url()
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_cursor) if self.next_cursor else None
+
+    @property
+    def previous_url(self):
+        return self._url(before=self.previous_cursor) if self.previous_cursor else None
+
+
+# ——— Курсоры ———
+
+def _jsonable(value):
+    # isoformat целиком: DjangoJSONEncoder обрезает микросекунды, и равенство по курсору не сработало бы
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_jsonable(v) for v in values], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    """Значения сортировки из курсора или None (нет курсора или он испорчен)."""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) and len(values) == size else None
+
+
+# ——— Порядок и условия ———
+
+def _nullable(model, path):
+    """Может ли колонка сортировки быть NULL (nullable-поле, LEFT JOIN по пути или аннотация)."""
+    opts = model._meta
+    for part in path.split('__'):
+        try:
+            field = opts.get_field(part)
+        except FieldDoesNotExist:
+            return True
+        if getattr(field, 'null', False):
+            return True
+        if field.is_relation and field.related_model:
+            opts = field.related_model._meta
+    return False
+
+
+def parse_ordering(model, ordering):
+    """('-date', '-id') → [(путь, по убыванию, nullable)]."""
+    columns = []
+    for item in ordering:
+        desc = item.startswith('-')
+        path = item.lstrip('-')
+        columns.append((path, desc, _nullable(model, path)))
+    return columns
+
+
+def _order_by(columns, reverse=False):
+    # NULL всегда в конце списка (для обратного прохода — в начале); для NOT NULL колонок
+    # NULLS не пишется, чтобы совпасть с обычными индексами
+    expressions = []
+    for path, desc, nullable in columns:
+        desc = desc != reverse
+        nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+        expr = F(path)
+        expressions.append((expr.desc if desc else expr.asc)(**(nulls if nullable else {})))
+    return expressions
+
+
+def _beyond(path, desc, nullable, value, nulls_last):
+    """Q строк, идущих по этой колонке строго после value (None — таких нет)."""
+    if value is None:
+        return None if nulls_last else Q(**{f'{path}__isnull': False})
+    q = Q(**{f'{path}__{"lt" if desc else "gt"}': value})
+    if nullable and nulls_last:
+        q |= Q(**{f'{path}__isnull': True})
+    return q
+
+
+def _seek(columns, values, reverse=False):
+    """Условие «после курсора» в порядке columns (reverse — «до курсора»)."""
+    clauses = []
+    equal = Q()
+    for (path, desc, nullable), value in zip(columns, values):
+        beyond = _beyond(path, desc != reverse, nullable, value, nulls_last=not reverse)
+        if beyond is not None:
+            clauses.append(equal & beyond)
+        equal &= Q(**{f'{path}__isnull': True}) if value is None else Q(**{path: value})
+    return reduce(or_, clauses) if clauses else Q(pk__in=[])
+
+
+# ——— Общее число строк ———
+
+def total_count(queryset):
+    """(число строк, это оценка) для списка без фильтров; (None, False) — при фильтрах не считается."""
+    if queryset.query.where:
+        return None, False
+    model = queryset.model
+    table = model._meta.db_table
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as c:
+            c.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = c.fetchone()
+        if row and row[0] >= getattr(settings, 'PAGINATION_ESTIMATE_MIN_ROWS', 10000):
+            return int(row[0]), True
+    key = f'pagination:count:{queryset.db}:{table}'
+    count = cache.get(key)
+    if count is None:
+        count = model._default_manager.using(queryset.db).count()
+        cache.set(key, count, getattr(settings, 'PAGINATION_COUNT_CACHE_SECONDS', 300))
+    return count, False
+
+
+# ——— Страница ———
+
+def _query_string(request):
+    query = request.GET.copy()
+    for key in CURSOR_PARAMS:
+        query.pop(key, None)
+    return query.urlencode()
+
+
+def _page_rows(queryset, columns, per_page, after=None, before=None):
+    """Queryset страницы: per_page + 1 строка (лишняя — признак следующей страницы)."""
+    qs = queryset.annotate(**{f'keyset_{i}': F(path) for i, (path, _, _) in enumerate(columns)})
+    if after or before:
+        qs = qs.filter(_seek(columns, after or before, reverse=before is not None))
+    return qs.order_by(*_order_by(columns, reverse=before is not None))[:per_page + 1]
+
+
+def _build_page(request, rows, columns, per_page, after, before, count):
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before is not None:
+        rows.reverse()
+
+    def cursor(obj):
+        return encode_cursor([getattr(obj, f'keyset_{i}') for i in range(len(columns))])
+
+    # Назад от курсора: следующая страница есть всегда, предыдущая — если нашлась лишняя строка
+    has_next = True if before is not None else more
+    has_previous = more if before is not None else after is not None
+    return KeysetPage(
+        rows, KeysetPaginator(per_page, *count), _query_string(request),
+        next_cursor=cursor(rows[-1]) if rows and has_next else None,
+        previous_cursor=cursor(rows[0]) if rows and has_previous else None,
+    )
+
+
+def _cursors(request, columns):
+    after = decode_cursor(request.GET.get('after'), len(columns))
+    before = None if after else decode_cursor(request.GET.get('before'), len(columns))
+    return after, before
+
+
+# Курсор с неверными значениями (подделан или устарел после смены сортировки) — первая страница
+_BAD_CURSOR = (ValidationError, ValueError, TypeError)
+
+
+def paginate(request, queryset, ordering, per_page, with_count=True):
+    """Keyset-страница queryset по ordering (последняя колонка уникальна); with_count=False — без «Всего»."""
+    columns = parse_ordering(queryset.model, ordering)
+    after, before = _cursors(request, columns)
+    try:
+        rows = list(_page_rows(queryset, columns, per_page, after, before))
+    except _BAD_CURSOR:
+        if not (after or before):
+            raise
+        after = before = None
+        rows = list(_page_rows(queryset, columns, per_page))
+    count = total_count(queryset) if with_count else (None, False)
+    return _build_page(request, rows, columns, per_page, after, before, count)
+
+
+async def apaginate(request, queryset, ordering, per_page):
+    """paginate для async-представлений."""
+    columns = parse_ordering(queryset.model, ordering)
+    after, before = _cursors(request, columns)
+    try:
+        rows = [obj async for obj in _page_rows(queryset, columns, per_page, after, before)]
+    except _BAD_CURSOR:
+        if not (after or before):
+            raise
+        after = before = None
+        rows = [obj async for obj in _page_rows(queryset, columns, per_page)]
+    count = await sync_to_async(total_count)(queryset)
+    return _build_page(request, rows, columns, per_page, after, before, count)
+
+
+def page_context(page):
+    """Ключи контекста, как у ListView: paginator, page_obj, is_paginated, object_list."""
+    return {
+        'paginator': page.paginator,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'object_list': page.object_list,
+    }
+
+
+class KeysetPaginationMixin:
+    """
+    Для ListView: keyset_ordering (или get_keyset_ordering) задаёт порядок строк, последняя колонка —
+    уникальная. В контексте page_obj — KeysetPage (шаблон pagination.html показывает «назад/вперёд»).
+    """
+    keyset_ordering = None
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        page = paginate(self.request, queryset, self.get_keyset_ordering(), page_size)
+        return page.paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,5 @@
+"""
+Бэкенд PostgreSQL с пулом соединений psycopg_pool (ENGINE = 'config.postgresql_pool').
+В Django 4.2 встроенного пула нет, поэтому бэкенд наследует django.db.backends.postgresql
+и берёт соединения из ConnectionPool; параметры пула — DATABASES[...]['OPTIONS']['pool'].
+"""
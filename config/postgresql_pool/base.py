@@ -0,0 +1,153 @@
+import atexit
+import logging
+import os
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.utils.asyncio import async_unsafe
+from psycopg import IsolationLevel
+
+from config import metrics
+
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError as e:
+    raise ImproperlyConfigured(
+        'Для ENGINE config.postgresql_pool нужен пакет psycopg_pool (pip install "psycopg[pool]").'
+    ) from e
+
+logger = logging.getLogger(__name__)
+
+# Пулы процесса: {алиас: пул}. После fork у воркера свои пулы — потоки пула родителя в нём не работают.
+_pools = {}
+_pools_pid = os.getpid()
+_pools_lock = threading.Lock()
+# Пулы родителя после fork не закрываются (их сокеты общие с родителем) — только удерживаются от сборщика
+_inherited = []
+
+
+def _process_pools():
+    global _pools, _pools_pid
+    if _pools_pid != os.getpid():
+        _inherited.extend(_pools.values())
+        _pools = {}
+        _pools_pid = os.getpid()
+    return _pools
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _process_pools().values():
+            pool.close()
+        _pools.clear()
+
+
+atexit.register(close_pools)
+
+
+def _collect_pool_metrics(store):
+    """Статистика пулов процесса для /metrics: размеры — показателями, события — счётчиками."""
+    for alias, pool in list(_process_pools().items()):
+        stats = pool.pop_stats()
+        store.set(metrics.DB_POOL_CONNECTIONS, (alias, 'size'), stats.get('pool_size', 0))
+        store.set(metrics.DB_POOL_CONNECTIONS, (alias, 'idle'), stats.get('pool_available', 0))
+        store.set(metrics.DB_POOL_CONNECTIONS, (alias, 'max'), stats.get('pool_max', 0))
+        store.set(metrics.DB_POOL_WAITING, (alias,), stats.get('requests_waiting', 0))
+        store.inc(metrics.DB_POOL_REQUESTS, (alias,), stats.get('requests_num', 0))
+        store.inc(metrics.DB_POOL_WAIT_TIME, (alias,), stats.get('requests_wait_ms', 0) / 1000)
+        for kind, key in (
+            ('timeout', 'requests_errors'),
+            ('connect', 'connections_errors'),
+            ('lost', 'connections_lost'),
+            ('bad_return', 'returns_bad'),
+        ):
+            store.inc(metrics.DB_POOL_ERRORS, (alias, kind), stats.get(key, 0))
+
+
+metrics.register_collector(_collect_pool_metrics)
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    """
+    Соединения берутся из пула при connect() и возвращаются в него при close(), то есть в конце
+    каждого запроса (CONN_MAX_AGE должен быть 0). Часовой пояс и роль настраиваются один раз —
+    при открытии физического соединения пулом, а не при каждой выдаче.
+    """
+
+    @property
+    def pool(self):
+        pool_options = self.settings_dict['OPTIONS'].get('pool')
+        if self.alias == NO_DB_ALIAS or not pool_options:
+            return None
+        pools = _process_pools()
+        pool = pools.get(self.alias)
+        if pool is not None:
+            return pool
+        if self.settings_dict['CONN_MAX_AGE'] != 0:
+            raise ImproperlyConfigured('С пулом соединений CONN_MAX_AGE должен быть 0: соединение держит пул, а не поток.')
+        if pool_options is True:
+            pool_options = {}
+        with _pools_lock:
+            pool = pools.get(self.alias)
+            if pool is None:
+                pool = ConnectionPool(
+                    kwargs=self.get_connection_params(),
+                    open=False,
+                    configure=self._configure_connection,
+                    check=ConnectionPool.check_connection if self.settings_dict['CONN_HEALTH_CHECKS'] else None,
+                    name=self.alias,
+                    **pool_options,
+                )
+                pool.open()
+                pools[self.alias] = pool
+        return pool
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    def _configure_connection(self, connection):
+        """Вызывается пулом для каждого нового физического соединения; должен оставить его без транзакции."""
+        timezone_name = self.timezone_name
+        if timezone_name and connection.info.parameter_status('TimeZone') != timezone_name:
+            with connection.cursor() as cursor:
+                cursor.execute(self.ops.set_time_zone_sql(), [timezone_name])
+        role = self.settings_dict['OPTIONS'].get('assume_role')
+        if role:
+            with connection.cursor() as cursor:
+                cursor.execute(self.ops.compose_sql('SET ROLE %s', [role]))
+        if not connection.autocommit:
+            connection.commit()
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        connection = pool.getconn()
+        level = self.settings_dict['OPTIONS'].get('isolation_level')
+        try:
+            self.isolation_level = IsolationLevel(level) if level is not None else IsolationLevel.READ_COMMITTED
+        except ValueError:
+            pool.putconn(connection)
+            raise ImproperlyConfigured(f'Некорректный уровень изоляции: {level}.')
+        if level is not None:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def init_connection_state(self):
+        if self.pool is None:
+            return super().init_connection_state()
+        # Часовой пояс и роль уже выставлены в _configure_connection
+        super(PostgresDatabaseWrapper, self).init_connection_state()
+
+    def _close(self):
+        pool = self.pool
+        if self.connection is None or pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            # Пул сам откатит незавершённую транзакцию и отбросит сломанное соединение
+            pool.putconn(self.connection)
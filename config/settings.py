@@ -47,11 +47,16 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Первым после SecurityMiddleware: учитывает и запросы сессий/аутентификации
+    'config.instrumentation.SQLInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # После сессий: запись сессии в конце ответа не «прикрепляет» пользователя к основной БД
+    'config.db_router.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'consultations.audit.AuditMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -59,7 +64,8 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates + замер времени рендеринга (config/instrumentation.py)
+        'BACKEND': 'config.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -96,9 +102,55 @@ DATABASES = {
             'connect_timeout': 10,
             'options': '-c timezone=Europe/Moscow',
         },
+        # Постоянные соединения: одно на поток на CONN_MAX_AGE секунд, перед повторным использованием
+        # проверяется, живо ли оно. По умолчанию 0: под ASGI (uvicorn, асинхронные представления) Django 4.2
+        # выполняет синхронный ORM в новых потоках, и каждый такой поток оставлял бы открытое соединение —
+        # соединения Postgres быстро заканчиваются. DB_CONN_MAX_AGE>0 — только для WSGI с постоянными
+        # потоками (gunicorn sync/gthread); под ASGI соединения переиспользуются через пул DB_POOL=1.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Пул соединений psycopg_pool (config/postgresql_pool): соединение берётся из пула на время запроса.
+# DB_POOL=1 требует пакет psycopg_pool; CONN_MAX_AGE при этом 0, проверку соединений выполняет пул.
+if os.getenv('DB_POOL', '0') == '1':
+    DATABASES['default'].update({
+        'ENGINE': 'config.postgresql_pool',
+        'CONN_MAX_AGE': 0,
+    })
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        # Сколько ждать свободного соединения, прежде чем ответить ошибкой (секунды)
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        # Закрывать лишние простаивающие соединения и пересоздавать старые (секунды)
+        'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', '600')),
+        'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', '3600')),
+    }
+
+# Реплика только для чтения (config/db_router.py): отчёты, динамика и выгрузки читают с неё.
+# Включается, если задан REPLICA_DB_HOST или REPLICA_DB_NAME; для проверки подойдёт вторая локальная БД.
+REPLICA_DB_ALIAS = 'replica'
+if os.getenv('REPLICA_DB_HOST') or os.getenv('REPLICA_DB_NAME'):
+    DATABASES[REPLICA_DB_ALIAS] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('REPLICA_DB_NAME') or DATABASES['default']['NAME'],
+        'USER': os.getenv('REPLICA_DB_USER') or DATABASES['default']['USER'],
+        'PASSWORD': os.getenv('REPLICA_DB_PASSWORD') or DATABASES['default']['PASSWORD'],
+        'HOST': os.getenv('REPLICA_DB_HOST') or DATABASES['default']['HOST'],
+        'PORT': os.getenv('REPLICA_DB_PORT') or DATABASES['default']['PORT'],
+        # Недоступная реплика не должна надолго задерживать отчёт: после таймаута читаем с основной
+        'OPTIONS': {**DATABASES['default']['OPTIONS'], 'connect_timeout': int(os.getenv('REPLICA_CONNECT_TIMEOUT', '3'))},
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['config.db_router.ReplicaRouter']
+# Отставание, при котором реплика не используется; период повторной проверки; «прилипание» к основной
+# БД после изменяющего запроса пользователя (секунды)
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '30'))
+REPLICA_CHECK_SECONDS = float(os.getenv('REPLICA_CHECK_SECONDS', '10'))
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '10'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -136,6 +188,89 @@ MEDIA_ROOT = BASE_DIR / 'media'
 BACKUP_DIR = BASE_DIR / 'backups'
 PG_DUMP_PATH = os.getenv('PG_DUMP_PATH', '')
 
+# Резервное копирование (consultations/backups.py)
+# Число параллельных потоков pg_dump для формата каталога (-j N)
+BACKUP_JOBS = int(os.getenv('BACKUP_JOBS', '4'))
+# Сжатие: gzip | zstd (нужен пакет zstandard; для .dump/.dir — PostgreSQL 16+) | none
+BACKUP_COMPRESSION = os.getenv('BACKUP_COMPRESSION', 'gzip')
+BACKUP_COMPRESSION_LEVEL = int(os.getenv('BACKUP_COMPRESSION_LEVEL', '6'))
+# Сколько секунд веб-процесс ждёт ответа запущенного manage.py backup_job (started / busy)
+BACKUP_JOB_START_TIMEOUT = int(os.getenv('BACKUP_JOB_START_TIMEOUT', '30'))
+# Ротация: всегда храним BACKUP_KEEP_LAST последних копий, остальные удаляем старше BACKUP_MAX_AGE_DAYS дней
+BACKUP_KEEP_LAST = int(os.getenv('BACKUP_KEEP_LAST', '10'))
+BACKUP_MAX_AGE_DAYS = int(os.getenv('BACKUP_MAX_AGE_DAYS', '30'))
+# Проверка копий (manage.py verify_backup): временная БД и пути к pg_restore/psql, если их нет в PATH
+BACKUP_VERIFY_DB = os.getenv('BACKUP_VERIFY_DB', '')
+PG_RESTORE_PATH = os.getenv('PG_RESTORE_PATH', '')
+PSQL_PATH = os.getenv('PSQL_PATH', '')
+
+# Вложения консультаций (consultations/attachments.py): хранилище по SHA-256 вне MEDIA_ROOT
+ATTACHMENT_ROOT = Path(os.getenv('ATTACHMENT_ROOT', '') or BASE_DIR / 'attachments')
+# Квоты в МБ: на одну консультацию и на всё хранилище (0 — без ограничения)
+ATTACHMENT_CONSULTATION_QUOTA_MB = int(os.getenv('ATTACHMENT_CONSULTATION_QUOTA_MB', '50'))
+ATTACHMENT_TOTAL_QUOTA_MB = int(os.getenv('ATTACHMENT_TOTAL_QUOTA_MB', '2048'))
+# Отдача файлов: django (разработка) | nginx (X-Accel-Redirect) | apache (X-Sendfile, mod_xsendfile)
+ATTACHMENT_SERVE_MODE = os.getenv('ATTACHMENT_SERVE_MODE', 'django')
+# internal location nginx, который указывает на ATTACHMENT_ROOT
+ATTACHMENT_ACCEL_PREFIX = os.getenv('ATTACHMENT_ACCEL_PREFIX', '/protected/attachments/')
+
+# Профилирование запросов (config/instrumentation.py): запросы сверх бюджета пишутся в лог 'instrumentation',
+# агрегаты по имени URL — в таблицу request_profiles (страница «Профилирование» у администратора)
+INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION_ENABLED', '1') == '1'
+INSTRUMENTATION_QUERY_BUDGET = int(os.getenv('INSTRUMENTATION_QUERY_BUDGET', '50'))
+INSTRUMENTATION_DB_TIME_BUDGET_MS = int(os.getenv('INSTRUMENTATION_DB_TIME_BUDGET_MS', '300'))
+INSTRUMENTATION_TIME_BUDGET_MS = int(os.getenv('INSTRUMENTATION_TIME_BUDGET_MS', '1000'))
+# Сколько раз один и тот же запрос (без учёта литералов) должен повториться, чтобы считаться N+1
+INSTRUMENTATION_REPEAT_THRESHOLD = int(os.getenv('INSTRUMENTATION_REPEAT_THRESHOLD', '10'))
+INSTRUMENTATION_FLUSH_SECONDS = int(os.getenv('INSTRUMENTATION_FLUSH_SECONDS', '60'))
+
+# Метрики Prometheus (/metrics, config/metrics.py). Доступ — по токену (Authorization: Bearer <METRICS_TOKEN>)
+# или с адресов METRICS_ALLOWED_IPS (через запятую, можно подсети); без них эндпоинт закрыт.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
+# Общий каталог, куда процессы WSGI пишут свои значения (раз в METRICS_FLUSH_SECONDS)
+METRICS_DIR = Path(os.getenv('METRICS_DIR', '') or BASE_DIR / 'metrics')
+METRICS_FLUSH_SECONDS = int(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+
+# Журнал аудита (consultations/audit.py): события пишутся фоновым потоком пачками
+AUDIT_ENABLED = os.getenv('AUDIT_ENABLED', '1') == '1'
+# 0 — писать сразу, в том же запросе (удобно при отладке)
+AUDIT_ASYNC = os.getenv('AUDIT_ASYNC', '1') == '1'
+AUDIT_FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', '2'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '200'))
+# Предел буфера, если БД недоступна: сверх него старые события отбрасываются
+AUDIT_MAX_BUFFER = int(os.getenv('AUDIT_MAX_BUFFER', '10000'))
+
+# Секционирование по месяцам (consultations/partitions.py, manage.py manage_partitions): logs,
+# student_notifications, chat_messages, chat_message_reads. Сроки хранения в месяцах, 0 — бессрочно.
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+AUDIT_RETENTION_MONTHS = int(os.getenv('AUDIT_RETENTION_MONTHS', '24'))
+NOTIFICATION_RETENTION_MONTHS = int(os.getenv('NOTIFICATION_RETENTION_MONTHS', '12'))
+CHAT_RETENTION_MONTHS = int(os.getenv('CHAT_RETENTION_MONTHS', '0'))
+# Устаревшие секции: archive — выгрузить в PARTITION_ARCHIVE_DIR (.csv.gz) и удалить | drop | detach
+PARTITION_EXPIRE_MODE = os.getenv('PARTITION_EXPIRE_MODE', 'archive')
+PARTITION_ARCHIVE_DIR = Path(os.getenv('PARTITION_ARCHIVE_DIR', '') or BACKUP_DIR / 'partitions')
+# Окно «свежих» данных для чатов и уведомлений: запросы ограничены им, чтобы читались только нужные секции
+CHAT_RECENT_MONTHS = int(os.getenv('CHAT_RECENT_MONTHS', '6'))
+NOTIFICATION_RECENT_MONTHS = int(os.getenv('NOTIFICATION_RECENT_MONTHS', '3'))
+
+# Расписание психологов (consultations/schedule.py): шаг сетки свободных окон (минуты) и глубина поиска (дни)
+SCHEDULE_SLOT_STEP_MINUTES = int(os.getenv('SCHEDULE_SLOT_STEP_MINUTES', '15'))
+SCHEDULE_SEARCH_DAYS = int(os.getenv('SCHEDULE_SEARCH_DAYS', '28'))
+# Праздники и каникулы — в эти дни консультации серий не назначаются (consultations/series.py).
+# Даты и диапазоны через запятую: 2026-11-04,2026-12-29..2027-01-11
+SCHOOL_HOLIDAYS = os.getenv('SCHOOL_HOLIDAYS', '')
+
+# Keyset-пагинация списков (config/pagination.py): «Всего» для списка без фильтров — оценка
+# pg_class.reltuples от PAGINATION_ESTIMATE_MIN_ROWS строк, иначе COUNT в кэше на столько секунд
+PAGINATION_ESTIMATE_MIN_ROWS = int(os.getenv('PAGINATION_ESTIMATE_MIN_ROWS', '10000'))
+PAGINATION_COUNT_CACHE_SECONDS = int(os.getenv('PAGINATION_COUNT_CACHE_SECONDS', '300'))
+
+# Прогрев серверного процесса при запуске (config/warmup.py, из config/wsgi.py и config/asgi.py):
+# импорт выгрузок, шрифт PDF, шаблоны, маршруты. Команды manage.py и скрипты его не выполняют
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', '1') == '1'
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
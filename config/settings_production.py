@@ -0,0 +1,71 @@
+"""
+Настройки для продакшена: DEBUG выключен, шаблоны компилируются один раз на процесс (cached loader),
+статика — с хэшем в имени и заранее сжатыми копиями (config/staticfiles.py), HTML-ответы сжимаются gzip.
+
+Запуск:
+  set DJANGO_SETTINGS_MODULE=config.settings_production   (Linux: export ...)
+  python manage.py collectstatic --noinput
+  uvicorn config.asgi:application --host 0.0.0.0 --port 8000
+
+Обязательны DJANGO_SECRET_KEY и DJANGO_ALLOWED_HOSTS. Соединения с БД под ASGI не удерживаются потоками
+(CONN_MAX_AGE=0); переиспользовать их — через пул DB_POOL=1.
+
+Статику лучше отдавать nginx (STATIC_SERVE=0), например:
+  location /static/ {
+      alias <STATIC_ROOT>/;
+      gzip_static on;
+      brotli_static on;   # модуль ngx_brotli
+      expires max;
+      add_header Cache-Control "public, immutable";
+  }
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401, F403
+from .settings import DATABASES, MIDDLEWARE, SECRET_KEY, TEMPLATES
+
+DEBUG = False
+
+if SECRET_KEY.startswith('django-insecure'):
+    raise ImproperlyConfigured('Для продакшена задайте DJANGO_SECRET_KEY.')
+
+ALLOWED_HOSTS = [h.strip() for h in os.getenv('DJANGO_ALLOWED_HOSTS', '').split(',') if h.strip()]
+if not ALLOWED_HOSTS:
+    raise ImproperlyConfigured('Для продакшена задайте DJANGO_ALLOWED_HOSTS (домены сайта через запятую).')
+
+# Под uvicorn синхронный ORM выполняется в новых потоках: постоянное соединение осталось бы открытым
+# в каждом из них. Соединения переиспользует только пул (DB_POOL=1), у которого CONN_MAX_AGE и так 0.
+for _database in DATABASES.values():
+    _database['CONN_MAX_AGE'] = 0
+
+# Шаблоны читаются и разбираются один раз на процесс; после обновления кода процесс перезапускается
+_options = TEMPLATES[0]['OPTIONS']
+TEMPLATES = [{
+    **TEMPLATES[0],
+    'APP_DIRS': False,
+    'OPTIONS': {
+        **_options,
+        'context_processors': [
+            p for p in _options['context_processors'] if p != 'django.template.context_processors.debug'
+        ],
+        'loaders': [
+            ('django.template.loaders.cached.Loader', [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ]),
+        ],
+    },
+}]
+
+# collectstatic: app.css → app.<хэш>.css (+ .gz, + .br при установленном пакете brotli)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'config.staticfiles.CompressedManifestStaticFilesStorage'},
+}
+# 1 — статику отдаёт само приложение (config.staticfiles.serve), если перед ним нет nginx
+STATIC_SERVE = os.getenv('STATIC_SERVE', '0') == '1'
+
+# Сжатие HTML и JSON: до остальных middleware, чтобы они видели несжатый ответ
+MIDDLEWARE = [MIDDLEWARE[0], 'django.middleware.gzip.GZipMiddleware', *MIDDLEWARE[1:]]
@@ -0,0 +1,108 @@
+"""
+Статика для продакшена: хэшированные имена файлов (ManifestStaticFilesStorage) и заранее сжатые копии
+.gz/.br рядом с ними — их отдаёт nginx (gzip_static / brotli_static) или, без nginx, представление serve.
+Файлы с хэшем в имени не меняются, поэтому кэшируются браузером на год.
+"""
+import gzip
+import mimetypes
+import posixpath
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него пишутся только .gz
+    brotli = None
+
+# Сжимаются только текстовые форматы: картинки и шрифты уже сжаты
+COMPRESSIBLE = ('.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico')
+# Меньше — выигрыш не окупает лишний файл
+MIN_COMPRESS_SIZE = 256
+# app.css → app.1a2b3c4d5e6f.css (12 hex-символов, как у ManifestStaticFilesStorage)
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^.]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _compressed(data):
+    """(суффикс, сжатые данные) для тех алгоритмов, что дают выигрыш."""
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    return [(suffix, packed) for suffix, packed in variants if len(packed) < len(data)]
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage, который после collectstatic кладёт рядом с файлами копии .gz и .br."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed.add(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        # Несжатые оригиналы тоже остаются в STATIC_ROOT, но шаблоны ({% static %}) ссылаются на хэшированные имена
+        for name in sorted(hashed):
+            if name.endswith(COMPRESSIBLE):
+                self._write_compressed(name)
+
+    def _write_compressed(self, name):
+        path = Path(self.path(name))
+        data = path.read_bytes()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        for suffix, packed in _compressed(data):
+            path.with_name(path.name + suffix).write_bytes(packed)
+
+
+def _accepted(request):
+    accept = request.headers.get('Accept-Encoding', '')
+    return {part.split(';')[0].strip().lower() for part in accept.split(',')}
+
+
+def serve(request, path):
+    """
+    Отдача STATIC_ROOT без nginx (STATIC_SERVE=1): готовая .br/.gz-копия по Accept-Encoding,
+    хэшированные имена — Cache-Control на год, остальные — с проверкой If-Modified-Since.
+    """
+    try:
+        fullpath = Path(safe_join(settings.STATIC_ROOT, posixpath.normpath(path).lstrip('/')))
+    except SuspiciousFileOperation:
+        raise Http404
+    if not fullpath.is_file() or fullpath.suffix in ('.gz', '.br'):
+        raise Http404
+    stat = fullpath.stat()
+    immutable = bool(HASHED_NAME.search(fullpath.name))
+    if not immutable and not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    content_type, _ = mimetypes.guess_type(fullpath.name)
+    chosen, encoding = fullpath, None
+    accepted = _accepted(request)
+    for name, suffix in ENCODINGS:
+        candidate = fullpath.with_name(fullpath.name + suffix)
+        if name in accepted and candidate.is_file():
+            chosen, encoding = candidate, name
+            break
+    response = FileResponse(
+        chosen.open('rb'), content_type=content_type or 'application/octet-stream', filename=fullpath.name,
+    )
+    if encoding:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = (
+        f'public, max-age={IMMUTABLE_MAX_AGE}, immutable' if immutable else 'public, max-age=0, must-revalidate'
+    )
+    return response
@@ -4,15 +4,23 @@ URL configuration for подсистема школьного психолога
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.shortcuts import redirect
 
+from config import staticfiles
+from config.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('', lambda r: redirect('users:login')),
     path('users/', include('users.urls', namespace='users')),
     path('students/', include('students.urls', namespace='students')),
     path('consultations/', include('consultations.urls', namespace='consultations')),
+    path('api/v1/', include('consultations.api_urls', namespace='api_v1')),
 ]
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+elif getattr(settings, 'STATIC_SERVE', False):
+    # Продакшен без nginx: статика со сжатыми копиями и долгим кэшем (config/settings_production.py)
+    urlpatterns.append(re_path(rf'^{settings.STATIC_URL.strip("/")}/(?P<path>.+)$', staticfiles.serve))
\ No newline at end of file
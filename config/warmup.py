@@ -0,0 +1,106 @@
+"""
+Прогрев серверного процесса при запуске (start() из config/wsgi.py и config/asgi.py): то, за что иначе
+платит первый запрос после старта или перезапуска воркера. Импорт reportlab/openpyxl и регистрация
+шрифта PDF — первая выгрузка; компиляция шаблонов, маршруты URL, переводы — первая страница.
+
+Прогрев не обращается к БД: справочник ролей загружается при первом обращении (Role.name_of).
+Команды manage.py, скрипты и тесты, вызывающие django.setup(), точки входа сервера не импортируют
+и прогрев не выполняют. Под gunicorn --preload он выполняется в мастере до fork, и воркеры получают
+всё готовым.
+"""
+import importlib
+import logging
+import os
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger('warmup')
+
+# Модули, которые выгрузки PDF/Excel импортируют внутри представлений
+EXPORT_MODULES = (
+    'reportlab.lib.colors',
+    'reportlab.lib.pagesizes',
+    'reportlab.lib.styles',
+    'reportlab.lib.units',
+    'reportlab.platypus',
+    'reportlab.pdfbase.ttfonts',
+    'reportlab.graphics.shapes',
+    'reportlab.graphics.charts.barcharts',
+    'openpyxl',
+    'openpyxl.styles',
+    'openpyxl.chart',
+    'openpyxl.utils',
+)
+
+
+def _import_exports():
+    for name in EXPORT_MODULES:
+        importlib.import_module(name)
+    return len(EXPORT_MODULES)
+
+
+def _register_fonts():
+    from consultations.views import _get_pdf_cyrillic_font
+    return _get_pdf_cyrillic_font()
+
+
+def _compile_templates():
+    """Все шаблоны из TEMPLATES DIRS: cached loader держит их скомпилированными до конца процесса."""
+    from django.template import engines
+
+    compiled = 0
+    for engine in engines.all():
+        for directory in engine.dirs:
+            for root, _, files in os.walk(directory):
+                for filename in files:
+                    if filename.endswith('.html'):
+                        name = os.path.relpath(os.path.join(root, filename), directory).replace(os.sep, '/')
+                        engine.get_template(name)
+                        compiled += 1
+    return compiled
+
+
+def _prime_registries():
+    from django.urls import get_resolver
+    from django.utils import translation
+
+    # reverse_dict строит таблицы reverse() для всех пространств имён; override загружает каталоги переводов
+    routes = len(get_resolver().reverse_dict)
+    with translation.override(settings.LANGUAGE_CODE):
+        pass
+    return routes
+
+
+STEPS = (
+    ('импорт выгрузок', _import_exports),
+    ('шрифт PDF', _register_fonts),
+    ('шаблоны', _compile_templates),
+    ('маршруты и переводы', _prime_registries),
+)
+
+
+def should_run():
+    return getattr(settings, 'WARMUP_ENABLED', True)
+
+
+def run():
+    """Выполняет шаги прогрева; ошибка шага пишется в лог и не мешает запуску."""
+    started = time.perf_counter()
+    timings = []
+    for label, step in STEPS:
+        t = time.perf_counter()
+        try:
+            result = step()
+        except Exception:
+            logger.warning('Прогрев: шаг «%s» не выполнен', label, exc_info=True)
+            result = 'ошибка'
+        timings.append(f'{label} — {(time.perf_counter() - t) * 1000:.0f} мс ({result})')
+    logger.info('Прогрев за %.0f мс: %s', (time.perf_counter() - started) * 1000, '; '.join(timings))
+    return timings
+
+
+def start():
+    """Прогрев из точки входа сервера (wsgi/asgi), если он не выключен WARMUP_ENABLED=0."""
+    if should_run():
+        run()
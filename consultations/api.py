@@ -0,0 +1,615 @@
+"""
+JSON API для мобильного приложения (/api/v1/): обращения, консультации и подтверждение участия,
+уведомления, чаты. Вход — той же сессией, что и сайт; POST — с заголовком X-CSRFToken (токен отдаёт
+корень API). Тело POST — JSON или обычная форма.
+
+Списки — keyset-курсоры (config/pagination.py): {"results": [...], "next": url, "previous": url},
+размер страницы — ?limit= (до MAX_LIMIT). ?fields=id,status — только перечисленные поля.
+
+Условный GET: ETag — хэш версии выборки (max(updated_at) и число строк одним агрегатным запросом).
+Запрос с тем же If-None-Match получает 304, остальные запросы не выполняются. updated_at обращений и
+консультаций ведут триггеры БД (миграция 0021): версию меняют и сырой SQL переходов (transitions.py),
+и QuerySet.update, и изменение участия учащихся.
+"""
+import hashlib
+import json
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, Count, ExpressionWrapper, Max, Prefetch, Q, Subquery
+from django.http import Http404, JsonResponse
+from django.middleware.csrf import get_token
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_date
+from django.views.generic import View
+
+from config import pagination
+from .forms import ChatMessageForm, MyRequestCreateForm
+from .models import (
+    ChatMessage,
+    ChatMessageRead,
+    Consultation,
+    ConsultationStudent,
+    Request,
+    RequestNote,
+    RequestStatus,
+    StudentNotification,
+    StudentPsychologistChat,
+)
+from . import partitions, transitions
+from .views import (
+    _chat_window,
+    _mark_chat_messages_read_for_user,
+    _read_by_user,
+    _resolve_psychologist_for_student,
+    annotate_chat_activity,
+)
+
+# Меняется при несовместимых изменениях ответов; входит в ETag, чтобы старые ответы не совпали
+API_VERSION = 1
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+STAFF_ROLES = ('psychologist', 'admin')
+# Кому видно поле: всем, психологу и администратору, учащемуся
+ALL, STAFF, STUDENT = 'all', 'staff', 'student'
+
+
+class ApiError(Exception):
+    """Ошибка запроса: ответ {"error": код, "message": текст} со статусом status."""
+
+    def __init__(self, status, code, message, **details):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+        self.details = details
+
+    def response(self):
+        return _json({'error': self.code, 'message': self.message, **self.details}, status=self.status)
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+# ——— Параметры запроса ———
+
+def _audience(user):
+    return STAFF if user.role_name in STAFF_ROLES else STUDENT
+
+
+def _student_id(request):
+    student_id = getattr(request.user, 'student_id', None)
+    if not student_id:
+        raise ApiError(403, 'no_profile', 'Аккаунт не привязан к карточке учащегося.')
+    return student_id
+
+
+def _limit(request):
+    raw = request.GET.get('limit', '').strip()
+    if not raw:
+        return DEFAULT_LIMIT
+    try:
+        return max(1, min(int(raw), MAX_LIMIT))
+    except ValueError:
+        raise ApiError(400, 'invalid_limit', f'limit — целое число от 1 до {MAX_LIMIT}.')
+
+
+def _date_param(request, name):
+    raw = request.GET.get(name, '').strip()
+    if not raw:
+        return None
+    try:
+        value = parse_date(raw)
+    except ValueError:
+        value = None
+    if value is None:
+        raise ApiError(400, 'invalid_date', f'{name} — дата в формате ГГГГ-ММ-ДД.')
+    return value
+
+
+def _fields(request, spec):
+    """Выбранные поля {имя: функция(объект)}: ?fields= или все поля, доступные роли пользователя."""
+    audience = _audience(request.user)
+    allowed = {name: getter for name, (getter, visible) in spec.items() if visible in (ALL, audience)}
+    names = [name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()]
+    if not names:
+        return allowed
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ApiError(400, 'unknown_fields', 'Неизвестные поля: ' + ', '.join(unknown), available=list(allowed))
+    return {name: allowed[name] for name in names}
+
+
+def _render(obj, fields):
+    return {name: getter(obj) for name, getter in fields.items()}
+
+
+def _payload(request):
+    if request.content_type != 'application/json':
+        return request.POST
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        raise ApiError(400, 'invalid_json', 'Тело запроса должно быть JSON-объектом.')
+    return data
+
+
+def _invalid(form):
+    return ApiError(400, 'invalid', 'Проверьте введённые данные.', errors=form.errors.get_json_data())
+
+
+def _action_response(result):
+    """Ответ на действие: 200 — применено, 409 — нет (state объясняет почему), 404 — объект не найден."""
+    if result.state is None:
+        raise Http404
+    return _json({'applied': result.applied, 'state': result.state}, status=200 if result.applied else 409)
+
+
+# ——— Поля ресурсов: имя → (функция, кому видно) ———
+
+def _person(user):
+    return {'id': user.pk, 'full_name': user.get_full_name()} if user else None
+
+
+def _consultation_state(consultation):
+    return 'completed' if consultation.completed_at else 'cancelled' if consultation.cancelled_at else 'planned'
+
+
+def _participation(link):
+    if link.participation_cancelled_at:
+        return 'cancelled'
+    return 'confirmed' if link.participation_confirmed_at else 'planned'
+
+
+REQUEST_FIELDS = {
+    'id': (attrgetter('pk'), ALL),
+    'status': (attrgetter('status.name'), ALL),
+    'status_display': (attrgetter('status_display'), ALL),
+    'source': (attrgetter('source'), ALL),
+    'created_at': (attrgetter('created_at'), ALL),
+    'updated_at': (attrgetter('updated_at'), ALL),
+    'student': (lambda r: {'id': r.student_id, 'full_name': r.student.full_name}, STAFF),
+    'psychologist_id': (attrgetter('psychologist_id'), STAFF),
+}
+
+CONSULTATION_FIELDS = {
+    'id': (attrgetter('pk'), ALL),
+    'date': (attrgetter('date'), ALL),
+    'start_time': (attrgetter('start_time'), ALL),
+    'end_time': (attrgetter('end_time'), ALL),
+    'duration': (attrgetter('duration'), ALL),
+    'form': (attrgetter('form.name'), ALL),
+    'state': (_consultation_state, ALL),
+    'request_id': (attrgetter('request_id'), ALL),
+    'created_at': (attrgetter('created_at'), ALL),
+    'updated_at': (attrgetter('updated_at'), ALL),
+    'my_participation': (lambda c: _participation(c.my_links[0]) if c.my_links else None, STUDENT),
+    'psychologist_id': (attrgetter('psychologist_id'), STAFF),
+    'series_id': (attrgetter('series_id'), STAFF),
+    'result': (attrgetter('result'), STAFF),
+    'students': (
+        lambda c: [
+            {'id': link.student_id, 'full_name': link.student.full_name, 'participation': _participation(link)}
+            for link in c.consultation_students.all()
+        ],
+        STAFF,
+    ),
+}
+
+NOTIFICATION_FIELDS = {
+    'id': (attrgetter('pk'), ALL),
+    'kind': (attrgetter('kind'), ALL),
+    'consultation_id': (attrgetter('consultation_id'), ALL),
+    'request_id': (attrgetter('request_id'), ALL),
+    'request_status': (lambda n: n.request.status.name if n.request_id else None, ALL),
+    'created_at': (attrgetter('created_at'), ALL),
+}
+
+CHAT_FIELDS = {
+    'id': (attrgetter('pk'), ALL),
+    'student': (lambda c: {'id': c.student_id, 'full_name': c.student.full_name}, ALL),
+    'psychologist': (lambda c: _person(c.psychologist), ALL),
+    'created_at': (attrgetter('created_at'), ALL),
+    'updated_at': (attrgetter('updated_at'), ALL),
+    'last_message_at': (attrgetter('last_message_at'), ALL),
+    'unread_count': (attrgetter('unread_count'), ALL),
+}
+
+MESSAGE_FIELDS = {
+    'id': (attrgetter('pk'), ALL),
+    'author_id': (attrgetter('author_id'), ALL),
+    'mine': (attrgetter('mine'), ALL),
+    'text': (attrgetter('text'), ALL),
+    'created_at': (attrgetter('created_at'), ALL),
+    'read_by_me': (attrgetter('read_by_me'), ALL),
+}
+
+
+# ——— Версии выборок для ETag ———
+
+def _state(scope, field='updated_at', **extra):
+    """
+    Версия выборки одним агрегатным запросом: max(field), число строк и дополнительные агрегаты.
+    Агрегаты по связанным строкам (учащиеся консультации) размножают строки — отсюда distinct.
+    """
+    return scope.order_by().aggregate(version=Max(field), rows=Count('pk', distinct=True), **extra)
+
+
+def _my_reads(user_id, chat_id=None):
+    """Последняя отметка прочтения пользователя: от неё зависят unread_count чатов и read_by_me сообщений."""
+    reads = ChatMessageRead.objects.filter(user_id=user_id)
+    if chat_id is None:
+        since = partitions.recent_since(settings.CHAT_RECENT_MONTHS)
+        if since is not None:
+            reads = reads.filter(message_created_at__gte=since)
+    else:
+        reads = reads.filter(message__chat_id=chat_id)
+    return Max(Subquery(reads.order_by('-read_at').values('read_at')[:1]))
+
+
+class ApiView(View):
+    """
+    Основа представлений API: ответы и ошибки — JSON, нужен вход (401), roles — допустимые роли (403).
+    Ответы помечены «private, no-cache»: клиент хранит их у себя и перепроверяет по ETag.
+    """
+    roles = None
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            response = self._dispatch(request, *args, **kwargs)
+        except ApiError as error:
+            response = error.response()
+        except Http404:
+            response = ApiError(404, 'not_found', 'Объект не найден.').response()
+        patch_vary_headers(response, ('Cookie',))
+        if not response.has_header('Cache-Control'):
+            response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def _dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            raise ApiError(401, 'not_authenticated', 'Требуется вход в систему.')
+        if self.roles is not None and request.user.role_name not in self.roles:
+            raise ApiError(403, 'forbidden', 'Недостаточно прав.')
+        return super().dispatch(request, *args, **kwargs)
+
+    def http_method_not_allowed(self, request, *args, **kwargs):
+        response = ApiError(405, 'method_not_allowed', f'Метод {request.method} не поддерживается.').response()
+        response['Allow'] = ', '.join(self._allowed_methods())
+        return response
+
+    def conditional(self, request, state, build, *extra):
+        """
+        Условный GET: ETag из версии выборки state (_state), пользователя и адреса запроса. Совпал
+        с If-None-Match — 304 без построения ответа, иначе ответ build().
+        """
+        user = request.user
+        parts = (API_VERSION, user.pk, getattr(user, 'student_id', None), request.get_full_path(), *extra)
+        parts += tuple(state[key] for key in sorted(state))
+        etag = '"%s"' % hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+        response = get_conditional_response(request, etag=etag) or build()
+        response['ETag'] = etag
+        return response
+
+    def page(self, request, queryset, ordering, fields):
+        page = pagination.paginate(request, queryset, ordering, _limit(request), with_count=False)
+
+        def link(url):
+            return request.build_absolute_uri(request.path + url) if url else None
+
+        return _json({
+            'results': [_render(obj, fields) for obj in page.object_list],
+            'next': link(page.next_url),
+            'previous': link(page.previous_url),
+        })
+
+
+class ApiRootView(ApiView):
+    """Пользователь, CSRF-токен для POST и адреса ресурсов."""
+
+    def get(self, request):
+        user = request.user
+        resources = ('requests', 'consultations', 'notifications', 'chats')
+        return _json({
+            'version': API_VERSION,
+            'user': {
+                'id': user.pk,
+                'username': user.username,
+                'full_name': user.get_full_name(),
+                'role': user.role_name,
+                'student_id': getattr(user, 'student_id', None),
+            },
+            'csrf_token': get_token(request),
+            'resources': {name: request.build_absolute_uri(reverse(f'api_v1:{name}')) for name in resources},
+        })
+
+
+# ——— Обращения ———
+
+def _request_scope(request):
+    if _audience(request.user) == STAFF:
+        return Request.objects.all()
+    return Request.objects.filter(student_id=_student_id(request))
+
+
+class RequestListApiView(ApiView):
+    """GET — обращения (учащемуся — свои), ?status=; POST — учащийся подаёт обращение (note — текст)."""
+
+    def get(self, request):
+        fields = _fields(request, REQUEST_FIELDS)
+        scope = _request_scope(request)
+        status = request.GET.get('status', '').strip()
+        if status:
+            scope = scope.filter(status__name=status)
+        # ФИО учащегося в ответе: его версия тоже входит в ETag
+        state = _state(scope, students=Max('student__updated_at'))
+        return self.conditional(request, state, lambda: self.page(
+            request, scope.select_related('status', 'student'), ('-created_at', '-id'), fields,
+        ))
+
+    def post(self, request):
+        if request.user.role_name != 'student':
+            raise ApiError(403, 'forbidden', 'Подать обращение может только учащийся.')
+        student_id = _student_id(request)
+        fields = _fields(request, REQUEST_FIELDS)
+        form = MyRequestCreateForm(_payload(request))
+        if not form.is_valid():
+            raise _invalid(form)
+        status_new = RequestStatus.objects.filter(name='new').first()
+        if not status_new:
+            raise ApiError(503, 'not_configured', 'В системе не настроен статус «Новое».')
+        with transaction.atomic():
+            request_obj = Request.objects.create(
+                student_id=student_id, source=Request.SOURCE_STUDENT, status=status_new,
+            )
+            note_text = form.cleaned_data.get('note')
+            if note_text:
+                RequestNote.objects.create(request_id=request_obj.pk, user_id=request.user.pk, text=note_text)
+        request_obj = Request.objects.select_related('status', 'student').get(pk=request_obj.pk)
+        return _json(_render(request_obj, fields), status=201)
+
+
+class RequestDetailApiView(ApiView):
+
+    def get(self, request, pk):
+        fields = _fields(request, REQUEST_FIELDS)
+        scope = _request_scope(request).filter(pk=pk)
+        state = _state(scope, students=Max('student__updated_at'))
+        if not state['rows']:
+            raise Http404
+        return self.conditional(request, state, lambda: _json(
+            _render(scope.select_related('status', 'student').get(), fields)
+        ))
+
+
+class RequestCancelApiView(ApiView):
+    """Отмена обращения: учащимся — своего, психологом — любого (до «Завершено»)."""
+    roles = ('psychologist', 'student')
+
+    def post(self, request, pk):
+        student_id = _student_id(request) if request.user.role_name == 'student' else None
+        return _action_response(transitions.cancel_request(pk, student_id=student_id))
+
+
+class RequestCompleteApiView(ApiView):
+    roles = ('psychologist',)
+
+    def post(self, request, pk):
+        return _action_response(transitions.complete_request(pk))
+
+
+# ——— Консультации ———
+
+def _consultation_scope(request):
+    if _audience(request.user) == STAFF:
+        return Consultation.objects.all()
+    student_id = _student_id(request)
+    # Участники — подзапросом, без JOIN и DISTINCT (как в журнале психолога)
+    participants = ConsultationStudent.objects.filter(student_id=student_id).values('consultation_id')
+    return Consultation.objects.filter(Q(request__student_id=student_id) | Q(pk__in=participants))
+
+
+def _consultation_rows(request, scope, fields):
+    qs = scope.select_related('form')
+    if 'students' in fields:
+        qs = qs.prefetch_related(Prefetch(
+            'consultation_students',
+            queryset=ConsultationStudent.objects.select_related('student').order_by(
+                'student__last_name', 'student__first_name',
+            ),
+        ))
+    if 'my_participation' in fields:
+        qs = qs.prefetch_related(Prefetch(
+            'consultation_students',
+            queryset=ConsultationStudent.objects.filter(student_id=request.user.student_id),
+            to_attr='my_links',
+        ))
+    return qs
+
+
+class ConsultationListApiView(ApiView):
+    """Консультации (учащемуся — свои и те, где он участник), ?date_from=, ?date_to=, ?state=."""
+
+    def get(self, request):
+        fields = _fields(request, CONSULTATION_FIELDS)
+        scope = _consultation_scope(request)
+        date_from, date_to = _date_param(request, 'date_from'), _date_param(request, 'date_to')
+        if date_from:
+            scope = scope.filter(date__gte=date_from)
+        if date_to:
+            scope = scope.filter(date__lte=date_to)
+        state = request.GET.get('state', '').strip()
+        if state == 'planned':
+            scope = scope.filter(completed_at__isnull=True, cancelled_at__isnull=True)
+        elif state == 'completed':
+            scope = scope.filter(completed_at__isnull=False)
+        elif state == 'cancelled':
+            scope = scope.filter(cancelled_at__isnull=False)
+        elif state:
+            raise ApiError(400, 'invalid_state', 'state — planned, completed или cancelled.')
+        state = _state(scope, students=Max('consultation_students__student__updated_at'))
+        return self.conditional(request, state, lambda: self.page(
+            request, _consultation_rows(request, scope, fields), ('-date', '-id'), fields,
+        ))
+
+
+class ConsultationDetailApiView(ApiView):
+
+    def get(self, request, pk):
+        fields = _fields(request, CONSULTATION_FIELDS)
+        scope = _consultation_scope(request).filter(pk=pk)
+        state = _state(scope, students=Max('consultation_students__student__updated_at'))
+        if not state['rows']:
+            raise Http404
+        return self.conditional(request, state, lambda: _json(
+            _render(_consultation_rows(request, scope, fields).get(), fields)
+        ))
+
+
+class ConsultationConfirmApiView(ApiView):
+    """Учащийся подтверждает участие (transitions.confirm_participation)."""
+    roles = ('student',)
+
+    def post(self, request, pk):
+        return _action_response(transitions.confirm_participation(pk, _student_id(request)))
+
+
+class ConsultationCancelParticipationApiView(ApiView):
+    """Учащийся окончательно отменяет участие; консультация и обращение отменяются."""
+    roles = ('student',)
+
+    def post(self, request, pk):
+        student_id = _student_id(request)
+        result = transitions.cancel_participation(pk, student_id)
+        if not result.applied:
+            # Состояние — в пределах консультаций учащегося: чужая консультация даёт 404
+            result = transitions.Result(False, transitions.participation_state(pk, student_id))
+        return _action_response(result)
+
+
+# ——— Уведомления ———
+
+class NotificationListApiView(ApiView):
+    """Уведомления учащегося за NOTIFICATION_RECENT_MONTHS месяцев."""
+    roles = ('student',)
+
+    def get(self, request):
+        fields = _fields(request, NOTIFICATION_FIELDS)
+        scope = StudentNotification.objects.filter(student_id=_student_id(request))
+        since = partitions.recent_since(settings.NOTIFICATION_RECENT_MONTHS)
+        if since is not None:
+            scope = scope.filter(created_at__gte=since)
+        # Уведомления не меняются после создания, но request_status берётся из обращения:
+        # версия — время последнего уведомления, их число и версия связанных обращений
+        state = _state(scope, 'created_at', requests=Max('request__updated_at'))
+        return self.conditional(request, state, lambda: self.page(
+            request, scope.select_related('request__status'), ('-created_at', '-id'), fields,
+        ), since)
+
+
+# ——— Чаты ———
+
+def _chat_scope(request):
+    chats = StudentPsychologistChat.objects.all()
+    role = request.user.role_name
+    if role == 'student':
+        return chats.filter(student_id=_student_id(request))
+    if role == 'psychologist':
+        return chats.filter(psychologist_id=request.user.id)
+    return chats
+
+
+def _chat_rows(request, scope):
+    return annotate_chat_activity(scope.select_related('student', 'psychologist'), request.user.id)
+
+
+class ChatListApiView(ApiView):
+    """GET — чаты пользователя; POST — учащийся открывает чат с психологом (201 — создан, 200 — уже есть)."""
+
+    def get(self, request):
+        fields = _fields(request, CHAT_FIELDS)
+        scope = _chat_scope(request)
+        # Новое сообщение сохраняет updated_at чата; прочтение меняет только отметки пользователя
+        state = _state(scope, reads=_my_reads(request.user.id), students=Max('student__updated_at'))
+        return self.conditional(request, state, lambda: self.page(
+            request, _chat_rows(request, scope), ('-updated_at', '-id'), fields,
+        ), partitions.recent_since(settings.CHAT_RECENT_MONTHS))
+
+    def post(self, request):
+        if request.user.role_name != 'student':
+            raise ApiError(403, 'forbidden', 'Открыть чат может только учащийся.')
+        student_id = _student_id(request)
+        fields = _fields(request, CHAT_FIELDS)
+        scope = StudentPsychologistChat.objects.filter(student_id=student_id)
+        status = 200
+        if not scope.exists():
+            psychologist = _resolve_psychologist_for_student(student_id)
+            if not psychologist:
+                raise ApiError(503, 'no_psychologist', 'Сейчас нет доступного психолога для чата.')
+            _, created = StudentPsychologistChat.objects.get_or_create(
+                student_id=student_id, defaults={'psychologist_id': psychologist.pk},
+            )
+            status = 201 if created else 200
+        return _json(_render(_chat_rows(request, scope).get(), fields), status=status)
+
+
+class ChatMessageListApiView(ApiView):
+    """
+    GET — сообщения чата за CHAT_RECENT_MONTHS месяцев (?all=1 — все), новые первыми; чтение
+    не отмечает их прочитанными (для этого — chats/<pk>/read/). POST — сообщение (text).
+    """
+
+    def get(self, request, pk):
+        fields = _fields(request, MESSAGE_FIELDS)
+        chat_scope = _chat_scope(request).filter(pk=pk)
+        # Каждое новое сообщение сохраняет updated_at чата — версия переписки без обхода сообщений
+        state = _state(chat_scope, reads=_my_reads(request.user.id, pk))
+        if not state['rows']:
+            raise Http404
+        since, _ = _chat_window(request, None)
+        return self.conditional(request, state, lambda: self.page(
+            request, self._messages(request, pk, since), ('-created_at', '-id'), fields,
+        ), since)
+
+    def _messages(self, request, chat_id, since):
+        messages_qs = ChatMessage.objects.filter(chat_id=chat_id)
+        if since is not None:
+            messages_qs = messages_qs.filter(created_at__gte=since)
+        user_id = request.user.id
+        return messages_qs.annotate(
+            read_by_me=_read_by_user(user_id),
+            mine=ExpressionWrapper(Q(author_id=user_id), output_field=BooleanField()),
+        )
+
+    def post(self, request, pk):
+        chat = _chat_scope(request).filter(pk=pk).first()
+        if chat is None:
+            raise Http404
+        # Администратор переписку только читает
+        if request.user.role_name not in ('student', 'psychologist'):
+            raise ApiError(403, 'forbidden', 'Администратор может только просматривать переписку.')
+        fields = _fields(request, MESSAGE_FIELDS)
+        form = ChatMessageForm(_payload(request))
+        if not form.is_valid():
+            raise _invalid(form)
+        message = ChatMessage.objects.create(chat_id=chat.pk, author_id=request.user.pk, text=form.cleaned_data['text'])
+        chat.save(update_fields=['updated_at'])
+        message.mine, message.read_by_me = True, False
+        return _json(_render(message, fields), status=201)
+
+
+class ChatReadApiView(ApiView):
+    """Отмечает сообщения чата прочитанными пользователем (за окно чата, ?all=1 — все)."""
+
+    def post(self, request, pk):
+        chat = _chat_scope(request).filter(pk=pk).first()
+        if chat is None:
+            raise Http404
+        since, _ = _chat_window(request, chat)
+        _mark_chat_messages_read_for_user(chat.pk, request.user.id, since)
+        return _json({'applied': True, 'state': 'read'})
@@ -0,0 +1,27 @@
+from django.urls import path
+from . import api
+
+app_name = 'api'
+
+urlpatterns = [
+    path('', api.ApiRootView.as_view(), name='root'),
+    # Обращения
+    path('requests/', api.RequestListApiView.as_view(), name='requests'),
+    path('requests/<int:pk>/', api.RequestDetailApiView.as_view(), name='request'),
+    path('requests/<int:pk>/cancel/', api.RequestCancelApiView.as_view(), name='request_cancel'),
+    path('requests/<int:pk>/complete/', api.RequestCompleteApiView.as_view(), name='request_complete'),
+    # Консультации и участие
+    path('consultations/', api.ConsultationListApiView.as_view(), name='consultations'),
+    path('consultations/<int:pk>/', api.ConsultationDetailApiView.as_view(), name='consultation'),
+    path('consultations/<int:pk>/confirm/', api.ConsultationConfirmApiView.as_view(), name='consultation_confirm'),
+    path(
+        'consultations/<int:pk>/cancel-participation/',
+        api.ConsultationCancelParticipationApiView.as_view(),
+        name='consultation_cancel_participation',
+    ),
+    # Уведомления и чаты
+    path('notifications/', api.NotificationListApiView.as_view(), name='notifications'),
+    path('chats/', api.ChatListApiView.as_view(), name='chats'),
+    path('chats/<int:pk>/messages/', api.ChatMessageListApiView.as_view(), name='chat_messages'),
+    path('chats/<int:pk>/read/', api.ChatReadApiView.as_view(), name='chat_read'),
+]
@@ -7,4 +7,4 @@ class ConsultationsConfig(AppConfig):
     verbose_name = 'Обращения и консультации'
 
     def ready(self):
-        from . import signals  # noqa: F401
+        from . import audit, signals  # noqa: F401
@@ -0,0 +1,246 @@
+"""
+Хранилище вложений консультаций с адресацией по содержимому: файл хэшируется (SHA-256) во время
+загрузки, одинаковое содержимое хранится один раз, объём ограничен квотами на консультацию и на всё
+хранилище. Сами байты отдаёт фронтовой веб-сервер (X-Accel-Redirect / X-Sendfile) после проверки доступа.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header
+
+from config import metrics
+
+MB = 1024 * 1024
+_CHUNK_SIZE = 1024 * 1024
+SERVE_MODES = ('django', 'nginx', 'apache')
+# Типы, которые браузер может открыть сам; остальное отдаётся как скачивание
+INLINE_CONTENT_TYPES = ('application/pdf', 'image/png', 'image/jpeg', 'text/plain')
+
+
+class QuotaExceeded(Exception):
+    """Загрузка превышает квоту консультации или хранилища."""
+
+
+def get_store_root():
+    root = Path(getattr(settings, 'ATTACHMENT_ROOT', settings.BASE_DIR / 'attachments'))
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def blob_relpath(sha256):
+    """Путь файла внутри хранилища: ab/cd/abcd…"""
+    return f'{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def blob_path(sha256):
+    return get_store_root() / blob_relpath(sha256)
+
+
+def _quota_bytes(name):
+    return max(0, int(getattr(settings, name, 0))) * MB
+
+
+def consultation_usage(consultation_id):
+    """Объём вложений консультации (каждое вложение считается, даже если файл общий)."""
+    from .models import Attachment
+
+    return Attachment.objects.filter(consultation_id=consultation_id).aggregate(total=Sum('size'))['total'] or 0
+
+
+def store_usage():
+    """Фактически занятый объём хранилища: каждый уникальный файл учитывается один раз."""
+    with connection.cursor() as c:
+        c.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM "
+            "(SELECT DISTINCT sha256, size FROM attachments WHERE sha256 IS NOT NULL) AS blobs"
+        )
+        return int(c.fetchone()[0])
+
+
+def _format_mb(size):
+    return f'{size / MB:.1f} МБ'
+
+
+def _write_temp(chunks, limit=None):
+    """Пишет поток во временный файл хранилища, считая SHA-256 и размер. Возвращает (tmp_path, sha256, size)."""
+    tmp_dir = get_store_root() / 'tmp'
+    tmp_dir.mkdir(exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=tmp_dir)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in chunks:
+                size += len(chunk)
+                if limit is not None and size > limit:
+                    raise QuotaExceeded(
+                        f'Превышена квота вложений консультации: осталось {_format_mb(max(limit, 0))}.'
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+        # mkstemp создаёт файл 0600 — веб-сервер должен иметь возможность его прочитать
+        os.chmod(tmp_name, 0o644)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return Path(tmp_name), digest.hexdigest(), size
+
+
+def _commit_blob(tmp_path, sha256):
+    """
+    Переносит временный файл на место. Переименование выполняется и для уже существующего файла:
+    содержимое то же, а параллельное удаление последней ссылки не оставит запись без файла.
+    """
+    target = blob_path(sha256)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, target)
+
+
+def _lock_blob(sha256):
+    """
+    Блокировка файла хранилища до конца транзакции (PostgreSQL): загрузка и удаление одного содержимого
+    не пересекаются между решением «файл нужен / больше не нужен» и операцией с файлом.
+    В SQLite запись и так выполняется одной транзакцией за раз.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as c:
+            c.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [sha256])
+
+
+def guess_content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def save_attachment(consultation_id, uploaded_file, description=None):
+    """
+    Сохраняет загруженный файл как вложение консультации. Файл хэшируется на лету; если такое
+    содержимое уже есть в хранилище, новый файл не занимает места. Бросает QuotaExceeded.
+    """
+    from .models import Attachment
+
+    consultation_quota = _quota_bytes('ATTACHMENT_CONSULTATION_QUOTA_MB')
+    limit = consultation_quota - consultation_usage(consultation_id) if consultation_quota else None
+    if limit is not None and (uploaded_file.size or 0) > limit:
+        raise QuotaExceeded(f'Превышена квота вложений консультации: осталось {_format_mb(max(limit, 0))}.')
+
+    tmp_path, sha256, size = _write_temp(uploaded_file.chunks(), limit)
+    try:
+        total_quota = _quota_bytes('ATTACHMENT_TOTAL_QUOTA_MB')
+        original_name = os.path.basename((uploaded_file.name or '').replace('\\', '/'))[:255] or sha256[:12]
+        # Запись и файл — вместе: если перенос файла не удался, записи без файла не остаётся
+        with transaction.atomic():
+            _lock_blob(sha256)
+            is_new = not Attachment.objects.filter(sha256=sha256).exists()
+            if total_quota and is_new and store_usage() + size > total_quota:
+                raise QuotaExceeded('Хранилище вложений заполнено. Обратитесь к администратору.')
+            attachment = Attachment.objects.create(
+                consultation_id=consultation_id,
+                file_path=blob_relpath(sha256),
+                original_name=original_name,
+                content_type=(uploaded_file.content_type or guess_content_type(original_name))[:100],
+                sha256=sha256,
+                size=size,
+                description=description,
+            )
+            _commit_blob(tmp_path, sha256)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    return attachment
+
+
+def delete_attachment(attachment):
+    """Удаляет вложение; файл хранилища удаляется, когда на него не осталось ссылок."""
+    from .models import Attachment
+
+    sha256 = attachment.sha256
+    legacy_path = _legacy_path(attachment) if not sha256 else None
+    with transaction.atomic():
+        if sha256:
+            # Параллельная загрузка того же содержимого ждёт, пока решение об удалении файла не выполнено
+            _lock_blob(sha256)
+        attachment.delete()
+        try:
+            if sha256 and not Attachment.objects.filter(sha256=sha256).exists():
+                blob_path(sha256).unlink()
+            elif legacy_path:
+                legacy_path.unlink()
+        except OSError:
+            pass
+
+
+def _legacy_path(attachment):
+    """Файл старого формата: media/consultations/<pk>/<имя>_<случайный суффикс>.<ext>."""
+    if not attachment.file_path:
+        return None
+    path = (Path(settings.MEDIA_ROOT) / attachment.file_path.replace('\\', '/')).resolve()
+    if Path(settings.MEDIA_ROOT).resolve() not in path.parents:
+        return None
+    return path
+
+
+def adopt_legacy_file(attachment):
+    """Переносит файл старого формата в хранилище по SHA-256. Возвращает False, если файла нет."""
+    source = _legacy_path(attachment)
+    if not source or not source.is_file():
+        return False
+    with open(source, 'rb') as fh:
+        tmp_path, sha256, size = _write_temp(iter(lambda: fh.read(_CHUNK_SIZE), b''))
+    attachment.original_name = attachment.original_name or attachment.filename
+    attachment.content_type = attachment.content_type or guess_content_type(attachment.original_name)
+    attachment.file_path = blob_relpath(sha256)
+    attachment.sha256 = sha256
+    attachment.size = size
+    with transaction.atomic():
+        _lock_blob(sha256)
+        attachment.save(update_fields=['file_path', 'original_name', 'content_type', 'sha256', 'size'])
+        _commit_blob(tmp_path, sha256)
+    source.unlink()
+    return True
+
+
+def serve_mode():
+    mode = (getattr(settings, 'ATTACHMENT_SERVE_MODE', 'django') or 'django').lower()
+    return mode if mode in SERVE_MODES else 'django'
+
+
+def attachment_response(request, attachment):
+    """
+    Ответ на скачивание вложения. Сильный ETag — SHA-256 содержимого; при совпадении If-None-Match
+    возвращается 304. В режимах nginx/apache тело отдаёт веб-сервер по X-Accel-Redirect/X-Sendfile.
+    """
+    etag = f'"{attachment.sha256}"'
+    response = get_conditional_response(request, etag=etag)
+    if request.headers.get('If-None-Match'):
+        # Повторное открытие вложения: 304 — файл взят из кэша браузера
+        metrics.record_cache('attachment_etag', response is not None)
+    if response is None:
+        path = blob_path(attachment.sha256)
+        mode = serve_mode()
+        if mode == 'nginx':
+            response = HttpResponse()
+            prefix = getattr(settings, 'ATTACHMENT_ACCEL_PREFIX', '/protected/attachments/').rstrip('/')
+            response['X-Accel-Redirect'] = f'{prefix}/{blob_relpath(attachment.sha256)}'
+        elif mode == 'apache':
+            response = HttpResponse()
+            response['X-Sendfile'] = str(path)
+        else:
+            response = FileResponse(open(path, 'rb'))
+        content_type = attachment.content_type or guess_content_type(attachment.filename)
+        response['Content-Type'] = content_type
+        response['Content-Disposition'] = content_disposition_header(
+            content_type not in INLINE_CONTENT_TYPES, attachment.filename
+        )
+    response['ETag'] = etag
+    # Вложения конфиденциальны: кэш только в браузере и с перепроверкой доступа при каждом открытии
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,274 @@
+"""
+Журнал аудита. События копятся в памяти процесса и записываются фоновым потоком пачками
+(bulk INSERT раз в AUDIT_FLUSH_SECONDS или по набору AUDIT_BATCH_SIZE), поэтому запись не добавляет
+задержку к ответу. AuditMiddleware фиксирует все изменяющие запросы (POST/PUT/PATCH/DELETE) к
+приложениям consultations, students, users и к JSON API, а также выгрузки и скачивания; вход и
+выход — сигналами.
+Таблица logs секционирована по месяцам; поток записи периодически создаёт секции всех таблиц
+наперёд (consultations/partitions.py). Устаревшие секции снимает только manage.py manage_partitions.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.signals import user_logged_in, user_logged_out, user_login_failed
+from django.db import InterfaceError, OperationalError, close_old_connections, connection
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import partitions
+
+logger = logging.getLogger(__name__)
+
+AUDITED_NAMESPACES = ('consultations', 'students', 'users', 'api_v1')
+STATE_CHANGING_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# Вход и выход пишутся сигналами (с именем пользователя при неудаче)
+SKIPPED_VIEWS = ('users:login', 'users:logout')
+# Чтение, которое тоже нужно видеть в журнале: выгрузки отчётов и скачивание файлов
+AUDITED_READ_PREFIXES = ('export_',)
+AUDITED_READ_SUFFIXES = ('_download',)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class AuditWriter:
+    """Буфер событий процесса и фоновый поток, который сбрасывает его в таблицу logs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._last_maintenance = 0.0
+
+    def submit(self, event):
+        with self._lock:
+            self._events.append(event)
+            overflow = len(self._events) - _setting('AUDIT_MAX_BUFFER', 10000)
+            if overflow > 0:
+                # БД недоступна слишком долго: теряем самые старые события, а не память процесса
+                del self._events[:overflow]
+                logger.error('Буфер аудита переполнен, отброшено событий: %s', overflow)
+            full = len(self._events) >= _setting('AUDIT_BATCH_SIZE', 200)
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        # После fork поток родителя в воркере не существует — запускаем свой
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(_setting('AUDIT_FLUSH_SECONDS', 2))
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+            self._maybe_maintain()
+
+    def flush(self):
+        """
+        Записывает накопленные события. БД недоступна (OperationalError, InterfaceError) — события
+        возвращаются в буфер для следующей попытки; другая ошибка пачки — события пишутся по одному,
+        и событие, которое записать нельзя, отбрасывается, чтобы не блокировать остальные.
+        """
+        from .models import Log
+
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        try:
+            Log.objects.bulk_create([Log(**event) for event in events], batch_size=_setting('AUDIT_BATCH_SIZE', 200))
+            return len(events)
+        except (OperationalError, InterfaceError):
+            logger.exception('Не удалось записать %s событий аудита', len(events))
+            self._requeue(events)
+            return 0
+        except Exception:
+            logger.exception('Пачка из %s событий аудита отклонена, запись по одному', len(events))
+        written = 0
+        for i, event in enumerate(events):
+            try:
+                Log.objects.create(**event)
+            except (OperationalError, InterfaceError):
+                logger.exception('Не удалось записать %s событий аудита', len(events) - i)
+                self._requeue(events[i:])
+                break
+            except Exception:
+                logger.exception('Событие аудита отброшено: %r', event)
+            else:
+                written += 1
+        return written
+
+    def _requeue(self, events):
+        with self._lock:
+            self._events[:0] = events
+
+    def _maybe_maintain(self):
+        interval = _setting('AUDIT_MAINTENANCE_SECONDS', 6 * 3600)
+        if time.monotonic() - self._last_maintenance < interval and self._last_maintenance:
+            return
+        self._last_maintenance = time.monotonic()
+        maintain_partitions()
+
+
+writer = AuditWriter()
+atexit.register(writer.flush)
+
+
+def maintain_partitions():
+    """
+    Секции на PARTITION_MONTHS_AHEAD месяцев вперёд для всех секционированных таблиц. Снятие устаревших
+    секций (архив, удаление) — только в manage.py manage_partitions по расписанию, не в веб-процессе.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    try:
+        return partitions.maintain_all(expire=False)
+    except Exception:
+        logger.exception('Не удалось обслужить секции таблиц')
+        return None
+
+
+def client_ip(request):
+    return (request.META.get('REMOTE_ADDR') or '')[:45] or None
+
+
+def record(action, user_id=None, object_id=None, request=None, **details):
+    """
+    Добавляет событие в журнал. При AUDIT_ASYNC=False (management-команды, отладка)
+    событие записывается сразу.
+    """
+    if not _setting('AUDIT_ENABLED', True):
+        return
+    if request is not None:
+        if user_id is None and getattr(request, 'user', None) is not None and request.user.is_authenticated:
+            user_id = request.user.pk
+        details.setdefault('ip', client_ip(request))
+    event = {
+        'user_id': user_id,
+        'action': action[:100],
+        'action_date': timezone.now(),
+        'object_id': object_id,
+        'ip_address': details.pop('ip', None),
+        'details': details or None,
+    }
+    if _setting('AUDIT_ASYNC', True):
+        writer.submit(event)
+    else:
+        from .models import Log
+
+        Log.objects.create(**event)
+
+
+# ——— Middleware ———
+
+def _is_audited(request, match):
+    if not match or not match.view_name or match.namespace not in AUDITED_NAMESPACES:
+        return False
+    if match.view_name in SKIPPED_VIEWS:
+        return False
+    if request.method in STATE_CHANGING_METHODS:
+        return True
+    return request.method == 'GET' and (
+        match.url_name.startswith(AUDITED_READ_PREFIXES) or match.url_name.endswith(AUDITED_READ_SUFFIXES)
+    )
+
+
+def _result(request, response):
+    """ok — действие выполнено; invalid — форма возвращена с ошибками; rejected — отказ с сообщением; denied — нет доступа."""
+    if response.status_code in (401, 403, 404, 405):
+        return 'denied'
+    if response.status_code == 409:
+        # API: действие не применилось из-за состояния объекта (как сообщение об отказе на странице)
+        return 'rejected'
+    if response.status_code == 400 and 'json' in response.get('Content-Type', ''):
+        return 'invalid'
+    if response.status_code >= 400:
+        return 'error'
+    queued = getattr(getattr(request, '_messages', None), '_queued_messages', ())
+    if any(message.level >= messages.ERROR for message in queued):
+        return 'rejected'
+    if any(message.level == messages.SUCCESS for message in queued):
+        return 'ok'
+    if response.status_code == 200 and request.method != 'GET' and 'html' in response.get('Content-Type', ''):
+        # Успешная отправка формы завершается редиректом; HTML-ответ на POST — форма с ошибками
+        return 'invalid'
+    return 'ok'
+
+
+class AuditMiddleware:
+    """Журналирует изменяющие запросы и выгрузки после того, как ответ сформирован (WSGI и ASGI)."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        if _setting('AUDIT_ENABLED', True) and _is_audited(request, match):
+            self._record(request, response, match)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        if _setting('AUDIT_ENABLED', True) and _is_audited(request, match):
+            # request.user и синхронная запись (AUDIT_ASYNC=0) обращаются к БД
+            await sync_to_async(self._record)(request, response, match)
+        return response
+
+    def _record(self, request, response, match):
+        object_id = match.kwargs.get('pk')
+        extra = {k: v for k, v in match.kwargs.items() if k != 'pk'}
+        record(
+            match.view_name,
+            object_id=object_id if isinstance(object_id, int) else None,
+            request=request,
+            method=request.method,
+            path=request.path[:255],
+            status=response.status_code,
+            result=_result(request, response),
+            **({'kwargs': extra} if extra else {}),
+        )
+
+
+# ——— Вход и выход ———
+
+@receiver(user_logged_in)
+def _on_logged_in(sender, request, user, **kwargs):
+    record('User logged in', user_id=user.pk, request=request)
+
+
+@receiver(user_logged_out)
+def _on_logged_out(sender, request, user, **kwargs):
+    if user is not None:
+        record('User logged out', user_id=user.pk, request=request)
+
+
+@receiver(user_login_failed)
+def _on_login_failed(sender, credentials, request=None, **kwargs):
+    record('Login failed', request=request, username=str(credentials.get('username') or '')[:150])
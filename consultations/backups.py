@@ -0,0 +1,614 @@
+"""
+Резервное копирование PostgreSQL: pg_dump в отдельном процессе (manage.py backup_job) с блокировкой
+«один бэкап за раз» (pg_try_advisory_lock), параллельный формат каталога (-j N), потоковое сжатие
+gzip/zstd, манифест контрольных сумм и ротация старых копий в BACKUP_DIR.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.utils import timezone
+
+from config import metrics
+
+from . import audit
+
+logger = logging.getLogger(__name__)
+
+BACKUP_NAME_RE = re.compile(
+    r'backup_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\.(sql|sql\.gz|sql\.zst|dump|dir)'
+)
+BACKUP_FORMATS = ('sql', 'dump', 'dir')
+COMPRESSIONS = ('gzip', 'zstd', 'none')
+
+LOCK_FILENAME = '.backup.lock'
+STATUS_FILENAME = '.backup_status.json'
+JOB_LOG_FILENAME = '.backup_job.log'
+# Ключ pg_try_advisory_lock: бэкап или проверка копии выполняется одним процессом за раз
+LOCK_KEY = 7_104_212
+# Ответ процесса backup_job запустившему его веб-процессу
+JOB_STARTED = 'started'
+JOB_BUSY = 'busy'
+MANIFEST_SUFFIX = '.manifest.json'
+_CHUNK_SIZE = 1024 * 1024
+
+
+# ——— Пути и настройки ———
+
+def get_backup_dir():
+    backup_dir = Path(settings.BACKUP_DIR)
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    return backup_dir
+
+
+def resolve_pg_tool(name):
+    """Путь к утилите PostgreSQL (pg_dump, pg_restore): settings/env -> PATH -> стандартные пути Windows."""
+    setting_name = f'{name.upper()}_PATH'
+    configured = getattr(settings, setting_name, None) or os.environ.get(setting_name)
+    if configured:
+        configured_path = Path(configured)
+        if configured_path.exists():
+            return str(configured_path)
+    from_path = shutil.which(name)
+    if from_path:
+        return from_path
+
+    # Windows fallback: C:\Program Files\PostgreSQL\<version>\bin\<name>.exe
+    pf = os.environ.get('ProgramFiles', r'C:\Program Files')
+    root = Path(pf) / 'PostgreSQL'
+    if root.exists():
+        candidates = []
+        for ver_dir in root.iterdir():
+            exe = ver_dir / 'bin' / f'{name}.exe'
+            if exe.exists():
+                candidates.append(exe)
+        if candidates:
+            candidates.sort(reverse=True)
+            return str(candidates[0])
+    return None
+
+
+def pg_tool_major_version(executable):
+    """Мажорная версия утилиты PostgreSQL (по выводу --version), 0 — если определить не удалось."""
+    try:
+        proc = subprocess.run([executable, '--version'], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return 0
+    match = re.search(r'(\d+)(?:\.\d+)?', proc.stdout or '')
+    return int(match.group(1)) if match else 0
+
+
+def pg_connection_args(db):
+    return [
+        '-h', str(db.get('HOST') or '127.0.0.1'),
+        '-p', str(db.get('PORT') or '5432'),
+        '-U', str(db.get('USER') or ''),
+    ]
+
+
+def pg_env(db):
+    env = os.environ.copy()
+    env['PGPASSWORD'] = str(db.get('PASSWORD') or '')
+    return env
+
+
+def _effective_compression():
+    """Метод сжатия из настроек; zstd без пакета zstandard заменяется на gzip."""
+    compression = (getattr(settings, 'BACKUP_COMPRESSION', 'gzip') or 'none').lower()
+    if compression not in COMPRESSIONS:
+        compression = 'gzip'
+    if compression == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            logger.warning('BACKUP_COMPRESSION=zstd, но пакет zstandard не установлен — используется gzip.')
+            compression = 'gzip'
+    return compression
+
+
+def _backup_filename(backup_format, compression):
+    stamp = timezone.now().strftime('%Y-%m-%d_%H-%M-%S')
+    if backup_format == 'sql':
+        ext = {'gzip': 'sql.gz', 'zstd': 'sql.zst'}.get(compression, 'sql')
+    else:
+        ext = backup_format
+    return f'backup_{stamp}.{ext}'
+
+
+def backup_format_of(name):
+    """Формат копии по имени файла: sql, dump или dir."""
+    if name.endswith('.dir'):
+        return 'dir'
+    if name.endswith('.dump'):
+        return 'dump'
+    return 'sql'
+
+
+def manifest_path(backup_path):
+    return backup_path.with_name(backup_path.name + MANIFEST_SUFFIX)
+
+
+def resolve_backup_path(filename):
+    """Безопасный путь к копии внутри BACKUP_DIR или None, если имя недопустимо."""
+    if not BACKUP_NAME_RE.fullmatch(filename or ''):
+        return None
+    backup_dir = Path(settings.BACKUP_DIR).resolve()
+    path = (backup_dir / filename).resolve()
+    if backup_dir not in path.parents:
+        return None
+    return path
+
+
+# ——— Блокировка и статус ———
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _read_lock(backup_dir):
+    try:
+        return json.loads((backup_dir / LOCK_FILENAME).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def _lock_is_stale(lock):
+    if not lock:
+        return True
+    timeout = getattr(settings, 'BACKUP_LOCK_TIMEOUT', 6 * 3600)
+    if time.time() - float(lock.get('created', 0)) > timeout:
+        return True
+    return not _pid_alive(int(lock.get('pid', 0)))
+
+
+def _acquire_file_lock(backup_dir):
+    lock_path = backup_dir / LOCK_FILENAME
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if _lock_is_stale(_read_lock(backup_dir)):
+                try:
+                    lock_path.unlink()
+                except OSError:
+                    pass
+                continue
+            return None
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            json.dump({'pid': os.getpid(), 'created': time.time()}, fh)
+        return lock_path
+    return None
+
+
+def _try_advisory_lock():
+    """Отдельное соединение с pg_try_advisory_lock или None, если блокировку держит другой процесс."""
+    lock_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        with lock_connection.cursor() as c:
+            c.execute('SELECT pg_try_advisory_lock(%s)', [LOCK_KEY])
+            acquired = c.fetchone()[0]
+    except BaseException:
+        lock_connection.close()
+        raise
+    if not acquired:
+        lock_connection.close()
+        return None
+    return lock_connection
+
+
+def _acquire_lock(backup_dir):
+    """
+    Блокировка «одна операция за раз». В PostgreSQL — pg_try_advisory_lock на отдельном соединении:
+    общая для всех серверов приложения и снимается сама, если процесс операции завершился. В других
+    СУБД — файл в BACKUP_DIR (O_EXCL) с pid владельца. Возвращает объект для _release_lock или None.
+    """
+    if connection.vendor == 'postgresql':
+        return _try_advisory_lock()
+    return _acquire_file_lock(backup_dir)
+
+
+def _release_lock(lock):
+    if isinstance(lock, Path):
+        try:
+            lock.unlink()
+        except OSError:
+            pass
+        return
+    try:
+        with lock.cursor() as c:
+            c.execute('SELECT pg_advisory_unlock(%s)', [LOCK_KEY])
+    finally:
+        lock.close()
+
+
+# Advisory-блокировка с ключом bigint в pg_locks: classid — старшие 32 бита ключа, objid — младшие, objsubid = 1
+_ADVISORY_LOCK_HELD_SQL = (
+    "SELECT EXISTS (SELECT 1 FROM pg_locks l JOIN pg_database d ON d.oid = l.database "
+    "WHERE l.locktype = 'advisory' AND l.granted AND d.datname = current_database() "
+    "AND l.classid::bigint = %s AND l.objid::bigint = %s AND l.objsubid = 1)"
+)
+
+
+def _lock_busy(backup_dir):
+    """
+    Выполняется ли сейчас операция: блокировку держит живой процесс (на любом сервере для PostgreSQL).
+    В PostgreSQL смотрим pg_locks на текущем соединении, не открывая нового при каждом опросе статуса.
+    """
+    if connection.vendor != 'postgresql':
+        return not _lock_is_stale(_read_lock(backup_dir))
+    with connection.cursor() as c:
+        c.execute(_ADVISORY_LOCK_HELD_SQL, [LOCK_KEY >> 32, LOCK_KEY & 0xFFFFFFFF])
+        return c.fetchone()[0]
+
+
+def _write_status(backup_dir, status):
+    tmp_path = backup_dir / (STATUS_FILENAME + '.tmp')
+    tmp_path.write_text(json.dumps(status, ensure_ascii=False), encoding='utf-8')
+    os.replace(tmp_path, backup_dir / STATUS_FILENAME)
+
+
+def read_status():
+    """
+    Состояние последнего запуска для страницы обслуживания БД. «Выполняется», которое не держит
+    блокировку (процесс операции завершился аварийно или сервер перезапущен), показывается как сбой.
+    """
+    backup_dir = get_backup_dir()
+    try:
+        status = json.loads((backup_dir / STATUS_FILENAME).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {'state': 'idle'}
+    if status.get('state') == 'running':
+        try:
+            busy = _lock_busy(backup_dir)
+        except Exception:
+            logger.warning('Не удалось проверить блокировку резервного копирования', exc_info=True)
+            busy = True
+        if not busy:
+            status['state'] = 'failed'
+            status['error'] = 'Процесс резервного копирования прерван.'
+    return status
+
+
+# ——— Снятие копии ———
+
+class _HashingWriter:
+    """Файловый объект, считающий SHA-256 и размер записанных байт."""
+
+    def __init__(self, fh):
+        self._fh = fh
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._fh.write(data)
+
+    def flush(self):
+        self._fh.flush()
+
+
+def _open_compressor(writer, compression, level):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=level, mtime=0)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).stream_writer(writer, closefd=False)
+    return None
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stream_dump(cmd, env, part_path, compression, level):
+    """pg_dump пишет в stdout; данные сжимаются и хэшируются по мере поступления."""
+    with tempfile.TemporaryFile() as stderr_fh, open(part_path, 'wb') as out:
+        writer = _HashingWriter(out)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_fh, env=env)
+        compressor = _open_compressor(writer, compression, level)
+        target = compressor or writer
+        try:
+            for chunk in iter(lambda: proc.stdout.read(_CHUNK_SIZE), b''):
+                target.write(chunk)
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+        if compressor is not None:
+            compressor.close()
+        if returncode != 0:
+            stderr_fh.seek(0)
+            raise RuntimeError(stderr_fh.read().decode('utf-8', errors='ignore').strip()[:300] or f'pg_dump: код {returncode}')
+    return [{'path': '', 'size': writer.size, 'sha256': writer.sha256.hexdigest()}]
+
+
+def _run_directory_dump(cmd, env, part_path):
+    proc = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', env=env)
+    if proc.returncode != 0:
+        raise RuntimeError((proc.stderr or '').strip()[:300] or f'pg_dump: код {proc.returncode}')
+    files = sorted(p for p in part_path.rglob('*') if p.is_file())
+    jobs = max(1, int(getattr(settings, 'BACKUP_JOBS', 4)))
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        digests = list(pool.map(sha256_file, files))
+    return [
+        {'path': p.relative_to(part_path).as_posix(), 'size': p.stat().st_size, 'sha256': digest}
+        for p, digest in zip(files, digests)
+    ]
+
+
+def _pg_dump_compress_args(pg_dump, compression, level):
+    """Встроенное сжатие pg_dump для форматов custom/directory (zstd — начиная с PostgreSQL 16)."""
+    if compression == 'none':
+        return ['-Z', '0'], 'none'
+    if compression == 'zstd' and pg_tool_major_version(pg_dump) >= 16:
+        return [f'--compress=zstd:{level}'], 'zstd'
+    return ['-Z', str(min(level, 9))], 'gzip'
+
+
+def create_backup(pg_dump, db, backup_dir, filename, backup_format, compression):
+    """Снимает копию БД в BACKUP_DIR и пишет рядом манифест с контрольными суммами."""
+    level = int(getattr(settings, 'BACKUP_COMPRESSION_LEVEL', 6))
+    jobs = max(1, int(getattr(settings, 'BACKUP_JOBS', 4)))
+    final_path = backup_dir / filename
+    part_path = backup_dir / (filename + '.part')
+    cmd = [pg_dump, *pg_connection_args(db), '-d', str(db.get('NAME') or ''), '--encoding=UTF8', '--no-owner', '--no-privileges']
+    env = pg_env(db)
+    started = time.monotonic()
+    try:
+        if backup_format == 'sql':
+            cmd += ['-F', 'p', '--clean', '--if-exists']
+            files = _stream_dump(cmd, env, part_path, compression, level)
+            used_compression = compression
+        elif backup_format == 'dump':
+            compress_args, used_compression = _pg_dump_compress_args(pg_dump, compression, level)
+            cmd += ['-F', 'c', *compress_args]
+            files = _stream_dump(cmd, env, part_path, 'none', level)
+        else:
+            compress_args, used_compression = _pg_dump_compress_args(pg_dump, compression, level)
+            cmd += ['-F', 'd', '-j', str(jobs), *compress_args, '-f', str(part_path)]
+            files = _run_directory_dump(cmd, env, part_path)
+        os.replace(part_path, final_path)
+    except BaseException:
+        _remove_path(part_path)
+        raise
+    manifest = {
+        'name': filename,
+        'format': backup_format,
+        'compression': used_compression,
+        'jobs': jobs if backup_format == 'dir' else 1,
+        'database': str(db.get('NAME') or ''),
+        'created_at': timezone.now().isoformat(),
+        'duration_sec': round(time.monotonic() - started, 2),
+        'size': sum(f['size'] for f in files),
+        'files': files,
+    }
+    manifest_path(final_path).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+    return manifest
+
+
+def run_job(operation, filename, job, ready=None, **status_extra):
+    """
+    Выполняет job() под общей блокировкой (бэкап и проверка восстановления не идут параллельно) и пишет
+    статус; словарь, который вернёт job, попадает в статус. ready() вызывается, когда блокировка взята
+    и статус записан. Возвращает False, если другая операция ещё выполняется.
+    """
+    backup_dir = get_backup_dir()
+    lock = _acquire_lock(backup_dir)
+    if lock is None:
+        return False
+    status = {
+        'state': 'running',
+        'operation': operation,
+        'filename': filename,
+        'started_at': timezone.now().isoformat(),
+        'pid': os.getpid(),
+        'host': socket.gethostname(),
+        **status_extra,
+    }
+    started = time.monotonic()
+    try:
+        _write_status(backup_dir, status)
+        if ready:
+            ready()
+        result = job() or {}
+        status.update({'state': 'succeeded', 'finished_at': timezone.now().isoformat(), **result})
+    except Exception as exc:
+        logger.exception('Операция %s (%s) завершилась ошибкой', operation, filename)
+        status.update({'state': 'failed', 'finished_at': timezone.now().isoformat(), 'error': str(exc)[:300]})
+    finally:
+        metrics.observe(metrics.JOB_DURATION, time.monotonic() - started, operation=operation, result=status['state'])
+        _write_status(backup_dir, status)
+        _release_lock(lock)
+    return True
+
+
+def run_in_background(operation, filename, *args):
+    """
+    Запускает операцию отдельным процессом (manage.py backup_job operation filename *args): она не
+    зависит от перезапуска веб-воркера. Ждёт, пока процесс возьмёт блокировку, и возвращает False,
+    если другая операция ещё выполняется. Вывод процесса — в BACKUP_DIR/.backup_job.log.
+    """
+    backup_dir = get_backup_dir()
+    cmd = [sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'backup_job', operation, filename, *args]
+    if os.name == 'nt':
+        detach = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        detach = {'start_new_session': True}
+    with open(backup_dir / JOB_LOG_FILENAME, 'ab') as log:
+        proc = subprocess.Popen(
+            cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=log, cwd=str(settings.BASE_DIR), **detach,
+        )
+    # Первая строка вывода — ответ процесса: started (блокировка взята) или busy. Читается в отдельном
+    # потоке, чтобы зависший процесс (например, на подключении к БД) не держал запрос воркера
+    lines = []
+    reader = threading.Thread(
+        target=lambda: lines.append(proc.stdout.readline()), name=f'pg-{operation}-answer', daemon=True,
+    )
+    reader.start()
+    timeout = getattr(settings, 'BACKUP_JOB_START_TIMEOUT', 30)
+    reader.join(timeout)
+    timed_out = reader.is_alive()
+    if timed_out:
+        proc.kill()
+        reader.join()
+    proc.stdout.close()
+    # Процесс дочерний для воркера: ожидание в фоне не оставляет зомби после его завершения
+    threading.Thread(target=proc.wait, name=f'pg-{operation}-wait', daemon=True).start()
+    if timed_out:
+        raise RuntimeError(
+            f'Операция {operation} не ответила за {timeout} с и остановлена: см. {JOB_LOG_FILENAME} в BACKUP_DIR.'
+        )
+    answer = lines[0].decode('utf-8', 'replace').strip() if lines else ''
+    if answer == JOB_BUSY:
+        return False
+    if answer != JOB_STARTED:
+        raise RuntimeError(f'Не удалось запустить операцию {operation}: см. {JOB_LOG_FILENAME} в BACKUP_DIR.')
+    return True
+
+
+@contextmanager
+def exclusive_lock():
+    """Та же блокировка для синхронного запуска (management-команды). BlockingIOError — если занято."""
+    backup_dir = get_backup_dir()
+    lock = _acquire_lock(backup_dir)
+    if lock is None:
+        raise BlockingIOError('Другая операция резервного копирования ещё выполняется.')
+    try:
+        yield backup_dir
+    finally:
+        _release_lock(lock)
+
+
+def backup_job(user_id, filename, backup_format, compression):
+    """Снятие копии с ротацией (выполняется в процессе manage.py backup_job). Результат — для статуса."""
+    db = settings.DATABASES.get('default', {})
+    pg_dump = resolve_pg_tool('pg_dump')
+    if not pg_dump:
+        raise RuntimeError('pg_dump недоступен. Укажите PG_DUMP_PATH в settings.py или добавьте PostgreSQL bin в PATH.')
+    backup_dir = get_backup_dir()
+    manifest = create_backup(pg_dump, db, backup_dir, filename, backup_format, compression)
+    pruned = apply_retention(backup_dir, protect={filename})
+    audit.record('Backup created', user_id=user_id, filename=filename, size=manifest['size'])
+    return {'duration_sec': manifest['duration_sec'], 'size': manifest['size'], 'pruned': pruned}
+
+
+def start_backup(user_id, backup_format):
+    """
+    Запускает резервное копирование отдельным процессом.
+    Возвращает имя будущего файла или None, если другая копия ещё создаётся.
+    """
+    if not resolve_pg_tool('pg_dump'):
+        raise RuntimeError('pg_dump недоступен. Укажите PG_DUMP_PATH в settings.py или добавьте PostgreSQL bin в PATH.')
+    if backup_format not in BACKUP_FORMATS:
+        backup_format = 'sql'
+    compression = _effective_compression()
+    filename = _backup_filename(backup_format, compression)
+    args = ['--format', backup_format, '--compression', compression]
+    if user_id:
+        args += ['--user', str(user_id)]
+    if not run_in_background('backup', filename, *args):
+        return None
+    return filename
+
+
+# ——— Список, удаление, ротация ———
+
+def list_backup_paths(backup_dir=None):
+    backup_dir = backup_dir or get_backup_dir()
+    return [p for p in backup_dir.glob('backup_*') if BACKUP_NAME_RE.fullmatch(p.name)]
+
+
+def path_size(path):
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+    return path.stat().st_size
+
+
+def read_manifest(path):
+    try:
+        return json.loads(manifest_path(path).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def list_backups():
+    """Копии для страницы обслуживания, новые сверху."""
+    backups = []
+    paths = list_backup_paths()
+    for path in sorted(paths, key=lambda p: p.stat().st_mtime, reverse=True):
+        stat = path.stat()
+        manifest = read_manifest(path) or {}
+        backups.append({
+            'name': path.name,
+            'format': backup_format_of(path.name),
+            'compression': manifest.get('compression', ''),
+            'is_dir': path.is_dir(),
+            'has_manifest': bool(manifest),
+            'size_mb': round(path_size(path) / (1024 * 1024), 2),
+            'modified_at': timezone.datetime.fromtimestamp(stat.st_mtime, tz=timezone.get_current_timezone()),
+        })
+    return backups
+
+
+def _remove_path(path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    elif path.exists():
+        path.unlink()
+
+
+def delete_backup(path):
+    _remove_path(path)
+    mpath = manifest_path(path)
+    if mpath.exists():
+        mpath.unlink()
+
+
+def apply_retention(backup_dir=None, keep_last=None, max_age_days=None, protect=()):
+    """
+    Ротация: всегда храним keep_last последних копий, из остальных удаляем
+    старше max_age_days (0 — удалять все сверх keep_last). Возвращает имена удалённых.
+    """
+    backup_dir = backup_dir or get_backup_dir()
+    if keep_last is None:
+        keep_last = int(getattr(settings, 'BACKUP_KEEP_LAST', 10))
+    if max_age_days is None:
+        max_age_days = int(getattr(settings, 'BACKUP_MAX_AGE_DAYS', 30))
+    cutoff = time.time() - max_age_days * 86400
+    paths = sorted(list_backup_paths(backup_dir), key=lambda p: p.stat().st_mtime, reverse=True)
+    removed = []
+    for index, path in enumerate(paths):
+        if index < keep_last or path.name in protect:
+            continue
+        if max_age_days and path.stat().st_mtime >= cutoff:
+            continue
+        try:
+            delete_backup(path)
+        except OSError:
+            logger.warning('Не удалось удалить старую копию %s', path.name)
+            continue
+        removed.append(path.name)
+    return removed
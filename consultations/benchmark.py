@@ -0,0 +1,233 @@
+"""
+Нагрузочный прогон представлений: каждый именованный URL приложений consultations, students и users
+запрашивается тестовым клиентом Django от имени каждой роли. Для каждой пары (URL, роль) считаются
+p50/p95 времени ответа, число SQL-запросов и пиковая память; результат сохраняется в JSON для
+сравнения прогонов. Запускать на отдельной БД с синтетическими данными (manage.py generate_dataset).
+"""
+import fnmatch
+import math
+import platform
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.utils import timezone
+
+BENCH_NAMESPACES = ('consultations', 'students', 'users')
+ROLES = ('admin', 'psychologist', 'student', 'anonymous')
+# Выход из системы сбросил бы сессию клиента
+SKIP_URLS = ('users:logout',)
+
+
+def iter_named_urls(namespaces=BENCH_NAMESPACES):
+    """(имя URL вида ns:name, маршрут, имена параметров) для всех именованных URL указанных приложений."""
+    for resolver in get_resolver().url_patterns:
+        if not isinstance(resolver, URLResolver) or resolver.namespace not in namespaces:
+            continue
+        for pattern in resolver.url_patterns:
+            if isinstance(pattern, URLPattern) and pattern.name:
+                route = str(pattern.pattern)
+                yield f'{resolver.namespace}:{pattern.name}', route, tuple(pattern.pattern.converters)
+
+
+# ——— Пользователи и параметры URL ———
+
+def pick_users(usernames=None):
+    """Пользователь на каждую роль: заданный явно или самый «нагруженный» из БД."""
+    from users.models import User
+
+    usernames = usernames or {}
+    active = User.objects.filter(is_active=True).select_related('role')
+    users = {}
+    for role in ('admin', 'psychologist', 'student'):
+        if usernames.get(role):
+            users[role] = active.filter(username=usernames[role]).first()
+            continue
+        qs = active.filter(role__name=role)
+        if role == 'psychologist':
+            qs = qs.annotate(load=Count('handled_requests')).order_by('-load', 'pk')
+        elif role == 'student':
+            qs = qs.filter(student__isnull=False).order_by('pk')
+            # Учащийся с чатом открывает больше страниц с данными
+            users[role] = qs.filter(student__psychologist_chat__isnull=False).first() or qs.first()
+            continue
+        else:
+            qs = qs.order_by('pk')
+        users[role] = qs.first()
+    users['anonymous'] = None
+    return users
+
+
+def _last_pk(qs):
+    return qs.order_by('-pk').values_list('pk', flat=True).first()
+
+
+def sample_kwargs(url_name, route, params, user):
+    """Значения параметров URL из БД; None — подходящего объекта нет."""
+    from students.models import Student
+    from users.models import User
+    from .backups import list_backup_paths
+    from .models import Attachment, Consultation, Request, StudentPsychologistChat
+
+    if not params:
+        return {}
+    if 'filename' in params:
+        paths = sorted(list_backup_paths(), key=lambda p: p.stat().st_mtime)
+        return {'filename': paths[-1].name} if paths else None
+    if 'attachment_id' in params:
+        row = Attachment.objects.order_by('-pk').values_list('consultation_id', 'pk').first()
+        return {'pk': row[0], 'attachment_id': row[1]} if row else None
+
+    student_id = getattr(user, 'student_id', None)
+    if url_name.startswith('users:'):
+        pk = _last_pk(User.objects.all())
+    elif url_name.startswith('students:') or route.startswith('reports/student/'):
+        pk = _last_pk(Student.objects.all())
+    elif route.startswith('my/requests/'):
+        pk = _last_pk(Request.objects.filter(student_id=student_id)) if student_id else None
+    elif route.startswith('my/consultations/'):
+        pk = _last_pk(Consultation.objects.filter(students__id=student_id)) if student_id else None
+    elif route.startswith('requests/'):
+        pk = _last_pk(Request.objects.all())
+    elif route.startswith('journal/'):
+        pk = _last_pk(Consultation.objects.all())
+    elif route.startswith('chats/'):
+        pk = _last_pk(StudentPsychologistChat.objects.all())
+    else:
+        pk = None
+    return {'pk': pk} if pk is not None else None
+
+
+# ——— Измерение ———
+
+def percentile(values, p):
+    """Перцентиль методом ближайшего ранга."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _consume(response):
+    """Полностью читает ответ (в том числе потоковый) и возвращает размер тела."""
+    if getattr(response, 'streaming', False):
+        size = sum(len(chunk) for chunk in response.streaming_content)
+        response.close()
+        return size
+    return len(response.content)
+
+
+def measure(client, path, repeat=10, warmup=1):
+    """Время — по repeat запросам; число SQL и пиковая память — по отдельному запросу под tracemalloc."""
+    for _ in range(warmup):
+        _consume(client.get(path))
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(path)
+        _consume(response)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        try:
+            response = client.get(path)
+            size = _consume(response)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'redirect': response.get('Location') if 300 <= response.status_code < 400 else None,
+        'bytes': size,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+        'queries': len(queries.captured_queries),
+        'sql_ms': round(sum(float(q['time']) for q in queries.captured_queries) * 1000, 2),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def _dataset_size():
+    from students.models import Student
+    from .models import ChatMessage, Consultation, Request
+
+    with connection.cursor() as c:
+        sizes = {}
+        for model in (Student, Request, Consultation, ChatMessage):
+            c.execute(f'SELECT COUNT(*) FROM {model._meta.db_table}')
+            sizes[model._meta.db_table] = c.fetchone()[0]
+    return sizes
+
+
+def run_benchmark(roles=ROLES, only=None, repeat=10, warmup=1, usernames=None, progress=None):
+    """
+    Прогон всех URL. only — список шаблонов имён (fnmatch), например ['consultations:report*'].
+    progress(result) вызывается после каждого измерения. Возвращает отчёт (dict).
+    """
+    users = pick_users(usernames)
+    report = {
+        'meta': {
+            'started_at': timezone.now().isoformat(),
+            'repeat': repeat,
+            'warmup': warmup,
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'dataset': _dataset_size(),
+            'users': {role: getattr(user, 'username', None) for role, user in users.items()},
+        },
+        'results': [],
+    }
+    hosts = list(settings.ALLOWED_HOSTS)
+    with override_settings(ALLOWED_HOSTS=hosts + ['testserver']):
+        for role in roles:
+            if role not in users or (role != 'anonymous' and users[role] is None):
+                continue
+            client = Client(raise_request_exception=False)
+            if users[role] is not None:
+                client.force_login(users[role])
+            for url_name, route, params in iter_named_urls():
+                if url_name in SKIP_URLS or (only and not any(fnmatch.fnmatch(url_name, p) for p in only)):
+                    continue
+                result = {'url': url_name, 'role': role}
+                kwargs = sample_kwargs(url_name, route, params, users[role])
+                if kwargs is None:
+                    result['skipped'] = 'нет подходящих данных'
+                else:
+                    result['path'] = reverse(url_name, kwargs=kwargs)
+                    result.update(measure(client, result['path'], repeat=repeat, warmup=warmup))
+                report['results'].append(result)
+                if progress:
+                    progress(result)
+    report['meta']['finished_at'] = timezone.now().isoformat()
+    return report
+
+
+def compare_reports(previous, current, threshold=0.2):
+    """
+    Сравнение двух прогонов по (URL, роль): изменение p95, числа запросов и памяти.
+    Возвращает строки, где p95 или память выросли больше чем на threshold, либо выросло число запросов.
+    """
+    before = {(r['url'], r['role']): r for r in previous.get('results', []) if 'p95_ms' in r}
+    changes = []
+    for row in current.get('results', []):
+        old = before.get((row['url'], row['role']))
+        if not old or 'p95_ms' not in row:
+            continue
+        p95_ratio = row['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0
+        mem_ratio = row['peak_kb'] / old['peak_kb'] - 1 if old['peak_kb'] else 0
+        if p95_ratio > threshold or mem_ratio > threshold or row['queries'] > old['queries']:
+            changes.append({
+                'url': row['url'],
+                'role': row['role'],
+                'p95_ms': (old['p95_ms'], row['p95_ms']),
+                'queries': (old['queries'], row['queries']),
+                'peak_kb': (old['peak_kb'], row['peak_kb']),
+            })
+    return changes
@@ -0,0 +1,277 @@
+"""
+Оценка динамики учащегося: уровень по доле проведённых консультаций, тренду обращений за 30 дней и
+сигналам прогресса и риска (статусы обращений, ключевые слова в результатах консультаций и заметках
+к обращениям). Одна реализация для страницы учащегося (StudentDynamicsView) и списка риска по всем
+учащимся (RiskRosterView), поэтому оценки на них не расходятся.
+
+Показатели собираются тремя сгруппированными запросами сразу для всех учащихся области (обращения,
+пары «консультация — учащийся», заметки), уровень считается на массивах NumPy одним проходом.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from students.models import Student
+from .models import Consultation, ConsultationStudent, Request, RequestNote
+
+POSITIVE_KEYWORDS = ('прогресс', 'улучш', 'стабил', 'справ', 'нормализ', 'спокойн')
+NEGATIVE_KEYWORDS = ('тревог', 'стресс', 'конфликт', 'булл', 'агресс', 'депресс', 'паник', 'проблем')
+TREND_DAYS = 30
+
+# Уровни в порядке списка риска (код уровня — индекс): сначала те, кому нужно внимание
+RISK, STABLE, POSITIVE, INSUFFICIENT = range(4)
+LEVELS = (
+    ('risk', 'Зона риска'),
+    ('stable', 'Стабильная'),
+    ('positive', 'Положительная'),
+    ('insufficient', 'Недостаточно данных'),
+)
+LEVEL_CODES = {slug: code for code, (slug, _) in enumerate(LEVELS)}
+
+# Сортировки списка риска: столбцы по убыванию приоритета («-» — по убыванию), затем ФИО
+SORTS = {
+    'level': ('level', '-problem', '-trend'),
+    'problem': ('-problem', 'level'),
+    'trend': ('-trend', 'level'),
+    'completion': ('completion_rate', 'level'),
+    'class': ('class', 'level'),
+    'name': (),
+}
+
+# Показатели учащегося (столбцы collect): по обращениям, по консультациям (столбцы пар после id), по заметкам
+REQUEST_METRICS = (
+    'req_total', 'req_new', 'req_in_progress', 'req_completed', 'req_cancelled',
+    'recent_requests', 'previous_requests',
+)
+PAIR_METRICS = ('cons_completed', 'cons_cancelled', 'positive_results', 'negative_results')
+NOTE_METRICS = ('positive_notes', 'negative_notes')
+METRICS = REQUEST_METRICS + ('cons_total',) + PAIR_METRICS + NOTE_METRICS
+
+
+def _keywords(field, words):
+    q = Q()
+    for word in words:
+        q |= Q(**{f'{field}__icontains': word})
+    return q
+
+
+def _flag(condition):
+    return Case(When(condition, then=Value(1)), default=Value(0), output_field=IntegerField())
+
+
+def scope_querysets(user, date_from='', date_to=''):
+    """
+    Обращения, консультации и заметки к обращениям, которые видит пользователь (психолог — свои и без
+    психолога, админ — все), за период по дате создания обращения и заметки и дате консультации.
+    """
+    req_qs = Request.objects.all()
+    cons_qs = Consultation.objects.all()
+    notes_qs = RequestNote.objects.all()
+    if user.role_name == 'psychologist':
+        req_qs = req_qs.filter(Q(psychologist_id=user.id) | Q(psychologist_id__isnull=True))
+        cons_qs = cons_qs.filter(
+            Q(request__psychologist_id=user.id)
+            | Q(request_id__isnull=True)
+            | Q(request__psychologist_id__isnull=True)
+        )
+        notes_qs = notes_qs.filter(Q(request__psychologist_id=user.id) | Q(request__psychologist_id__isnull=True))
+    if date_from:
+        req_qs = req_qs.filter(created_at__date__gte=date_from)
+        cons_qs = cons_qs.filter(date__gte=date_from)
+        notes_qs = notes_qs.filter(created_at__date__gte=date_from)
+    if date_to:
+        req_qs = req_qs.filter(created_at__date__lte=date_to)
+        cons_qs = cons_qs.filter(date__lte=date_to)
+        notes_qs = notes_qs.filter(created_at__date__lte=date_to)
+    return req_qs, cons_qs, notes_qs
+
+
+def collect(user, date_from='', date_to='', student_ids=None, today=None):
+    """
+    Показатели учащихся области: (ids, {показатель: массив}) — ids по возрастанию, строка на учащегося
+    с обращениями или консультациями за период. student_ids ограничивает выборку; эти учащиеся попадают
+    в результат и без активности (с нулями).
+    """
+    req_qs, cons_qs, notes_qs = scope_querysets(user, date_from, date_to)
+    if student_ids is not None:
+        req_qs = req_qs.filter(student_id__in=student_ids)
+        notes_qs = notes_qs.filter(request__student_id__in=student_ids)
+    today = today or timezone.now().date()
+    recent_from = today - timedelta(days=TREND_DAYS)
+    previous_from = today - timedelta(days=2 * TREND_DAYS)
+
+    requests = list(req_qs.order_by().values('student_id').annotate(
+        req_total=Count('id'),
+        req_new=Count('id', filter=Q(status__name='new')),
+        req_in_progress=Count('id', filter=Q(status__name='in_progress')),
+        req_completed=Count('id', filter=Q(status__name='completed')),
+        req_cancelled=Count('id', filter=Q(status__name='cancelled')),
+        recent_requests=Count('id', filter=Q(created_at__date__gte=recent_from)),
+        previous_requests=Count('id', filter=Q(created_at__date__gte=previous_from, created_at__date__lt=recent_from)),
+    ))
+    pairs = _consultation_pairs(cons_qs, student_ids)
+    notes = list(notes_qs.order_by().values('request__student_id').annotate(
+        positive_notes=Count('id', filter=_keywords('text', POSITIVE_KEYWORDS)),
+        negative_notes=Count('id', filter=_keywords('text', NEGATIVE_KEYWORDS)),
+    ))
+
+    ids = np.union1d(
+        np.array([row['student_id'] for row in requests], dtype=np.int64),
+        pairs[:, 1],
+    )
+    if student_ids is not None:
+        ids = np.union1d(ids, np.asarray(list(student_ids), dtype=np.int64))
+    metrics = {name: np.zeros(len(ids), dtype=np.int64) for name in METRICS}
+    if requests:
+        rows = np.searchsorted(ids, [row['student_id'] for row in requests])
+        for name in REQUEST_METRICS:
+            metrics[name][rows] = [row[name] for row in requests]
+    rows = np.searchsorted(ids, pairs[:, 1])
+    metrics['cons_total'] = np.bincount(rows, minlength=len(ids)).astype(np.int64)
+    for column, name in enumerate(PAIR_METRICS, 2):
+        metrics[name] = np.bincount(rows, weights=pairs[:, column], minlength=len(ids)).astype(np.int64)
+    # Заметки учитываются только у учащихся с обращениями или консультациями за период
+    notes = [row for row in notes if row['request__student_id'] is not None]
+    if notes:
+        note_ids = np.array([row['request__student_id'] for row in notes], dtype=np.int64)
+        known = np.isin(note_ids, ids)
+        rows = np.searchsorted(ids, note_ids[known])
+        for name in NOTE_METRICS:
+            metrics[name][rows] = np.array([row[name] for row in notes], dtype=np.int64)[known]
+    return ids, metrics
+
+
+def _consultation_pairs(cons_qs, student_ids):
+    """
+    Пары (консультация, учащийся) без повторов: учащийся — автор обращения консультации или участник.
+    Столбцы: id консультации, id учащегося, проведена, отменена, сигнал прогресса и риска в результате.
+    """
+    def flags(prefix=''):
+        return {
+            'done': _flag(Q(**{f'{prefix}completed_at__isnull': False})),
+            'cancelled': _flag(Q(**{f'{prefix}cancelled_at__isnull': False})),
+            'positive': _flag(_keywords(f'{prefix}result', POSITIVE_KEYWORDS)),
+            'negative': _flag(_keywords(f'{prefix}result', NEGATIVE_KEYWORDS)),
+        }
+    authors = cons_qs.filter(request__student_id__isnull=False)
+    participants = ConsultationStudent.objects.filter(consultation__in=cons_qs.values('id'))
+    if student_ids is not None:
+        authors = authors.filter(request__student_id__in=student_ids)
+        participants = participants.filter(student_id__in=student_ids)
+    fields = tuple(flags())
+    rows = list(authors.order_by().annotate(**flags()).values_list('id', 'request__student_id', *fields))
+    rows += participants.order_by().annotate(**flags('consultation__')).values_list('consultation_id', 'student_id', *fields)
+    if not rows:
+        return np.zeros((0, 6), dtype=np.int64)
+    pairs = np.array(rows, dtype=np.int64)
+    _, first = np.unique(pairs[:, :2], axis=0, return_index=True)
+    return pairs[np.sort(first)]
+
+
+def assess(metrics):
+    """
+    Оценка для всех строк сразу: доля проведённых консультаций (%), тренд обращений (за 30 дней минус
+    предыдущие 30), сигналы прогресса, нейтральные и риска, код уровня (индекс в LEVELS).
+    """
+    cons_total = metrics['cons_total']
+    completion_rate = np.where(
+        cons_total > 0, np.round(metrics['cons_completed'] / np.maximum(cons_total, 1) * 100), 0,
+    ).astype(np.int64)
+    trend = metrics['recent_requests'] - metrics['previous_requests']
+    success = metrics['cons_completed'] + metrics['positive_results'] + metrics['positive_notes']
+    # Отменённые консультации не считаем автоматически риском:
+    # отмена может быть по нейтральным причинам (перенос, личные обстоятельства и т.п.).
+    neutral = metrics['cons_cancelled']
+    problem = (
+        metrics['req_new'] + metrics['req_in_progress']
+        + metrics['negative_results'] + metrics['negative_notes']
+    )
+    level = np.select(
+        [
+            (cons_total == 0) & (metrics['req_total'] <= 1),
+            (completion_rate >= 70) & (trend <= 0) & (success >= problem),
+            (trend > 0) | (problem > success),
+        ],
+        [INSUFFICIENT, POSITIVE, RISK],
+        default=STABLE,
+    )
+    return {
+        'completion_rate': completion_rate,
+        'trend': trend,
+        'success': success,
+        'neutral': neutral,
+        'problem': problem,
+        'level': level,
+    }
+
+
+def level_name(code):
+    return LEVELS[code][1]
+
+
+def level_comment(code, neutral):
+    if code == INSUFFICIENT:
+        return 'Пока недостаточно истории наблюдений для обоснованной оценки динамики.'
+    if code == POSITIVE:
+        return 'Наблюдается положительная динамика: завершённых консультаций больше, чем риск-факторов.'
+    if code == RISK:
+        return 'Есть признаки сохранения/роста трудностей. Рекомендуется усилить сопровождение.'
+    if neutral > 0:
+        return (
+            'Состояние без выраженного ухудшения. Есть отменённые консультации, '
+            'но они не трактуются как риск без дополнительных негативных факторов.'
+        )
+    return 'Состояние без выраженного ухудшения, но требуется дальнейшее наблюдение.'
+
+
+def trend_text(delta):
+    if delta < 0:
+        return 'Снижение числа обращений за последние 30 дней.'
+    if delta > 0:
+        return 'Рост числа обращений за последние 30 дней.'
+    return 'Частота обращений стабильна.'
+
+
+def roster(user, date_from='', date_to='', level='', classroom_id=None, sort='level'):
+    """
+    Список риска: (строки, уровни). Строка — учащийся области с показателями и оценкой; фильтр по уровню
+    (slug из LEVELS) и классу, порядок — SORTS[sort]. Уровни — (slug, название, число учащихся) с учётом
+    фильтра по классу, но не по уровню: для переключателя уровней.
+    """
+    ids, metrics = collect(user, date_from, date_to)
+    students = list(
+        Student.objects.filter(pk__in=ids.tolist()).select_related('classroom').order_by('last_name', 'first_name', 'id')
+    )
+    positions = np.searchsorted(ids, np.array([s.pk for s in students], dtype=np.int64))
+    columns = {name: values[positions] for name, values in {**metrics, **assess(metrics)}.items()}
+    columns['name'] = np.arange(len(students))
+    class_names = sorted({s.classroom.name for s in students if s.classroom_id})
+    class_rank = {name: rank for rank, name in enumerate(class_names)}
+    columns['class'] = np.array(
+        [class_rank[s.classroom.name] if s.classroom_id else len(class_names) for s in students], dtype=np.int64,
+    )
+
+    mask = np.ones(len(students), dtype=bool)
+    if classroom_id:
+        mask &= np.array([s.classroom_id == classroom_id for s in students], dtype=bool)
+    counts = np.bincount(columns['level'][mask], minlength=len(LEVELS))
+    if level in LEVEL_CODES:
+        mask &= columns['level'] == LEVEL_CODES[level]
+    # np.lexsort: последний ключ — главный
+    keys = [columns['name']]
+    for key in reversed(SORTS.get(sort, SORTS['level'])):
+        keys.append(-columns[key[1:]] if key.startswith('-') else columns[key])
+    order = np.lexsort(keys)
+    order = order[mask[order]]
+
+    fields = ('req_total', 'cons_total', 'recent_requests', 'previous_requests', 'completion_rate', 'trend', 'success', 'neutral', 'problem')
+    rows = []
+    for index in order.tolist():
+        code = int(columns['level'][index])
+        row = {name: int(columns[name][index]) for name in fields}
+        row.update(student=students[index], level=LEVELS[code][0], level_name=LEVELS[code][1])
+        rows.append(row)
+    levels = [(slug, name, int(counts[code])) for code, (slug, name) in enumerate(LEVELS)]
+    return rows, levels
@@ -8,7 +8,9 @@ from config.input_validation import normalize_spaces
 from students.models import Student
 from users.models import User
 
-from .models import Consultation, Request
+from . import schedule
+from . import series
+from .models import Consultation, ConsultationSeries, Request
 
 
 class RequestForm(forms.ModelForm):
@@ -85,8 +87,8 @@ class ConsultationNoteForm(forms.Form):
 
 
 class ConsultationForm(forms.ModelForm):
-    WORKDAY_START = datetime.strptime('08:30', '%H:%M').time()
-    WORKDAY_END = datetime.strptime('16:00', '%H:%M').time()
+    WORKDAY_START = schedule.WORKDAY_START
+    WORKDAY_END = schedule.WORKDAY_END
 
     students = forms.ModelMultipleChoiceField(
         queryset=Student.objects.none(),
@@ -113,8 +115,10 @@ class ConsultationForm(forms.ModelForm):
             'end_time': 'Время окончания',
         }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, psychologist_id=None, **kwargs):
         super().__init__(*args, **kwargs)
+        # Чьё расписание проверяется на пересечения: у существующей консультации — её психолог
+        self.psychologist_id = getattr(self.instance, 'psychologist_id', None) or psychologist_id
         self.fields['students'].queryset = Student.objects.order_by('last_name', 'first_name')
         self.fields['request'].required = False
         self.fields['result'].required = False
@@ -180,6 +184,13 @@ class ConsultationForm(forms.ModelForm):
             raise ValidationError('Результат консультации слишком короткий. Укажите не менее 10 символов.')
         return value
 
+    def _check_form_students(self, form_type, students_val):
+        # Критичное правило: индивидуальная консультация только для одного учащегося.
+        if form_type and form_type.name == 'individual' and students_val and len(students_val) > 1:
+            self.add_error('students', 'Для индивидуальной консультации можно выбрать только одного учащегося.')
+        if form_type and form_type.name == 'group' and students_val and len(students_val) < 2:
+            self.add_error('students', 'Для групповой консультации нужно выбрать минимум двух учащихся.')
+
     def clean(self):
         data = super().clean()
         date_val = data.get('date')
@@ -189,11 +200,7 @@ class ConsultationForm(forms.ModelForm):
         students_val = data.get('students')
         form_type = data.get('form')
 
-        # Критичное правило: индивидуальная консультация только для одного учащегося.
-        if form_type and form_type.name == 'individual' and students_val and len(students_val) > 1:
-            self.add_error('students', 'Для индивидуальной консультации можно выбрать только одного учащегося.')
-        if form_type and form_type.name == 'group' and students_val and len(students_val) < 2:
-            self.add_error('students', 'Для групповой консультации нужно выбрать минимум двух учащихся.')
+        self._check_form_students(form_type, students_val)
 
         if not self.instance.pk and (not start_val or not end_val):
             if not start_val:
@@ -212,6 +219,16 @@ class ConsultationForm(forms.ModelForm):
             if date_val < today and not result_val:
                 self.add_error('result', 'Для прошедшей консультации укажите результат.')
 
+        if (
+            self.psychologist_id and date_val and start_val and end_val and end_val > start_val
+            and not self.instance.cancelled_at and not self.has_error('start_time')
+        ):
+            busy = schedule.find_conflicts(self.psychologist_id, date_val, start_val, end_val, exclude_id=self.instance.pk)
+            if busy:
+                self.add_error('start_time', 'В это время у психолога уже есть консультация: {}.'.format(
+                    ', '.join(c.time_display() for c in busy)
+                ))
+
         return data
 
     def save(self, commit=True):
@@ -223,6 +240,9 @@ class ConsultationForm(forms.ModelForm):
         if result is not None:
             instance.result = normalize_spaces(result) or None
 
+        if not instance.psychologist_id:
+            instance.psychologist_id = self.psychologist_id
+
         if start and end:
             dt_start = datetime.combine(date.today(), start)
             dt_end = datetime.combine(date.today(), end)
@@ -235,6 +255,122 @@ class ConsultationForm(forms.ModelForm):
         return instance
 
 
+class ConsultationSeriesForm(forms.ModelForm):
+    """
+    Серия консультаций. Все даты серии проверяются по расписанию психолога сразу; занятые даты можно
+    пропустить. У существующей серии меняются время, форма, участники и дата окончания.
+    """
+    WORKDAY_START = schedule.WORKDAY_START
+    WORKDAY_END = schedule.WORKDAY_END
+
+    students = forms.ModelMultipleChoiceField(
+        queryset=Student.objects.none(),
+        label='Учащиеся',
+        required=True,
+        widget=forms.SelectMultiple(attrs={'class': 'form-select consultation-students-select', 'size': 6}),
+        help_text='Одни и те же учащиеся на всех консультациях серии.',
+    )
+    skip_busy = forms.BooleanField(
+        required=False,
+        label='Пропустить даты, на которые это время уже занято',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+    )
+
+    class Meta:
+        model = ConsultationSeries
+        fields = ('request', 'students', 'date_from', 'date_until', 'interval_weeks', 'start_time', 'end_time', 'form')
+        widgets = {
+            'request': forms.Select(attrs={'class': 'form-select'}),
+            'date_from': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}, format='%Y-%m-%d'),
+            'date_until': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}, format='%Y-%m-%d'),
+            'interval_weeks': forms.Select(attrs={'class': 'form-select'}),
+            'start_time': forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'}, format='%H:%M'),
+            'end_time': forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'}, format='%H:%M'),
+            'form': forms.Select(attrs={'class': 'form-select'}),
+        }
+        labels = {
+            'request': 'Обращение (необязательно, для контекста)',
+            'date_until': 'Повторять до',
+        }
+
+    def __init__(self, *args, psychologist_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.psychologist_id = self.instance.psychologist_id or psychologist_id
+        self.fields['students'].queryset = Student.objects.order_by('last_name', 'first_name')
+        self.fields['request'].queryset = Request.objects.select_related('student', 'status')
+        self.fields['request'].required = False
+        # Даты серии и занятые из них — заполняются в clean()
+        self.dates = []
+        self.busy = {}
+        if self.instance.pk:
+            for name in ('request', 'date_from', 'interval_weeks'):
+                self.fields[name].disabled = True
+            self.fields['students'].initial = list(
+                series.current_students(self.instance).values_list('pk', flat=True)
+            )
+        elif self.initial.get('request'):
+            self.fields['request'].widget = forms.HiddenInput()
+            self.fields['students'].initial = [self.initial['request'].student_id]
+
+    clean_students = ConsultationForm.clean_students
+    clean_form = ConsultationForm.clean_form
+    clean_start_time = ConsultationForm.clean_start_time
+    clean_end_time = ConsultationForm.clean_end_time
+    _check_form_students = ConsultationForm._check_form_students
+
+    def clean_date_from(self):
+        value = self.cleaned_data.get('date_from')
+        if value and not self.instance.pk and value < timezone.now().date():
+            raise ValidationError('Серия не может начинаться с прошедшей даты.')
+        return value
+
+    def clean(self):
+        data = super().clean()
+        date_from = data.get('date_from')
+        date_until = data.get('date_until')
+        start_val = data.get('start_time')
+        end_val = data.get('end_time')
+        self._check_form_students(data.get('form'), data.get('students'))
+        if not date_from or not date_until or not start_val or not end_val or self.errors:
+            return data
+        if date_until < date_from:
+            self.add_error('date_until', 'Дата окончания серии не может быть раньше первой консультации.')
+            return data
+
+        added = None
+        if self.instance.pk:
+            kept, added, dropped = series.plan_update(self.instance, date_until)
+            dates = sorted([c.date for c in kept] + added)
+        else:
+            dates = series.occurrences(date_from, date_until, data.get('interval_weeks') or 1)
+        now = timezone.now()
+        if not self.instance.pk and dates and dates[0] == now.date() and start_val <= now.time():
+            dates = dates[1:]
+        if not dates and not self.instance.pk:
+            self.add_error('date_until', 'В выбранный период нет рабочих дней для консультаций (выходные, праздники и каникулы пропускаются).')
+            return data
+        if len(dates) > series.MAX_OCCURRENCES:
+            self.add_error('date_until', f'Слишком длинная серия: {len(dates)} консультаций, допускается не больше {series.MAX_OCCURRENCES}.')
+            return data
+
+        busy = series.find_conflicts(
+            self.psychologist_id, dates, start_val, end_val, series=self.instance if self.instance.pk else None,
+        )
+        # У существующей серии пропустить можно только новые даты — уже назначенные придётся перенести вручную
+        skippable = set(busy) if added is None else set(busy) & set(added)
+        if busy and (not data.get('skip_busy') or skippable != set(busy)):
+            self.add_error('start_time', 'Это время у психолога уже занято: {}.'.format('; '.join(
+                '{:%d.%m.%Y} ({})'.format(day, ', '.join(c.time_display() for c in found))
+                for day, found in sorted(busy.items())
+            )))
+            return data
+        self.dates = [day for day in dates if day not in busy]
+        self.busy = busy
+        if not self.dates and not self.instance.pk:
+            self.add_error('start_time', 'Все даты серии заняты — выберите другое время.')
+        return data
+
+
 class ChatMessageForm(forms.Form):
     text = forms.CharField(
         label='Сообщение',
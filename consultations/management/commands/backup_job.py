@@ -0,0 +1,46 @@
+"""
+Операция с резервными копиями, запущенная со страницы обслуживания БД (backups.run_in_background):
+снятие копии или проверка восстановления. Выполняется отдельным процессом, чтобы перезапуск
+веб-воркера не прерывал её; первая строка вывода — started или busy (занято другой операцией).
+Использование: python manage.py backup_job backup backup_2026-02-18_14-41-03.dump --format dump --compression gzip
+             python manage.py backup_job verify backup_2026-02-18_14-41-03.dump --user 1
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from consultations import backups, restore
+
+
+class Command(BaseCommand):
+    help = 'Снимает или проверяет резервную копию под общей блокировкой (для запуска со страницы обслуживания)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('operation', choices=('backup', 'verify'))
+        parser.add_argument('filename', help='Имя файла в BACKUP_DIR')
+        parser.add_argument('--user', type=int, default=None, help='id пользователя, запустившего операцию')
+        parser.add_argument('--format', choices=backups.BACKUP_FORMATS, default='sql', help='Формат копии')
+        parser.add_argument('--compression', choices=backups.COMPRESSIONS, default='gzip', help='Сжатие копии')
+
+    def handle(self, *args, **options):
+        operation, filename, user_id = options['operation'], options['filename'], options['user']
+        if not backups.resolve_backup_path(filename):
+            raise CommandError(f'Недопустимое имя файла: {filename}')
+        extra = {}
+        if operation == 'backup':
+            extra['format'] = options['format']
+
+            def job():
+                return backups.backup_job(user_id, filename, options['format'], options['compression'])
+        else:
+            def job():
+                return restore.verification_job(user_id, filename)
+
+        if not backups.run_job(operation, filename, job, ready=self._ready, **extra):
+            self._answer(backups.JOB_BUSY)
+            raise CommandError('Другая операция резервного копирования ещё выполняется.')
+
+    def _ready(self):
+        self._answer(backups.JOB_STARTED)
+
+    def _answer(self, text):
+        self.stdout.write(text)
+        self.stdout.flush()
@@ -0,0 +1,59 @@
+"""
+Сгенерировать синтетический набор данных (файлы COPY по всем таблицам schema.sql) и при необходимости загрузить его.
+Использование: python manage.py generate_dataset dataset/ --students 100000 --requests 1000000 --chat-messages 5000000
+             python manage.py generate_dataset dataset/ --students 5000 --load
+             python manage.py generate_dataset dataset/ --load-only
+Справочники (роли, статусы, формы) и максимальные id берутся из текущей БД — загружать в неё же.
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from consultations import synthetic
+
+
+class Command(BaseCommand):
+    help = 'Генерирует детерминированный синтетический набор данных в формате COPY'
+
+    def add_arguments(self, parser):
+        parser.add_argument('out_dir', help='Каталог для файлов <таблица>.copy и manifest.json')
+        parser.add_argument('--seed', type=int, default=1, help='Зерно генератора (по умолчанию 1)')
+        parser.add_argument('--students', type=int, default=1000, help='Число учащихся')
+        parser.add_argument('--requests', type=int, default=None, help='Число обращений (по умолчанию 3 на учащегося)')
+        parser.add_argument('--chat-messages', type=int, default=None, help='Число сообщений чатов (по умолчанию 10 на учащегося)')
+        parser.add_argument('--years', type=int, default=2, help='Глубина истории в годах')
+        parser.add_argument('--until', default=None, help='Последний день истории, ГГГГ-ММ-ДД (по умолчанию сегодня)')
+        parser.add_argument('--load', action='store_true', help='Загрузить набор в БД после генерации')
+        parser.add_argument('--load-only', action='store_true', help='Только загрузить ранее сгенерированный набор')
+
+    def handle(self, *args, **options):
+        out_dir = options['out_dir']
+        if not options['load_only']:
+            try:
+                until = date.fromisoformat(options['until']) if options['until'] else None
+            except ValueError:
+                raise CommandError('Дата --until должна быть в формате ГГГГ-ММ-ДД.')
+            try:
+                manifest = synthetic.generate_dataset(
+                    out_dir,
+                    seed=options['seed'],
+                    students=options['students'],
+                    requests=options['requests'],
+                    chat_messages=options['chat_messages'],
+                    until=until,
+                    years=options['years'],
+                )
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            for table, info in manifest['tables'].items():
+                self.stdout.write(f"  {table}: {info['rows']}")
+            self.stdout.write(self.style.SUCCESS(
+                f"Набор сгенерирован в {out_dir} (seed={manifest['seed']}, до {manifest['until']}). "
+                f"Пароль всех пользователей: {manifest['password']}"
+            ))
+        if options['load'] or options['load_only']:
+            try:
+                loaded = synthetic.load_dataset(out_dir)
+            except (OSError, RuntimeError) as e:
+                raise CommandError(f'Не удалось загрузить набор: {e}')
+            self.stdout.write(self.style.SUCCESS(f'Загружено строк: {sum(loaded.values())} в {len(loaded)} таблиц.'))
@@ -0,0 +1,66 @@
+"""
+Обслужить помесячные секции logs, student_notifications, chat_messages и chat_message_reads:
+создать секции наперёд и снять секции старше срока хранения (см. PARTITION_* в настройках).
+Использование: python manage.py manage_partitions
+             python manage.py manage_partitions --dry-run
+             python manage.py manage_partitions --table chat_messages --table chat_message_reads --start 2024-09
+             python manage.py manage_partitions --mode detach
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from consultations import partitions
+
+
+class Command(BaseCommand):
+    help = 'Создаёт помесячные секции наперёд и снимает секции старше срока хранения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--table', action='append', choices=list(partitions.PARTITIONED_TABLES),
+            help='Таблица (можно повторять; по умолчанию — все секционированные)',
+        )
+        parser.add_argument('--start', default=None, help='Создать секции начиная с месяца ГГГГ-ММ (по умолчанию — текущий)')
+        parser.add_argument(
+            '--mode', choices=partitions.EXPIRE_MODES, default=None,
+            help='Что делать с устаревшими секциями (по умолчанию PARTITION_EXPIRE_MODE)',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет создано и снято')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Секционирование доступно только для PostgreSQL.')
+        start = None
+        if options['start']:
+            try:
+                start = date.fromisoformat(f"{options['start']}-01")
+            except ValueError:
+                raise CommandError('Месяц --start должен быть в формате ГГГГ-ММ.')
+        tables = options['table'] or list(partitions.PARTITIONED_TABLES)
+        # Порядок PARTITIONED_TABLES сохраняется: ссылающиеся таблицы снимаются раньше
+        tables = [t for t in partitions.PARTITIONED_TABLES if t in tables]
+        mode = options['mode'] or partitions.expire_mode()
+
+        for table in tables:
+            if not partitions.is_partitioned(table):
+                self.stdout.write(self.style.WARNING(f'{table}: таблица не секционирована (примените миграции)'))
+                continue
+            column, months_ahead, keep_months = partitions.table_policy(table)
+            if options['dry_run']:
+                missing = partitions.missing_months(table, months_ahead, start=start)
+                expired = partitions.expired_partitions(table, keep_months)
+                self.stdout.write(
+                    f"{table}: будут созданы {[partitions.partition_name(table, m) for m in missing] or '—'}, "
+                    f"сняты ({mode}) {expired or '—'}"
+                )
+                continue
+            result = partitions.maintain(table, column, months_ahead, keep_months, mode, start=start)
+            if result is None:
+                raise CommandError('Обслуживание секций уже выполняет другой процесс.')
+            self.stdout.write(
+                f"{table}: созданы {result['created'] or '—'}, сняты ({mode}) {result['expired'] or '—'}"
+            )
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Обслуживание секций завершено.'))
@@ -0,0 +1,36 @@
+"""
+Перенести вложения старого формата (media/consultations/<pk>/…) в хранилище по SHA-256:
+одинаковые файлы сохраняются один раз, исходные файлы удаляются.
+Использование: python manage.py migrate_attachments
+             python manage.py migrate_attachments --dry-run
+"""
+from django.core.management.base import BaseCommand
+
+from consultations import attachments
+from consultations.models import Attachment
+
+
+class Command(BaseCommand):
+    help = 'Переносит вложения из MEDIA_ROOT в хранилище с дедупликацией по SHA-256'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько вложений будет перенесено')
+
+    def handle(self, *args, **options):
+        legacy = Attachment.objects.filter(sha256__isnull=True).exclude(file_path__isnull=True).order_by('pk')
+        if options['dry_run']:
+            self.stdout.write(f'Вложений старого формата: {legacy.count()}')
+            return
+        before = attachments.store_usage()
+        moved = missing = 0
+        for att in legacy.iterator():
+            if attachments.adopt_legacy_file(att):
+                moved += 1
+            else:
+                missing += 1
+                self.stdout.write(self.style.WARNING(f'Нет файла: {att.file_path} (вложение {att.pk})'))
+        added = attachments.store_usage() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено вложений: {moved}, без файла: {missing}. '
+            f'Хранилище выросло на {added / attachments.MB:.1f} МБ.'
+        ))
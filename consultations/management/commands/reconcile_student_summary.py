@@ -0,0 +1,26 @@
+"""
+Ночная сверка сводки по учащимся (student_summary) с исходными таблицами: строки пересчитываются
+пачками по id учащихся, переписываются только расходящиеся. Использование:
+    python manage.py reconcile_student_summary
+    python manage.py reconcile_student_summary --batch 2000
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from consultations import summary
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводку по учащимся и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch', type=int, default=summary.RECONCILE_BATCH,
+            help=f'Учащихся в одной транзакции (по умолчанию {summary.RECONCILE_BATCH})',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch'] < 1:
+            raise CommandError('--batch должен быть положительным.')
+        verbose = options['verbosity'] > 1
+        fixed = summary.reconcile(batch=options['batch'], stdout=self.stdout if verbose else None)
+        self.stdout.write(self.style.SUCCESS(f'Сводка по учащимся сверена: добавлено и исправлено строк — {fixed}.'))
@@ -0,0 +1,42 @@
+"""
+Снимки отчётов (consultations/snapshots.py): досчитывает закрытые месяцы для всех областей — администратора
+и каждого активного психолога; с --rebuild пересчитывает уже сохранённые. Использование:
+    python manage.py report_snapshots
+    python manage.py report_snapshots --rebuild --since 2025-09
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from consultations import snapshots
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет снимки отчётов за закрытые месяцы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Пересчитать сохранённые снимки по текущим данным')
+        parser.add_argument('--since', help='С какого месяца пересчитывать (ГГГГ-ММ; по умолчанию — все)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            if not options['rebuild']:
+                raise CommandError('--since используется вместе с --rebuild.')
+            try:
+                since = snapshots.parse_month(options['since'])
+            except ValueError:
+                raise CommandError('--since: ожидается месяц в виде ГГГГ-ММ.')
+        psychologist_ids = User.objects.filter(role__name='psychologist', is_active=True).order_by('pk').values_list('pk', flat=True)
+        scopes = [snapshots.ADMIN] + [f'psychologist:{pk}' for pk in psychologist_ids]
+        closed_until = snapshots.month_start(timezone.now().date())
+        saved = 0
+        for scope in scopes:
+            if options['rebuild']:
+                count = snapshots.rebuild(scope, since)
+            else:
+                count = snapshots.ensure(scope, closed_until)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{scope}: {count}')
+            saved += count
+        self.stdout.write(self.style.SUCCESS(f'Снимки отчётов сохранены: областей — {len(scopes)}, месяцев — {saved}.'))
@@ -0,0 +1,72 @@
+"""
+Нагрузочный прогон всех именованных URL (consultations, students, users) от имени каждой роли.
+Использование: python manage.py run_benchmark --output bench_before.json
+             python manage.py run_benchmark --only "consultations:report*" --roles admin psychologist --repeat 20
+             python manage.py run_benchmark --output bench_after.json --compare bench_before.json
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from consultations import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Измеряет p50/p95, число SQL-запросов и пиковую память представлений; результат — JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='Файл отчёта (по умолчанию bench_<дата-время>.json)')
+        parser.add_argument('--compare', default=None, help='Предыдущий отчёт для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Порог ухудшения p95/памяти (0.2 = 20 %%)')
+        parser.add_argument('--repeat', type=int, default=10, help='Запросов на каждый URL')
+        parser.add_argument('--warmup', type=int, default=1, help='Прогревочных запросов')
+        parser.add_argument('--roles', nargs='+', choices=benchmark.ROLES, default=list(benchmark.ROLES))
+        parser.add_argument('--only', nargs='+', default=None, help='Шаблоны имён URL, например "students:*"')
+        parser.add_argument('--admin', default=None, help='Логин администратора')
+        parser.add_argument('--psychologist', default=None, help='Логин психолога')
+        parser.add_argument('--student', default=None, help='Логин учащегося')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as fh:
+                    previous = json.load(fh)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Не удалось прочитать отчёт для сравнения: {e}')
+
+        def progress(result):
+            if 'skipped' in result:
+                self.stdout.write(f"  {result['role']:<12} {result['url']:<50} пропущено: {result['skipped']}")
+                return
+            line = (
+                f"  {result['role']:<12} {result['url']:<50} {result['status']} "
+                f"p50={result['p50_ms']}мс p95={result['p95_ms']}мс sql={result['queries']} "
+                f"mem={result['peak_kb']}КБ"
+            )
+            self.stdout.write(self.style.ERROR(line) if result['status'] >= 500 else line)
+
+        report = benchmark.run_benchmark(
+            roles=options['roles'],
+            only=options['only'],
+            repeat=max(1, options['repeat']),
+            warmup=max(0, options['warmup']),
+            usernames={role: options[role] for role in ('admin', 'psychologist', 'student')},
+            progress=progress,
+        )
+        output = options['output'] or f"bench_{timezone.now():%Y-%m-%d_%H-%M-%S}.json"
+        with open(output, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Измерено: {len(report['results'])}. Отчёт: {output}"))
+
+        if previous:
+            changes = benchmark.compare_reports(previous, report, threshold=options['threshold'])
+            for change in changes:
+                self.stdout.write(self.style.WARNING(
+                    f"  {change['role']:<12} {change['url']:<50} p95 {change['p95_ms'][0]}→{change['p95_ms'][1]}мс, "
+                    f"sql {change['queries'][0]}→{change['queries'][1]}, "
+                    f"память {change['peak_kb'][0]}→{change['peak_kb'][1]}КБ"
+                ))
+            if not changes:
+                self.stdout.write(self.style.SUCCESS('Ухудшений относительно предыдущего прогона нет.'))
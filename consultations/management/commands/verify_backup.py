@@ -0,0 +1,59 @@
+"""
+Проверить резервную копию: восстановить во временную БД (pg_restore -j), посчитать строки
+и контрольные суммы таблиц, сверить со schema.sql и записать время восстановления.
+Использование: python manage.py verify_backup
+             python manage.py verify_backup backup_2026-02-18_14-41-03.dump --jobs 8 --compare-source
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from consultations import backups, restore
+
+
+class Command(BaseCommand):
+    help = 'Восстанавливает резервную копию во временную БД и проверяет её целостность'
+
+    def add_arguments(self, parser):
+        parser.add_argument('backup', nargs='?', help='Имя файла в BACKUP_DIR (по умолчанию — последняя копия)')
+        parser.add_argument('--jobs', type=int, default=None, help='Число параллельных потоков (по умолчанию BACKUP_JOBS)')
+        parser.add_argument('--scratch-db', default=None, help='Имя временной БД (по умолчанию <NAME>_restore_check)')
+        parser.add_argument('--keep', action='store_true', help='Не удалять временную БД после проверки')
+        parser.add_argument('--compare-source', action='store_true', help='Сравнить число строк с рабочей БД')
+
+    def handle(self, *args, **options):
+        name = options['backup']
+        if name:
+            path = backups.resolve_backup_path(name)
+            if not path or not path.exists():
+                raise CommandError(f'Копия не найдена: {name}')
+        else:
+            paths = sorted(backups.list_backup_paths(), key=lambda p: p.stat().st_mtime, reverse=True)
+            if not paths:
+                raise CommandError('В BACKUP_DIR нет резервных копий.')
+            path = paths[0]
+
+        self.stdout.write(f'Проверка {path.name}…')
+        try:
+            with backups.exclusive_lock():
+                report = restore.verify_backup(
+                    path,
+                    jobs=options['jobs'],
+                    scratch_db=options['scratch_db'],
+                    keep=options['keep'],
+                    compare_source=options['compare_source'],
+                )
+        except BlockingIOError as e:
+            raise CommandError(str(e))
+
+        for table, stats in sorted((report.get('tables') or {}).items()):
+            self.stdout.write(f"  {table:<32} {stats['rows']:>10}  {stats['checksum']}")
+        self.stdout.write(
+            f"Восстановление: {report.get('restore_sec', '—')} с, подсчёт: {report.get('stats_sec', '—')} с, "
+            f"всего: {report['total_sec']} с, строк: {report.get('total_rows', 0)}"
+        )
+        for warning in report['warnings']:
+            self.stdout.write(self.style.WARNING(f'  ! {warning}'))
+        for problem in report['problems']:
+            self.stderr.write(self.style.ERROR(f'  ✗ {problem}'))
+        if not report['ok']:
+            raise CommandError('Проверка копии не пройдена.')
+        self.stdout.write(self.style.SUCCESS('Копия восстанавливается и соответствует schema.sql.'))
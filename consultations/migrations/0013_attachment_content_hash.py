@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+ATTACHMENT_COLUMNS = (
+    ('original_name', 'VARCHAR(255)'),
+    ('content_type', 'VARCHAR(100)'),
+    ('sha256', 'CHAR(64)'),
+    ('size', 'BIGINT'),
+)
+
+
+def add_attachment_hash_columns(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        existing = {col.name for col in connection.introspection.get_table_description(c, 'attachments')}
+        for name, column_type in ATTACHMENT_COLUMNS:
+            if name not in existing:
+                c.execute(f"ALTER TABLE attachments ADD COLUMN {name} {column_type};")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_attachments_consultation ON attachments(consultation_id);")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_attachments_sha256 ON attachments(sha256);")
+
+
+def drop_attachment_hash_columns(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        c.execute("DROP INDEX IF EXISTS idx_attachments_sha256;")
+        c.execute("DROP INDEX IF EXISTS idx_attachments_consultation;")
+        existing = {col.name for col in connection.introspection.get_table_description(c, 'attachments')}
+        for name, _ in ATTACHMENT_COLUMNS:
+            if name in existing:
+                c.execute(f"ALTER TABLE attachments DROP COLUMN {name};")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('consultations', '0012_chat_message_reads'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_attachment_hash_columns, drop_attachment_hash_columns),
+    ]
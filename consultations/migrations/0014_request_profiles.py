@@ -0,0 +1,50 @@
+from django.db import migrations
+
+
+def create_request_profiles_table(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    id_column = 'id INTEGER PRIMARY KEY AUTOINCREMENT' if vendor == 'sqlite' else 'id SERIAL PRIMARY KEY'
+    with schema_editor.connection.cursor() as c:
+        c.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS request_profiles (
+                {id_column},
+                url_name VARCHAR(200) NOT NULL,
+                method VARCHAR(10) NOT NULL,
+                day DATE NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                total_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+                max_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+                db_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+                queries BIGINT NOT NULL DEFAULT 0,
+                max_queries INTEGER NOT NULL DEFAULT 0,
+                template_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+                over_budget INTEGER NOT NULL DEFAULT 0,
+                n_plus_one INTEGER NOT NULL DEFAULT 0,
+                slowest_sql TEXT,
+                slowest_sql_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+                top_fingerprint TEXT,
+                top_fingerprint_count INTEGER NOT NULL DEFAULT 0
+            );
+            """
+        )
+        c.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_request_profiles_url_method_day "
+            "ON request_profiles(url_name, method, day);"
+        )
+        c.execute("CREATE INDEX IF NOT EXISTS idx_request_profiles_day ON request_profiles(day);")
+
+
+def drop_request_profiles_table(apps, schema_editor):
+    with schema_editor.connection.cursor() as c:
+        c.execute("DROP TABLE IF EXISTS request_profiles;")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('consultations', '0013_attachment_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_request_profiles_table, drop_request_profiles_table),
+    ]
@@ -0,0 +1,122 @@
+from datetime import date
+
+from django.db import migrations
+
+
+LOG_COLUMNS = (
+    ('object_id', 'INTEGER'),
+    ('ip_address', 'VARCHAR(45)'),
+    ('details', 'JSONB'),
+)
+
+PARTITIONS_AHEAD = 3
+
+
+def _add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_logs_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_action_date ON logs(action_date DESC, id DESC);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_user_date ON logs(user_id, action_date DESC);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_action ON logs(action, action_date DESC);")
+
+
+def partition_logs(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor != 'postgresql':
+            existing = {col.name for col in connection.introspection.get_table_description(c, 'logs')}
+            for name, column_type in LOG_COLUMNS:
+                if name not in existing:
+                    c.execute(f"ALTER TABLE logs ADD COLUMN {name} {'TEXT' if column_type == 'JSONB' else column_type};")
+            _create_logs_indexes(c)
+            return
+
+        c.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('logs')")
+        row = c.fetchone()
+        if row and row[0] != 'p':
+            c.execute("ALTER TABLE logs RENAME TO logs_unpartitioned;")
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS logs (
+                id BIGSERIAL,
+                user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                action VARCHAR(100),
+                action_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                object_id INTEGER,
+                ip_address VARCHAR(45),
+                details JSONB,
+                PRIMARY KEY (id, action_date)
+            ) PARTITION BY RANGE (action_date);
+            """
+        )
+        c.execute("CREATE TABLE IF NOT EXISTS logs_default PARTITION OF logs DEFAULT;")
+
+        first_month = date.today().replace(day=1)
+        if row and row[0] != 'p':
+            c.execute("SELECT MIN(action_date) FROM logs_unpartitioned")
+            oldest = c.fetchone()[0]
+            if oldest:
+                first_month = min(first_month, oldest.date().replace(day=1))
+        month = first_month
+        while month <= _add_months(date.today().replace(day=1), PARTITIONS_AHEAD):
+            name = f'logs_y{month.year:04d}m{month.month:02d}'
+            c.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF logs "
+                f"FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}');"
+            )
+            month = _add_months(month, 1)
+
+        if row and row[0] != 'p':
+            c.execute(
+                """
+                INSERT INTO logs (id, user_id, action, action_date)
+                SELECT id, user_id, action, COALESCE(action_date, CURRENT_TIMESTAMP) FROM logs_unpartitioned;
+                """
+            )
+            c.execute("SELECT setval(pg_get_serial_sequence('logs', 'id'), COALESCE((SELECT MAX(id) FROM logs), 0) + 1, false);")
+            c.execute("DROP TABLE logs_unpartitioned;")
+        _create_logs_indexes(c)
+
+
+def unpartition_logs(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor != 'postgresql':
+            c.execute("DROP INDEX IF EXISTS idx_logs_action_date;")
+            c.execute("DROP INDEX IF EXISTS idx_logs_user_date;")
+            c.execute("DROP INDEX IF EXISTS idx_logs_action;")
+            existing = {col.name for col in connection.introspection.get_table_description(c, 'logs')}
+            for name, _ in LOG_COLUMNS:
+                if name in existing:
+                    c.execute(f"ALTER TABLE logs DROP COLUMN {name};")
+            return
+        c.execute("ALTER TABLE logs RENAME TO logs_partitioned;")
+        c.execute(
+            """
+            CREATE TABLE logs (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id),
+                action VARCHAR(100),
+                action_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """
+        )
+        c.execute(
+            "INSERT INTO logs (id, user_id, action, action_date) "
+            "SELECT id, user_id, action, action_date FROM logs_partitioned;"
+        )
+        c.execute("SELECT setval(pg_get_serial_sequence('logs', 'id'), COALESCE((SELECT MAX(id) FROM logs), 0) + 1, false);")
+        c.execute("DROP TABLE logs_partitioned CASCADE;")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('consultations', '0014_request_profiles'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_logs, unpartition_logs),
+    ]
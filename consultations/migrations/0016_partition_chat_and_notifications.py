@@ -0,0 +1,211 @@
+from datetime import date
+
+from django.db import migrations
+
+
+PARTITIONS_AHEAD = 3
+
+# Первичный ключ секционированной таблицы обязан включать ключ секционирования, поэтому ссылка
+# chat_message_reads → chat_messages становится составной (message_id, message_created_at),
+# а сами отметки прочтения секционируются по дате сообщения — вместе с ним.
+TABLES = {
+    'student_notifications': (
+        'created_at',
+        """
+        CREATE TABLE student_notifications (
+            id SERIAL,
+            student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+            kind VARCHAR(30) NOT NULL,
+            consultation_id INTEGER REFERENCES consultations(id) ON DELETE SET NULL,
+            request_id INTEGER REFERENCES requests(id) ON DELETE SET NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        """,
+        """
+        INSERT INTO student_notifications (id, student_id, kind, consultation_id, request_id, created_at)
+        SELECT id, student_id, kind, consultation_id, request_id, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM student_notifications_unpartitioned;
+        """,
+    ),
+    'chat_messages': (
+        'created_at',
+        """
+        CREATE TABLE chat_messages (
+            id SERIAL,
+            chat_id INTEGER NOT NULL REFERENCES student_psychologist_chats(id) ON DELETE CASCADE,
+            author_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            text TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            read_at TIMESTAMP NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        """,
+        """
+        INSERT INTO chat_messages (id, chat_id, author_id, text, created_at, read_at)
+        SELECT id, chat_id, author_id, text, COALESCE(created_at, CURRENT_TIMESTAMP), read_at
+        FROM chat_messages_unpartitioned;
+        """,
+    ),
+    'chat_message_reads': (
+        'message_created_at',
+        """
+        CREATE TABLE chat_message_reads (
+            id SERIAL,
+            message_id INTEGER NOT NULL,
+            message_created_at TIMESTAMP NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            read_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, message_created_at),
+            UNIQUE (message_id, message_created_at, user_id),
+            FOREIGN KEY (message_id, message_created_at) REFERENCES chat_messages(id, created_at) ON DELETE CASCADE
+        ) PARTITION BY RANGE (message_created_at);
+        """,
+        """
+        INSERT INTO chat_message_reads (id, message_id, message_created_at, user_id, read_at)
+        SELECT r.id, r.message_id, m.created_at, r.user_id, r.read_at
+        FROM chat_message_reads_unpartitioned r
+        JOIN chat_messages m ON m.id = r.message_id;
+        """,
+    ),
+}
+
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_student_notifications_student ON student_notifications(student_id, created_at DESC);",
+    "CREATE INDEX IF NOT EXISTS idx_student_notifications_created ON student_notifications(created_at DESC);",
+    "CREATE INDEX IF NOT EXISTS idx_chat_messages_chat ON chat_messages(chat_id, created_at);",
+    "CREATE INDEX IF NOT EXISTS idx_chat_messages_created ON chat_messages(created_at DESC);",
+    "CREATE INDEX IF NOT EXISTS idx_chat_messages_read_at ON chat_messages(read_at);",
+    "CREATE INDEX IF NOT EXISTS idx_chat_message_reads_user ON chat_message_reads(user_id);",
+)
+
+
+def _add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_partitions(c, table, first_month):
+    c.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT;")
+    month = first_month
+    while month <= _add_months(date.today().replace(day=1), PARTITIONS_AHEAD):
+        c.execute(
+            f"CREATE TABLE IF NOT EXISTS {table}_y{month.year:04d}m{month.month:02d} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}');"
+        )
+        month = _add_months(month, 1)
+
+
+def _is_partitioned(c, table):
+    c.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = c.fetchone()
+    return bool(row and row[0] == 'p')
+
+
+def partition_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor != 'postgresql':
+            existing = {col.name for col in connection.introspection.get_table_description(c, 'chat_message_reads')}
+            if 'message_created_at' not in existing:
+                c.execute("ALTER TABLE chat_message_reads ADD COLUMN message_created_at DATETIME;")
+            c.execute(
+                "UPDATE chat_message_reads SET message_created_at = "
+                "(SELECT created_at FROM chat_messages WHERE chat_messages.id = chat_message_reads.message_id) "
+                "WHERE message_created_at IS NULL;"
+            )
+            c.execute("DROP INDEX IF EXISTS idx_chat_messages_chat;")
+            c.execute("DROP INDEX IF EXISTS idx_student_notifications_student;")
+            for sql in INDEXES:
+                c.execute(sql)
+            return
+
+        converted = [table for table in TABLES if not _is_partitioned(c, table)]
+        # Сначала переименовываем все три: у старой chat_message_reads есть FK на старую chat_messages
+        for table in converted:
+            c.execute(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned;")
+        today = date.today().replace(day=1)
+        for table in ('student_notifications', 'chat_messages', 'chat_message_reads'):
+            column, create_sql, copy_sql = TABLES[table]
+            if table not in converted:
+                continue
+            c.execute(create_sql)
+            source_column = 'created_at' if table == 'chat_message_reads' else column
+            source_table = 'chat_messages' if table == 'chat_message_reads' else f'{table}_unpartitioned'
+            c.execute(f"SELECT MIN({source_column}) FROM {source_table}")
+            oldest = c.fetchone()[0]
+            _create_partitions(c, table, min(today, oldest.date().replace(day=1)) if oldest else today)
+            c.execute(copy_sql)
+            c.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false);"
+            )
+        for table in reversed(list(TABLES)):
+            if table in converted:
+                c.execute(f"DROP TABLE {table}_unpartitioned;")
+        for sql in INDEXES:
+            c.execute(sql)
+
+
+def unpartition_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor != 'postgresql':
+            existing = {col.name for col in connection.introspection.get_table_description(c, 'chat_message_reads')}
+            if 'message_created_at' in existing:
+                c.execute("ALTER TABLE chat_message_reads DROP COLUMN message_created_at;")
+            return
+        for table in TABLES:
+            c.execute(f"ALTER TABLE {table} RENAME TO {table}_partitioned;")
+        c.execute(
+            """
+            CREATE TABLE student_notifications (
+                id SERIAL PRIMARY KEY,
+                student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+                kind VARCHAR(30) NOT NULL,
+                consultation_id INTEGER REFERENCES consultations(id) ON DELETE SET NULL,
+                request_id INTEGER REFERENCES requests(id) ON DELETE SET NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            INSERT INTO student_notifications SELECT * FROM student_notifications_partitioned;
+            CREATE TABLE chat_messages (
+                id SERIAL PRIMARY KEY,
+                chat_id INTEGER NOT NULL REFERENCES student_psychologist_chats(id) ON DELETE CASCADE,
+                author_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                text TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                read_at TIMESTAMP NULL
+            );
+            INSERT INTO chat_messages SELECT * FROM chat_messages_partitioned;
+            CREATE TABLE chat_message_reads (
+                id SERIAL PRIMARY KEY,
+                message_id INTEGER NOT NULL REFERENCES chat_messages(id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                read_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            INSERT INTO chat_message_reads (id, message_id, user_id, read_at)
+            SELECT id, message_id, user_id, read_at FROM chat_message_reads_partitioned;
+            DROP TABLE chat_message_reads_partitioned;
+            DROP TABLE chat_messages_partitioned;
+            DROP TABLE student_notifications_partitioned;
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_chat_message_reads_message_user ON chat_message_reads(message_id, user_id);
+            CREATE INDEX IF NOT EXISTS idx_chat_message_reads_message ON chat_message_reads(message_id);
+            """
+        )
+        for table in TABLES:
+            c.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false);"
+            )
+        for sql in INDEXES:
+            c.execute(sql)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('consultations', '0015_partitioned_logs'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
@@ -0,0 +1,85 @@
+# Migration: психолог в расписании консультации и запрет пересечений (EXCLUDE USING gist)
+from django.db import migrations
+
+# Пересекаются интервалы [date + start_time, date + end_time) одного психолога; отменённые не учитываются.
+OVERLAP_CONSTRAINT = """
+    ALTER TABLE consultations ADD CONSTRAINT consultations_no_overlap EXCLUDE USING gist (
+        psychologist_id WITH =,
+        tsrange(date + start_time, date + end_time) WITH &&
+    ) WHERE (
+        cancelled_at IS NULL AND psychologist_id IS NOT NULL
+        AND start_time IS NOT NULL AND end_time IS NOT NULL AND end_time > start_time
+    );
+"""
+
+OVERLAPS_SQL = """
+    SELECT a.id, b.id, a.psychologist_id, a.date
+    FROM consultations a
+    JOIN consultations b
+      ON b.psychologist_id = a.psychologist_id AND b.date = a.date AND b.id > a.id
+     AND b.start_time < a.end_time AND a.start_time < b.end_time
+    WHERE a.cancelled_at IS NULL AND b.cancelled_at IS NULL
+      AND a.end_time > a.start_time AND b.end_time > b.start_time
+    ORDER BY a.date, a.id
+    LIMIT 20
+"""
+
+
+def add_schedule(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor == 'postgresql':
+            c.execute(
+                "ALTER TABLE consultations "
+                "ADD COLUMN IF NOT EXISTS psychologist_id INTEGER NULL REFERENCES users(id) ON DELETE SET NULL;"
+            )
+        else:
+            existing = {col.name for col in connection.introspection.get_table_description(c, 'consultations')}
+            if 'psychologist_id' not in existing:
+                c.execute("ALTER TABLE consultations ADD COLUMN psychologist_id integer NULL REFERENCES users(id);")
+        # Психолог консультации — ведущий психолог её обращения
+        c.execute(
+            "UPDATE consultations SET psychologist_id = "
+            "(SELECT psychologist_id FROM requests WHERE requests.id = consultations.request_id) "
+            "WHERE psychologist_id IS NULL AND request_id IS NOT NULL;"
+        )
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS idx_consultations_schedule "
+            "ON consultations(date, psychologist_id) WHERE cancelled_at IS NULL;"
+        )
+        if connection.vendor != 'postgresql':
+            return
+        c.execute("SELECT 1 FROM pg_constraint WHERE conname = 'consultations_no_overlap'")
+        if c.fetchone():
+            return
+        c.execute(OVERLAPS_SQL)
+        overlaps = c.fetchall()
+        if overlaps:
+            pairs = '; '.join(f'#{a} и #{b} (психолог {p}, {d})' for a, b, p, d in overlaps)
+            raise RuntimeError(
+                'В расписании есть пересекающиеся консультации, ограничение consultations_no_overlap '
+                f'не может быть создано: {pairs}. Отмените или перенесите их и повторите migrate.'
+            )
+        # btree_gist нужен для сравнения psychologist_id (integer) в GiST-индексе
+        c.execute("CREATE EXTENSION IF NOT EXISTS btree_gist;")
+        c.execute(OVERLAP_CONSTRAINT)
+
+
+def remove_schedule(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        c.execute("DROP INDEX IF EXISTS idx_consultations_schedule;")
+        if connection.vendor == 'postgresql':
+            c.execute("ALTER TABLE consultations DROP CONSTRAINT IF EXISTS consultations_no_overlap;")
+            c.execute("ALTER TABLE consultations DROP COLUMN IF EXISTS psychologist_id;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultations', '0016_partition_chat_and_notifications'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_schedule, remove_schedule),
+    ]
@@ -0,0 +1,72 @@
+# Migration: серии консультаций (consultation_series) и ссылка на серию у консультации
+from django.db import migrations
+
+
+def add_series(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor == 'postgresql':
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS consultation_series (
+                    id SERIAL PRIMARY KEY,
+                    psychologist_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                    request_id INTEGER REFERENCES requests(id) ON DELETE SET NULL,
+                    form_id INTEGER NOT NULL REFERENCES consultation_forms(id),
+                    start_time TIME NOT NULL,
+                    end_time TIME NOT NULL,
+                    interval_weeks SMALLINT NOT NULL DEFAULT 1 CHECK (interval_weeks IN (1, 2)),
+                    date_from DATE NOT NULL,
+                    date_until DATE NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    cancelled_at TIMESTAMP NULL
+                );
+                """
+            )
+            c.execute(
+                "ALTER TABLE consultations ADD COLUMN IF NOT EXISTS series_id INTEGER NULL "
+                "REFERENCES consultation_series(id) ON DELETE SET NULL;"
+            )
+        else:
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS consultation_series (
+                    id integer PRIMARY KEY AUTOINCREMENT,
+                    psychologist_id integer NULL REFERENCES users(id),
+                    request_id integer NULL REFERENCES requests(id),
+                    form_id integer NOT NULL REFERENCES consultation_forms(id),
+                    start_time time NOT NULL,
+                    end_time time NOT NULL,
+                    interval_weeks smallint NOT NULL DEFAULT 1,
+                    date_from date NOT NULL,
+                    date_until date NOT NULL,
+                    created_at datetime NULL,
+                    cancelled_at datetime NULL
+                );
+                """
+            )
+            existing = {col.name for col in connection.introspection.get_table_description(c, 'consultations')}
+            if 'series_id' not in existing:
+                c.execute("ALTER TABLE consultations ADD COLUMN series_id integer NULL REFERENCES consultation_series(id);")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_consultations_series ON consultations(series_id, date);")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_consultation_series_psychologist ON consultation_series(psychologist_id);")
+
+
+def remove_series(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        c.execute("DROP INDEX IF EXISTS idx_consultations_series;")
+        if connection.vendor == 'postgresql':
+            c.execute("ALTER TABLE consultations DROP COLUMN IF EXISTS series_id;")
+            c.execute("DROP TABLE IF EXISTS consultation_series;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultations', '0017_consultation_schedule'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_series, remove_series),
+    ]
@@ -0,0 +1,110 @@
+# Migration: сводка по учащемуся (student_summary) для сортировки и фильтров списка учащихся
+from django.db import migrations
+
+SORT_COLUMNS = (
+    'open_requests', 'total_requests', 'consultations', 'last_consultation_date',
+    'last_message_at', 'unread_messages',
+)
+
+# Консультации учащегося: участник или автор обращения; отменённые не считаются
+_STUDENT_CONSULTATIONS = """
+    c.cancelled_at IS NULL AND c.id IN (
+        SELECT cs.consultation_id FROM consultation_students cs WHERE cs.student_id = s.id
+        UNION
+        SELECT rc.id FROM consultations rc JOIN requests r ON r.id = rc.request_id WHERE r.student_id = s.id
+    )
+"""
+
+# Непрочитанные — сообщения учащегося без отметки прочтения психологом чата
+BACKFILL_SQL = f"""
+    INSERT INTO student_summary (
+        student_id, open_requests, total_requests, consultations, last_consultation_date,
+        last_message_at, unread_messages, updated_at
+    )
+    SELECT
+        s.id,
+        (SELECT COUNT(*) FROM requests r JOIN request_statuses rs ON rs.id = r.status_id
+          WHERE r.student_id = s.id AND rs.name IN ('new', 'in_progress')),
+        (SELECT COUNT(*) FROM requests r WHERE r.student_id = s.id),
+        (SELECT COUNT(*) FROM consultations c WHERE {_STUDENT_CONSULTATIONS}),
+        (SELECT MAX(c.date) FROM consultations c WHERE c.completed_at IS NOT NULL AND {_STUDENT_CONSULTATIONS}),
+        (SELECT MAX(m.created_at) FROM chat_messages m
+           JOIN student_psychologist_chats ch ON ch.id = m.chat_id WHERE ch.student_id = s.id),
+        (SELECT COUNT(*) FROM chat_messages m
+           JOIN student_psychologist_chats ch ON ch.id = m.chat_id
+          WHERE ch.student_id = s.id AND (m.author_id IS NULL OR m.author_id <> ch.psychologist_id)
+            AND NOT EXISTS (
+                SELECT 1 FROM chat_message_reads mr
+                WHERE mr.message_id = m.id AND mr.message_created_at = m.created_at
+                  AND mr.user_id = ch.psychologist_id
+            )),
+        CURRENT_TIMESTAMP
+    FROM students s
+    WHERE s.id NOT IN (SELECT student_id FROM student_summary)
+"""
+
+
+def add_student_summary(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor == 'postgresql':
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS student_summary (
+                    student_id INTEGER PRIMARY KEY REFERENCES students(id) ON DELETE CASCADE,
+                    open_requests INTEGER NOT NULL DEFAULT 0,
+                    total_requests INTEGER NOT NULL DEFAULT 0,
+                    consultations INTEGER NOT NULL DEFAULT 0,
+                    last_consultation_date DATE NULL,
+                    last_message_at TIMESTAMP NULL,
+                    unread_messages INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP NULL
+                );
+                """
+            )
+        else:
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS student_summary (
+                    student_id integer NOT NULL PRIMARY KEY REFERENCES students(id) ON DELETE CASCADE,
+                    open_requests integer NOT NULL DEFAULT 0,
+                    total_requests integer NOT NULL DEFAULT 0,
+                    consultations integer NOT NULL DEFAULT 0,
+                    last_consultation_date date NULL,
+                    last_message_at datetime NULL,
+                    unread_messages integer NOT NULL DEFAULT 0,
+                    updated_at datetime NULL
+                );
+                """
+            )
+        # Пересчёт сводки одного учащегося: его обращения и консультации по ним
+        c.execute("CREATE INDEX IF NOT EXISTS idx_requests_student ON requests(student_id);")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_consultations_request ON consultations(request_id);")
+        # Сортировка списка по любой колонке сводки: индекс (колонка DESC, student_id) читается
+        # в обе стороны, страница берётся из начала индекса без сортировки всех учащихся
+        nulls = ' NULLS LAST' if connection.vendor == 'postgresql' else ''
+        for column in SORT_COLUMNS:
+            c.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_student_summary_{column} "
+                f"ON student_summary({column} DESC{nulls}, student_id);"
+            )
+        # Заполнение: по строке на каждого учащегося (дальше сводку ведёт consultations.summary)
+        c.execute(BACKFILL_SQL)
+
+
+def remove_student_summary(apps, schema_editor):
+    with schema_editor.connection.cursor() as c:
+        c.execute("DROP TABLE IF EXISTS student_summary;")
+        c.execute("DROP INDEX IF EXISTS idx_requests_student;")
+        c.execute("DROP INDEX IF EXISTS idx_consultations_request;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultations', '0018_consultation_series'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_student_summary, remove_student_summary),
+    ]
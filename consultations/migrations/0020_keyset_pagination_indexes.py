@@ -0,0 +1,35 @@
+# Migration: индексы под keyset-пагинацию списков (config/pagination.py)
+from django.db import migrations
+
+
+def add_keyset_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    nulls = ' NULLS LAST' if connection.vendor == 'postgresql' else ''
+    with connection.cursor() as c:
+        # Консультации: ORDER BY date DESC, id DESC — индекс читается с конца
+        c.execute("CREATE INDEX IF NOT EXISTS idx_consultations_date_id ON consultations(date, id);")
+        # «Мои обращения»: обращения учащегося по created_at DESC NULLS LAST, id DESC
+        c.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_requests_student_created "
+            f"ON requests(student_id, created_at DESC{nulls}, id DESC);"
+        )
+        # Учащиеся по ФИО
+        c.execute("CREATE INDEX IF NOT EXISTS idx_students_name_id ON students(last_name, first_name, id);")
+
+
+def remove_keyset_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as c:
+        c.execute("DROP INDEX IF EXISTS idx_consultations_date_id;")
+        c.execute("DROP INDEX IF EXISTS idx_requests_student_created;")
+        c.execute("DROP INDEX IF EXISTS idx_students_name_id;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultations', '0019_student_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_keyset_indexes, remove_keyset_indexes),
+    ]
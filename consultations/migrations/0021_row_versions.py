@@ -0,0 +1,136 @@
+# Migration: версия строки (updated_at) у обращений и консультаций для ETag API и условных ответов
+from django.db import migrations
+
+VERSIONED_TABLES = ('requests', 'consultations')
+# Дочерняя таблица → (родительская таблица, столбец ссылки): изменение дочерней строки меняет версию родителя
+CHILD_TABLES = {
+    'consultation_students': ('consultations', 'consultation_id'),
+}
+
+
+def _columns(cursor, connection, table):
+    return {col.name for col in connection.introspection.get_table_description(cursor, table)}
+
+
+def _add_postgresql(c):
+    # Любой UPDATE, не задавший updated_at сам (сырой SQL, QuerySet.update, триггеры), получает время записи
+    c.execute(
+        """
+        CREATE OR REPLACE FUNCTION trg_touch_updated_at()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at THEN
+                NEW.updated_at := clock_timestamp()::timestamp;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    # Аргументы: родительская таблица, столбец ссылки в дочерней
+    c.execute(
+        """
+        CREATE OR REPLACE FUNCTION trg_touch_parent()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            new_id BIGINT;
+            old_id BIGINT;
+        BEGIN
+            IF TG_OP <> 'DELETE' THEN
+                new_id := (to_jsonb(NEW) ->> TG_ARGV[1])::bigint;
+            END IF;
+            IF TG_OP <> 'INSERT' THEN
+                old_id := (to_jsonb(OLD) ->> TG_ARGV[1])::bigint;
+            END IF;
+            EXECUTE format('UPDATE %I SET updated_at = clock_timestamp()::timestamp WHERE id IN ($1, $2)', TG_ARGV[0])
+                USING new_id, old_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    for table in VERSIONED_TABLES:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;")
+        c.execute(f"UPDATE {table} SET updated_at = COALESCE(created_at, LOCALTIMESTAMP) WHERE updated_at IS NULL;")
+        c.execute(f"ALTER TABLE {table} ALTER COLUMN updated_at SET DEFAULT LOCALTIMESTAMP;")
+        c.execute(f"DROP TRIGGER IF EXISTS touch_updated_at ON {table};")
+        c.execute(
+            f"CREATE TRIGGER touch_updated_at BEFORE UPDATE ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION trg_touch_updated_at();"
+        )
+        # max(updated_at) по всей таблице — для списков психолога без фильтров
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table}(updated_at);")
+    for child, (parent, column) in CHILD_TABLES.items():
+        c.execute(f"DROP TRIGGER IF EXISTS touch_{parent} ON {child};")
+        c.execute(
+            f"CREATE TRIGGER touch_{parent} AFTER INSERT OR UPDATE OR DELETE ON {child} "
+            f"FOR EACH ROW EXECUTE FUNCTION trg_touch_parent('{parent}', '{column}');"
+        )
+
+
+def _add_sqlite(c, connection):
+    now = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+    for table in VERSIONED_TABLES:
+        if 'updated_at' not in _columns(c, connection, table):
+            c.execute(f"ALTER TABLE {table} ADD COLUMN updated_at datetime NULL;")
+        c.execute(f"UPDATE {table} SET updated_at = COALESCE(created_at, {now}) WHERE updated_at IS NULL;")
+        c.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_touch_insert AFTER INSERT ON {table} "
+            f"FOR EACH ROW WHEN NEW.updated_at IS NULL "
+            f"BEGIN UPDATE {table} SET updated_at = {now} WHERE id = NEW.id; END;"
+        )
+        c.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_touch_update AFTER UPDATE ON {table} "
+            f"FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at "
+            f"BEGIN UPDATE {table} SET updated_at = {now} WHERE id = NEW.id; END;"
+        )
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table}(updated_at);")
+    for child, (parent, column) in CHILD_TABLES.items():
+        for event, rows in (('INSERT', ('NEW',)), ('UPDATE', ('NEW', 'OLD')), ('DELETE', ('OLD',))):
+            ids = ', '.join(f'{row}.{column}' for row in rows)
+            c.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {child}_touch_{parent}_{event.lower()} AFTER {event} ON {child} "
+                f"FOR EACH ROW BEGIN UPDATE {parent} SET updated_at = {now} WHERE id IN ({ids}); END;"
+            )
+
+
+def add_row_versions(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor == 'postgresql':
+            _add_postgresql(c)
+        else:
+            _add_sqlite(c, connection)
+
+
+def remove_row_versions(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor == 'postgresql':
+            for child, (parent, _) in CHILD_TABLES.items():
+                c.execute(f"DROP TRIGGER IF EXISTS touch_{parent} ON {child};")
+            for table in VERSIONED_TABLES:
+                c.execute(f"DROP TRIGGER IF EXISTS touch_updated_at ON {table};")
+                c.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS updated_at;")
+            c.execute("DROP FUNCTION IF EXISTS trg_touch_parent();")
+            c.execute("DROP FUNCTION IF EXISTS trg_touch_updated_at();")
+            return
+        for child, (parent, _) in CHILD_TABLES.items():
+            for event in ('insert', 'update', 'delete'):
+                c.execute(f"DROP TRIGGER IF EXISTS {child}_touch_{parent}_{event};")
+        for table in VERSIONED_TABLES:
+            c.execute(f"DROP TRIGGER IF EXISTS {table}_touch_insert;")
+            c.execute(f"DROP TRIGGER IF EXISTS {table}_touch_update;")
+            c.execute(f"DROP INDEX IF EXISTS idx_{table}_updated_at;")
+            c.execute(f"ALTER TABLE {table} DROP COLUMN updated_at;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultations', '0020_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_row_versions, remove_row_versions),
+    ]
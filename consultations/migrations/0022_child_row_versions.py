@@ -0,0 +1,56 @@
+# Migration: изменения заметок, вложений и консультаций меняют версию (updated_at) родительской строки
+from django.db import migrations
+
+# Дочерняя таблица → (родительская таблица, столбец ссылки); consultation_students — в 0021.
+# Консультация меняет версию обращения: её дата, форма и результат видны на странице обращения.
+CHILD_TABLES = {
+    'notes': ('consultations', 'consultation_id'),
+    'attachments': ('consultations', 'consultation_id'),
+    'request_notes': ('requests', 'request_id'),
+    'consultations': ('requests', 'request_id'),
+}
+EVENTS = (('INSERT', ('NEW',)), ('UPDATE', ('NEW', 'OLD')), ('DELETE', ('OLD',)))
+
+
+def add_child_versions(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor == 'postgresql':
+            # trg_touch_parent(родитель, столбец) создана миграцией 0021
+            for child, (parent, column) in CHILD_TABLES.items():
+                c.execute(f"DROP TRIGGER IF EXISTS touch_{parent} ON {child};")
+                c.execute(
+                    f"CREATE TRIGGER touch_{parent} AFTER INSERT OR UPDATE OR DELETE ON {child} "
+                    f"FOR EACH ROW EXECUTE FUNCTION trg_touch_parent('{parent}', '{column}');"
+                )
+            return
+        now = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+        for child, (parent, column) in CHILD_TABLES.items():
+            for event, rows in EVENTS:
+                ids = ', '.join(f'{row}.{column}' for row in rows)
+                c.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {child}_touch_{parent}_{event.lower()} AFTER {event} ON {child} "
+                    f"FOR EACH ROW BEGIN UPDATE {parent} SET updated_at = {now} WHERE id IN ({ids}); END;"
+                )
+
+
+def remove_child_versions(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        for child, (parent, _) in CHILD_TABLES.items():
+            if connection.vendor == 'postgresql':
+                c.execute(f"DROP TRIGGER IF EXISTS touch_{parent} ON {child};")
+                continue
+            for event, _ in EVENTS:
+                c.execute(f"DROP TRIGGER IF EXISTS {child}_touch_{parent}_{event.lower()};")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultations', '0021_row_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_child_versions, remove_child_versions),
+    ]
@@ -0,0 +1,28 @@
+# Migration: снимки отчётов (consultations/snapshots.py) — одна строка reports на область и месяц
+from django.db import migrations
+
+
+def add_snapshot_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as c:
+        # Частичный уникальный индекс: прочие отчёты могут называться одинаково, снимки — нет
+        # (параллельный расчёт одного месяца вставляет строку один раз, см. snapshots.ensure)
+        c.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_reports_snapshot_name "
+            "ON reports(report_name) WHERE report_name LIKE 'snapshot:%';"
+        )
+
+
+def remove_snapshot_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as c:
+        c.execute("DROP INDEX IF EXISTS uq_reports_snapshot_name;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultations', '0022_child_row_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_snapshot_index, remove_snapshot_index),
+    ]
@@ -0,0 +1,60 @@
+# Migration: версия строки (updated_at) у учащихся — ФИО учащегося входит в ответы API обращений, консультаций и чатов
+from django.db import migrations
+
+NOW_SQLITE = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+
+
+def _columns(cursor, connection, table):
+    return {col.name for col in connection.introspection.get_table_description(cursor, table)}
+
+
+def add_student_version(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor == 'postgresql':
+            # trg_touch_updated_at() создана миграцией 0021
+            c.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;")
+            c.execute("UPDATE students SET updated_at = COALESCE(created_at, LOCALTIMESTAMP) WHERE updated_at IS NULL;")
+            c.execute("ALTER TABLE students ALTER COLUMN updated_at SET DEFAULT LOCALTIMESTAMP;")
+            c.execute("DROP TRIGGER IF EXISTS touch_updated_at ON students;")
+            c.execute(
+                "CREATE TRIGGER touch_updated_at BEFORE UPDATE ON students "
+                "FOR EACH ROW EXECUTE FUNCTION trg_touch_updated_at();"
+            )
+            return
+        if 'updated_at' not in _columns(c, connection, 'students'):
+            c.execute("ALTER TABLE students ADD COLUMN updated_at datetime NULL;")
+        c.execute(f"UPDATE students SET updated_at = COALESCE(created_at, {NOW_SQLITE}) WHERE updated_at IS NULL;")
+        c.execute(
+            f"CREATE TRIGGER IF NOT EXISTS students_touch_insert AFTER INSERT ON students "
+            f"FOR EACH ROW WHEN NEW.updated_at IS NULL "
+            f"BEGIN UPDATE students SET updated_at = {NOW_SQLITE} WHERE id = NEW.id; END;"
+        )
+        c.execute(
+            f"CREATE TRIGGER IF NOT EXISTS students_touch_update AFTER UPDATE ON students "
+            f"FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at "
+            f"BEGIN UPDATE students SET updated_at = {NOW_SQLITE} WHERE id = NEW.id; END;"
+        )
+
+
+def remove_student_version(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as c:
+        if connection.vendor == 'postgresql':
+            c.execute("DROP TRIGGER IF EXISTS touch_updated_at ON students;")
+            c.execute("ALTER TABLE students DROP COLUMN IF EXISTS updated_at;")
+            return
+        c.execute("DROP TRIGGER IF EXISTS students_touch_insert;")
+        c.execute("DROP TRIGGER IF EXISTS students_touch_update;")
+        c.execute("ALTER TABLE students DROP COLUMN updated_at;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultations', '0023_report_snapshots'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_student_version, remove_student_version),
+    ]
@@ -0,0 +1,160 @@
+# Migration: состояние моделей без управления схемой (managed=False), которых не было в истории миграций,
+# и порядок Log. Таблицы уже созданы schema.sql и миграциями RunPython — операции меняют только состояние,
+# чтобы makemigrations --check не находил изменений
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0001_initial'),
+        ('consultations', '0024_student_row_versions'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='ChatMessage',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('text', models.TextField()),
+                    ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                    ('read_at', models.DateTimeField(blank=True, null=True)),
+                ],
+                options={
+                    'db_table': 'chat_messages',
+                    'ordering': ['created_at'],
+                    'managed': False,
+                },
+            ),
+            migrations.CreateModel(
+                name='ChatMessageRead',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('message_created_at', models.DateTimeField()),
+                    ('read_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ],
+                options={
+                    'db_table': 'chat_message_reads',
+                    'managed': False,
+                },
+            ),
+            migrations.CreateModel(
+                name='ConsultationSeries',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('start_time', models.TimeField(verbose_name='Время начала')),
+                    ('end_time', models.TimeField(verbose_name='Время окончания')),
+                    ('interval_weeks', models.PositiveSmallIntegerField(choices=[(1, 'Еженедельно'), (2, 'Раз в две недели')], default=1, verbose_name='Периодичность')),
+                    ('date_from', models.DateField(verbose_name='Первая консультация')),
+                    ('date_until', models.DateField(verbose_name='Последняя дата серии')),
+                    ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                    ('cancelled_at', models.DateTimeField(blank=True, null=True, verbose_name='Отменена')),
+                ],
+                options={
+                    'db_table': 'consultation_series',
+                    'ordering': ['-date_from'],
+                    'managed': False,
+                },
+            ),
+            migrations.CreateModel(
+                name='ConsultationStudent',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('participation_confirmed_at', models.DateTimeField(blank=True, null=True, verbose_name='Участие подтверждено')),
+                    ('participation_cancelled_at', models.DateTimeField(blank=True, null=True, verbose_name='Участие отменено (окончательно)')),
+                ],
+                options={
+                    'db_table': 'consultation_students',
+                    'managed': False,
+                },
+            ),
+            migrations.CreateModel(
+                name='RequestNote',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('text', models.TextField()),
+                    ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ],
+                options={
+                    'db_table': 'request_notes',
+                    'ordering': ['created_at'],
+                    'managed': False,
+                },
+            ),
+            migrations.CreateModel(
+                name='RequestProfile',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('url_name', models.CharField(max_length=200)),
+                    ('method', models.CharField(max_length=10)),
+                    ('day', models.DateField()),
+                    ('requests', models.IntegerField(default=0)),
+                    ('total_ms', models.FloatField(default=0)),
+                    ('max_ms', models.FloatField(default=0)),
+                    ('db_ms', models.FloatField(default=0)),
+                    ('queries', models.BigIntegerField(default=0)),
+                    ('max_queries', models.IntegerField(default=0)),
+                    ('template_ms', models.FloatField(default=0)),
+                    ('over_budget', models.IntegerField(default=0)),
+                    ('n_plus_one', models.IntegerField(default=0)),
+                    ('slowest_sql', models.TextField(blank=True, null=True)),
+                    ('slowest_sql_ms', models.FloatField(default=0)),
+                    ('top_fingerprint', models.TextField(blank=True, null=True)),
+                    ('top_fingerprint_count', models.IntegerField(default=0)),
+                ],
+                options={
+                    'db_table': 'request_profiles',
+                    'managed': False,
+                },
+            ),
+            migrations.CreateModel(
+                name='StudentNotification',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('kind', models.CharField(max_length=30)),
+                    ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ],
+                options={
+                    'db_table': 'student_notifications',
+                    'ordering': ['-created_at'],
+                    'managed': False,
+                },
+            ),
+            migrations.CreateModel(
+                name='StudentPsychologistChat',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                    ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ],
+                options={
+                    'db_table': 'student_psychologist_chats',
+                    'ordering': ['-updated_at', '-created_at'],
+                    'managed': False,
+                },
+            ),
+            migrations.CreateModel(
+                name='StudentSummary',
+                fields=[
+                    ('student', models.OneToOneField(db_column='student_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='students.student')),
+                    ('open_requests', models.IntegerField(default=0)),
+                    ('total_requests', models.IntegerField(default=0)),
+                    ('consultations', models.IntegerField(default=0)),
+                    ('last_consultation_date', models.DateField(blank=True, null=True)),
+                    ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                    ('unread_messages', models.IntegerField(default=0)),
+                    ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ],
+                options={
+                    'db_table': 'student_summary',
+                    'managed': False,
+                },
+            ),
+            migrations.AlterModelOptions(
+                name='log',
+                options={'managed': False, 'ordering': ['-action_date', '-id']},
+            ),
+        ]),
+    ]
@@ -4,6 +4,7 @@ managed=False — таблицы создаются schema.sql.
 """
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class RequestStatus(models.Model):
@@ -32,6 +33,8 @@ class Request(models.Model):
     source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
     status = models.ForeignKey(RequestStatus, on_delete=models.PROTECT, db_column='status_id', related_name='requests')
     created_at = models.DateTimeField(auto_now_add=True, null=True)
+    # Версия строки: меняется при любом изменении (триггер БД ловит и сырой SQL, миграция 0021)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
 
     class Meta:
         db_table = 'requests'
@@ -70,9 +73,39 @@ class ConsultationStudent(models.Model):
         unique_together = [['consultation', 'student']]
 
 
+class ConsultationSeries(models.Model):
+    """Серия консультаций: одно время раз в неделю или в две недели с date_from по date_until (см. series.py)."""
+    INTERVAL_CHOICES = [(1, 'Еженедельно'), (2, 'Раз в две недели')]
+
+    psychologist = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, db_column='psychologist_id', related_name='consultation_series')
+    request = models.ForeignKey(Request, on_delete=models.SET_NULL, null=True, blank=True, db_column='request_id', related_name='consultation_series')
+    form = models.ForeignKey(ConsultationForm, on_delete=models.PROTECT, db_column='form_id', related_name='series')
+    start_time = models.TimeField(verbose_name='Время начала')
+    end_time = models.TimeField(verbose_name='Время окончания')
+    interval_weeks = models.PositiveSmallIntegerField(choices=INTERVAL_CHOICES, default=1, verbose_name='Периодичность')
+    date_from = models.DateField(verbose_name='Первая консультация')
+    date_until = models.DateField(verbose_name='Последняя дата серии')
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
+    cancelled_at = models.DateTimeField(blank=True, null=True, verbose_name='Отменена')
+
+    class Meta:
+        db_table = 'consultation_series'
+        managed = False
+        ordering = ['-date_from']
+
+    def __str__(self):
+        return f'{self.get_interval_weeks_display()} с {self.date_from:%d.%m.%Y} по {self.date_until:%d.%m.%Y}'
+
+    def time_display(self):
+        return f'{self.start_time.strftime("%H:%M")} — {self.end_time.strftime("%H:%M")}'
+
+
 class Consultation(models.Model):
     request = models.ForeignKey(Request, on_delete=models.CASCADE, null=True, blank=True, db_column='request_id', related_name='consultations')
     form = models.ForeignKey(ConsultationForm, on_delete=models.PROTECT, db_column='form_id', related_name='consultations')
+    # Психолог, у которого консультация стоит в расписании (для проверки пересечений, см. schedule.py)
+    psychologist = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, db_column='psychologist_id', related_name='scheduled_consultations')
+    series = models.ForeignKey(ConsultationSeries, on_delete=models.SET_NULL, null=True, blank=True, db_column='series_id', related_name='consultations')
     date = models.DateField()
     start_time = models.TimeField(blank=True, null=True, verbose_name='Время начала')
     end_time = models.TimeField(blank=True, null=True, verbose_name='Время окончания')
@@ -81,6 +114,8 @@ class Consultation(models.Model):
     completed_at = models.DateTimeField(blank=True, null=True, verbose_name='Завершена')
     cancelled_at = models.DateTimeField(blank=True, null=True, verbose_name='Отменена')
     created_at = models.DateTimeField(auto_now_add=True, null=True)
+    # Версия строки: меняется и при изменении участия учащихся (consultation_students), миграция 0021
+    updated_at = models.DateTimeField(auto_now=True, null=True)
     students = models.ManyToManyField(
         'students.Student',
         through='ConsultationStudent',
@@ -106,9 +141,10 @@ class Consultation(models.Model):
 
     def students_display(self):
         """Список учащихся для отображения (с учётом старых записей через request)."""
-        qs = self.students.all()
-        if qs.exists():
-            return ', '.join(s.full_name for s in qs.order_by('last_name', 'first_name'))
+        # Сортировка в Python: при prefetch_related('students') не нужен отдельный запрос на строку
+        students = sorted(self.students.all(), key=lambda s: (s.last_name, s.first_name))
+        if students:
+            return ', '.join(s.full_name for s in students)
         if self.request_id:
             return self.request.student.full_name
         return '—'
@@ -123,6 +159,10 @@ class Consultation(models.Model):
 class Attachment(models.Model):
     consultation = models.ForeignKey(Consultation, on_delete=models.CASCADE, db_column='consultation_id', related_name='attachments')
     file_path = models.CharField(max_length=255, blank=True, null=True)
+    original_name = models.CharField(max_length=255, blank=True, null=True)
+    content_type = models.CharField(max_length=100, blank=True, null=True)
+    sha256 = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    size = models.BigIntegerField(blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     uploaded_at = models.DateTimeField(auto_now_add=True, null=True)
 
@@ -133,6 +173,8 @@ class Attachment(models.Model):
     @property
     def filename(self):
         """Имя файла для отображения (без пути)."""
+        if self.original_name:
+            return self.original_name
         if not self.file_path:
             return '—'
         return self.file_path.replace('\\', '/').split('/')[-1]
@@ -172,13 +214,18 @@ class Report(models.Model):
 
 
 class Log(models.Model):
+    """Событие журнала аудита (пишется через consultations.audit; таблица секционирована по action_date)."""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, db_column='user_id')
     action = models.CharField(max_length=100, blank=True, null=True)
-    action_date = models.DateTimeField(auto_now_add=True, null=True)
+    action_date = models.DateTimeField(default=timezone.now)
+    object_id = models.IntegerField(blank=True, null=True)
+    ip_address = models.CharField(max_length=45, blank=True, null=True)
+    details = models.JSONField(blank=True, null=True)
 
     class Meta:
         db_table = 'logs'
         managed = False
+        ordering = ['-action_date', '-id']
 
 
 class StudentNotification(models.Model):
@@ -244,6 +291,8 @@ class ChatMessage(models.Model):
 class ChatMessageRead(models.Model):
     """Отметка прочтения сообщения конкретным пользователем."""
     message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, db_column='message_id', related_name='read_marks')
+    # Дата сообщения: ключ секционирования chat_message_reads (секция того же месяца, что и сообщение)
+    message_created_at = models.DateTimeField()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_column='user_id', related_name='chat_message_reads')
     read_at = models.DateTimeField(auto_now_add=True, null=True)
 
@@ -251,3 +300,44 @@ class ChatMessageRead(models.Model):
         db_table = 'chat_message_reads'
         managed = False
         unique_together = [['message', 'user']]
+
+
+class StudentSummary(models.Model):
+    """Сводка по учащемуся для списка учащихся (пересчитывает consultations.summary)."""
+    student = models.OneToOneField('students.Student', on_delete=models.CASCADE, primary_key=True, db_column='student_id', related_name='summary')
+    open_requests = models.IntegerField(default=0)
+    total_requests = models.IntegerField(default=0)
+    consultations = models.IntegerField(default=0)
+    last_consultation_date = models.DateField(null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    unread_messages = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'student_summary'
+        managed = False
+
+
+class RequestProfile(models.Model):
+    """Дневной агрегат профилирования запросов по имени URL (заполняет config.instrumentation)."""
+    url_name = models.CharField(max_length=200)
+    method = models.CharField(max_length=10)
+    day = models.DateField()
+    requests = models.IntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    db_ms = models.FloatField(default=0)
+    queries = models.BigIntegerField(default=0)
+    max_queries = models.IntegerField(default=0)
+    template_ms = models.FloatField(default=0)
+    over_budget = models.IntegerField(default=0)
+    n_plus_one = models.IntegerField(default=0)
+    slowest_sql = models.TextField(blank=True, null=True)
+    slowest_sql_ms = models.FloatField(default=0)
+    top_fingerprint = models.TextField(blank=True, null=True)
+    top_fingerprint_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'request_profiles'
+        managed = False
+        unique_together = [['url_name', 'method', 'day']]
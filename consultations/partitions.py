@@ -0,0 +1,255 @@
+"""
+Помесячное секционирование PostgreSQL (PARTITION BY RANGE по дате) для таблиц, которые только растут:
+logs, student_notifications, chat_messages и chat_message_reads. Секции <таблица>_yYYYYmMM создаются
+наперёд; строки, попавшие в секцию DEFAULT, переносятся в новую секцию при её создании. Секции старше
+срока хранения удаляются, отключаются (остаются отдельной таблицей) или выгружаются в сжатый CSV
+и удаляются — см. PARTITION_EXPIRE_MODE. Запуск: manage.py manage_partitions (и фоново — из consultations.audit).
+"""
+import gzip
+import logging
+from datetime import date, datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_try_advisory_lock: обслуживание секций выполняет один процесс за раз
+MAINTENANCE_LOCK_KEY = 7_104_211
+
+EXPIRE_MODES = ('archive', 'drop', 'detach')
+
+# Таблица → (колонка секционирования, настройка срока хранения в месяцах, значение по умолчанию).
+# Порядок важен: chat_message_reads ссылается на chat_messages и должна освобождаться раньше.
+PARTITIONED_TABLES = {
+    'logs': ('action_date', 'AUDIT_RETENTION_MONTHS', 24),
+    'student_notifications': ('created_at', 'NOTIFICATION_RETENTION_MONTHS', 12),
+    'chat_message_reads': ('message_created_at', 'CHAT_RETENTION_MONTHS', 0),
+    'chat_messages': ('created_at', 'CHAT_RETENTION_MONTHS', 0),
+}
+
+# Таблица → [(ссылающаяся таблица, её колонка секционирования)]: при переносе строк из DEFAULT
+# ON DELETE CASCADE удалил бы ссылающиеся строки, поэтому они сохраняются и вставляются заново.
+REFERENCED_BY = {
+    'chat_messages': [('chat_message_reads', 'message_created_at')],
+}
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_y{month.year:04d}m{month.month:02d}'
+
+
+def is_partitioned(table, using=None):
+    conn = using or connection
+    if conn.vendor != 'postgresql':
+        return False
+    with conn.cursor() as c:
+        c.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = c.fetchone()
+    return bool(row and row[0] == 'p')
+
+
+def list_partitions(table, using=None):
+    """[(имя секции, начало диапазона или None для DEFAULT)] по возрастанию."""
+    conn = using or connection
+    with conn.cursor() as c:
+        c.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits i
+            JOIN pg_class child ON child.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            """,
+            [table],
+        )
+        rows = c.fetchall()
+    result = []
+    for name, bound in rows:
+        start = None
+        if bound and 'FROM (' in bound:
+            # FOR VALUES FROM ('2026-10-01 00:00:00') TO ('2026-11-01 00:00:00')
+            start = datetime.fromisoformat(bound.split("'")[1]).date()
+        result.append((name, start))
+    return sorted(result, key=lambda item: (item[1] is None, item[1] or date.min))
+
+
+def recent_since(months):
+    """
+    Начало окна «последних months месяцев» (с начала месяца, чтобы граница совпадала с границей секции).
+    Условие created_at >= recent_since(...) позволяет планировщику читать только свежие секции. 0 — без границы.
+    """
+    if not months:
+        return None
+    start = add_months(month_start(date.today()), -(months - 1))
+    return datetime(start.year, start.month, 1)
+
+
+def default_partition(table):
+    return f'{table}_default'
+
+
+def create_month_partition(table, column, month, using=None):
+    """
+    Создаёт секцию за месяц. Строки этого месяца из секции DEFAULT переносятся в неё
+    (иначе PostgreSQL не позволит подключить секцию).
+    """
+    conn = using or connection
+    name = partition_name(table, month)
+    start, end = month, add_months(month, 1)
+    default = default_partition(table)
+    with transaction.atomic(using=conn.alias), conn.cursor() as c:
+        c.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        c.execute("SELECT to_regclass(%s) IS NOT NULL", [default])
+        if c.fetchone()[0]:
+            c.execute(f'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE "{column}" >= %s AND "{column}" < %s)', [start, end])
+            has_rows = c.fetchone()[0]
+        else:
+            has_rows = False
+        if has_rows:
+            kept = []
+            for child, child_column in REFERENCED_BY.get(table, ()):
+                temp = f'_keep_{child}'
+                c.execute(
+                    f'CREATE TEMP TABLE "{temp}" ON COMMIT DROP AS '
+                    f'SELECT * FROM "{child}" WHERE "{child_column}" >= %s AND "{child_column}" < %s',
+                    [start, end],
+                )
+                kept.append((child, temp))
+            c.execute(
+                f'WITH moved AS (DELETE FROM "{default}" WHERE "{column}" >= %s AND "{column}" < %s RETURNING *) '
+                f'INSERT INTO "{name}" SELECT * FROM moved',
+                [start, end],
+            )
+        c.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" FOR VALUES FROM (\'{start}\') TO (\'{end}\')')
+        if has_rows:
+            for child, temp in kept:
+                c.execute(f'INSERT INTO "{child}" SELECT * FROM "{temp}"')
+    return name
+
+
+def missing_months(table, months_ahead=3, start=None, using=None):
+    """Месяцы без секции от start (по умолчанию — текущий месяц) до months_ahead месяцев вперёд."""
+    existing = {name for name, _ in list_partitions(table, using=using)}
+    today = month_start(date.today())
+    month = month_start(start) if start else today
+    missing = []
+    while month <= add_months(today, months_ahead):
+        if partition_name(table, month) not in existing:
+            missing.append(month)
+        month = add_months(month, 1)
+    return missing
+
+
+def ensure_partitions(table, column, months_ahead=3, start=None, using=None):
+    """Создаёт недостающие секции от start (по умолчанию — текущий месяц) до months_ahead месяцев вперёд."""
+    conn = using or connection
+    return [
+        create_month_partition(table, column, month, using=conn)
+        for month in missing_months(table, months_ahead, start=start, using=conn)
+    ]
+
+
+def expire_mode():
+    mode = (getattr(settings, 'PARTITION_EXPIRE_MODE', 'archive') or 'archive').lower()
+    return mode if mode in EXPIRE_MODES else 'archive'
+
+
+def get_archive_dir():
+    path = Path(getattr(settings, 'PARTITION_ARCHIVE_DIR', '') or Path(settings.BACKUP_DIR) / 'partitions')
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def archive_partition(name, using=None):
+    """Выгружает секцию в <PARTITION_ARCHIVE_DIR>/<секция>.csv.gz (COPY … TO STDOUT). Возвращает путь."""
+    conn = using or connection
+    target = get_archive_dir() / f'{name}.csv.gz'
+    part = target.with_name(target.name + '.part')
+    with conn.cursor() as c, gzip.open(part, 'wb') as out:
+        with c.copy(f'COPY "{name}" TO STDOUT (FORMAT csv, HEADER)') as copy:
+            for chunk in copy:
+                out.write(chunk)
+    part.replace(target)
+    return target
+
+
+def expired_partitions(table, keep_months, using=None):
+    """Секции, целиком лежащие раньше, чем keep_months месяцев назад (0 — хранить всё)."""
+    if not keep_months:
+        return []
+    border = add_months(month_start(date.today()), -keep_months)
+    return [
+        name for name, start in list_partitions(table, using=using)
+        if start is not None and add_months(start, 1) <= border
+    ]
+
+
+def drop_expired_partitions(table, keep_months, mode='drop', using=None):
+    """
+    Снимает секции старше срока хранения. mode: drop — удалить; detach — отключить и оставить
+    отдельной таблицей; archive — выгрузить в сжатый CSV, затем удалить.
+    """
+    conn = using or connection
+    expired = []
+    for name in expired_partitions(table, keep_months, using=conn):
+        if mode == 'archive':
+            archive_partition(name, using=conn)
+        with transaction.atomic(using=conn.alias), conn.cursor() as c:
+            c.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+            if mode != 'detach':
+                c.execute(f'DROP TABLE "{name}"')
+        expired.append(name)
+    return expired
+
+
+def table_policy(table):
+    """(колонка, месяцев наперёд, месяцев хранения) по настройкам."""
+    column, setting, default = PARTITIONED_TABLES[table]
+    return column, getattr(settings, 'PARTITION_MONTHS_AHEAD', 3), getattr(settings, setting, default)
+
+
+def maintain(table, column, months_ahead, keep_months, mode='drop', using=None, start=None, expire=True):
+    """
+    Обслуживание секций одной таблицы; expire=False — только создать секции наперёд, без снятия
+    устаревших. Выполняется под advisory lock; если обслуживанием уже занят другой процесс, возвращает None.
+    """
+    conn = using or connection
+    if not is_partitioned(table, using=conn):
+        return None
+    with conn.cursor() as c:
+        c.execute('SELECT pg_try_advisory_lock(%s)', [MAINTENANCE_LOCK_KEY])
+        if not c.fetchone()[0]:
+            return None
+    try:
+        created = ensure_partitions(table, column, months_ahead, start=start, using=conn)
+        expired = drop_expired_partitions(table, keep_months, mode, using=conn) if expire else []
+    finally:
+        with conn.cursor() as c:
+            c.execute('SELECT pg_advisory_unlock(%s)', [MAINTENANCE_LOCK_KEY])
+    if created or expired:
+        logger.info('Секции %s: созданы %s, сняты (%s) %s', table, created, mode, expired)
+    return {'created': created, 'expired': expired}
+
+
+def maintain_all(tables=None, using=None, start=None, mode=None, expire=True):
+    """Обслуживание всех секционированных таблиц по их политикам. Возвращает {таблица: результат}."""
+    conn = using or connection
+    if conn.vendor != 'postgresql':
+        return {}
+    results = {}
+    for table in tables or PARTITIONED_TABLES:
+        column, months_ahead, keep_months = table_policy(table)
+        results[table] = maintain(
+            table, column, months_ahead, keep_months, mode or expire_mode(), using=conn, start=start, expire=expire,
+        )
+    return results
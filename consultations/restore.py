@@ -0,0 +1,292 @@
+"""
+Проверка резервных копий: восстановление во временную БД (pg_restore -j), параллельный
+подсчёт строк и контрольных сумм по таблицам, сверка со schema.sql и журнал времени восстановления.
+"""
+import gzip
+import json
+import re
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import audit, backups
+
+HISTORY_FILENAME = 'restore_history.jsonl'
+_CHUNK_SIZE = 1024 * 1024
+# Тело CREATE TABLE до закрывающей скобки; у секционированных таблиц после неё — PARTITION BY …
+_TABLE_RE = re.compile(r'CREATE TABLE IF NOT EXISTS (\w+)\s*\((.*?)\n\)\s*(?:PARTITION BY [^;]*)?;', re.S)
+_CONSTRAINT_PREFIXES = ('PRIMARY', 'UNIQUE', 'FOREIGN', 'CHECK', 'CONSTRAINT', 'EXCLUDE')
+
+# Сумма 60-битных префиксов md5 строк: не зависит от порядка строк и не требует сортировки.
+_TABLE_STATS_SQL = (
+    "SELECT count(*), "
+    "coalesce(sum(('x' || substr(md5(t::text), 1, 15))::bit(60)::bigint), 0)::text "
+    "FROM {table} AS t"
+)
+
+
+def _connect(db, dbname):
+    import psycopg
+
+    return psycopg.connect(
+        host=db.get('HOST') or '127.0.0.1',
+        port=db.get('PORT') or '5432',
+        user=db.get('USER') or None,
+        password=db.get('PASSWORD') or None,
+        dbname=dbname,
+        connect_timeout=10,
+        autocommit=True,
+    )
+
+
+def scratch_db_name(db):
+    return getattr(settings, 'BACKUP_VERIFY_DB', '') or f"{db.get('NAME') or 'db'}_restore_check"
+
+
+def _recreate_database(db, name):
+    from psycopg import sql
+
+    if name == db.get('NAME'):
+        raise RuntimeError('Временная БД для проверки не может совпадать с рабочей.')
+    with _connect(db, 'postgres') as conn:
+        conn.execute(sql.SQL('DROP DATABASE IF EXISTS {}').format(sql.Identifier(name)))
+        conn.execute(
+            sql.SQL("CREATE DATABASE {} TEMPLATE template0 ENCODING 'UTF8'").format(sql.Identifier(name))
+        )
+
+
+def drop_database(db, name):
+    from psycopg import sql
+
+    with _connect(db, 'postgres') as conn:
+        conn.execute(sql.SQL('DROP DATABASE IF EXISTS {}').format(sql.Identifier(name)))
+
+
+def _restore_plain(path, db, target, env):
+    """Текстовый дамп (.sql/.sql.gz/.sql.zst) подаётся в psql потоком, без распаковки на диск."""
+    psql = backups.resolve_pg_tool('psql')
+    if not psql:
+        raise RuntimeError('psql недоступен. Укажите PSQL_PATH или добавьте PostgreSQL bin в PATH.')
+    cmd = [psql, *backups.pg_connection_args(db), '-d', target, '-q', '-v', 'ON_ERROR_STOP=1', '-f', '-']
+    if path.name.endswith('.gz'):
+        source = gzip.open(path, 'rb')
+    elif path.name.endswith('.zst'):
+        import zstandard
+        source = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    else:
+        source = open(path, 'rb')
+    with tempfile.TemporaryFile() as stderr_fh, source:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_fh, env=env)
+        try:
+            for chunk in iter(lambda: source.read(_CHUNK_SIZE), b''):
+                proc.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            proc.stdin.close()
+        if proc.wait() != 0:
+            stderr_fh.seek(0)
+            stderr = stderr_fh.read().decode('utf-8', errors='ignore')
+            raise RuntimeError(stderr.strip()[:300] or 'psql завершился с ошибкой.')
+
+
+def restore_backup(path, db, target, jobs):
+    """Восстанавливает копию в БД target; custom/directory — параллельно через pg_restore -j."""
+    env = backups.pg_env(db)
+    if backups.backup_format_of(path.name) == 'sql':
+        _restore_plain(path, db, target, env)
+        return
+    pg_restore = backups.resolve_pg_tool('pg_restore')
+    if not pg_restore:
+        raise RuntimeError('pg_restore недоступен. Укажите PG_RESTORE_PATH или добавьте PostgreSQL bin в PATH.')
+    cmd = [
+        pg_restore, *backups.pg_connection_args(db), '-d', target,
+        '-j', str(jobs), '--no-owner', '--no-privileges', '--exit-on-error', str(path),
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', env=env)
+    if proc.returncode != 0:
+        raise RuntimeError((proc.stderr or '').strip()[:300] or 'pg_restore завершился с ошибкой.')
+
+
+def verify_manifest(path):
+    """Сверка SHA-256 файлов копии с манифестом. Возвращает список расхождений (None — манифеста нет)."""
+    manifest = backups.read_manifest(path)
+    if not manifest:
+        return None
+    problems = []
+    for entry in manifest.get('files', []):
+        file_path = path / entry['path'] if entry.get('path') else path
+        if not file_path.is_file():
+            problems.append(f"{entry.get('path') or path.name}: файл отсутствует")
+        elif backups.sha256_file(file_path) != entry['sha256']:
+            problems.append(f"{entry.get('path') or path.name}: контрольная сумма не совпадает")
+    return problems
+
+
+def schema_tables(schema_path=None):
+    """Таблицы и столбцы, описанные в schema.sql."""
+    schema_path = schema_path or (settings.BASE_DIR / 'schema.sql')
+    text = schema_path.read_text(encoding='utf-8')
+    tables = {}
+    for name, body in _TABLE_RE.findall(text):
+        columns = []
+        for line in body.splitlines():
+            token = line.strip().split(' ', 1)[0]
+            if token and not token.startswith(('--', ')')) and not token.upper().startswith(_CONSTRAINT_PREFIXES):
+                columns.append(token)
+        tables[name] = columns
+    return tables
+
+
+def _database_columns(db, dbname):
+    with _connect(db, dbname) as conn:
+        # Обычные и секционированные таблицы без их секций: строки секций считаются в родительской таблице
+        rows = conn.execute(
+            "SELECT cl.relname, a.attname FROM pg_attribute a "
+            "JOIN pg_class cl ON cl.oid = a.attrelid "
+            "JOIN pg_namespace n ON n.oid = cl.relnamespace "
+            "WHERE n.nspname = 'public' AND cl.relkind IN ('r', 'p') AND NOT cl.relispartition "
+            "AND a.attnum > 0 AND NOT a.attisdropped "
+            "ORDER BY cl.relname, a.attnum"
+        ).fetchall()
+    columns = {}
+    for table, column in rows:
+        columns.setdefault(table, []).append(column)
+    return columns
+
+
+def _table_stats(db, dbname, table):
+    from psycopg import sql
+
+    with _connect(db, dbname) as conn:
+        query = sql.SQL(_TABLE_STATS_SQL).format(table=sql.Identifier(table))
+        count, checksum = conn.execute(query).fetchone()
+    return table, {'rows': count, 'checksum': checksum}
+
+
+def collect_table_stats(db, dbname, tables, jobs):
+    """Число строк и контрольная сумма каждой таблицы; таблицы обрабатываются параллельно."""
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = pool.map(lambda table: _table_stats(db, dbname, table), tables)
+        return dict(results)
+
+
+def compare_with_schema(expected, actual):
+    """Расхождения восстановленной БД со schema.sql: отсутствующие таблицы и столбцы."""
+    problems = []
+    for table, columns in expected.items():
+        if table not in actual:
+            problems.append(f'нет таблицы {table}')
+            continue
+        missing = [c for c in columns if c not in actual[table]]
+        if missing:
+            problems.append(f"{table}: нет столбцов {', '.join(missing)}")
+    return problems
+
+
+def verify_backup(path, jobs=None, scratch_db=None, keep=False, compare_source=False):
+    """
+    Полная проверка копии: манифест, восстановление, статистика таблиц, сверка со schema.sql.
+    Возвращает отчёт (dict), который также дописывается в журнал restore_history.jsonl.
+    """
+    db = settings.DATABASES.get('default', {})
+    jobs = jobs or max(1, int(getattr(settings, 'BACKUP_JOBS', 4)))
+    target = scratch_db or scratch_db_name(db)
+    report = {
+        'backup': path.name,
+        'format': backups.backup_format_of(path.name),
+        'size': backups.path_size(path),
+        'jobs': jobs,
+        'started_at': timezone.now().isoformat(),
+        'problems': [],
+        'warnings': [],
+    }
+    started = time.monotonic()
+
+    manifest_problems = verify_manifest(path)
+    if manifest_problems is None:
+        report['warnings'].append('манифест контрольных сумм отсутствует')
+    report['problems'].extend(manifest_problems or [])
+
+    _recreate_database(db, target)
+    try:
+        t0 = time.monotonic()
+        restore_backup(path, db, target, jobs)
+        report['restore_sec'] = round(time.monotonic() - t0, 2)
+
+        t0 = time.monotonic()
+        actual_columns = _database_columns(db, target)
+        tables = collect_table_stats(db, target, sorted(actual_columns), jobs)
+        report['stats_sec'] = round(time.monotonic() - t0, 2)
+        report['tables'] = tables
+        report['total_rows'] = sum(t['rows'] for t in tables.values())
+        report['problems'].extend(compare_with_schema(schema_tables(), actual_columns))
+
+        if compare_source:
+            source = collect_table_stats(db, db.get('NAME'), sorted(tables), jobs)
+            for table, stats in tables.items():
+                if source.get(table) != stats:
+                    report['warnings'].append(
+                        f"{table}: в рабочей БД {source.get(table, {}).get('rows', '—')} строк, в копии {stats['rows']}"
+                    )
+    except Exception as exc:
+        report['problems'].append(f'ошибка восстановления: {str(exc)[:300]}')
+    finally:
+        if not keep:
+            drop_database(db, target)
+
+    report['total_sec'] = round(time.monotonic() - started, 2)
+    report['ok'] = not report['problems']
+    append_history(report)
+    return report
+
+
+def append_history(report):
+    entry = {k: v for k, v in report.items() if k != 'tables'}
+    entry['table_count'] = len(report.get('tables') or {})
+    with open(backups.get_backup_dir() / HISTORY_FILENAME, 'a', encoding='utf-8') as fh:
+        fh.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def read_history(limit=10):
+    """Последние проверки восстановления, новые сверху."""
+    try:
+        lines = (backups.get_backup_dir() / HISTORY_FILENAME).read_text(encoding='utf-8').splitlines()
+    except OSError:
+        return []
+    history = []
+    for line in reversed(lines[-limit:]):
+        try:
+            history.append(json.loads(line))
+        except ValueError:
+            continue
+    return history
+
+
+def verification_job(user_id, filename):
+    """Проверка копии (выполняется в процессе manage.py backup_job). Результат — для статуса."""
+    path = backups.resolve_backup_path(filename)
+    if not path or not path.exists():
+        raise FileNotFoundError(f'Копия не найдена: {filename}')
+    report = verify_backup(path)
+    audit.record(
+        'Backup verified' if report['ok'] else 'Backup verification failed', user_id=user_id, filename=filename,
+    )
+    return {
+        'ok': report['ok'],
+        'restore_sec': report.get('restore_sec'),
+        'duration_sec': report['total_sec'],
+        'problems': report['problems'][:10],
+    }
+
+
+def start_verification(user_id, filename):
+    """Запускает проверку копии отдельным процессом (под общей блокировкой). False — если занято."""
+    path = backups.resolve_backup_path(filename)
+    if not path or not path.exists():
+        raise FileNotFoundError(filename)
+    return backups.run_in_background('verify', filename, *(['--user', str(user_id)] if user_id else []))
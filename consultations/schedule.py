@@ -0,0 +1,169 @@
+"""
+Расписание психологов: интервальный индекс консультаций по (психолог, день) из consultations.start_time/end_time
+без отменённых. Используется для проверки пересечений при сохранении консультации (в PostgreSQL её дублирует
+ограничение consultations_no_overlap, см. миграцию 0017) и для поиска ближайших свободных окон.
+"""
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from users.models import User
+
+from .models import Consultation
+
+WORKDAY_START = time(8, 30)
+WORKDAY_END = time(16, 0)
+# Консультация длится не дольше 2 часов (ConsultationForm, триггер check_duration): пересечься с интервалом
+# могут только консультации, начавшиеся не раньше чем за MAX_DURATION_MINUTES до его начала.
+MAX_DURATION_MINUTES = 120
+
+# Ограничение-исключение в PostgreSQL (миграция 0017)
+OVERLAP_CONSTRAINT = 'consultations_no_overlap'
+OVERLAP_MESSAGE = 'Это время у психолога только что заняли. Выберите другое время.'
+
+Slot = namedtuple('Slot', 'psychologist_id date start end')
+
+
+def to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def from_minutes(value):
+    return time(value // 60, value % 60)
+
+
+def slot_step():
+    return max(5, getattr(settings, 'SCHEDULE_SLOT_STEP_MINUTES', 15))
+
+
+class DaySchedule:
+    """Занятые интервалы одного психолога за день: [(начало, конец, id консультации)] в минутах, по началу."""
+
+    __slots__ = ('intervals',)
+
+    def __init__(self):
+        self.intervals = []
+
+    def add(self, start, end, consultation_id=None):
+        insort(self.intervals, (start, end, consultation_id or 0))
+
+    def conflicts(self, start, end, exclude_id=None):
+        """id консультаций, пересекающихся с [start, end). Смежные интервалы (конец = начало) не пересекаются."""
+        lo = bisect_left(self.intervals, (start - MAX_DURATION_MINUTES,))
+        hi = bisect_left(self.intervals, (end,))
+        return [
+            consultation_id for busy_start, busy_end, consultation_id in self.intervals[lo:hi]
+            if busy_end > start and consultation_id != exclude_id
+        ]
+
+    def gaps(self, day_start, day_end):
+        """Свободные промежутки [(начало, конец)] внутри рабочего дня."""
+        cursor = day_start
+        for busy_start, busy_end, _ in self.intervals:
+            if busy_start > cursor:
+                yield cursor, min(busy_start, day_end)
+            cursor = max(cursor, busy_end)
+            if cursor >= day_end:
+                return
+        if cursor < day_end:
+            yield cursor, day_end
+
+    def first_free(self, duration, not_before=0, step=15):
+        """Ближайшее начало в каждом свободном промежутке, куда помещается консультация длиной duration."""
+        day_start, day_end = to_minutes(WORKDAY_START), to_minutes(WORKDAY_END)
+        for gap_start, gap_end in self.gaps(max(day_start, not_before), day_end):
+            start = -(-gap_start // step) * step
+            if start + duration <= gap_end:
+                yield start
+
+
+class ScheduleIndex:
+    """Индекс {(психолог, день): DaySchedule}, строится одним запросом за период."""
+
+    def __init__(self):
+        self._days = {}
+
+    @classmethod
+    def load(cls, date_from, date_to, psychologist_ids=None, exclude_id=None):
+        index = cls()
+        qs = Consultation.objects.filter(
+            date__gte=date_from, date__lte=date_to, cancelled_at__isnull=True,
+            psychologist_id__isnull=False, start_time__isnull=False, end_time__isnull=False,
+        )
+        if psychologist_ids is not None:
+            qs = qs.filter(psychologist_id__in=list(psychologist_ids))
+        if exclude_id:
+            qs = qs.exclude(pk=exclude_id)
+        for pk, psychologist_id, day, start, end in qs.values_list(
+            'pk', 'psychologist_id', 'date', 'start_time', 'end_time'
+        ).order_by():
+            index.add(psychologist_id, day, start, end, pk)
+        return index
+
+    def add(self, psychologist_id, day, start, end, consultation_id=None):
+        key = (psychologist_id, day)
+        if key not in self._days:
+            self._days[key] = DaySchedule()
+        self._days[key].add(to_minutes(start), to_minutes(end), consultation_id)
+
+    def day(self, psychologist_id, day):
+        return self._days.get((psychologist_id, day)) or DaySchedule()
+
+    def conflicts(self, psychologist_id, day, start, end, exclude_id=None):
+        return self.day(psychologist_id, day).conflicts(to_minutes(start), to_minutes(end), exclude_id)
+
+    def free_slots(self, psychologist_ids, date_from, date_to, duration, count, now=None):
+        """
+        Ближайшие count свободных окон длиной duration минут по дням date_from..date_to (без выходных):
+        в каждом свободном промежутке психолога — самое раннее начало, кратное шагу сетки.
+        """
+        now = now or timezone.now()
+        step = slot_step()
+        slots = []
+        day = date_from
+        while day <= date_to and len(slots) < count:
+            if day.weekday() < 5:
+                not_before = to_minutes(now.time()) + 1 if day == now.date() else 0
+                found = [
+                    Slot(psychologist_id, day, from_minutes(start), from_minutes(start + duration))
+                    for psychologist_id in psychologist_ids
+                    for start in self.day(psychologist_id, day).first_free(duration, not_before, step)
+                ]
+                found.sort(key=lambda slot: (slot.start, slot.psychologist_id))
+                slots.extend(found[:count - len(slots)])
+            day += timedelta(days=1)
+        return slots
+
+
+def find_conflicts(psychologist_id, day, start, end, exclude_id=None):
+    """Неотменённые консультации психолога, пересекающиеся с интервалом start–end дня day."""
+    ids = ScheduleIndex.load(day, day, [psychologist_id], exclude_id=exclude_id).conflicts(
+        psychologist_id, day, start, end,
+    )
+    if not ids:
+        return []
+    return list(Consultation.objects.filter(pk__in=ids).order_by('start_time'))
+
+
+def next_free_slots(duration, count=5, date_from=None, psychologist_ids=None):
+    """Ближайшие свободные окна длиной duration минут у указанных (по умолчанию — всех активных) психологов."""
+    now = timezone.now()
+    date_from = max(date_from or now.date(), now.date())
+    date_to = date_from + timedelta(days=getattr(settings, 'SCHEDULE_SEARCH_DAYS', 28))
+    if psychologist_ids is None:
+        psychologist_ids = User.objects.filter(role__name='psychologist', is_active=True).values_list('pk', flat=True)
+    psychologist_ids = sorted(psychologist_ids)
+    if not psychologist_ids or duration <= 0:
+        return []
+    index = ScheduleIndex.load(date_from, date_to, psychologist_ids)
+    return index.free_slots(psychologist_ids, date_from, date_to, duration, count, now=now)
+
+
+def is_overlap_error(exc):
+    """IntegrityError вызвана ограничением consultations_no_overlap (а не, например, внешним ключом)."""
+    diag = getattr(getattr(exc, '__cause__', None), 'diag', None)
+    name = getattr(diag, 'constraint_name', None)
+    return name == OVERLAP_CONSTRAINT if name else OVERLAP_CONSTRAINT in str(exc)
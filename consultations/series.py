@@ -0,0 +1,191 @@
+"""
+Серии консультаций: одно время раз в неделю или в две недели до даты окончания, без выходных, праздников
+и каникул (SCHOOL_HOLIDAYS). Все даты серии проверяются по расписанию психолога за один проход (schedule.py);
+консультации, участники и уведомления создаются bulk_create в одной транзакции (сигнал post_save
+ConsultationStudent при этом не срабатывает, поэтому уведомления создаются здесь же).
+"""
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import schedule, summary
+from .models import Consultation, ConsultationSeries, ConsultationStudent, StudentNotification
+
+# Не больше учебного года еженедельных встреч
+MAX_OCCURRENCES = 40
+
+
+def holiday_ranges(value=None):
+    """
+    Праздники и каникулы из SCHOOL_HOLIDAYS: даты и диапазоны через запятую,
+    например «2026-11-04, 2026-12-29..2027-01-11». Возвращает [(начало, конец)].
+    """
+    value = getattr(settings, 'SCHOOL_HOLIDAYS', '') if value is None else value
+    ranges = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        start, _, end = item.partition('..')
+        first = date.fromisoformat(start.strip())
+        ranges.append((first, date.fromisoformat(end.strip()) if end else first))
+    return ranges
+
+
+def is_day_off(day, holidays):
+    return day.weekday() >= 5 or any(start <= day <= end for start, end in holidays)
+
+
+def occurrences(date_from, date_until, interval_weeks=1, holidays=None):
+    """Даты серии: от date_from с шагом interval_weeks недель до date_until, без выходных и праздников."""
+    holidays = holiday_ranges() if holidays is None else holidays
+    step = timedelta(weeks=interval_weeks)
+    days = []
+    day = date_from
+    while day <= date_until:
+        if not is_day_off(day, holidays):
+            days.append(day)
+        day += step
+    return days
+
+
+def find_conflicts(psychologist_id, dates, start_time, end_time, series=None):
+    """{дата: [консультации]} — пересечения со всеми датами серии по одному запросу к расписанию."""
+    if not dates or not psychologist_id:
+        return {}
+    index = schedule.ScheduleIndex.load(min(dates), max(dates), [psychologist_id])
+    own = set(series.consultations.values_list('pk', flat=True)) if series else set()
+    busy = {}
+    for day in dates:
+        ids = [pk for pk in index.conflicts(psychologist_id, day, start_time, end_time) if pk not in own]
+        if ids:
+            busy[day] = ids
+    if busy:
+        by_id = Consultation.objects.in_bulk([pk for ids in busy.values() for pk in ids])
+        busy = {day: [by_id[pk] for pk in ids if pk in by_id] for day, ids in busy.items()}
+    return busy
+
+
+def _duration(start_time, end_time):
+    return schedule.to_minutes(end_time) - schedule.to_minutes(start_time)
+
+
+def _add_occurrences(series, dates, students):
+    """Консультации серии на даты dates с участниками и уведомлениями — тремя bulk_create."""
+    consultations = Consultation.objects.bulk_create([
+        Consultation(
+            series=series, request_id=series.request_id, form_id=series.form_id,
+            psychologist_id=series.psychologist_id, date=day, start_time=series.start_time,
+            end_time=series.end_time, duration=_duration(series.start_time, series.end_time),
+        )
+        for day in dates
+    ])
+    _add_participants([(c.pk, student.pk) for c in consultations for student in students])
+    return consultations
+
+
+def _add_participants(pairs):
+    """Участники [(консультация, учащийся)] и уведомления о назначении."""
+    ConsultationStudent.objects.bulk_create([
+        ConsultationStudent(consultation_id=consultation_id, student_id=student_id)
+        for consultation_id, student_id in pairs
+    ])
+    StudentNotification.objects.bulk_create([
+        StudentNotification(
+            student_id=student_id, kind=StudentNotification.KIND_CONSULTATION_ASSIGNED,
+            consultation_id=consultation_id,
+        )
+        for consultation_id, student_id in pairs
+    ])
+
+
+def create_series(psychologist_id, students, form, start_time, end_time, dates, interval_weeks, date_until,
+                  request=None):
+    """Серия и все её консультации в одной транзакции. dates — уже проверенные даты (occurrences)."""
+    with transaction.atomic():
+        series = ConsultationSeries.objects.create(
+            psychologist_id=psychologist_id, request=request, form=form, start_time=start_time,
+            end_time=end_time, interval_weeks=interval_weeks, date_from=dates[0], date_until=date_until,
+        )
+        _add_occurrences(series, dates, students)
+        summary.touch(student.pk for student in students)
+    return series
+
+
+def upcoming(series, since=None):
+    """Ещё не проведённые и не отменённые консультации серии начиная с since (по умолчанию — сегодня)."""
+    return series.consultations.filter(
+        date__gte=since or timezone.now().date(), completed_at__isnull=True, cancelled_at__isnull=True,
+    )
+
+
+def current_students(series):
+    """Участники серии — по ближайшей предстоящей (или последней) консультации."""
+    from students.models import Student
+
+    consultation = upcoming(series).order_by('date').first() or series.consultations.order_by('-date').first()
+    if consultation is None:
+        return Student.objects.none()
+    return Student.objects.filter(consultation_participations__consultation=consultation)
+
+
+def plan_update(series, date_until, since=None):
+    """
+    Что изменится при правке серии: (предстоящие консультации, которые останутся, новые даты
+    при продлении, консультации, выпадающие при сокращении).
+    """
+    since = since or timezone.now().date()
+    pending = list(upcoming(series, since).order_by('date'))
+    kept = [c for c in pending if c.date <= date_until]
+    dropped = [c for c in pending if c.date > date_until]
+    last = max(series.consultations.values_list('date', flat=True), default=since - timedelta(days=1))
+    added = [
+        day for day in occurrences(series.date_from, date_until, series.interval_weeks)
+        if day > last and day >= since
+    ]
+    return kept, added, dropped
+
+
+def update_series(series, students, form, start_time, end_time, date_until, since=None, skip=()):
+    """
+    Правка серии целиком: время, форма и участники меняются у всех предстоящих консультаций,
+    при продлении добавляются новые даты, при сокращении лишние консультации отменяются.
+    Проведённые консультации не меняются. skip — новые даты, которые не добавлять (занятое время).
+    """
+    kept, added, dropped = plan_update(series, date_until, since)
+    added = [day for day in added if day not in skip]
+    student_ids = {student.pk for student in students}
+    with transaction.atomic():
+        series.form = form
+        series.start_time, series.end_time, series.date_until = start_time, end_time, date_until
+        series.save(update_fields=['form_id', 'start_time', 'end_time', 'date_until'])
+        Consultation.objects.filter(pk__in=[c.pk for c in kept]).update(
+            form_id=form.pk, start_time=start_time, end_time=end_time,
+            duration=_duration(start_time, end_time),
+        )
+        if dropped:
+            Consultation.objects.filter(pk__in=[c.pk for c in dropped]).update(cancelled_at=timezone.now())
+        links = ConsultationStudent.objects.filter(consultation_id__in=[c.pk for c in kept])
+        links.exclude(student_id__in=student_ids).delete()
+        existing = set(links.values_list('consultation_id', 'student_id'))
+        missing = [(c.pk, student_id) for c in kept for student_id in student_ids if (c.pk, student_id) not in existing]
+        if missing:
+            _add_participants(missing)
+        if added:
+            _add_occurrences(series, added, students)
+        summary.touch(student_ids)
+    return kept, added, dropped
+
+
+def cancel_series(series, since=None):
+    """Отмена всех предстоящих консультаций серии. Возвращает число отменённых."""
+    now = timezone.now()
+    with transaction.atomic():
+        cancelled = upcoming(series, since)
+        summary.touch(summary.consultation_students(cancelled.values_list('pk', flat=True)))
+        count = cancelled.update(cancelled_at=now)
+        series.cancelled_at = now
+        series.save(update_fields=['cancelled_at'])
+    return count
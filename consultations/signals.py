@@ -1,8 +1,12 @@
-"""Сигналы и хелперы для уведомлений учащегося."""
-from django.db.models.signals import post_save
+"""Сигналы и хелперы для уведомлений учащегося и сводки по учащемуся (summary.py)."""
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
-from .models import ConsultationStudent, StudentNotification
+from students.models import Student
+
+from . import summary
+from .models import ChatMessage, Consultation, ConsultationStudent, Request, StudentNotification
+from .transitions import transitioned
 
 
 def notify_request_status_changed(request_obj):
@@ -25,3 +29,53 @@ def on_consultation_student_created(sender, instance, created, **kwargs):
             kind=StudentNotification.KIND_CONSULTATION_ASSIGNED,
             consultation_id=instance.consultation_id,
         )
+
+
+# ——— Сводка по учащемуся ———
+# Записи через модели пересчитывают сводку затронутых учащихся после фиксации транзакции; массовые
+# операции (series.py, переходы статусов, отметки прочтения) вызывают summary.touch сами.
+
+@receiver(post_save, sender=Student)
+def on_student_saved(sender, instance, created, **kwargs):
+    if created:
+        summary.touch([instance.pk])
+
+
+@receiver(post_save, sender=Request)
+@receiver(post_delete, sender=Request)
+def on_request_changed(sender, instance, **kwargs):
+    summary.touch([instance.student_id])
+
+
+@receiver(post_save, sender=Consultation)
+def on_consultation_saved(sender, instance, **kwargs):
+    summary.touch(summary.consultation_students([instance.pk]))
+
+
+@receiver(pre_delete, sender=Consultation)
+def on_consultation_deleted(sender, instance, **kwargs):
+    summary.touch(summary.consultation_students([instance.pk]))
+
+
+@receiver(post_save, sender=ConsultationStudent)
+@receiver(post_delete, sender=ConsultationStudent)
+def on_consultation_student_changed(sender, instance, **kwargs):
+    summary.touch([instance.student_id])
+
+
+@receiver(m2m_changed, sender=Consultation.students.through)
+def on_consultation_students_set(sender, instance, action, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove') and pk_set:
+        summary.touch(pk_set if isinstance(instance, Consultation) else [instance.pk])
+
+
+@receiver(post_save, sender=ChatMessage)
+def on_chat_message_created(sender, instance, created, **kwargs):
+    if created:
+        summary.touch_chat(instance.chat_id)
+
+
+@receiver(transitioned)
+def on_transition(sender, request_ids, consultation_ids, student_ids, **kwargs):
+    # Уже после фиксации: пересчёт сразу
+    summary.refresh(set(student_ids) | summary.consultation_students(consultation_ids))
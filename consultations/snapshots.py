@@ -0,0 +1,282 @@
+"""
+Снимки отчётов в таблице reports (Report.report_data): показатели закрытого месяца считаются один раз
+и дальше читаются из снимка, поэтому правка старых записей не меняет отчёты за прошедшие периоды.
+
+Снимок — строка на месяц и область видимости (scope): «psychologist:<id>» — обращения психолога и
+обращения без психолога, их консультации; «admin» — все. В снимке — обращения по статусам, консультации
+(всего, проведено, отменено, длительность проведённых, по формам), у психолога — учащиеся (обращения,
+консультации, последняя консультация), у администратора — психологи (обращения по статусам).
+Обращение относится к месяцу создания, консультация — к месяцу своей даты.
+
+Отчёт за период собирается из снимков месяцев, целиком вошедших в период, и живых данных за остальное:
+неполные месяцы на краях периода, текущий месяц и консультации, назначенные на будущее. Закрытые месяцы
+после последнего снимка досчитываются при построении отчёта и сразу сохраняются.
+Пересчитать снимки (например, после исправления данных задним числом) —
+manage.py report_snapshots --rebuild [--since ГГГГ-ММ].
+"""
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import Consultation, ConsultationStudent, Report, Request
+
+# Меняется при изменении состава данных снимка; снимки другой версии не читаются (пересчёт — --rebuild)
+SNAPSHOT_VERSION = 1
+PREFIX = 'snapshot'
+ADMIN = 'admin'
+REQUEST_STATUSES = ('new', 'in_progress', 'completed', 'cancelled')
+
+
+# ——— Месяцы ———
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def month_key(day):
+    return f'{day.year:04d}-{day.month:02d}'
+
+
+def parse_month(key):
+    year, month = key.split('-')
+    return date(int(year), int(month), 1)
+
+
+def _name(scope, month):
+    return f'{PREFIX}:{scope}:{month_key(month)}'
+
+
+def _prefix(scope):
+    return f'{PREFIX}:{scope}:'
+
+
+# ——— Области видимости ———
+
+def scope_for(user):
+    return ADMIN if user.role_name == 'admin' else f'psychologist:{user.pk}'
+
+
+def querysets(scope):
+    """Обращения и консультации области scope (как в отчётах психолога и администратора)."""
+    qs_req = Request.objects.all()
+    qs_cons = Consultation.objects.all()
+    if scope != ADMIN:
+        user_id = int(scope.split(':')[1])
+        qs_req = qs_req.filter(Q(psychologist_id=user_id) | Q(psychologist_id__isnull=True))
+        qs_cons = qs_cons.filter(
+            Q(request__psychologist_id=user_id)
+            | Q(request_id__isnull=True)
+            | Q(request__psychologist_id__isnull=True)
+        )
+    return qs_req, qs_cons
+
+
+# ——— Расчёт по живым данным ———
+
+def _empty(scope):
+    data = {
+        'requests': dict.fromkeys(REQUEST_STATUSES, 0),
+        'consultations': {'total': 0, 'completed': 0, 'cancelled': 0, 'duration': 0, 'timed': 0, 'forms': {}},
+    }
+    data['psychologists' if scope == ADMIN else 'students'] = {}
+    return data
+
+
+def compute(scope, start=None, end=None):
+    """
+    Помесячные показатели области scope за [start, end) по живым данным: {'ГГГГ-ММ': данные}.
+    Несколько сгруппированных запросов на весь период, а не запросы на каждого учащегося.
+    """
+    qs_req, qs_cons = querysets(scope)
+    if start is not None:
+        qs_req = qs_req.filter(created_at__gte=start)
+        qs_cons = qs_cons.filter(date__gte=start)
+    if end is not None:
+        qs_req = qs_req.filter(created_at__lt=end)
+        qs_cons = qs_cons.filter(date__lt=end)
+    months = {}
+
+    def month(value):
+        return months.setdefault(month_key(value), _empty(scope))
+
+    is_admin = scope == ADMIN
+    request_fields = ('month', 'status__name', 'psychologist_id', 'psychologist__username') if is_admin else ('month', 'status__name')
+    for row in qs_req.annotate(month=TruncMonth('created_at')).values(*request_fields).annotate(cnt=Count('id')):
+        if row['month'] is None:
+            continue
+        data = month(row['month'])
+        status = row['status__name']
+        data['requests'][status] = data['requests'].get(status, 0) + row['cnt']
+        if is_admin and row['psychologist_id'] is not None:
+            psychologist = data['psychologists'].setdefault(
+                str(row['psychologist_id']), {'name': row['psychologist__username'], 'statuses': {}},
+            )
+            psychologist['statuses'][status] = psychologist['statuses'].get(status, 0) + row['cnt']
+
+    completed = Q(completed_at__isnull=False)
+    for row in qs_cons.annotate(month=TruncMonth('date')).values('month', 'form__name').annotate(
+        total=Count('id'),
+        completed=Count('id', filter=completed),
+        cancelled=Count('id', filter=Q(cancelled_at__isnull=False)),
+        minutes=Sum('duration', filter=completed),
+        timed=Count('duration', filter=completed),
+    ):
+        totals = month(row['month'])['consultations']
+        for field in ('total', 'completed', 'cancelled', 'timed'):
+            totals[field] += row[field] or 0
+        totals['duration'] += row['minutes'] or 0
+        form = row['form__name'] or ''
+        totals['forms'][form] = totals['forms'].get(form, 0) + row['total']
+
+    if not is_admin:
+        _compute_students(qs_req, qs_cons, month)
+    return months
+
+
+def _compute_students(qs_req, qs_cons, month):
+    """Учащиеся: обращения по месяцам и консультации, где учащийся — автор обращения или участник."""
+    for row in qs_req.annotate(month=TruncMonth('created_at')).values('month', 'student_id').annotate(cnt=Count('id')):
+        if row['month'] is None:
+            continue
+        student = month(row['month'])['students'].setdefault(str(row['student_id']), [0, 0, None])
+        student[0] += row['cnt']
+    # Пары (консультация, учащийся) без повторов: учащийся может быть и автором, и участником
+    pairs = set(qs_cons.filter(request__isnull=False).values_list('id', 'request__student_id', 'date'))
+    pairs.update(
+        ConsultationStudent.objects.filter(consultation__in=qs_cons.values('id'))
+        .values_list('consultation_id', 'student_id', 'consultation__date')
+    )
+    for _, student_id, day in pairs:
+        student = month(day)['students'].setdefault(str(student_id), [0, 0, None])
+        student[1] += 1
+        if student[2] is None or day.isoformat() > student[2]:
+            student[2] = day.isoformat()
+
+
+# ——— Хранение ———
+
+def latest_month(scope):
+    """Первый день последнего сохранённого месяца области или None."""
+    name = (
+        Report.objects.filter(report_name__startswith=_prefix(scope))
+        .order_by('-report_name').values_list('report_name', flat=True).first()
+    )
+    return parse_month(name.rsplit(':', 1)[1]) if name else None
+
+
+def ensure(scope, closed_until, user_id=None):
+    """
+    Сохраняет снимки закрытых месяцев (до closed_until) после последнего снимка области.
+    Первый расчёт — за всю историю; пустые месяцы тоже сохраняются, чтобы не считать их снова.
+    """
+    latest = latest_month(scope)
+    start = next_month(latest) if latest else None
+    if start is not None and start >= closed_until:
+        return 0
+    months = compute(scope, start, closed_until)
+    if start is None:
+        previous = month_start(closed_until - timedelta(days=1))
+        start = min((parse_month(key) for key in months), default=previous)
+    rows = []
+    month = start
+    while month < closed_until:
+        key = month_key(month)
+        rows.append(Report(
+            report_name=_name(scope, month),
+            created_by_id=user_id,
+            report_data={'version': SNAPSHOT_VERSION, 'scope': scope, 'month': key, 'data': months.get(key) or _empty(scope)},
+        ))
+        month = next_month(month)
+    # Уникальный индекс по имени снимка (миграция 0023): параллельный расчёт того же месяца не дублирует строку
+    Report.objects.bulk_create(rows, ignore_conflicts=True)
+    return len(rows)
+
+
+def _load(scope, first, last):
+    """Сохранённые месяцы области в [first, last) (first=None — с начала) и дата последнего снимка."""
+    rows = Report.objects.filter(report_name__startswith=_prefix(scope), report_name__lt=_name(scope, last))
+    if first is not None:
+        rows = rows.filter(report_name__gte=_name(scope, first))
+    months, saved_at = {}, None
+    for created_at, payload in rows.values_list('created_at', 'report_data'):
+        if not payload or payload.get('version') != SNAPSHOT_VERSION:
+            continue
+        months[payload['month']] = payload['data']
+        if created_at and (saved_at is None or created_at > saved_at):
+            saved_at = created_at
+    return months, saved_at
+
+
+def delete(scope=None, since=None):
+    """Удаляет снимки области (None — всех) начиная с месяца since (None — все месяцы)."""
+    rows = Report.objects.filter(report_name__startswith=_prefix(scope) if scope else f'{PREFIX}:')
+    if since is not None:
+        ids = [pk for pk, name in rows.values_list('pk', 'report_name') if name.rsplit(':', 1)[1] >= month_key(since)]
+        rows = Report.objects.filter(pk__in=ids)
+    return rows.delete()[0]
+
+
+def rebuild(scope, since=None, today=None):
+    """Пересчитывает снимки области с месяца since (None — все) по текущим данным."""
+    closed_until = month_start(today or timezone.now().date())
+    with transaction.atomic():
+        delete(scope, since)
+        return ensure(scope, closed_until)
+
+
+# ——— Отчёт за период ———
+
+def combine(months):
+    """Сводит помесячные данные: учащиеся и психологи — суммы за все месяцы."""
+    students, psychologists = {}, {}
+    for key in sorted(months):
+        data = months[key]
+        for student_id, (requests, consultations, last) in data.get('students', {}).items():
+            total = students.setdefault(int(student_id), [0, 0, None])
+            total[0] += requests
+            total[1] += consultations
+            if last and (total[2] is None or last > total[2]):
+                total[2] = last
+        for psychologist_id, row in data.get('psychologists', {}).items():
+            total = psychologists.setdefault(int(psychologist_id), {'name': row['name'], 'statuses': {}})
+            total['name'] = row['name']
+            for status, count in row['statuses'].items():
+                total['statuses'][status] = total['statuses'].get(status, 0) + count
+    return {'months': dict(sorted(months.items())), 'students': students, 'psychologists': psychologists}
+
+
+def report(scope, date_from=None, date_to=None, user_id=None, today=None):
+    """
+    Данные отчёта области за период [date_from, date_to] (даты включительно, None — без границы):
+    combine() по месяцам плюс 'snapshot' — {'months': число месяцев из снимков, 'until': первый день
+    месяца после них, 'saved_at': время последнего снимка} или None, если снимки не понадобились.
+    """
+    closed_until = month_start(today or timezone.now().date())
+    ensure(scope, closed_until, user_id)
+    end = date_to + timedelta(days=1) if date_to else None
+    # Целые закрытые месяцы периода: [first, last)
+    first = None if date_from is None else (date_from if date_from.day == 1 else next_month(date_from))
+    last = closed_until if end is None else min(month_start(end), closed_until)
+    months, saved_at = {}, None
+    if first is not None and last <= first:
+        live = [(date_from, end)]
+    else:
+        months, saved_at = _load(scope, first, last)
+        live = []
+        if date_from is not None and date_from < first:
+            live.append((date_from, first))
+        if end is None or last < end:
+            live.append((last, end))
+    snapshot_months = len(months)
+    for start, stop in live:
+        months.update(compute(scope, start, stop))
+    data = combine(months)
+    data['snapshot'] = {'months': snapshot_months, 'until': last, 'saved_at': saved_at} if snapshot_months else None
+    return data
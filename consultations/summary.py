@@ -0,0 +1,118 @@
+"""
+Сводка по учащемуся (student_summary): обращения (открытые и всего), консультации, дата последней
+проведённой консультации, последнее сообщение в чате и непрочитанные психологом сообщения.
+Строки пересчитываются из исходных таблиц одним INSERT … ON CONFLICT для затронутых учащихся после
+фиксации транзакции (touch); ночная сверка (manage.py reconcile_student_summary) проходит всех учащихся
+пачками и исправляет расхождения, например после загрузки данных в обход приложения.
+"""
+from django.db import connection, transaction
+
+from .models import Consultation, ConsultationStudent, StudentPsychologistChat
+
+# Поля сводки, по которым можно сортировать список учащихся (у каждого свой индекс, миграция 0019)
+FIELDS = (
+    'open_requests', 'total_requests', 'consultations', 'last_consultation_date',
+    'last_message_at', 'unread_messages',
+)
+OPEN_STATUSES = ('new', 'in_progress')
+RECONCILE_BATCH = 5000
+
+# Консультации учащегося — как в отчётах: участник или автор обращения (старые записи без участников).
+# UNION вместо OR: обе ветки идут по индексам consultation_students(student_id) и requests(student_id)
+_STUDENT_CONSULTATIONS = """
+    c.cancelled_at IS NULL AND c.id IN (
+        SELECT cs.consultation_id FROM consultation_students cs WHERE cs.student_id = s.id
+        UNION
+        SELECT rc.id FROM consultations rc JOIN requests r ON r.id = rc.request_id WHERE r.student_id = s.id
+    )
+"""
+
+_SELECT = f"""
+    SELECT
+        s.id,
+        (SELECT COUNT(*) FROM requests r JOIN request_statuses rs ON rs.id = r.status_id
+          WHERE r.student_id = s.id AND rs.name IN (%s, %s)),
+        (SELECT COUNT(*) FROM requests r WHERE r.student_id = s.id),
+        (SELECT COUNT(*) FROM consultations c WHERE {_STUDENT_CONSULTATIONS}),
+        (SELECT MAX(c.date) FROM consultations c WHERE c.completed_at IS NOT NULL AND {_STUDENT_CONSULTATIONS}),
+        (SELECT MAX(m.created_at) FROM chat_messages m
+           JOIN student_psychologist_chats ch ON ch.id = m.chat_id WHERE ch.student_id = s.id),
+        (SELECT COUNT(*) FROM chat_messages m
+           JOIN student_psychologist_chats ch ON ch.id = m.chat_id
+          WHERE ch.student_id = s.id AND (m.author_id IS NULL OR m.author_id <> ch.psychologist_id)
+            AND NOT EXISTS (
+                SELECT 1 FROM chat_message_reads mr
+                WHERE mr.message_id = m.id AND mr.message_created_at = m.created_at
+                  AND mr.user_id = ch.psychologist_id
+            )),
+        CURRENT_TIMESTAMP
+    FROM students s
+"""
+
+
+def _upsert_sql(where):
+    # Строка переписывается только при расхождении: rowcount — число добавленных и исправленных строк
+    distinct = 'IS DISTINCT FROM' if connection.vendor == 'postgresql' else 'IS NOT'
+    changed = ' OR '.join(f'student_summary.{f} {distinct} excluded.{f}' for f in FIELDS)
+    columns = ', '.join(FIELDS)
+    updates = ', '.join(f'{f} = excluded.{f}' for f in (*FIELDS, 'updated_at'))
+    return (
+        f'INSERT INTO student_summary (student_id, {columns}, updated_at) {_SELECT} WHERE {where} '
+        f'ON CONFLICT (student_id) DO UPDATE SET {updates} WHERE {changed}'
+    )
+
+
+def refresh(student_ids):
+    """Пересчитывает строки сводки учащихся student_ids. Возвращает число изменённых строк."""
+    ids = sorted({pk for pk in student_ids if pk})
+    if not ids:
+        return 0
+    with connection.cursor() as c:
+        c.execute(_upsert_sql(f"s.id IN ({', '.join(['%s'] * len(ids))})"), [*OPEN_STATUSES, *ids])
+        return c.rowcount
+
+
+def touch(student_ids):
+    """Пересчитать сводку учащихся после фиксации текущей транзакции (сразу — вне транзакции)."""
+    ids = {pk for pk in student_ids if pk}
+    if ids:
+        transaction.on_commit(lambda: refresh(ids))
+
+
+def touch_chat(chat_id):
+    """Пересчитать сводку учащегося чата chat_id (новое сообщение, отметки прочтения)."""
+    touch(StudentPsychologistChat.objects.filter(pk=chat_id).values_list('student_id', flat=True))
+
+
+def consultation_students(consultation_ids):
+    """Учащиеся консультаций: участники и авторы обращений."""
+    ids = list(consultation_ids)
+    if not ids:
+        return set()
+    students = set(
+        ConsultationStudent.objects.filter(consultation_id__in=ids).values_list('student_id', flat=True)
+    )
+    students.update(
+        Consultation.objects.filter(pk__in=ids, request__isnull=False).values_list('request__student_id', flat=True)
+    )
+    return students
+
+
+def reconcile(batch=RECONCILE_BATCH, stdout=None):
+    """Сверка всей сводки пачками по id учащихся. Возвращает число добавленных и исправленных строк."""
+    fixed = 0
+    last = 0
+    with connection.cursor() as c:
+        c.execute('DELETE FROM student_summary WHERE student_id NOT IN (SELECT id FROM students)')
+        while True:
+            c.execute('SELECT MAX(id) FROM (SELECT id FROM students WHERE id > %s ORDER BY id LIMIT %s) t', [last, batch])
+            upper = c.fetchone()[0]
+            if upper is None:
+                break
+            with transaction.atomic():
+                c.execute(_upsert_sql('s.id > %s AND s.id <= %s'), [*OPEN_STATUSES, last, upper])
+                fixed += max(c.rowcount, 0)
+            if stdout:
+                stdout.write(f'  учащиеся до id {upper}: исправлено строк — {fixed}')
+            last = upper
+    return fixed
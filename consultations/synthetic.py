@@ -0,0 +1,556 @@
+"""
+Детерминированный генератор синтетических данных для нагрузочного тестирования.
+Данные пишутся потоком в файлы формата COPY (text) — по одному на каждую таблицу schema.sql —
+и загружаются в БД через COPY FROM STDIN. Одинаковые seed, размеры и дата --until дают одинаковый набор.
+"""
+import json
+import math
+import random
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+
+from . import partitions, schedule, summary
+
+# Порядок загрузки учитывает внешние ключи
+TABLE_COLUMNS = {
+    'teachers': ('id', 'first_name', 'last_name', 'subject', 'email'),
+    'classrooms': ('id', 'name', 'teacher_id'),
+    'students': ('id', 'first_name', 'last_name', 'class_id', 'birth_date', 'created_at'),
+    'users': (
+        'id', 'username', 'password_hash', 'role_id', 'student_id', 'created_at',
+        'is_active', 'last_login', 'is_staff', 'is_superuser',
+    ),
+    'user_security_phrases': ('id', 'user_id', 'phrase_hash', 'created_at'),
+    'parents': ('id', 'student_id', 'first_name', 'last_name', 'phone', 'email'),
+    'requests': ('id', 'student_id', 'psychologist_id', 'source', 'status_id', 'created_at'),
+    'consultations': (
+        'id', 'request_id', 'form_id', 'psychologist_id', 'date', 'start_time', 'end_time', 'duration', 'result',
+        'completed_at', 'cancelled_at', 'created_at',
+    ),
+    'consultation_students': (
+        'id', 'consultation_id', 'student_id', 'participation_confirmed_at', 'participation_cancelled_at',
+    ),
+    'notes': ('id', 'consultation_id', 'user_id', 'text', 'created_at'),
+    'attachments': (
+        'id', 'consultation_id', 'file_path', 'original_name', 'content_type', 'sha256', 'size',
+        'description', 'uploaded_at',
+    ),
+    'events': ('id', 'name', 'date', 'description', 'created_by'),
+    'reports': ('id', 'report_name', 'created_by', 'created_at', 'report_data'),
+    'logs': ('id', 'user_id', 'action', 'action_date'),
+    'student_notifications': ('id', 'student_id', 'kind', 'consultation_id', 'request_id', 'created_at'),
+    'request_notes': ('id', 'request_id', 'user_id', 'text', 'created_at'),
+    'student_psychologist_chats': ('id', 'student_id', 'psychologist_id', 'created_at', 'updated_at'),
+    'chat_messages': ('id', 'chat_id', 'author_id', 'text', 'created_at', 'read_at'),
+    'chat_message_reads': ('id', 'message_id', 'message_created_at', 'user_id', 'read_at'),
+}
+MANIFEST_NAME = 'manifest.json'
+BENCH_PASSWORD = 'bench-password'
+
+FIRST_NAMES_M = (
+    'Александр', 'Дмитрий', 'Максим', 'Иван', 'Артём', 'Никита', 'Михаил', 'Даниил', 'Егор', 'Кирилл',
+    'Илья', 'Алексей', 'Роман', 'Сергей', 'Андрей', 'Владимир', 'Павел', 'Николай', 'Евгений', 'Денис',
+)
+FIRST_NAMES_F = (
+    'Мария', 'Анна', 'Елена', 'Ольга', 'Виктория', 'Дарья', 'Полина', 'Алиса', 'Ксения', 'Наталья',
+    'Татьяна', 'Екатерина', 'Анастасия', 'София', 'Александра', 'Елизавета', 'Ульяна', 'Варвара', 'Валерия', 'Вероника',
+)
+LAST_NAMES = (
+    'Иванов', 'Петров', 'Сидоров', 'Козлов', 'Новиков', 'Морозов', 'Волков', 'Соколов', 'Лебедев', 'Кузнецов',
+    'Попов', 'Фёдоров', 'Михайлов', 'Андреев', 'Зайцев', 'Семёнов', 'Егоров', 'Павлов', 'Голубев', 'Виноградов',
+    'Богданов', 'Воробьёв', 'Фролов', 'Лазарев', 'Медведев', 'Белов', 'Александров', 'Герасимов', 'Степанов', 'Николаев',
+    'Орлов', 'Киселёв', 'Макаров', 'Захаров', 'Соловьёв', 'Борисов', 'Яковлев', 'Григорьев', 'Романов', 'Тихонов',
+)
+PATRONYMICS_M = ('Александрович', 'Дмитриевич', 'Сергеевич', 'Андреевич', 'Игоревич', 'Олегович', 'Павлович')
+PATRONYMICS_F = ('Александровна', 'Дмитриевна', 'Сергеевна', 'Андреевна', 'Игоревна', 'Олеговна', 'Павловна')
+SUBJECTS = ('Математика', 'Русский язык', 'Литература', 'История', 'Физика', 'Биология', 'Английский язык')
+LETTERS = 'АБВГДЕЖЗИКЛМНОПРСТУФХЦЧШЭЮЯ'
+RESULTS = (
+    'Проведена диагностика тревожности, даны рекомендации.',
+    'Обсуждены трудности адаптации в классе.',
+    'Проведена беседа по конфликту со сверстниками.',
+    'Рекомендовано повторное наблюдение через месяц.',
+    'Выполнено упражнение на снижение стресса перед экзаменами.',
+)
+CHAT_PHRASES = (
+    'Здравствуйте!', 'Можно записаться на консультацию?', 'Да, конечно. Какое время удобно?',
+    'После уроков, если можно.', 'Хорошо, жду вас в среду.', 'Спасибо!', 'Как вы себя чувствуете?',
+    'Уже лучше, спасибо.', 'Напишите, если что-то изменится.', 'Хорошо.',
+)
+NOTE_TEXTS = (
+    'Наблюдается положительная динамика.', 'Требуется беседа с родителями.',
+    'Учащийся охотно идёт на контакт.', 'Согласовать встречу с классным руководителем.',
+)
+# Доля обращений по статусам для «старых» (старше 60 дней) и свежих обращений
+STATUS_MIX_OLD = (('completed', 0.80), ('cancelled', 0.15), ('in_progress', 0.05))
+STATUS_MIX_RECENT = (('new', 0.35), ('in_progress', 0.45), ('completed', 0.15), ('cancelled', 0.05))
+SOURCE_MIX = (('student', 0.5), ('parent', 0.25), ('teacher', 0.25))
+GROUP_SHARE = 0.15
+STUDENTS_PER_CLASS = 25
+
+
+# ——— Формат COPY ———
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY."""
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return str(value).translate(_COPY_ESCAPES)
+
+
+class CopyWriter:
+    """Пишет строки таблиц в <каталог>/<таблица>.copy и ведёт манифест с числом строк."""
+
+    def __init__(self, out_dir):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self._files = {}
+        self.counts = dict.fromkeys(TABLE_COLUMNS, 0)
+
+    def write(self, table, row):
+        fh = self._files.get(table)
+        if fh is None:
+            fh = self._files[table] = open(self.out_dir / f'{table}.copy', 'w', encoding='utf-8', newline='\n')
+        fh.write('\t'.join(map(copy_value, row)) + '\n')
+        self.counts[table] += 1
+
+    def close(self, meta):
+        for fh in self._files.values():
+            fh.close()
+        manifest = dict(meta, tables={t: {'columns': list(TABLE_COLUMNS[t]), 'rows': self.counts[t]} for t in TABLE_COLUMNS})
+        (self.out_dir / MANIFEST_NAME).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+        return manifest
+
+
+# ——— Генерация ———
+
+def _weighted(rng, mix):
+    x = rng.random()
+    for value, share in mix:
+        x -= share
+        if x < 0:
+            return value
+    return mix[-1][0]
+
+
+def _season_weight(day):
+    """Летом обращений почти нет, в учебные месяцы — больше, в выходные — мало."""
+    weight = 0.15 if day.month in (6, 7, 8) else 1.0
+    return weight * (0.2 if day.weekday() >= 5 else 1.0)
+
+
+def read_dictionaries():
+    """Идентификаторы справочников (роли, статусы, формы консультаций) и максимальные id таблиц."""
+    with connection.cursor() as c:
+        c.execute('SELECT name, id FROM roles')
+        roles = dict(c.fetchall())
+        c.execute('SELECT name, id FROM request_statuses')
+        statuses = dict(c.fetchall())
+        c.execute('SELECT name, id FROM consultation_forms')
+        forms = dict(c.fetchall())
+        offsets = {}
+        for table in TABLE_COLUMNS:
+            c.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+            offsets[table] = c.fetchone()[0]
+    missing = [n for n in ('admin', 'psychologist', 'student') if n not in roles]
+    missing += [n for n in ('new', 'in_progress', 'completed', 'cancelled') if n not in statuses]
+    missing += [n for n in ('individual', 'group') if n not in forms]
+    if missing:
+        raise RuntimeError(f"В справочниках нет значений: {', '.join(missing)}. Примените schema.sql и миграции.")
+    return {'roles': roles, 'statuses': statuses, 'forms': forms}, offsets
+
+
+class DatasetGenerator:
+    """
+    Школа: классы по 25 учащихся, классные руководители, родители, учётные записи,
+    обращения с сезонностью и смесью статусов, индивидуальные и групповые консультации,
+    личные чаты с сообщениями «сериями».
+    """
+
+    def __init__(self, writer, dictionaries, offsets, seed=1, students=1000, requests=None,
+                 chat_messages=None, until=None, years=2):
+        self.writer = writer
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.dictionaries = dictionaries
+        self._ids = dict(offsets)
+        self.student_count = students
+        self.request_count = requests if requests is not None else students * 3
+        self.chat_message_count = chat_messages if chat_messages is not None else students * 10
+        self.until = until or date.today()
+        self.since = self.until - timedelta(days=365 * years)
+        self.password_hash = make_password(BENCH_PASSWORD, salt='syntheticdata')
+        # (психолог, день) → занятые интервалы: в БД действует ограничение consultations_no_overlap
+        self.busy = {}
+
+    def next_id(self, table):
+        self._ids[table] += 1
+        return self._ids[table]
+
+    def emit(self, table, *values):
+        self.writer.write(table, values)
+
+    def _moment(self, day, start_hour=8, end_hour=17):
+        return datetime.combine(day, time(start_hour)) + timedelta(
+            seconds=self.rng.randrange((end_hour - start_hour) * 3600)
+        )
+
+    def run(self):
+        self._school()
+        self._users()
+        self._requests()
+        self._events_and_reports()
+        self._chats()
+        return {
+            'seed': self.seed,
+            'students': self.student_count,
+            'requests': self.request_count,
+            'chat_messages': self.chat_message_count,
+            'since': self.since.isoformat(),
+            'until': self.until.isoformat(),
+            'password': BENCH_PASSWORD,
+        }
+
+    # Классы, учителя, учащиеся, родители
+    def _school(self):
+        rng = self.rng
+        parallels = max(1, math.ceil(self.student_count / (11 * STUDENTS_PER_CLASS)))
+        self.class_ids = []
+        self.class_grade = {}
+        for grade in range(1, 12):
+            for n in range(parallels):
+                suffix = LETTERS[n % len(LETTERS)] + (str(n // len(LETTERS)) if n >= len(LETTERS) else '')
+                teacher_id = self.next_id('teachers')
+                male = rng.random() < 0.2
+                self.emit(
+                    'teachers', teacher_id,
+                    rng.choice(FIRST_NAMES_M if male else FIRST_NAMES_F),
+                    rng.choice(LAST_NAMES) + ('' if male else 'а'),
+                    rng.choice(SUBJECTS), f'teacher{teacher_id}@school.example',
+                )
+                class_id = self.next_id('classrooms')
+                self.emit('classrooms', class_id, f'{grade}{suffix}', teacher_id)
+                self.class_ids.append(class_id)
+                self.class_grade[class_id] = grade
+
+        self.student_ids = []
+        self.student_class = {}
+        self.class_members = {class_id: [] for class_id in self.class_ids}
+        created = datetime.combine(self.since, time(9))
+        for i in range(self.student_count):
+            class_id = self.class_ids[i % len(self.class_ids)]
+            male = rng.random() < 0.5
+            student_id = self.next_id('students')
+            first = rng.choice(FIRST_NAMES_M if male else FIRST_NAMES_F)
+            patronymic = rng.choice(PATRONYMICS_M if male else PATRONYMICS_F)
+            family = rng.choice(LAST_NAMES)
+            last = family + ('' if male else 'а')
+            birth_year = self.until.year - 7 - self.class_grade[class_id] + (1 if self.until.month >= 9 else 0)
+            birth_date = date(birth_year, rng.randint(1, 12), rng.randint(1, 28))
+            self.emit('students', student_id, f'{first} {patronymic}', last, class_id, birth_date, created)
+            self.student_ids.append(student_id)
+            self.student_class[student_id] = class_id
+            self.class_members[class_id].append(student_id)
+
+            parents = _weighted(rng, ((1, 0.7), (2, 0.25), (0, 0.05)))
+            for p in range(parents):
+                parent_id = self.next_id('parents')
+                self.emit(
+                    'parents', parent_id, student_id,
+                    rng.choice(FIRST_NAMES_F if p == 0 else FIRST_NAMES_M),
+                    family if p else family + 'а',
+                    f'+7 9{rng.randrange(10**9):09d}', f'parent{parent_id}@mail.example',
+                )
+
+    # Учётные записи: админ, психологи (по одному на ~500 учащихся), учащиеся (70 % с аккаунтом)
+    def _users(self):
+        rng = self.rng
+        roles = self.dictionaries['roles']
+        joined = datetime.combine(self.since, time(8))
+        self.admin_id = self.next_id('users')
+        self.emit('users', self.admin_id, f'bench_admin_{self.admin_id}', self.password_hash, roles['admin'],
+                  None, joined, True, None, True, True)
+        self.psychologist_ids = []
+        for _ in range(max(2, self.student_count // 500)):
+            user_id = self.next_id('users')
+            self.emit('users', user_id, f'bench_psych_{user_id}', self.password_hash, roles['psychologist'],
+                      None, joined, True, None, False, False)
+            self.psychologist_ids.append(user_id)
+        for user_id in [self.admin_id, *self.psychologist_ids]:
+            self.emit('user_security_phrases', self.next_id('user_security_phrases'), user_id, self.password_hash, joined)
+        # Каждый класс закреплён за одним психологом
+        self.class_psychologist = {
+            class_id: self.psychologist_ids[i % len(self.psychologist_ids)] for i, class_id in enumerate(self.class_ids)
+        }
+        self.student_user = {}
+        for student_id in self.student_ids:
+            if rng.random() < 0.7:
+                user_id = self.next_id('users')
+                self.emit('users', user_id, f'bench_s{student_id}', self.password_hash, roles['student'],
+                          student_id, joined, True, None, False, False)
+                self.student_user[student_id] = user_id
+
+    def _log(self, user_id, action, moment):
+        self.emit('logs', self.next_id('logs'), user_id, action, moment)
+
+    def _notify(self, student_id, kind, moment, consultation_id=None, request_id=None):
+        self.emit('student_notifications', self.next_id('student_notifications'), student_id, kind,
+                  consultation_id, request_id, moment)
+
+    # Обращения и консультации: по дням окна с сезонностью; «склонность» учащихся распределена по Парето
+    def _requests(self):
+        rng = self.rng
+        days = [self.since + timedelta(days=i) for i in range((self.until - self.since).days)]
+        weights = [_season_weight(day) for day in days]
+        total_weight = sum(weights) or 1
+        cum_weights = []
+        acc = 0.0
+        for _ in self.student_ids:
+            acc += rng.paretovariate(1.5)
+            cum_weights.append(acc)
+        self.students_with_requests = set()
+        carry = 0.0
+        for day, weight in zip(days, weights):
+            expected = self.request_count * weight / total_weight + carry
+            count = int(expected)
+            carry = expected - count
+            if not count:
+                continue
+            for student_id in rng.choices(self.student_ids, cum_weights=cum_weights, k=count):
+                self._request(student_id, self._moment(day))
+            if rng.random() < 0.03 * weight:
+                self._group_consultation(None, self.rng.choice(self.class_ids), day, 'planned')
+
+    def _request(self, student_id, created_at):
+        rng = self.rng
+        statuses = self.dictionaries['statuses']
+        age = (self.until - created_at.date()).days
+        status = _weighted(rng, STATUS_MIX_OLD if age > 60 else STATUS_MIX_RECENT)
+        psychologist_id = self.class_psychologist[self.student_class[student_id]]
+        if status == 'new' and rng.random() < 0.5:
+            psychologist_id = None
+        request_id = self.next_id('requests')
+        source = _weighted(rng, SOURCE_MIX)
+        self.emit('requests', request_id, student_id, psychologist_id, source, statuses[status], created_at)
+        self.students_with_requests.add(student_id)
+        student_user = self.student_user.get(student_id)
+        self._log(student_user if source == 'student' and student_user else psychologist_id, 'Request created', created_at)
+        if status != 'new':
+            self._notify(student_id, 'request_status', created_at + timedelta(hours=rng.randint(1, 48)), request_id=request_id)
+        if student_user and rng.random() < 0.2:
+            self.emit('request_notes', self.next_id('request_notes'), request_id, student_user,
+                      'Хотелось бы обсудить ситуацию в классе.', created_at + timedelta(minutes=rng.randint(1, 120)))
+
+        consultations = {'new': 0, 'in_progress': rng.randint(0, 2), 'completed': rng.randint(1, 3),
+                         'cancelled': rng.randint(0, 1)}[status]
+        day = created_at.date()
+        for n in range(consultations):
+            day = day + timedelta(days=rng.randint(1, 14))
+            while day.weekday() >= 5:
+                day += timedelta(days=1)
+            if status == 'cancelled':
+                state = 'cancelled'
+            elif day > self.until or (status == 'in_progress' and n == consultations - 1):
+                state = 'planned'
+            else:
+                state = 'completed'
+            if rng.random() < GROUP_SHARE:
+                self._group_consultation(
+                    request_id, self.student_class[student_id], day, state, student_id, psychologist_id, created_at
+                )
+            else:
+                self._consultation(request_id, [student_id], day, state, psychologist_id, created_after=created_at)
+
+    def _group_consultation(self, request_id, class_id, day, state, student_id=None, psychologist_id=None,
+                            created_after=None):
+        members = self.class_members[class_id]
+        group = self.rng.sample(members, min(len(members), self.rng.randint(3, 8)))
+        if student_id is not None and student_id not in group:
+            group[0] = student_id
+        self._consultation(request_id, group, day, state, psychologist_id or self.class_psychologist[class_id],
+                           group=True, created_after=created_after)
+
+    def _consultation(self, request_id, student_ids, day, state, psychologist_id, group=False, created_after=None):
+        rng = self.rng
+        forms = self.dictionaries['forms']
+        duration = rng.choice((30, 45, 60) if not group else (45, 60, 90))
+        if state == 'cancelled':
+            start = datetime.combine(day, time(8)) + timedelta(minutes=15 * rng.randrange(32))
+        else:
+            day, start = self._book(psychologist_id, day, duration)
+        end = start + timedelta(minutes=duration)
+        created_at = start - timedelta(days=rng.randint(1, 10))
+        if created_after and created_at < created_after:
+            created_at = created_after + timedelta(minutes=rng.randint(5, 240))
+        completed_at = end + timedelta(minutes=rng.randint(5, 120)) if state == 'completed' else None
+        cancelled_at = start - timedelta(hours=rng.randint(1, 72)) if state == 'cancelled' else None
+        consultation_id = self.next_id('consultations')
+        self.emit(
+            'consultations', consultation_id, request_id, forms['group' if group else 'individual'], psychologist_id, day,
+            start.time(), end.time(), duration, rng.choice(RESULTS) if completed_at else None,
+            completed_at, cancelled_at, created_at,
+        )
+        self._log(psychologist_id, 'Consultation created', created_at)
+        for student_id in student_ids:
+            confirmed = created_at + timedelta(hours=rng.randint(1, 48)) if rng.random() < 0.6 else None
+            cancelled = None
+            if state == 'cancelled' or (group and rng.random() < 0.05):
+                cancelled, confirmed = cancelled_at or created_at + timedelta(hours=2), None
+            self.emit('consultation_students', self.next_id('consultation_students'), consultation_id, student_id,
+                      confirmed, cancelled)
+            self._notify(student_id, 'consultation_assigned', created_at, consultation_id=consultation_id)
+        if completed_at:
+            for _ in range(rng.choice((0, 1, 1, 2))):
+                self.emit('notes', self.next_id('notes'), consultation_id, psychologist_id, rng.choice(NOTE_TEXTS),
+                          completed_at + timedelta(minutes=rng.randint(1, 60)))
+            if rng.random() < 0.05:
+                digest = f'{rng.getrandbits(256):064x}'
+                self.emit('attachments', self.next_id('attachments'), consultation_id,
+                          f'{digest[:2]}/{digest[2:4]}/{digest}', f'report_{consultation_id}.pdf',
+                          'application/pdf', digest, rng.randint(20_000, 2_000_000), None, completed_at)
+
+    def _book(self, psychologist_id, day, duration):
+        """Свободное время у психолога: несколько случайных попыток за день, затем следующий рабочий день."""
+        rng = self.rng
+        while True:
+            busy = self.busy.setdefault((psychologist_id, day), schedule.DaySchedule())
+            for _ in range(8):
+                start = 8 * 60 + 15 * rng.randrange(32)
+                if not busy.conflicts(start, start + duration):
+                    busy.add(start, start + duration)
+                    return day, datetime.combine(day, time(8)) + timedelta(minutes=start - 8 * 60)
+            day += timedelta(days=1)
+            while day.weekday() >= 5:
+                day += timedelta(days=1)
+
+    def _events_and_reports(self):
+        rng = self.rng
+        day = self.since
+        while day < self.until:
+            self.emit('events', self.next_id('events'), 'Классный час', day,
+                      'Тематическое занятие по профилактике конфликтов', rng.choice(self.psychologist_ids))
+            day += timedelta(days=rng.randint(10, 25))
+        month = date(self.since.year, self.since.month, 1)
+        while month < self.until:
+            self.emit('reports', self.next_id('reports'), f'Отчёт за {month:%m.%Y}', self.admin_id,
+                      datetime.combine(month, time(10)),
+                      {'month': month.isoformat(), 'consultations': rng.randint(10, 500)})
+            month = (month + timedelta(days=32)).replace(day=1)
+        # Входы пользователей: по одной записи на учащегося с аккаунтом и пачка входов сотрудников
+        for user_id in [self.admin_id, *self.psychologist_ids, *self.student_user.values()]:
+            self._log(user_id, 'Login', self._moment(self.until - timedelta(days=rng.randint(0, 60))))
+
+    # Чаты: у учащихся с аккаунтом и хотя бы одним обращением; сообщения идут сериями
+    def _chats(self):
+        rng = self.rng
+        chats = []
+        now = datetime.combine(self.until, time(18))
+        for student_id in self.student_ids:
+            user_id = self.student_user.get(student_id)
+            if not user_id or student_id not in self.students_with_requests:
+                continue
+            chat_id = self.next_id('student_psychologist_chats')
+            chats.append((chat_id, student_id, user_id, self.class_psychologist[self.student_class[student_id]]))
+        if not chats:
+            return
+        cum_weights = []
+        acc = 0.0
+        for _ in chats:
+            acc += rng.paretovariate(1.2)
+            cum_weights.append(acc)
+        per_chat = {chat[0]: 0 for chat in chats}
+        for start in range(0, self.chat_message_count, 100_000):
+            k = min(100_000, self.chat_message_count - start)
+            for chat in rng.choices(chats, cum_weights=cum_weights, k=k):
+                per_chat[chat[0]] += 1
+
+        span = (self.until - self.since).days
+        for chat_id, student_id, student_user, psychologist_id in chats:
+            remaining = per_chat[chat_id]
+            created = datetime.combine(self.since + timedelta(days=rng.randrange(max(1, span))), time(12))
+            last = created
+            moment = created
+            while remaining > 0:
+                burst = min(remaining, rng.randint(3, 20))
+                remaining -= burst
+                moment = self._moment(moment.date() + timedelta(days=rng.randint(1, 20)), 8, 21)
+                if moment > now:
+                    moment = now - timedelta(hours=rng.randint(1, 48))
+                author = student_user
+                for _ in range(burst):
+                    moment += timedelta(seconds=rng.randint(20, 600))
+                    read_at = moment + timedelta(minutes=rng.randint(1, 240))
+                    if read_at > now:
+                        read_at = None
+                    message_id = self.next_id('chat_messages')
+                    self.emit('chat_messages', message_id, chat_id, author, rng.choice(CHAT_PHRASES), moment, read_at)
+                    if read_at:
+                        reader = psychologist_id if author == student_user else student_user
+                        self.emit(
+                            'chat_message_reads', self.next_id('chat_message_reads'), message_id, moment, reader, read_at,
+                        )
+                    if rng.random() < 0.6:
+                        author = psychologist_id if author == student_user else student_user
+                last = max(last, moment)
+            self.emit('student_psychologist_chats', chat_id, student_id, psychologist_id, created, last)
+
+
+def generate_dataset(out_dir, **options):
+    """Генерирует набор данных в каталог out_dir. Возвращает манифест."""
+    dictionaries, offsets = read_dictionaries()
+    writer = CopyWriter(out_dir)
+    try:
+        meta = DatasetGenerator(writer, dictionaries, offsets, **options).run()
+    except BaseException:
+        writer.close({'incomplete': True})
+        raise
+    return writer.close(meta)
+
+
+def load_dataset(out_dir, chunk_size=1024 * 1024):
+    """Загружает каталог, созданный generate_dataset, через COPY FROM STDIN; затем сдвигает sequences и ANALYZE."""
+    out_dir = Path(out_dir)
+    manifest = json.loads((out_dir / MANIFEST_NAME).read_text(encoding='utf-8'))
+    if manifest.get('incomplete'):
+        raise RuntimeError('Набор данных сгенерирован не полностью.')
+    loaded = {}
+    # Секции за весь период набора создаются до загрузки: иначе строки лягут в DEFAULT
+    since = date.fromisoformat(manifest['since']) if manifest.get('since') else None
+    for table in partitions.PARTITIONED_TABLES:
+        if table in manifest['tables'] and partitions.is_partitioned(table):
+            column, months_ahead, _ = partitions.table_policy(table)
+            partitions.ensure_partitions(table, column, months_ahead, start=since)
+    with transaction.atomic(), connection.cursor() as c:
+        for table, info in manifest['tables'].items():
+            path = out_dir / f'{table}.copy'
+            if not info['rows'] or not path.exists():
+                continue
+            with open(path, 'rb') as fh, c.copy(f"COPY {table} ({', '.join(info['columns'])}) FROM STDIN") as copy:
+                for chunk in iter(lambda: fh.read(chunk_size), b''):
+                    copy.write(chunk)
+            c.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"
+            )
+            loaded[table] = info['rows']
+    # COPY идёт в обход приложения: сводка по учащимся пересчитывается целиком
+    summary.reconcile()
+    with connection.cursor() as c:
+        for table in (*loaded, 'student_summary'):
+            c.execute(f'ANALYZE {table}')
+    return loaded
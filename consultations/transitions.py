@@ -0,0 +1,338 @@
+"""
+Переходы статусов обращений и консультаций. Каждый переход — одна транзакция из условных
+UPDATE … WHERE <допустимое состояние> RETURNING: если строку уже изменил параллельный запрос (двойной
+клик, другой психолог), условие не выполнится и переход просто не применится — без чтения объекта,
+блокировок и гонок. Уведомления учащимся пишутся в той же транзакции одной пачкой, а сигнал
+transitioned отправляется только после фиксации (transaction.on_commit).
+
+Функции возвращают Result(applied, state): применился ли переход и, если нет, текущее состояние
+(для сообщения пользователю; None — объекта нет или он недоступен). Отмена консультации дополнительно
+сообщает request_cancelled — переведено ли её обращение в «Отменено».
+"""
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Consultation, ConsultationStudent, Request, StudentNotification
+
+# После фиксации перехода: sender — имя перехода, аргументы request_ids, consultation_ids, student_ids
+transitioned = Signal()
+
+Result = namedtuple('Result', 'applied state request_cancelled', defaults=(False,))
+
+# Действие доски обращений → (целевой статус, из каких статусов допустим переход)
+REQUEST_ACTIONS = {
+    'complete': ('completed', ('new', 'in_progress')),
+    'cancel': ('cancelled', ('new', 'in_progress')),
+}
+# Назначить психолога можно только обращениям, с которыми ещё работают
+ASSIGNABLE_STATUSES = ('new', 'in_progress')
+
+# Не больше стольких обращений за одно действие (ограничение числа параметров запроса)
+MAX_BULK_IDS = 500
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _status_in(names, negate=False):
+    return (
+        f'status_id {"NOT IN" if negate else "IN"} '
+        f'(SELECT id FROM request_statuses WHERE name IN ({_placeholders(names)}))',
+        list(names),
+    )
+
+
+def _update_returning(table, assignments, where, returning='id'):
+    """
+    UPDATE table SET … WHERE … RETURNING returning (первая колонка — id). assignments и where — пары
+    (sql, params). Без поддержки RETURNING (SQLite до 3.35) подходящие строки сначала выбираются.
+    """
+    set_sql, set_params = assignments
+    where_sql, where_params = where
+    with connection.cursor() as c:
+        if connection.features.can_return_columns_from_insert:
+            c.execute(
+                f'UPDATE {table} SET {set_sql} WHERE {where_sql} RETURNING {returning}',
+                [*set_params, *where_params],
+            )
+            return c.fetchall()
+        c.execute(f'SELECT {returning} FROM {table} WHERE {where_sql}', where_params)
+        rows = c.fetchall()
+        if rows:
+            ids = [row[0] for row in rows]
+            c.execute(
+                f'UPDATE {table} SET {set_sql} WHERE {where_sql} AND id IN ({_placeholders(ids)})',
+                [*set_params, *where_params, *ids],
+            )
+        return rows
+
+
+def _on_commit(action, request_ids=(), consultation_ids=(), student_ids=()):
+    if not (request_ids or consultation_ids):
+        return
+    transaction.on_commit(lambda: transitioned.send(
+        sender=action, request_ids=list(request_ids), consultation_ids=list(consultation_ids),
+        student_ids=sorted({s for s in student_ids if s}),
+    ))
+
+
+def notify_status_changed(rows):
+    """Уведомления об изменении статуса по строкам (id обращения, id учащегося) — одним INSERT."""
+    StudentNotification.objects.bulk_create([
+        StudentNotification(
+            student_id=student_id, kind=StudentNotification.KIND_REQUEST_STATUS, request_id=request_id,
+        )
+        for request_id, student_id in rows if student_id
+    ])
+
+
+def _move_requests(ids, target, allowed=None, excluded=None, extra=None):
+    """
+    Переводит обращения ids в статус target, если их статус входит в allowed (или не входит в excluded),
+    и уведомляет учащихся. extra — дополнительное условие (sql, params). Возвращает [(id, student_id)].
+    """
+    conditions, params = [f'id IN ({_placeholders(ids)})'], list(ids)
+    for condition in (
+        _status_in(allowed) if allowed else None,
+        _status_in(excluded, negate=True) if excluded else None,
+        extra,
+    ):
+        if condition:
+            conditions.append(condition[0])
+            params.extend(condition[1])
+    rows = _update_returning(
+        'requests',
+        ('status_id = (SELECT id FROM request_statuses WHERE name = %s)', [target]),
+        (' AND '.join(conditions), params),
+        returning='id, student_id',
+    )
+    notify_status_changed(rows)
+    _on_commit(f'request_{target}', [r[0] for r in rows], student_ids=[r[1] for r in rows])
+    return rows
+
+
+def _request_state(request_id, student_id=None):
+    qs = Request.objects.filter(pk=request_id)
+    if student_id is not None:
+        qs = qs.filter(student_id=student_id)
+    return qs.values_list('status__name', flat=True).first()
+
+
+# ——— Обращения ———
+
+def complete_request(request_id):
+    """Обращение → «Завершено» (из любого статуса, кроме завершённого)."""
+    with transaction.atomic():
+        rows = _move_requests([request_id], 'completed', excluded=('completed',))
+    return Result(True, 'completed') if rows else Result(False, _request_state(request_id))
+
+
+def cancel_request(request_id, student_id=None):
+    """Обращение → «Отменено», пока оно не завершено. student_id — отмена самим учащимся (только своё)."""
+    extra = ('student_id = %s', [student_id]) if student_id is not None else None
+    with transaction.atomic():
+        rows = _move_requests([request_id], 'cancelled', excluded=('completed', 'cancelled'), extra=extra)
+    return Result(True, 'cancelled') if rows else Result(False, _request_state(request_id, student_id))
+
+
+def start_request(request_id, psychologist_id):
+    """
+    Первая консультация по обращению: психолог становится ведущим, новое обращение переходит «В работу».
+    Вызывается внутри транзакции, сохраняющей консультацию.
+    """
+    if not request_id:
+        return Result(False, None)
+    with transaction.atomic():
+        _update_returning(
+            'requests', ('psychologist_id = %s', [psychologist_id]),
+            ('id = %s AND (psychologist_id IS NULL OR psychologist_id <> %s)', [request_id, psychologist_id]),
+        )
+        rows = _move_requests([request_id], 'in_progress', allowed=('new',))
+    return Result(bool(rows), 'in_progress' if rows else None)
+
+
+def bulk_request_status(ids, action):
+    """Переводит обращения ids в статус действия action. Возвращает id обращений, которые изменились."""
+    target, allowed = REQUEST_ACTIONS[action]
+    ids = list(ids)[:MAX_BULK_IDS]
+    if not ids:
+        return []
+    with transaction.atomic():
+        rows = _move_requests(ids, target, allowed=allowed)
+    return sorted(row[0] for row in rows)
+
+
+def bulk_assign_psychologist(ids, psychologist_id):
+    """
+    Назначает психолога обращениям ids (только новым и в работе). Предстоящие консультации этих
+    обращений переходят в его расписание; пересечение с его консультациями откатывает всё действие
+    (IntegrityError от consultations_no_overlap). Возвращает id изменённых обращений.
+    """
+    ids = list(ids)[:MAX_BULK_IDS]
+    if not ids:
+        return []
+    status_sql, status_params = _status_in(ASSIGNABLE_STATUSES)
+    with transaction.atomic():
+        rows = _update_returning(
+            'requests', ('psychologist_id = %s', [psychologist_id]),
+            (
+                f'id IN ({_placeholders(ids)}) AND {status_sql} '
+                f'AND (psychologist_id IS NULL OR psychologist_id <> %s)',
+                [*ids, *status_params, psychologist_id],
+            ),
+            returning='id, student_id',
+        )
+        changed = sorted(row[0] for row in rows)
+        if changed:
+            Consultation.objects.filter(
+                request_id__in=changed, completed_at__isnull=True, cancelled_at__isnull=True,
+                date__gte=timezone.now().date(),
+            ).update(psychologist_id=psychologist_id)
+        _on_commit('request_assigned', changed, student_ids=[row[1] for row in rows])
+    return changed
+
+
+# ——— Консультации ———
+
+# Условия завершения: не завершена и не отменена, результат заполнен, обращение закреплено за этим
+# психологом, все учащиеся (кроме окончательно отменивших участие) подтвердили участие.
+_COMPLETABLE = """
+    id = %s AND completed_at IS NULL AND cancelled_at IS NULL
+    AND result IS NOT NULL AND TRIM(result) <> ''
+    AND request_id IN (SELECT id FROM requests WHERE psychologist_id = %s)
+    AND NOT EXISTS (
+        SELECT 1 FROM consultation_students cs
+        WHERE cs.consultation_id = consultations.id
+          AND cs.participation_cancelled_at IS NULL AND cs.participation_confirmed_at IS NULL
+    )
+"""
+
+
+def _consultation_state(consultation_id):
+    row = Consultation.objects.filter(pk=consultation_id).values_list('completed_at', 'cancelled_at').first()
+    if row is None:
+        return None
+    return 'completed' if row[0] else 'cancelled' if row[1] else 'planned'
+
+
+def complete_consultation(consultation_id, psychologist_id):
+    """Консультация → завершена, её обращение → «Завершено». Не применяется, если условия не выполнены."""
+    with transaction.atomic():
+        rows = _update_returning(
+            'consultations', ('completed_at = %s', [timezone.now()]),
+            (_COMPLETABLE, [consultation_id, psychologist_id]), returning='id, request_id',
+        )
+        if not rows:
+            return Result(False, _consultation_state(consultation_id))
+        request_id = rows[0][1]
+        if request_id:
+            _move_requests([request_id], 'completed', excluded=('completed',))
+        _on_commit('consultation_completed', [request_id] if request_id else (), [consultation_id])
+    return Result(True, 'completed')
+
+
+def _cancel_consultation(consultation_id, action):
+    """Отменяет консультацию и её незавершённое обращение. None — не применено, иначе — отменено ли обращение."""
+    rows = _update_returning(
+        'consultations', ('cancelled_at = %s', [timezone.now()]),
+        ('id = %s AND completed_at IS NULL AND cancelled_at IS NULL', [consultation_id]),
+        returning='id, request_id',
+    )
+    if not rows:
+        return None
+    request_id = rows[0][1]
+    moved = _move_requests([request_id], 'cancelled', excluded=('completed', 'cancelled')) if request_id else []
+    _on_commit(action, [request_id] if request_id else (), [consultation_id])
+    return bool(moved)
+
+
+def cancel_consultation(consultation_id):
+    """Консультация → отменена, её обращение → «Отменено» (если оно ещё не завершено)."""
+    with transaction.atomic():
+        request_cancelled = _cancel_consultation(consultation_id, 'consultation_cancelled')
+        if request_cancelled is not None:
+            return Result(True, 'cancelled', request_cancelled)
+    return Result(False, _consultation_state(consultation_id))
+
+
+def participation_state(consultation_id, student_id):
+    """Состояние для отказа: None — консультация не учащегося, иначе её состояние или состояние участия."""
+    consultation = Consultation.objects.filter(
+        Q(request__student_id=student_id)
+        | Q(pk__in=ConsultationStudent.objects.filter(student_id=student_id).values('consultation_id')),
+        pk=consultation_id,
+    ).values_list('completed_at', 'cancelled_at').first()
+    if consultation is None:
+        return None
+    if consultation[0] or consultation[1]:
+        return 'completed' if consultation[0] else 'cancelled'
+    link = ConsultationStudent.objects.filter(consultation_id=consultation_id, student_id=student_id).values_list(
+        'participation_confirmed_at', 'participation_cancelled_at',
+    ).first()
+    if link is None:
+        return 'not_participant'
+    return 'participation_cancelled' if link[1] else 'confirmed' if link[0] else 'planned'
+
+
+def confirm_participation(consultation_id, student_id):
+    """
+    Учащийся подтверждает участие в предстоящей консультации. Автор обращения старой консультации без
+    участников сначала добавляется участником. Не применяется, если участие уже подтверждено или
+    окончательно отменено, а также к проведённой или отменённой консультации.
+    """
+    with transaction.atomic():
+        with connection.cursor() as c:
+            c.execute(
+                """
+                INSERT INTO consultation_students (consultation_id, student_id)
+                SELECT c.id, r.student_id FROM consultations c JOIN requests r ON r.id = c.request_id
+                WHERE c.id = %s AND r.student_id = %s AND c.completed_at IS NULL AND c.cancelled_at IS NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM consultation_students cs
+                      WHERE cs.consultation_id = c.id AND cs.student_id = r.student_id
+                  )
+                """,
+                [consultation_id, student_id],
+            )
+        rows = _update_returning(
+            'consultation_students',
+            ('participation_confirmed_at = %s', [timezone.now()]),
+            (
+                'consultation_id = %s AND student_id = %s '
+                'AND participation_confirmed_at IS NULL AND participation_cancelled_at IS NULL '
+                'AND consultation_id IN (SELECT id FROM consultations '
+                'WHERE completed_at IS NULL AND cancelled_at IS NULL)',
+                [consultation_id, student_id],
+            ),
+        )
+        if rows:
+            _on_commit('participation_confirmed', consultation_ids=[consultation_id], student_ids=[student_id])
+            return Result(True, 'confirmed')
+    return Result(False, participation_state(consultation_id, student_id))
+
+
+def cancel_participation(consultation_id, student_id):
+    """
+    Учащийся окончательно отменяет участие: подтверждение снимается, консультация и обращение
+    отменяются. Не применяется, если участие уже отменено или консультация проведена/отменена.
+    """
+    with transaction.atomic():
+        rows = _update_returning(
+            'consultation_students',
+            ('participation_confirmed_at = NULL, participation_cancelled_at = %s', [timezone.now()]),
+            (
+                'consultation_id = %s AND student_id = %s AND participation_cancelled_at IS NULL '
+                'AND consultation_id IN (SELECT id FROM consultations '
+                'WHERE completed_at IS NULL AND cancelled_at IS NULL)',
+                [consultation_id, student_id],
+            ),
+        )
+        if rows:
+            request_cancelled = _cancel_consultation(consultation_id, 'participation_cancelled')
+            return Result(True, 'cancelled', bool(request_cancelled))
+    return Result(False, _consultation_state(consultation_id))
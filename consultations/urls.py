@@ -6,6 +6,7 @@ app_name = 'consultations'
 urlpatterns = [
     # Обращения
     path('requests/', views.RequestListView.as_view(), name='request_list'),
+    path('requests/bulk/', views.RequestBulkActionView.as_view(), name='request_bulk_action'),
     path('requests/create/', views.RequestCreateView.as_view(), name='request_create'),
     path('requests/<int:pk>/', views.RequestDetailView.as_view(), name='request_detail'),
     path('requests/<int:pk>/edit/', views.RequestUpdateView.as_view(), name='request_edit'),
@@ -15,21 +16,33 @@ urlpatterns = [
     # Консультации (журнал)
     path('journal/', views.ConsultationListView.as_view(), name='consultation_list'),
     path('journal/create/', views.ConsultationCreateView.as_view(), name='consultation_create'),
+    path('journal/series/create/', views.ConsultationSeriesCreateView.as_view(), name='consultation_series_create'),
+    path('journal/series/<int:pk>/', views.ConsultationSeriesDetailView.as_view(), name='consultation_series_detail'),
+    path('journal/series/<int:pk>/edit/', views.ConsultationSeriesUpdateView.as_view(), name='consultation_series_edit'),
+    path('journal/series/<int:pk>/cancel/', views.ConsultationSeriesCancelView.as_view(), name='consultation_series_cancel'),
     path('journal/<int:pk>/', views.ConsultationDetailView.as_view(), name='consultation_detail'),
     path('journal/<int:pk>/notes/add/', views.ConsultationNoteCreateView.as_view(), name='consultation_note_add'),
     path('journal/<int:pk>/attachments/', views.ConsultationAttachmentUploadView.as_view(), name='consultation_attachment_upload'),
+    path('journal/<int:pk>/attachments/<int:attachment_id>/', views.ConsultationAttachmentDownloadView.as_view(), name='consultation_attachment_download'),
     path('journal/<int:pk>/attachments/<int:attachment_id>/delete/', views.ConsultationAttachmentDeleteView.as_view(), name='consultation_attachment_delete'),
     path('journal/<int:pk>/assign-psychologist/', views.ConsultationAssignPsychologistView.as_view(), name='consultation_assign_psychologist'),
     path('journal/<int:pk>/edit/', views.ConsultationUpdateView.as_view(), name='consultation_edit'),
     path('journal/<int:pk>/complete/', views.ConsultationCompleteView.as_view(), name='consultation_complete'),
     path('journal/<int:pk>/cancel/', views.ConsultationCancelView.as_view(), name='consultation_cancel'),
     path('journal/<int:pk>/delete/', views.ConsultationDeleteView.as_view(), name='consultation_delete'),
+    path('schedule/free-slots/', views.ScheduleFreeSlotsView.as_view(), name='schedule_free_slots'),
     path('admin/database/', views.DatabaseMaintenanceView.as_view(), name='database_maintenance'),
+    path('admin/database/status/', views.DatabaseBackupStatusView.as_view(), name='database_backup_status'),
     path('admin/database/download/<str:filename>/', views.DatabaseBackupDownloadView.as_view(), name='database_backup_download'),
+    path('admin/database/verify/<str:filename>/', views.DatabaseBackupVerifyView.as_view(), name='database_backup_verify'),
     path('admin/database/delete/<str:filename>/', views.DatabaseBackupDeleteView.as_view(), name='database_backup_delete'),
+    path('admin/profiling/', views.RequestProfileView.as_view(), name='request_profiles'),
+    path('admin/audit/', views.AuditLogView.as_view(), name='audit_log'),
     # Отчёты
     path('reports/', views.ReportView.as_view(), name='report'),
+    path('reports/consultations/', views.ReportConsultationsView.as_view(), name='report_consultations'),
     path('reports/student/<int:pk>/dynamics/', views.StudentDynamicsView.as_view(), name='student_dynamics'),
+    path('reports/risk/', views.RiskRosterView.as_view(), name='risk_roster'),
     # Экспорт (психолог — три отчёта; админ — по консультациям)
     path('reports/export/students-report/pdf/', views.ExportStudentsReportPDFView.as_view(), name='export_students_report_pdf'),
     path('reports/export/students-report/excel/', views.ExportStudentsReportExcelView.as_view(), name='export_students_report_excel'),
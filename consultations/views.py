@@ -1,16 +1,18 @@
 ﻿'\nОбращения (requests), консультации, отчёты. Доступ: психолог, администратор.\n'
+import asyncio
 import json
-import os
-import re
-import shutil
-import subprocess
 from datetime import timedelta
-from pathlib import Path
-from django.db.models import Q, Count, Max, Sum, Avg, OuterRef, Subquery, IntegerField, Value
+from urllib.parse import quote, urlencode
+from django.db.models import (
+    Q, Count, Max, Sum, Avg, OuterRef, Subquery, Exists, IntegerField, Value, F, FloatField, ExpressionWrapper,
+)
 from django.db.models.functions import TruncMonth, Coalesce
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.core.paginator import InvalidPage, Page, Paginator
 from django.core.exceptions import PermissionDenied
-from django.http import FileResponse, Http404, HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
 from django.views.generic import (
@@ -18,12 +20,22 @@ from django.views.generic import (
 )
 from django.contrib import messages
 from django.utils import timezone
-
-from users.decorators import PsychologistRequiredMixin, AdminRequiredMixin, StudentRequiredMixin
-from students.models import Student
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
+
+from config import pagination
+from config.conditional import conditional_page
+from config.db_router import ReplicaReadMixin
+from config.pagination import KeysetPaginationMixin
+from config.instrumentation import profile_buffer
+from users.decorators import (
+    PsychologistRequiredMixin, AdminRequiredMixin, StudentRequiredMixin, AsyncStudentRequiredMixin,
+)
+from students.models import Classroom, Student
 from .models import (
     Request,
     Consultation,
+    ConsultationSeries,
     RequestStatus,
     ConsultationStudent,
     StudentNotification,
@@ -34,6 +46,7 @@ from .models import (
     StudentPsychologistChat,
     ChatMessage,
     ChatMessageRead,
+    RequestProfile,
 )
 from .forms import (
     RequestForm,
@@ -42,34 +55,9 @@ from .forms import (
     MyRequestCreateForm,
     ChatMessageForm,
     ConsultationPsychologistAssignForm,
+    ConsultationSeriesForm,
 )
-from .signals import notify_request_status_changed
-
-
-def _resolve_pg_dump_path():
-    """Возвращает путь к pg_dump: settings/env -> PATH -> стандартные пути Windows."""
-    configured = getattr(settings, 'PG_DUMP_PATH', None) or os.environ.get('PG_DUMP_PATH')
-    if configured:
-        configured_path = Path(configured)
-        if configured_path.exists():
-            return str(configured_path)
-    from_path = shutil.which('pg_dump')
-    if from_path:
-        return from_path
-
-    # Windows fallback: C:\Program Files\PostgreSQL\<version>\bin\pg_dump.exe
-    pf = os.environ.get('ProgramFiles', r'C:\Program Files')
-    root = Path(pf) / 'PostgreSQL'
-    if root.exists():
-        candidates = []
-        for ver_dir in root.iterdir():
-            exe = ver_dir / 'bin' / 'pg_dump.exe'
-            if exe.exists():
-                candidates.append(exe)
-        if candidates:
-            candidates.sort(reverse=True)
-            return str(candidates[0])
-    return None
+from . import attachments, audit, backups, dynamics, partitions, restore, schedule, series, snapshots, summary, transitions
 
 
 def _get_pdf_cyrillic_font():
@@ -125,9 +113,72 @@ class RequestListView(PsychologistRequiredMixin, ListView):
         ctx['requests_in_progress'] = qs.filter(status__name='in_progress')[:50]
         ctx['requests_completed'] = qs.filter(status__name='completed')[:50]
         ctx['requests_cancelled'] = qs.filter(status__name='cancelled')[:50]
+        if self.request.user.role_name == 'admin':
+            ctx['assign_psychologist_form'] = ConsultationPsychologistAssignForm()
         return ctx
 
 
+class RequestBulkActionView(PsychologistRequiredMixin, View):
+    """
+    Массовые действия доски обращений: завершить, отменить (психолог), назначить психолога (админ).
+    Каждое действие — один условный UPDATE; обращения в неподходящем статусе пропускаются.
+    """
+    def post(self, request):
+        action = request.POST.get('action', '')
+        ids = [int(v) for v in request.POST.getlist('ids') if v.isdigit()]
+        back = reverse('consultations:request_list')
+        if request.POST.get('q'):
+            back += '?q=' + quote(request.POST['q'])
+        if not ids:
+            messages.warning(request, 'Отметьте обращения для массового действия.')
+            return redirect(back)
+        if len(ids) > transitions.MAX_BULK_IDS:
+            messages.error(request, f'За один раз можно обработать не больше {transitions.MAX_BULK_IDS} обращений.')
+            return redirect(back)
+
+        if action in transitions.REQUEST_ACTIONS:
+            if request.user.role_name != 'psychologist':
+                messages.error(request, 'Только психолог может завершать и отменять обращения.')
+                return redirect(back)
+            changed = transitions.bulk_request_status(ids, action)
+            done = {'complete': 'Завершено', 'cancel': 'Отменено'}[action]
+        elif action == 'assign':
+            if request.user.role_name != 'admin':
+                messages.error(request, 'Назначать психолога может только администратор.')
+                return redirect(back)
+            form = ConsultationPsychologistAssignForm(request.POST)
+            if not form.is_valid():
+                messages.error(request, 'Выберите психолога из списка.')
+                return redirect(back)
+            try:
+                changed = transitions.bulk_assign_psychologist(ids, form.cleaned_data['psychologist'].pk)
+            except IntegrityError as e:
+                if not schedule.is_overlap_error(e):
+                    raise
+                messages.error(request, 'У психолога уже есть консультации в это время — назначение не выполнено.')
+                return redirect(back)
+            done = f'Назначено психологу {form.cleaned_data["psychologist"].username}'
+        else:
+            messages.error(request, 'Неизвестное действие.')
+            return redirect(back)
+
+        skipped = len(set(ids)) - len(changed)
+        text = f'{done} обращений: {len(changed)}.'
+        if skipped:
+            text += f' Пропущено (статус не позволяет или уже выполнено): {skipped}.'
+        if changed:
+            messages.success(request, text)
+        else:
+            messages.warning(request, text)
+        return redirect(back)
+
+
+def _request_version(request, pk):
+    # updated_at обращения меняют и его заметки, и консультации (миграция 0022); ФИО — из строки учащегося
+    return Request.objects.filter(pk=pk).values_list('updated_at', 'student__updated_at').first()
+
+
+@method_decorator(conditional_page(_request_version), name='get')
 class RequestDetailView(PsychologistRequiredMixin, DetailView):
     model = Request
     template_name = 'consultations/request_detail.html'
@@ -206,18 +257,13 @@ class RequestCompleteView(PsychologistRequiredMixin, View):
         if request.user.role_name != 'psychologist':
             messages.error(request, 'Только психолог может завершать обращения.')
             return redirect('consultations:request_detail', pk=pk)
-        request_obj = get_object_or_404(Request, pk=pk)
-        completed_status = RequestStatus.objects.filter(name='completed').first()
-        if not completed_status:
-            messages.error(request, 'В системе не найден статус «Завершено».')
-            return redirect('consultations:request_detail', pk=pk)
-        if request_obj.status.name == 'completed':
+        result = transitions.complete_request(pk)
+        if result.applied:
+            messages.success(request, 'Обращение завершено.')
+        elif result.state is None:
+            raise Http404
+        else:
             messages.info(request, 'Обращение уже завершено.')
-            return redirect('consultations:request_detail', pk=pk)
-        request_obj.status = completed_status
-        request_obj.save(update_fields=['status_id'])
-        notify_request_status_changed(request_obj)
-        messages.success(request, 'Обращение завершено.')
         return redirect('consultations:request_detail', pk=pk)
 
 
@@ -227,31 +273,27 @@ class RequestCancelView(PsychologistRequiredMixin, View):
         if request.user.role_name != 'psychologist':
             messages.error(request, 'Только психолог может отменять обращения.')
             return redirect('consultations:request_detail', pk=pk)
-        request_obj = get_object_or_404(Request, pk=pk)
-        if request_obj.status.name == 'completed':
+        result = transitions.cancel_request(pk)
+        if result.state is None:
+            raise Http404
+        if result.state == 'completed':
             messages.warning(request, 'Завершённое обращение отменить нельзя.')
             return redirect('consultations:request_detail', pk=pk)
-        cancelled_status = RequestStatus.objects.filter(name='cancelled').first()
-        if not cancelled_status:
-            messages.error(request, 'В системе не найден статус «Отменено». Обратитесь к администратору.')
-            return redirect('consultations:request_detail', pk=pk)
-        request_obj.status = cancelled_status
-        request_obj.save(update_fields=['status_id'])
-        notify_request_status_changed(request_obj)
-        messages.success(request, 'Обращение отменено.')
+        messages.success(request, 'Обращение отменено.' if result.applied else 'Обращение уже отменено.')
         return redirect('consultations:request_list')
 
 
 # ——— Консультации ———
 
-class ConsultationListView(PsychologistRequiredMixin, ListView):
+class ConsultationListView(PsychologistRequiredMixin, KeysetPaginationMixin, ListView):
     model = Consultation
     template_name = 'consultations/consultation_list.html'
     context_object_name = 'consultations'
     paginate_by = 20
+    keyset_ordering = ('-date', '-id')
 
     def get_queryset(self):
-        qs = Consultation.objects.select_related('request', 'request__student', 'form').prefetch_related('students').order_by('-date', '-created_at')
+        qs = Consultation.objects.select_related('request', 'request__student', 'form').prefetch_related('students')
         date_from = self.request.GET.get('date_from', '').strip()
         date_to = self.request.GET.get('date_to', '').strip()
         student_id = self.request.GET.get('student', '').strip()
@@ -270,16 +312,20 @@ class ConsultationListView(PsychologistRequiredMixin, ListView):
             qs = qs.filter(date__gte=date_from)
         if date_to:
             qs = qs.filter(date__lte=date_to)
+        # Участники — подзапросом, а не JOIN + DISTINCT: keyset-страница идёт по индексу (date, id)
         if student_id:
-            qs = qs.filter(Q(request__student_id=student_id) | Q(students__id=student_id)).distinct()
+            participants = ConsultationStudent.objects.filter(student_id=student_id)
+            qs = qs.filter(Q(request__student_id=student_id) | Q(pk__in=participants.values('consultation_id')))
         if q:
+            participants = ConsultationStudent.objects.filter(
+                Q(student__last_name__icontains=q) | Q(student__first_name__icontains=q)
+            )
             qs = qs.filter(
                 Q(request__student__last_name__icontains=q)
                 | Q(request__student__first_name__icontains=q)
-                | Q(students__last_name__icontains=q)
-                | Q(students__first_name__icontains=q)
+                | Q(pk__in=participants.values('consultation_id'))
                 | Q(result__icontains=q)
-            ).distinct()
+            )
         return qs
 
     def get_context_data(self, **kwargs):
@@ -299,13 +345,25 @@ class ConsultationListView(PsychologistRequiredMixin, ListView):
         return ctx
 
 
+def _consultation_version(request, pk):
+    # Участники, заметки и вложения меняют updated_at консультации; психолог показывается из обращения,
+    # ФИО — из строк учащегося обращения и участников
+    return (
+        Consultation.objects.filter(pk=pk)
+        .annotate(participants_version=Max('consultation_students__student__updated_at'))
+        .values_list('updated_at', 'request__updated_at', 'request__student__updated_at', 'participants_version')
+        .first()
+    )
+
+
+@method_decorator(conditional_page(_consultation_version), name='get')
 class ConsultationDetailView(PsychologistRequiredMixin, DetailView):
     model = Consultation
     template_name = 'consultations/consultation_detail.html'
     context_object_name = 'consultation'
 
     def get_queryset(self):
-        return Consultation.objects.select_related('request', 'form').prefetch_related(
+        return Consultation.objects.select_related('request', 'form', 'series').prefetch_related(
             'students', 'consultation_students__student', 'attachments', 'notes__user'
         )
 
@@ -377,8 +435,34 @@ class ConsultationAssignPsychologistView(AdminRequiredMixin, View):
         if req.psychologist_id == assigned.pk:
             messages.info(request, f'Психолог уже установлен: {assigned.username}.')
             return redirect('consultations:consultation_detail', pk=pk)
-        req.psychologist_id = assigned.pk
-        req.save(update_fields=['psychologist_id'])
+        # Предстоящие консультации по обращению переходят в расписание нового психолога
+        planned = list(req.consultations.filter(
+            completed_at__isnull=True, cancelled_at__isnull=True, date__gte=timezone.now().date(),
+        ))
+        index = schedule.ScheduleIndex.load(
+            min((c.date for c in planned), default=None) or timezone.now().date(),
+            max((c.date for c in planned), default=None) or timezone.now().date(),
+            [assigned.pk],
+        )
+        busy = [
+            c for c in planned
+            if c.start_time and c.end_time and index.conflicts(assigned.pk, c.date, c.start_time, c.end_time, exclude_id=c.pk)
+        ]
+        if busy:
+            messages.error(request, 'У психолога {} уже есть консультации в это время: {}.'.format(
+                assigned.username, ', '.join(f'{c.date:%d.%m.%Y} {c.time_display()}' for c in busy),
+            ))
+            return redirect('consultations:consultation_detail', pk=pk)
+        try:
+            with transaction.atomic():
+                req.psychologist_id = assigned.pk
+                req.save(update_fields=['psychologist_id'])
+                Consultation.objects.filter(pk__in=[c.pk for c in planned]).update(psychologist_id=assigned.pk)
+        except IntegrityError as e:
+            if not schedule.is_overlap_error(e):
+                raise
+            messages.error(request, schedule.OVERLAP_MESSAGE)
+            return redirect('consultations:consultation_detail', pk=pk)
         messages.success(request, f'Психолог для консультации установлен: {assigned.username}.')
         return redirect('consultations:consultation_detail', pk=pk)
 
@@ -412,8 +496,15 @@ class ConsultationCreateView(PsychologistRequiredMixin, CreateView):
             except Request.DoesNotExist:
                 linked_request = None
         ctx['linked_request'] = linked_request
+        ctx['free_slots_url'] = reverse('consultations:schedule_free_slots')
         return ctx
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        # Зарегистрировавший психолог становится ведущим — консультация встаёт в его расписание
+        kwargs['psychologist_id'] = self.request.user.id
+        return kwargs
+
     def get_success_url(self):
         # После регистрации консультации по обращению — обратно к карточке обращения
         req_id = getattr(self, '_created_request_id', None)
@@ -422,20 +513,17 @@ class ConsultationCreateView(PsychologistRequiredMixin, CreateView):
         return reverse_lazy('consultations:consultation_list')
 
     def form_valid(self, form):
-        consultation = form.save()
+        try:
+            with transaction.atomic():
+                consultation = form.save()
+                transitions.start_request(consultation.request_id, self.request.user.id)
+        except IntegrityError as e:
+            # Проверку формы одновременно прошли две записи на одно время: вторую отклонило ограничение БД
+            if not schedule.is_overlap_error(e):
+                raise
+            form.add_error('start_time', schedule.OVERLAP_MESSAGE)
+            return self.form_invalid(form)
         self._created_request_id = consultation.request_id
-        req = consultation.request
-        # Психолог, зарегистрировавший консультацию, становится ведущим по обращению.
-        if req and req.psychologist_id != self.request.user.id:
-            req.psychologist_id = self.request.user.id
-            req.save(update_fields=['psychologist_id'])
-        # При первой консультации по обращению переводим статус в «В работе»
-        if req and req.status.name == 'new':
-            in_progress = RequestStatus.objects.filter(name='in_progress').first()
-            if in_progress:
-                req.status = in_progress
-                req.save(update_fields=['status_id'])
-                notify_request_status_changed(req)
         messages.success(self.request, 'Консультация зарегистрирована.')
         return redirect(self.get_success_url())
 
@@ -452,12 +540,33 @@ class ConsultationUpdateView(PsychologistRequiredMixin, UpdateView):
             return redirect('consultations:consultation_detail', pk=kwargs.get('pk'))
         return super().dispatch(request, *args, **kwargs)
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        consultation = self.object
+        kwargs['psychologist_id'] = (
+            consultation.request.psychologist_id if consultation.request_id else None
+        ) or self.request.user.id
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['free_slots_url'] = reverse('consultations:schedule_free_slots')
+        return ctx
+
     def get_success_url(self):
         return reverse_lazy('consultations:consultation_list')
 
     def form_valid(self, form):
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+        except IntegrityError as e:
+            if not schedule.is_overlap_error(e):
+                raise
+            form.add_error('start_time', schedule.OVERLAP_MESSAGE)
+            return self.form_invalid(form)
         messages.success(self.request, 'Консультация обновлена.')
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
 
 
 class ConsultationDeleteView(PsychologistRequiredMixin, DeleteView):
@@ -478,8 +587,177 @@ class ConsultationDeleteView(PsychologistRequiredMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 
+# ——— Серии консультаций ———
+
+class ConsultationSeriesCreateView(PsychologistRequiredMixin, CreateView):
+    'Серия консультаций: одинаковое время раз в неделю или в две недели до даты окончания.'
+    model = ConsultationSeries
+    form_class = ConsultationSeriesForm
+    template_name = 'consultations/consultation_series_form.html'
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.role_name != 'psychologist':
+            messages.error(request, 'Администратор не может назначать консультации.')
+            return redirect('consultations:consultation_list')
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_initial(self):
+        initial = super().get_initial()
+        req_id = self.request.GET.get('request')
+        if req_id:
+            initial['request'] = get_object_or_404(Request, pk=req_id)
+        return initial
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['psychologist_id'] = self.request.user.id
+        return kwargs
+
+    def form_valid(self, form):
+        data = form.cleaned_data
+        try:
+            with transaction.atomic():
+                created = series.create_series(
+                    self.request.user.id, data['students'], data['form'], data['start_time'], data['end_time'],
+                    form.dates, data['interval_weeks'], data['date_until'], request=data.get('request'),
+                )
+                transitions.start_request(created.request_id, self.request.user.id)
+        except IntegrityError as e:
+            if not schedule.is_overlap_error(e):
+                raise
+            form.add_error('start_time', schedule.OVERLAP_MESSAGE)
+            return self.form_invalid(form)
+        skipped = ''
+        if form.busy:
+            skipped = ' Пропущены занятые даты: {}.'.format(', '.join(f'{d:%d.%m.%Y}' for d in sorted(form.busy)))
+        messages.success(self.request, f'Серия создана: консультаций — {len(form.dates)}.{skipped}')
+        return redirect('consultations:consultation_series_detail', pk=created.pk)
+
+
+class ConsultationSeriesDetailView(PsychologistRequiredMixin, DetailView):
+    model = ConsultationSeries
+    template_name = 'consultations/consultation_series_detail.html'
+    context_object_name = 'series'
+
+    def get_queryset(self):
+        return ConsultationSeries.objects.select_related('psychologist', 'request__student', 'form')
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['today'] = timezone.now().date()
+        ctx['occurrences'] = self.object.consultations.order_by('date').prefetch_related('students')
+        ctx['upcoming_count'] = series.upcoming(self.object).count()
+        ctx['can_manage'] = (
+            self.request.user.role_name == 'psychologist' and self.object.psychologist_id == self.request.user.id
+        )
+        return ctx
+
+
+class _SeriesOwnerMixin:
+    'Менять и отменять серию может только её психолог.'
+
+    def dispatch(self, request, *args, **kwargs):
+        self.series = get_object_or_404(ConsultationSeries, pk=kwargs.get('pk'))
+        if request.user.role_name != 'psychologist' or self.series.psychologist_id != request.user.id:
+            messages.error(request, 'Изменять серию может только психолог, который её назначил.')
+            return redirect('consultations:consultation_series_detail', pk=self.series.pk)
+        if self.series.cancelled_at:
+            messages.info(request, 'Серия уже отменена.')
+            return redirect('consultations:consultation_series_detail', pk=self.series.pk)
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ConsultationSeriesUpdateView(PsychologistRequiredMixin, _SeriesOwnerMixin, UpdateView):
+    model = ConsultationSeries
+    form_class = ConsultationSeriesForm
+    template_name = 'consultations/consultation_series_form.html'
+    context_object_name = 'series'
+
+    def get_object(self, queryset=None):
+        return self.series
+
+    def form_valid(self, form):
+        data = form.cleaned_data
+        try:
+            kept, added, dropped = series.update_series(
+                self.series, data['students'], data['form'], data['start_time'], data['end_time'],
+                data['date_until'], skip=set(form.busy),
+            )
+        except IntegrityError as e:
+            if not schedule.is_overlap_error(e):
+                raise
+            form.add_error('start_time', schedule.OVERLAP_MESSAGE)
+            return self.form_invalid(form)
+        parts = [f'изменено консультаций — {len(kept)}']
+        if added:
+            parts.append(f'добавлено — {len(added)}')
+        if dropped:
+            parts.append(f'отменено — {len(dropped)}')
+        messages.success(self.request, 'Серия обновлена: {}.'.format(', '.join(parts)))
+        return redirect('consultations:consultation_series_detail', pk=self.series.pk)
+
+
+class ConsultationSeriesCancelView(PsychologistRequiredMixin, _SeriesOwnerMixin, View):
+    'Отмена всех предстоящих консультаций серии.'
+    def post(self, request, pk):
+        with transaction.atomic():
+            count = series.cancel_series(self.series)
+            if self.series.request_id:
+                transitions.cancel_request(self.series.request_id)
+        messages.success(request, f'Серия отменена: отменено консультаций — {count}.')
+        return redirect('consultations:consultation_series_detail', pk=pk)
+
+
+# ——— Расписание психологов ———
+
+class ScheduleFreeSlotsView(PsychologistRequiredMixin, View):
+    """
+    Ближайшие свободные окна (JSON для формы консультации).
+    GET: duration — длительность в минутах, count — сколько окон, date — искать начиная с даты,
+    psychologist — id психолога или me (по умолчанию — все активные психологи).
+    """
+
+    def get(self, request):
+        from users.models import User
+
+        try:
+            duration = int(request.GET.get('duration') or 45)
+            count = int(request.GET.get('count') or 5)
+            date_from = parse_date(request.GET.get('date') or '')
+            psychologist = (request.GET.get('psychologist') or '').strip()
+            if psychologist == 'me':
+                psychologist_ids = [request.user.id]
+            elif psychologist:
+                psychologist_ids = [int(psychologist)]
+            else:
+                psychologist_ids = None
+        except ValueError:
+            return JsonResponse({'error': 'Некорректные параметры запроса.'}, status=400)
+        duration = min(max(duration, 15), schedule.MAX_DURATION_MINUTES)
+        count = min(max(count, 1), 20)
+        slots = schedule.next_free_slots(duration, count, date_from, psychologist_ids)
+        names = dict(
+            User.objects.filter(pk__in={slot.psychologist_id for slot in slots}).values_list('pk', 'username')
+        )
+        response = JsonResponse({
+            'duration': duration,
+            'slots': [
+                {
+                    'psychologist_id': slot.psychologist_id,
+                    'psychologist': names.get(slot.psychologist_id, ''),
+                    'date': slot.date.isoformat(),
+                    'start': slot.start.strftime('%H:%M'),
+                    'end': slot.end.strftime('%H:%M'),
+                }
+                for slot in slots
+            ],
+        })
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
 class DatabaseMaintenanceView(AdminRequiredMixin, TemplateView):
-    """Резервное копирование PostgreSQL для администратора."""
+    """Резервное копирование PostgreSQL для администратора (pg_dump выполняется в фоне)."""
     template_name = 'consultations/database_maintenance.html'
 
     def dispatch(self, request, *args, **kwargs):
@@ -489,19 +767,12 @@ class DatabaseMaintenanceView(AdminRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        backup_dir = Path(settings.BACKUP_DIR)
-        backup_dir.mkdir(parents=True, exist_ok=True)
-        backups = []
-        files = list(backup_dir.glob('backup_*.sql')) + list(backup_dir.glob('backup_*.dump'))
-        for f in sorted(files, key=lambda p: p.stat().st_mtime, reverse=True):
-            stat = f.stat()
-            backups.append({
-                'name': f.name,
-                'format': f.suffix.lower().lstrip('.'),
-                'size_mb': round(stat.st_size / (1024 * 1024), 2),
-                'modified_at': timezone.datetime.fromtimestamp(stat.st_mtime, tz=timezone.get_current_timezone()),
-            })
-        ctx['backups'] = backups
+        ctx['backups'] = backups.list_backups()
+        ctx['backup_status'] = backups.read_status()
+        ctx['backup_jobs'] = getattr(settings, 'BACKUP_JOBS', 4)
+        ctx['backup_keep_last'] = getattr(settings, 'BACKUP_KEEP_LAST', 10)
+        ctx['backup_max_age_days'] = getattr(settings, 'BACKUP_MAX_AGE_DAYS', 30)
+        ctx['restore_history'] = restore.read_history()
         return ctx
 
     def post(self, request, *args, **kwargs):
@@ -511,47 +782,51 @@ class DatabaseMaintenanceView(AdminRequiredMixin, TemplateView):
             messages.error(request, 'Резервное копирование доступно только для PostgreSQL.')
             return redirect('consultations:database_maintenance')
 
-        pg_dump = _resolve_pg_dump_path()
-        if not pg_dump:
-            messages.error(
-                request,
-                'pg_dump недоступен. Укажите PG_DUMP_PATH в settings.py или добавьте PostgreSQL bin в PATH.'
-            )
-            return redirect('consultations:database_maintenance')
-
-        backup_dir = Path(settings.BACKUP_DIR)
-        backup_dir.mkdir(parents=True, exist_ok=True)
         backup_format = (request.POST.get('backup_format') or 'sql').strip().lower()
-        if backup_format not in {'sql', 'dump'}:
-            backup_format = 'sql'
-        ext = 'sql' if backup_format == 'sql' else 'dump'
-        filename = f"backup_{timezone.now().strftime('%Y-%m-%d_%H-%M-%S')}.{ext}"
-        backup_path = backup_dir / filename
-
-        cmd = [
-            pg_dump,
-            '-h', str(db.get('HOST') or '127.0.0.1'),
-            '-p', str(db.get('PORT') or '5432'),
-            '-U', str(db.get('USER') or ''),
-            '-d', str(db.get('NAME') or ''),
-            '-F', 'p' if backup_format == 'sql' else 'c',
-            '--encoding=UTF8',
-            '--clean',
-            '--if-exists',
-            '--no-owner',
-            '--no-privileges',
-            '-f', str(backup_path),
-        ]
-        env = os.environ.copy()
-        env['PGPASSWORD'] = str(db.get('PASSWORD') or '')
-        proc = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', env=env)
+        try:
+            filename = backups.start_backup(request.user.pk, backup_format)
+        except RuntimeError as e:
+            messages.error(request, str(e))
+            return redirect('consultations:database_maintenance')
 
-        if proc.returncode != 0:
-            messages.error(request, f'Не удалось создать бэкап: {(proc.stderr or "").strip()[:300]}')
+        if not filename:
+            messages.warning(request, 'Резервное копирование уже выполняется. Дождитесь его завершения.')
             return redirect('consultations:database_maintenance')
+        messages.info(request, f'Создание бэкапа запущено: {filename}. Статус обновится автоматически.')
+        return redirect('consultations:database_maintenance')
+
+
+class DatabaseBackupStatusView(AdminRequiredMixin, View):
+    """Статус текущего/последнего резервного копирования (JSON для опроса со страницы)."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.role_name != 'admin':
+            raise PermissionDenied('Доступ разрешён только администратору.')
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request):
+        response = JsonResponse(backups.read_status())
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
+class DatabaseBackupVerifyView(AdminRequiredMixin, View):
+    """Проверка копии: восстановление во временную БД и сверка таблиц (в фоне)."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.role_name != 'admin':
+            raise PermissionDenied('Доступ разрешён только администратору.')
+        return super().dispatch(request, *args, **kwargs)
 
-        Log.objects.create(user_id=request.user.pk, action='Backup created')
-        messages.success(request, f'Бэкап успешно создан: {filename}')
+    def post(self, request, filename):
+        try:
+            started = restore.start_verification(request.user.pk, filename)
+        except FileNotFoundError:
+            raise Http404('Файл не найден.')
+        if not started:
+            messages.warning(request, 'Сейчас выполняется другая операция с резервными копиями. Повторите позже.')
+        else:
+            messages.info(request, f'Проверка восстановления запущена: {filename}.')
         return redirect('consultations:database_maintenance')
 
 
@@ -564,13 +839,9 @@ class DatabaseBackupDownloadView(AdminRequiredMixin, View):
         return super().dispatch(request, *args, **kwargs)
 
     def get(self, request, filename):
-        if not re.fullmatch(r'backup_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\.(sql|dump)', filename):
-            raise Http404('Файл не найден.')
-        backup_dir = Path(settings.BACKUP_DIR).resolve()
-        file_path = (backup_dir / filename).resolve()
-        if backup_dir not in file_path.parents and file_path != backup_dir:
-            raise Http404('Файл не найден.')
-        if not file_path.exists() or not file_path.is_file():
+        file_path = backups.resolve_backup_path(filename)
+        # Копии в формате каталога (.dir) скачиваются только с сервера.
+        if not file_path or not file_path.exists() or not file_path.is_file():
             raise Http404('Файл не найден.')
         response = FileResponse(
             open(file_path, 'rb'),
@@ -591,33 +862,189 @@ class DatabaseBackupDeleteView(AdminRequiredMixin, View):
         return super().dispatch(request, *args, **kwargs)
 
     def post(self, request, filename):
-        if not re.fullmatch(r'backup_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\.(sql|dump)', filename):
+        file_path = backups.resolve_backup_path(filename)
+        if not file_path:
             raise Http404('Файл не найден.')
-        backup_dir = Path(settings.BACKUP_DIR).resolve()
-        file_path = (backup_dir / filename).resolve()
-        if backup_dir not in file_path.parents and file_path != backup_dir:
-            raise Http404('Файл не найден.')
-        if not file_path.exists() or not file_path.is_file():
+        if not file_path.exists():
             messages.error(request, 'Файл бэкапа не найден.')
             return redirect('consultations:database_maintenance')
         try:
-            file_path.unlink()
+            backups.delete_backup(file_path)
         except OSError:
             messages.error(request, 'Не удалось удалить файл бэкапа.')
             return redirect('consultations:database_maintenance')
-        Log.objects.create(user_id=request.user.pk, action='Backup deleted')
+        audit.record('Backup deleted', request=request, filename=filename)
         messages.success(request, f'Бэкап удалён: {filename}')
         return redirect('consultations:database_maintenance')
 
 
-def _safe_attachment_filename(name):
-    'Оставляет только безопасные символы в имени файла.'
-    import re
-    import uuid
-    base, *rest = name.rsplit('.', 1)
-    ext = ('.' + rest[0]) if rest else ''
-    safe_base = re.sub(r'[^\w\-]', '_', base)[:80] or uuid.uuid4().hex[:8]
-    return f'{safe_base}_{uuid.uuid4().hex[:8]}{ext}'
+class RequestProfileView(AdminRequiredMixin, TemplateView):
+    """Профили запросов по имени URL за последние дни (данные config.instrumentation)."""
+    template_name = 'consultations/request_profiles.html'
+    PERIODS = (1, 7, 30)
+    SORTS = {
+        'total': '-total_ms',
+        'avg': '-avg_ms',
+        'db': '-db_ms',
+        'queries': '-avg_queries',
+        'requests': '-requests',
+        'n_plus_one': '-n_plus_one',
+    }
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.role_name != 'admin':
+            raise PermissionDenied('Доступ разрешён только администратору.')
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        # Накопленное этим процессом попадает в таблицу сразу, остальные процессы — по таймеру
+        profile_buffer.flush()
+        try:
+            days = int(self.request.GET.get('days') or 7)
+        except ValueError:
+            days = 7
+        days = days if days in self.PERIODS else 7
+        sort = self.request.GET.get('sort') or 'total'
+        sort = sort if sort in self.SORTS else 'total'
+        since = timezone.now().date() - timedelta(days=days - 1)
+        rows = (
+            RequestProfile.objects.filter(day__gte=since)
+            .values('url_name')
+            .annotate(
+                requests=Sum('requests'),
+                total_ms=Sum('total_ms'),
+                max_ms=Max('max_ms'),
+                db_ms=Sum('db_ms'),
+                queries=Sum('queries'),
+                max_queries=Max('max_queries'),
+                template_ms=Sum('template_ms'),
+                over_budget=Sum('over_budget'),
+                n_plus_one=Sum('n_plus_one'),
+            )
+            .annotate(
+                avg_ms=ExpressionWrapper(F('total_ms') / F('requests'), output_field=FloatField()),
+                avg_queries=ExpressionWrapper(F('queries') * 1.0 / F('requests'), output_field=FloatField()),
+            )
+            .filter(requests__gt=0)
+            .order_by(self.SORTS[sort], 'url_name')
+        )
+        rows = list(rows[:200])
+        # Самый медленный SQL и самый частый повторяющийся запрос — из строки с максимальным значением
+        details = {}
+        for profile in RequestProfile.objects.filter(day__gte=since).only(
+            'url_name', 'slowest_sql', 'slowest_sql_ms', 'top_fingerprint', 'top_fingerprint_count',
+        ):
+            item = details.setdefault(profile.url_name, {
+                'slowest_sql': None, 'slowest_sql_ms': 0, 'top_fingerprint': None, 'top_fingerprint_count': 0,
+            })
+            if profile.slowest_sql and profile.slowest_sql_ms > item['slowest_sql_ms']:
+                item['slowest_sql'], item['slowest_sql_ms'] = profile.slowest_sql, profile.slowest_sql_ms
+            if profile.top_fingerprint and profile.top_fingerprint_count > item['top_fingerprint_count']:
+                item['top_fingerprint'] = profile.top_fingerprint
+                item['top_fingerprint_count'] = profile.top_fingerprint_count
+        for row in rows:
+            row.update(details.get(row['url_name'], {}))
+        ctx.update({
+            'profiles': rows,
+            'days': days,
+            'periods': self.PERIODS,
+            'sort': sort,
+            'instrumentation_enabled': getattr(settings, 'INSTRUMENTATION_ENABLED', True),
+            'query_budget': getattr(settings, 'INSTRUMENTATION_QUERY_BUDGET', 50),
+            'db_time_budget_ms': getattr(settings, 'INSTRUMENTATION_DB_TIME_BUDGET_MS', 300),
+            'time_budget_ms': getattr(settings, 'INSTRUMENTATION_TIME_BUDGET_MS', 1000),
+            'repeat_threshold': getattr(settings, 'INSTRUMENTATION_REPEAT_THRESHOLD', 10),
+        })
+        return ctx
+
+
+class AuditLogView(AdminRequiredMixin, TemplateView):
+    """
+    Журнал аудита с фильтрами и keyset-пагинацией по (action_date, id): страница не требует
+    COUNT и OFFSET, а условие по дате позволяет PostgreSQL читать только нужные секции logs.
+    """
+    template_name = 'consultations/audit_log.html'
+    PAGE_SIZE = 50
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.role_name != 'admin':
+            raise PermissionDenied('Доступ разрешён только администратору.')
+        return super().dispatch(request, *args, **kwargs)
+
+    @staticmethod
+    def _parse_cursor(value):
+        """Курсор вида «2026-10-01T12:00:00.123456_42» → (datetime, id) или None."""
+        stamp, _, pk = (value or '').rpartition('_')
+        moment = parse_datetime(stamp) if stamp else None
+        if moment is None or not pk.isdigit():
+            return None
+        return moment, int(pk)
+
+    @staticmethod
+    def _cursor(log):
+        return f'{log.action_date.isoformat()}_{log.pk}'
+
+    def get_filters(self):
+        get = self.request.GET
+        return {
+            'user': get.get('user', '').strip(),
+            'action': get.get('action', '').strip(),
+            'object_id': get.get('object_id', '').strip(),
+            'date_from': get.get('date_from', '').strip(),
+            'date_to': get.get('date_to', '').strip(),
+        }
+
+    def get_queryset(self, filters):
+        qs = Log.objects.select_related('user')
+        if filters['user']:
+            qs = qs.filter(user__username__istartswith=filters['user'])
+        if filters['action']:
+            qs = qs.filter(action__startswith=filters['action'])
+        if filters['object_id'].isdigit():
+            qs = qs.filter(object_id=int(filters['object_id']))
+        # Границы по самой колонке action_date (а не по её дате) — иначе секции не отсекаются
+        date_from = parse_date(filters['date_from']) if filters['date_from'] else None
+        date_to = parse_date(filters['date_to']) if filters['date_to'] else None
+        if date_from:
+            qs = qs.filter(action_date__gte=date_from)
+        if date_to:
+            qs = qs.filter(action_date__lt=date_to + timedelta(days=1))
+        return qs
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        filters = self.get_filters()
+        qs = self.get_queryset(filters)
+        before = self._parse_cursor(self.request.GET.get('before'))
+        after = self._parse_cursor(self.request.GET.get('after'))
+        if after:
+            moment, pk = after
+            page = list(
+                qs.filter(Q(action_date__gt=moment) | Q(action_date=moment, id__gt=pk))
+                .order_by('action_date', 'id')[:self.PAGE_SIZE + 1]
+            )
+            has_newer = len(page) > self.PAGE_SIZE
+            logs = list(reversed(page[:self.PAGE_SIZE]))
+            has_older = True
+        else:
+            if before:
+                moment, pk = before
+                qs = qs.filter(Q(action_date__lt=moment) | Q(action_date=moment, id__lt=pk))
+            page = list(qs.order_by('-action_date', '-id')[:self.PAGE_SIZE + 1])
+            has_older = len(page) > self.PAGE_SIZE
+            logs = page[:self.PAGE_SIZE]
+            has_newer = before is not None
+        query = {k: v for k, v in filters.items() if v}
+        ctx.update({
+            'logs': logs,
+            'filters': filters,
+            'filter_query': '&'.join(f'{k}={quote(v)}' for k, v in query.items()),
+            'older_cursor': self._cursor(logs[-1]) if logs and has_older else None,
+            'newer_cursor': self._cursor(logs[0]) if logs and has_newer else None,
+            'retention_months': getattr(settings, 'AUDIT_RETENTION_MONTHS', 24),
+        })
+        return ctx
 
 
 class ConsultationAttachmentUploadView(PsychologistRequiredMixin, View):
@@ -626,66 +1053,66 @@ class ConsultationAttachmentUploadView(PsychologistRequiredMixin, View):
         if request.user.role_name != 'psychologist':
             messages.error(request, 'Администратор не может прикреплять документы.')
             return redirect('consultations:consultation_detail', pk=pk)
-        from django.conf import settings
-        import os
         consultation = get_object_or_404(Consultation, pk=pk)
         f = request.FILES.get('file')
         if not f:
             messages.error(request, 'Выберите файл для загрузки.')
             return redirect('consultations:consultation_detail', pk=pk)
-        rel_dir = os.path.join('consultations', str(consultation.pk))
-        dest_dir = os.path.join(settings.MEDIA_ROOT, rel_dir)
-        os.makedirs(dest_dir, exist_ok=True)
-        filename = _safe_attachment_filename(f.name)
-        rel_path = os.path.join(rel_dir, filename)
-        full_path = os.path.join(settings.MEDIA_ROOT, rel_path)
+        description = (request.POST.get('description') or '').strip() or None
         try:
-            with open(full_path, 'wb') as out:
-                for chunk in f.chunks():
-                    out.write(chunk)
-        except Exception as e:
+            attachments.save_attachment(consultation.pk, f, description=description)
+        except attachments.QuotaExceeded as e:
+            messages.error(request, str(e))
+            return redirect('consultations:consultation_detail', pk=pk)
+        except OSError as e:
             messages.error(request, f'Ошибка сохранения файла: {e}')
             return redirect('consultations:consultation_detail', pk=pk)
-        description = (request.POST.get('description') or '').strip() or None
-        Attachment.objects.create(
-            consultation_id=consultation.pk,
-            file_path=rel_path.replace('\\', '/'),
-            description=description,
-        )
         messages.success(request, 'Документ прикреплён.')
         return redirect('consultations:consultation_detail', pk=pk)
 
 
+class ConsultationAttachmentDownloadView(PsychologistRequiredMixin, View):
+    'Скачивание вложения: доступ проверяет Django, файл отдаёт веб-сервер.'
+    def get(self, request, pk, attachment_id):
+        att = get_object_or_404(Attachment, pk=attachment_id, consultation_id=pk)
+        if not att.sha256 and not attachments.adopt_legacy_file(att):
+            raise Http404('Файл вложения не найден.')
+        if not attachments.blob_path(att.sha256).is_file():
+            raise Http404('Файл вложения не найден.')
+        return attachments.attachment_response(request, att)
+
+
 class ConsultationAttachmentDeleteView(PsychologistRequiredMixin, View):
     'Удаление вложения консультации.'
     def post(self, request, pk, attachment_id):
         if request.user.role_name != 'psychologist':
             messages.error(request, 'Администратор не может удалять документы.')
             return redirect('consultations:consultation_detail', pk=pk)
-        from django.conf import settings
-        import os
         consultation = get_object_or_404(Consultation, pk=pk)
         att = get_object_or_404(Attachment, pk=attachment_id, consultation_id=consultation.pk)
-        if att.file_path:
-            full_path = os.path.join(settings.MEDIA_ROOT, att.file_path.replace('/', os.sep))
-            if os.path.isfile(full_path):
-                try:
-                    os.remove(full_path)
-                except OSError:
-                    pass
-        att.delete()
+        attachments.delete_attachment(att)
         messages.success(request, 'Вложение удалено.')
         return redirect('consultations:consultation_detail', pk=pk)
 
 
 class ConsultationCompleteView(PsychologistRequiredMixin, View):
-    'Завершение консультации: помечаем как пройденную, результаты попадают в отчётность.'
+    """
+    Завершение консультации: помечаем как пройденную, результаты попадают в отчётность.
+    Условия проверяет сам переход (transitions.complete_consultation); объект читается,
+    только если завершить не удалось, — чтобы объяснить почему.
+    """
     def post(self, request, pk):
         if request.user.role_name != 'psychologist':
             messages.error(request, 'Только психолог может завершать консультации.')
             return redirect('consultations:consultation_detail', pk=pk)
+        if transitions.complete_consultation(pk, request.user.id).applied:
+            messages.success(request, 'Консультация завершена. Результаты учтены в отчётности.')
+            return redirect('consultations:consultation_detail', pk=pk)
+        return self.refuse(request, pk)
+
+    def refuse(self, request, pk):
         consultation = get_object_or_404(
-            Consultation.objects.select_related('request').prefetch_related('consultation_students'),
+            Consultation.objects.select_related('request').prefetch_related('consultation_students__student'),
             pk=pk
         )
         if not consultation.request_id or not consultation.request.psychologist_id:
@@ -707,28 +1134,19 @@ class ConsultationCompleteView(PsychologistRequiredMixin, View):
             )
             return redirect('consultations:consultation_edit', pk=pk)
         # Требуем подтверждение участия всеми учащимися (кто не отменил участие окончательно)
-        links = list(consultation.consultation_students.all())
-        if links:
-            active = [link for link in links if not link.participation_cancelled_at]
-            unconfirmed = [link for link in active if not link.participation_confirmed_at]
-            if unconfirmed:
-                names = ', '.join(link.student.full_name for link in unconfirmed)
-                messages.warning(
-                    request,
-                    f'Завершение невозможно: участие не подтверждено учащимися: {names}. '
-                    'Учащийся должен подтвердить участие в разделе «Мои консультации».'
-                )
-                return redirect('consultations:consultation_detail', pk=pk)
-        consultation.completed_at = timezone.now()
-        consultation.save(update_fields=['completed_at'])
-        # Обращение считаем завершённым после завершения консультации по нему
-        if consultation.request_id:
-            completed_status = RequestStatus.objects.filter(name='completed').first()
-            if completed_status:
-                consultation.request.status = completed_status
-                consultation.request.save(update_fields=['status_id'])
-                notify_request_status_changed(consultation.request)
-        messages.success(request, 'Консультация завершена. Результаты учтены в отчётности.')
+        unconfirmed = [
+            link for link in consultation.consultation_students.all()
+            if not link.participation_cancelled_at and not link.participation_confirmed_at
+        ]
+        if unconfirmed:
+            names = ', '.join(link.student.full_name for link in unconfirmed)
+            messages.warning(
+                request,
+                f'Завершение невозможно: участие не подтверждено учащимися: {names}. '
+                'Учащийся должен подтвердить участие в разделе «Мои консультации».'
+            )
+            return redirect('consultations:consultation_detail', pk=pk)
+        messages.warning(request, 'Консультацию только что изменили. Проверьте данные и повторите.')
         return redirect('consultations:consultation_detail', pk=pk)
 
 
@@ -738,23 +1156,17 @@ class ConsultationCancelView(PsychologistRequiredMixin, View):
         if request.user.role_name != 'psychologist':
             messages.error(request, 'Только психолог может отменять консультации.')
             return redirect('consultations:consultation_detail', pk=pk)
-        consultation = get_object_or_404(Consultation.objects.select_related('request'), pk=pk)
-        if consultation.completed_at:
+        result = transitions.cancel_consultation(pk)
+        if result.applied and result.request_cancelled:
+            messages.success(request, 'Консультация отменена. Связанное обращение переведено в статус «Отменено».')
+        elif result.applied:
+            messages.success(request, 'Консультация отменена.')
+        elif result.state is None:
+            raise Http404
+        elif result.state == 'completed':
             messages.warning(request, 'Завершённую консультацию отменить нельзя.')
-            return redirect('consultations:consultation_detail', pk=pk)
-        if consultation.cancelled_at:
+        else:
             messages.info(request, 'Консультация уже отменена.')
-            return redirect('consultations:consultation_detail', pk=pk)
-        consultation.cancelled_at = timezone.now()
-        consultation.save(update_fields=['cancelled_at'])
-        # Обращение по этой консультации тоже переводим в «Отменённые»
-        if consultation.request_id:
-            cancelled_status = RequestStatus.objects.filter(name='cancelled').first()
-            if cancelled_status:
-                consultation.request.status = cancelled_status
-                consultation.request.save(update_fields=['status_id'])
-                notify_request_status_changed(consultation.request)
-        messages.success(request, 'Консультация отменена. Связанное обращение переведено в статус «Отменено».')
         return redirect('consultations:consultation_detail', pk=pk)
 
 
@@ -773,11 +1185,11 @@ def _apply_report_filters(qs_req, qs_cons, date_from, date_to, status, student_i
     'Применяет фильтры к QuerySet обращений и консультаций.'
     if date_from:
         qs_req = qs_req.filter(created_at__date__gte=date_from)
-        # РљРѕРЅСЃСѓР»СЊС‚Р°С†РёСЏ РІ РїРµСЂРёРѕРґРµ: РїРѕ РґР°С‚Рµ РїСЂРѕРІРµРґРµРЅРёСЏ РР›Р РїРѕ РґР°С‚Рµ Р·Р°РІРµСЂС€РµРЅРёСЏ
-        qs_cons = qs_cons.filter(Q(date__gte=date_from) | Q(completed_at__date__gte=date_from))
+        # Консультация относится к периоду по дате проведения — как в снимках отчётов, динамике и журнале
+        qs_cons = qs_cons.filter(date__gte=date_from)
     if date_to:
         qs_req = qs_req.filter(created_at__date__lte=date_to)
-        qs_cons = qs_cons.filter(Q(date__lte=date_to) | Q(completed_at__date__lte=date_to))
+        qs_cons = qs_cons.filter(date__lte=date_to)
     if status:
         qs_req = qs_req.filter(status__name=status)
     if student_id:
@@ -786,7 +1198,115 @@ def _apply_report_filters(qs_req, qs_cons, date_from, date_to, status, student_i
     return qs_req, qs_cons
 
 
-class ReportView(PsychologistRequiredMixin, TemplateView):
+REPORT_STATUS_LABELS = {'new': 'Новое', 'in_progress': 'В работе', 'completed': 'Завершено', 'cancelled': 'Отменено'}
+REPORT_CONSULTATIONS_PAGE = 50
+
+
+def _admin_request_stats(qs_req):
+    """
+    Статистика обращений для админа одним запросом: всего, по статусам, по психологам и психолог × статус.
+    В PostgreSQL — GROUPING SETS (уровень группировки даёт GROUPING()), в других СУБД — UNION ALL тех же
+    группировок по общему CTE. Уровни: 3 — всего, 2 — статус, 1 — психолог, 0 — психолог × статус.
+    """
+    inner = qs_req.order_by().values(pid=F('psychologist_id'), pname=F('psychologist__username'), sname=F('status__name'))
+    inner_sql, params = inner.query.get_compiler(using=inner.db).as_sql()
+    connection = connections[inner.db]
+    if connection.vendor == 'postgresql':
+        sql = (
+            f'SELECT GROUPING(pid, sname), pid, MAX(pname), sname, COUNT(*) FROM ({inner_sql}) t '
+            'GROUP BY GROUPING SETS ((), (sname), (pid), (pid, sname))'
+        )
+    else:
+        sql = (
+            f'WITH t AS ({inner_sql}) '
+            'SELECT 3, NULL, NULL, NULL, COUNT(*) FROM t '
+            'UNION ALL SELECT 2, NULL, NULL, sname, COUNT(*) FROM t GROUP BY sname '
+            'UNION ALL SELECT 1, pid, MAX(pname), NULL, COUNT(*) FROM t GROUP BY pid '
+            'UNION ALL SELECT 0, pid, MAX(pname), sname, COUNT(*) FROM t GROUP BY pid, sname'
+        )
+    with connection.cursor() as c:
+        c.execute(sql, params)
+        rows = c.fetchall()
+    total, by_status, by_psychologist, cells = 0, {}, {}, {}
+    for level, pid, name, status_name, cnt in rows:
+        if level == 3:
+            total = cnt
+        elif level == 2:
+            by_status[status_name] = cnt
+        elif pid is None:
+            continue  # обращения без психолога в разбивке по психологам не показываются
+        elif level == 1:
+            by_psychologist[pid] = {'psychologist_id': pid, 'name': name or '—', 'cnt': cnt}
+        else:
+            cells[pid, status_name] = cnt
+    return _admin_stats_context(total, by_status, by_psychologist, cells)
+
+
+def _admin_snapshot_stats(data):
+    'Статистика обращений для админа из данных snapshots.report (те же поля, что у _admin_request_stats).'
+    by_status, by_psychologist, cells = {}, {}, {}
+    for month in data['months'].values():
+        for status_name, cnt in month['requests'].items():
+            by_status[status_name] = by_status.get(status_name, 0) + cnt
+    for pid, row in data['psychologists'].items():
+        by_psychologist[pid] = {'psychologist_id': pid, 'name': row['name'] or '—', 'cnt': sum(row['statuses'].values())}
+        for status_name, cnt in row['statuses'].items():
+            cells[pid, status_name] = cnt
+    by_status = {name: cnt for name, cnt in by_status.items() if cnt}
+    return _admin_stats_context(sum(by_status.values()), by_status, by_psychologist, cells)
+
+
+def _admin_stats_context(total, by_status, by_psychologist, cells):
+    for row in by_psychologist.values():
+        row['by_status'] = [cells.get((row['psychologist_id'], name), 0) for name in REPORT_STATUS_LABELS]
+    by_status = [
+        {'status__name': name, 'cnt': cnt, 'status_display': REPORT_STATUS_LABELS.get(name, name or '—')}
+        for name, cnt in by_status.items()
+    ]
+    return {
+        'request_total': total,
+        'request_by_status': sorted(by_status, key=lambda r: -r['cnt']),
+        'request_by_psychologist': sorted(by_psychologist.values(), key=lambda r: (-r['cnt'], r['name'])),
+        'request_status_labels': list(REPORT_STATUS_LABELS.values()),
+    }
+
+
+def _parse_report_cursor(value):
+    """Курсор списка консультаций отчёта «2026-10-01_42» → (дата, id) или None."""
+    day, _, pk = (value or '').partition('_')
+    day = parse_date(day) if day else None
+    if day is None or not pk.isdigit():
+        return None
+    return day, int(pk)
+
+
+def _report_consultations_page(request, qs_cons):
+    """
+    Страница консультаций отчёта по (date, id) в обратном порядке (keyset, без OFFSET и COUNT)
+    и контекст фрагмента report_consultations.html со ссылкой на следующую страницу.
+    """
+    qs = qs_cons.select_related('form', 'request__student', 'request__psychologist').prefetch_related('students')
+    after = _parse_report_cursor(request.GET.get('after'))
+    if after:
+        day, pk = after
+        qs = qs.filter(Q(date__lt=day) | Q(date=day, id__lt=pk))
+    page = list(qs.order_by('-date', '-id')[:REPORT_CONSULTATIONS_PAGE + 1])
+    rows = page[:REPORT_CONSULTATIONS_PAGE]
+    next_cursor = f'{rows[-1].date.isoformat()}_{rows[-1].pk}' if len(page) > REPORT_CONSULTATIONS_PAGE else None
+    query = request.GET.copy()
+    query.pop('after', None)
+    return {
+        'consultations_in_report': rows,
+        'consultations_next_url': (
+            reverse('consultations:report_consultations') + '?' + '&'.join(
+                part for part in (query.urlencode(), f'after={quote(next_cursor)}') if part
+            )
+            if next_cursor else None
+        ),
+    }
+
+
+class ReportView(PsychologistRequiredMixin, ReplicaReadMixin, TemplateView):
     template_name = 'consultations/report.html'
 
     def get_context_data(self, **kwargs):
@@ -797,21 +1317,6 @@ class ReportView(PsychologistRequiredMixin, TemplateView):
 
         date_from, date_to, status, student_id = _report_filters(self.request)
 
-        # Базовые queryset: у психолога — свои обращения и консультации (в т.ч. без обращения)
-        qs_req = Request.objects.all()
-        qs_cons = Consultation.objects.select_related('request')
-        if is_psychologist:
-            # Обращения: созданные учащимися (без психолога) + назначенные этому психологу
-            qs_req = qs_req.filter(Q(psychologist_id=user.id) | Q(psychologist_id__isnull=True))
-            # Свои консультации: по своим обращениям, без обращения или по обращениям без привязки психолога
-            qs_cons = qs_cons.filter(
-                Q(request__psychologist_id=user.id)
-                | Q(request_id__isnull=True)
-                | Q(request__psychologist_id__isnull=True)
-            )
-
-        qs_req, qs_cons = _apply_report_filters(qs_req, qs_cons, date_from, date_to, status, student_id)
-
         ctx['is_admin'] = is_admin
         ctx['is_psychologist'] = is_psychologist
         ctx['date_from'] = date_from
@@ -826,29 +1331,13 @@ class ReportView(PsychologistRequiredMixin, TemplateView):
 
         # ——— Для психолога: три отчёта ———
         if is_psychologist:
-            student_ids = set(qs_req.values_list('student_id', flat=True))
-            student_ids |= set(qs_cons.values_list('request__student_id', flat=True))
-            student_ids |= set(qs_cons.values_list('students__id', flat=True))
-            student_ids.discard(None)
-            students_list = list(Student.objects.filter(pk__in=student_ids).order_by('last_name', 'first_name')) if student_ids else []
-
+            report = _psychologist_report(user, date_from, date_to, status, student_id)
+            ctx['report_snapshot'] = report['snapshot']
             # 1) Обращения и консультации по учащимся
-            students_report_data = []
-            for s in students_list:
-                req_cnt = qs_req.filter(student_id=s.id).count()
-                cons_qs = qs_cons.filter(Q(request__student_id=s.id) | Q(students__id=s.id)).distinct()
-                cons_cnt = cons_qs.count()
-                last_cons = cons_qs.aggregate(m=Max('date'))['m']
-                students_report_data.append({
-                    'student': s,
-                    'request_count': req_cnt,
-                    'consultation_count': cons_cnt,
-                    'last_consultation_date': last_cons,
-                })
-            ctx['students_report_data'] = students_report_data
+            ctx['students_report_data'] = report['students']
 
             # 2) Динамика обращений по месяцам (новые, в работе, завершённые, отменённые)
-            request_dynamics_list = _get_request_dynamics_data(qs_req)
+            request_dynamics_list = report['request_dynamics']
             ctx['request_dynamics'] = request_dynamics_list
             ctx['request_dynamics_chart_json'] = json.dumps([{
                 'label': d['label'],
@@ -859,7 +1348,7 @@ class ReportView(PsychologistRequiredMixin, TemplateView):
                 'cnt': d['cnt']
             } for d in request_dynamics_list]) if request_dynamics_list else '[]'
             # 3) Динамика консультаций по месяцам (завершённые, отменённые)
-            consultation_dynamics_list = _get_consultation_dynamics_data(qs_cons)
+            consultation_dynamics_list = report['consultation_dynamics']
             ctx['consultation_dynamics'] = consultation_dynamics_list
             ctx['consultation_dynamics_chart_json'] = json.dumps([{
                 'label': d['label'],
@@ -869,56 +1358,37 @@ class ReportView(PsychologistRequiredMixin, TemplateView):
             } for d in consultation_dynamics_list]) if consultation_dynamics_list else '[]'
 
             # 4) Нагрузка школьного психолога
-            ctx['workload_requests'] = qs_req.count()
-            ctx['workload_consultations'] = qs_cons.count()
-            completed_cons = qs_cons.filter(completed_at__isnull=False)
-            dur_agg = completed_cons.aggregate(total=Sum('duration'), avg=Avg('duration'))
-            ctx['workload_duration_total'] = dur_agg['total'] or 0
-            ctx['workload_duration_avg'] = round(dur_agg['avg'], 1) if dur_agg['avg'] is not None else 0
-
-        # ——— Для админа: статистика по психологам и общая, отчёт по консультациям ———
+            workload = report['workload']
+            ctx['workload_requests'] = workload['requests']
+            ctx['workload_consultations'] = workload['consultations']
+            ctx['workload_duration_total'] = workload['duration_total']
+            ctx['workload_duration_avg'] = workload['duration_avg']
+
+        # ——— Для админа: статистика по психологам и общая, первая страница консультаций ———
         if is_admin:
-            ctx['consultation_count'] = qs_cons.count()
-            # По психологам: количество обращений (те же фильтры: даты, статус, учащийся)
-            by_psychologist = Request.objects.filter(psychologist_id__isnull=False)
-            if date_from:
-                by_psychologist = by_psychologist.filter(created_at__date__gte=date_from)
-            if date_to:
-                by_psychologist = by_psychologist.filter(created_at__date__lte=date_to)
-            if status:
-                by_psychologist = by_psychologist.filter(status__name=status)
-            if student_id:
-                by_psychologist = by_psychologist.filter(student_id=student_id)
-            by_psychologist = list(
-                by_psychologist.values('psychologist_id', 'psychologist__username')
-                .annotate(cnt=Count('id')).order_by('-cnt')
+            qs_req, qs_cons = _apply_report_filters(
+                Request.objects.all(), Consultation.objects.select_related('request'),
+                date_from, date_to, status, student_id,
             )
-            for r in by_psychologist:
-                r['name'] = r.get('psychologist__username', '—')
-            ctx['request_by_psychologist'] = by_psychologist
-            # Общая статистика обращений (те же фильтры)
-            req_all = Request.objects.all()
-            if date_from:
-                req_all = req_all.filter(created_at__date__gte=date_from)
-            if date_to:
-                req_all = req_all.filter(created_at__date__lte=date_to)
-            if status:
-                req_all = req_all.filter(status__name=status)
-            if student_id:
-                req_all = req_all.filter(student_id=student_id)
-            ctx['request_total'] = req_all.count()
-            _status_labels = {'new': 'Новое', 'in_progress': 'В работе', 'completed': 'Завершено', 'cancelled': 'Отменено'}
-            req_by_status = list(req_all.values('status__name').annotate(cnt=Count('id')).order_by('-cnt'))
-            for r in req_by_status:
-                r['status_display'] = _status_labels.get(r.get('status__name'), r.get('status__name') or '—')
-            ctx['request_by_status'] = req_by_status
-            # Список консультаций для отчёта (с фильтрами)
-            ctx['consultations_in_report'] = qs_cons.select_related('request__student', 'request__psychologist').prefetch_related('students').order_by('-date')[:500]
+            ctx.update(_admin_report(user, qs_req, date_from, date_to, status, student_id))
+            ctx.update(_report_consultations_page(self.request, qs_cons))
 
         return ctx
 
 
-class StudentDynamicsView(PsychologistRequiredMixin, TemplateView):
+class ReportConsultationsView(PsychologistRequiredMixin, ReplicaReadMixin, View):
+    'Следующая страница консультаций отчёта администратора: строки таблицы для кнопки «Показать ещё».'
+    def get(self, request):
+        if request.user.role_name != 'admin':
+            raise PermissionDenied('Доступ разрешён только администратору.')
+        date_from, date_to, status, student_id = _report_filters(request)
+        _, qs_cons = _apply_report_filters(
+            Request.objects.none(), Consultation.objects.all(), date_from, date_to, status, student_id,
+        )
+        return render(request, 'consultations/report_consultations.html', _report_consultations_page(request, qs_cons))
+
+
+class StudentDynamicsView(PsychologistRequiredMixin, ReplicaReadMixin, TemplateView):
     template_name = 'consultations/student_dynamics.html'
 
     def get_context_data(self, **kwargs):
@@ -931,118 +1401,41 @@ class StudentDynamicsView(PsychologistRequiredMixin, TemplateView):
 
         date_from, date_to, _, _ = _report_filters(self.request)
 
-        req_qs = Request.objects.filter(student_id=student.id).select_related('status', 'psychologist')
-        cons_qs = Consultation.objects.filter(
+        # Обращения, консультации и заметки учащегося, которые видит пользователь, за период
+        req_qs, cons_qs, req_notes_qs = dynamics.scope_querysets(user, date_from, date_to)
+        req_qs = req_qs.filter(student_id=student.id)
+        cons_qs = cons_qs.filter(
             Q(request__student_id=student.id) | Q(students__id=student.id)
         ).select_related('request', 'request__status', 'form').prefetch_related('students').distinct()
+        req_notes_qs = req_notes_qs.filter(request__student_id=student.id)
 
-        if user.role_name == 'psychologist':
-            req_qs = req_qs.filter(Q(psychologist_id=user.id) | Q(psychologist_id__isnull=True))
-            cons_qs = cons_qs.filter(
-                Q(request__psychologist_id=user.id)
-                | Q(request_id__isnull=True)
-                | Q(request__psychologist_id__isnull=True)
-            )
-
-        if date_from:
-            req_qs = req_qs.filter(created_at__date__gte=date_from)
-            cons_qs = cons_qs.filter(date__gte=date_from)
-        if date_to:
-            req_qs = req_qs.filter(created_at__date__lte=date_to)
-            cons_qs = cons_qs.filter(date__lte=date_to)
+        # Показатели и оценка — те же, что в списке риска (consultations/dynamics.py)
+        _, metrics = dynamics.collect(user, date_from, date_to, student_ids=[student.id])
+        row = {name: int(values[0]) for name, values in metrics.items()}
+        assessment = {name: int(values[0]) for name, values in dynamics.assess(metrics).items()}
 
-        if user.role_name == 'psychologist' and not req_qs.exists() and not cons_qs.exists():
+        if user.role_name == 'psychologist' and not row['req_total'] and not row['cons_total']:
             raise PermissionDenied('Нет доступа к аналитике этого учащегося.')
 
-        req_total = req_qs.count()
-        req_status_map = {'new': 0, 'in_progress': 0, 'completed': 0, 'cancelled': 0}
-        for row in req_qs.values('status__name').annotate(cnt=Count('id')):
-            name = row.get('status__name')
-            if name in req_status_map:
-                req_status_map[name] = row.get('cnt', 0) or 0
-
-        cons_total = cons_qs.count()
-        cons_completed = cons_qs.filter(completed_at__isnull=False).count()
-        cons_cancelled = cons_qs.filter(cancelled_at__isnull=False).count()
+        req_total = row['req_total']
+        req_status_map = {
+            'new': row['req_new'], 'in_progress': row['req_in_progress'],
+            'completed': row['req_completed'], 'cancelled': row['req_cancelled'],
+        }
+        cons_total = row['cons_total']
+        cons_completed = row['cons_completed']
+        cons_cancelled = row['cons_cancelled']
         cons_planned = cons_total - cons_completed - cons_cancelled
-        completion_rate = round((cons_completed / cons_total) * 100) if cons_total else 0
-
-        today = timezone.now().date()
-        recent_from = today - timedelta(days=30)
-        previous_from = today - timedelta(days=60)
-        recent_requests = req_qs.filter(created_at__date__gte=recent_from).count()
-        previous_requests = req_qs.filter(
-            created_at__date__gte=previous_from,
-            created_at__date__lt=recent_from,
-        ).count()
-        request_trend_delta = recent_requests - previous_requests
-        if request_trend_delta < 0:
-            request_trend_text = 'Снижение числа обращений за последние 30 дней.'
-        elif request_trend_delta > 0:
-            request_trend_text = 'Рост числа обращений за последние 30 дней.'
-        else:
-            request_trend_text = 'Частота обращений стабильна.'
-
-        positive_keywords = ('прогресс', 'улучш', 'стабил', 'справ', 'нормализ', 'спокойн')
-        negative_keywords = ('тревог', 'стресс', 'конфликт', 'булл', 'агресс', 'депресс', 'паник', 'проблем')
-        pos_q = Q()
-        neg_q = Q()
-        for word in positive_keywords:
-            pos_q |= Q(result__icontains=word)
-        for word in negative_keywords:
-            neg_q |= Q(result__icontains=word)
-
-        positive_result_signals = cons_qs.exclude(result__isnull=True).exclude(result__exact='').filter(pos_q).count()
-        negative_result_signals = cons_qs.exclude(result__isnull=True).exclude(result__exact='').filter(neg_q).count()
-
-        req_notes_qs = RequestNote.objects.filter(request__student_id=student.id)
-        if user.role_name == 'psychologist':
-            req_notes_qs = req_notes_qs.filter(
-                Q(request__psychologist_id=user.id) | Q(request__psychologist_id__isnull=True)
-            )
-        if date_from:
-            req_notes_qs = req_notes_qs.filter(created_at__date__gte=date_from)
-        if date_to:
-            req_notes_qs = req_notes_qs.filter(created_at__date__lte=date_to)
-
-        pos_note_q = Q()
-        neg_note_q = Q()
-        for word in positive_keywords:
-            pos_note_q |= Q(text__icontains=word)
-        for word in negative_keywords:
-            neg_note_q |= Q(text__icontains=word)
-        positive_note_signals = req_notes_qs.filter(pos_note_q).count()
-        negative_note_signals = req_notes_qs.filter(neg_note_q).count()
-
-        # Отменённые консультации не считаем автоматически риском:
-        # отмена может быть по нейтральным причинам (перенос, личные обстоятельства и т.п.).
-        success_signals = cons_completed + positive_result_signals + positive_note_signals
-        neutral_signals = cons_cancelled
-        problem_signals = (
-            req_status_map['new']
-            + req_status_map['in_progress']
-            + negative_result_signals
-            + negative_note_signals
-        )
-
-        if cons_total == 0 and req_total <= 1:
-            dynamics_level = 'Недостаточно данных'
-            dynamics_comment = 'Пока недостаточно истории наблюдений для обоснованной оценки динамики.'
-        elif completion_rate >= 70 and request_trend_delta <= 0 and success_signals >= problem_signals:
-            dynamics_level = 'Положительная'
-            dynamics_comment = 'Наблюдается положительная динамика: завершённых консультаций больше, чем риск-факторов.'
-        elif request_trend_delta > 0 or problem_signals > success_signals:
-            dynamics_level = 'Зона риска'
-            dynamics_comment = 'Есть признаки сохранения/роста трудностей. Рекомендуется усилить сопровождение.'
-        else:
-            dynamics_level = 'Стабильная'
-            if neutral_signals > 0:
-                dynamics_comment = (
-                    'Состояние без выраженного ухудшения. Есть отменённые консультации, '
-                    'но они не трактуются как риск без дополнительных негативных факторов.'
-                )
-            else:
-                dynamics_comment = 'Состояние без выраженного ухудшения, но требуется дальнейшее наблюдение.'
+        completion_rate = assessment['completion_rate']
+        recent_requests = row['recent_requests']
+        previous_requests = row['previous_requests']
+        request_trend_delta = assessment['trend']
+        request_trend_text = dynamics.trend_text(request_trend_delta)
+        success_signals = assessment['success']
+        neutral_signals = assessment['neutral']
+        problem_signals = assessment['problem']
+        dynamics_level = dynamics.level_name(assessment['level'])
+        dynamics_comment = dynamics.level_comment(assessment['level'], neutral_signals)
 
         months_ru = (
             '',
@@ -1116,6 +1509,36 @@ class StudentDynamicsView(PsychologistRequiredMixin, TemplateView):
         return ctx
 
 
+class RiskRosterView(PsychologistRequiredMixin, ReplicaReadMixin, TemplateView):
+    'Список риска: оценка динамики всех учащихся области (как на странице учащегося) с фильтром по уровню и классу.'
+    template_name = 'consultations/risk_roster.html'
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        date_from, date_to, _, _ = _report_filters(self.request)
+        level = self.request.GET.get('level', '').strip()
+        sort = self.request.GET.get('sort', '').strip()
+        if sort not in dynamics.SORTS:
+            sort = 'level'
+        classroom = self.request.GET.get('classroom', '').strip()
+        classroom_id = int(classroom) if classroom.isdigit() else None
+
+        rows, levels = dynamics.roster(self.request.user, date_from, date_to, level, classroom_id, sort)
+        period = {key: value for key, value in (('date_from', date_from), ('date_to', date_to)) if value}
+        ctx.update({
+            'rows': rows,
+            'levels': levels,
+            'date_from': date_from,
+            'date_to': date_to,
+            'filter_level': level if level in dynamics.LEVEL_CODES else '',
+            'filter_classroom_id': classroom_id,
+            'sort': sort,
+            'classrooms': Classroom.objects.order_by('name'),
+            'period_params': urlencode(period),
+        })
+        return ctx
+
+
 # ——— Экспорт отчётов ———
 
 def _get_psychologist_querysets(user, date_from, date_to, status, student_id):
@@ -1136,7 +1559,7 @@ def _get_students_report_data(qs_req, qs_cons):
     student_ids |= set(qs_cons.values_list('request__student_id', flat=True))
     student_ids |= set(qs_cons.values_list('students__id', flat=True))
     student_ids.discard(None)
-    students_list = list(Student.objects.filter(pk__in=student_ids).order_by('last_name', 'first_name')) if student_ids else []
+    students_list = list(Student.objects.filter(pk__in=student_ids).select_related('classroom').order_by('last_name', 'first_name')) if student_ids else []
     result = []
     for s in students_list:
         req_cnt = qs_req.filter(student_id=s.id).count()
@@ -1152,6 +1575,109 @@ def _get_students_report_data(qs_req, qs_cons):
     return result
 
 
+def _report_period(date_from, date_to):
+    'Границы периода отчёта датами (None — без границы) или None, если дата задана с ошибкой.'
+    period = []
+    for value in (date_from, date_to):
+        try:
+            day = parse_date(value) if value else None
+        except ValueError:
+            day = None
+        if value and day is None:
+            return None
+        period.append(day)
+    return period
+
+
+def _snapshot_report(user, date_from, date_to, status, student_id):
+    """
+    Данные отчёта из снимков (consultations/snapshots.py) или None — тогда отчёт считается по живым данным:
+    снимки хранят показатели области целиком, без разреза по статусу обращения и учащемуся.
+    """
+    period = None if status or student_id else _report_period(date_from, date_to)
+    if period is None:
+        return None
+    return snapshots.report(snapshots.scope_for(user), *period, user_id=user.pk)
+
+
+def _psychologist_report(user, date_from, date_to, status, student_id):
+    """
+    Отчёты психолога: по учащимся, динамика обращений и консультаций, нагрузка и формы консультаций;
+    'snapshot' — сведения о снимках, из которых взяты закрытые месяцы периода (None — всё посчитано заново).
+    """
+    data = _snapshot_report(user, date_from, date_to, status, student_id)
+    if data is None:
+        qs_req, qs_cons = _get_psychologist_querysets(user, date_from, date_to, status, student_id)
+        dur_agg = qs_cons.filter(completed_at__isnull=False).aggregate(total=Sum('duration'), avg=Avg('duration'))
+        forms = qs_cons.order_by().values('form__name').annotate(cnt=Count('id', distinct=True))
+        return {
+            'students': _get_students_report_data(qs_req, qs_cons),
+            'request_dynamics': _get_request_dynamics_data(qs_req),
+            'consultation_dynamics': _get_consultation_dynamics_data(qs_cons),
+            'workload': {
+                'requests': qs_req.count(),
+                'consultations': qs_cons.count(),
+                'duration_total': dur_agg['total'] or 0,
+                'duration_avg': round(dur_agg['avg'], 1) if dur_agg['avg'] is not None else 0,
+            },
+            'form_stats': _form_stats({row['form__name']: row['cnt'] for row in forms}),
+            'snapshot': None,
+        }
+
+    request_months, consultation_months, forms = {}, {}, {}
+    requests = consultations = duration = timed = 0
+    for key, month in data['months'].items():
+        day = snapshots.parse_month(key)
+        counts, totals = month['requests'], month['consultations']
+        if any(counts.values()):
+            request_months[day.year, day.month] = {
+                'req_new': counts.get('new', 0), 'req_in_progress': counts.get('in_progress', 0),
+                'req_completed': counts.get('completed', 0), 'req_cancelled': counts.get('cancelled', 0),
+            }
+        if totals['total']:
+            consultation_months[day.year, day.month] = {
+                'cons_completed': totals['completed'], 'cons_cancelled': totals['cancelled'],
+            }
+        for name, cnt in totals['forms'].items():
+            forms[name] = forms.get(name, 0) + cnt
+        requests += sum(counts.values())
+        consultations += totals['total']
+        duration += totals['duration']
+        timed += totals['timed']
+
+    students = []
+    if data['students']:
+        for s in Student.objects.filter(pk__in=data['students']).select_related('classroom').order_by('last_name', 'first_name'):
+            request_count, consultation_count, last = data['students'][s.pk]
+            students.append({
+                'student': s,
+                'request_count': request_count,
+                'consultation_count': consultation_count,
+                'last_consultation_date': parse_date(last) if last else None,
+            })
+    return {
+        'students': students,
+        'request_dynamics': _request_dynamics_rows(request_months),
+        'consultation_dynamics': _consultation_dynamics_rows(consultation_months),
+        'workload': {
+            'requests': requests,
+            'consultations': consultations,
+            'duration_total': duration,
+            'duration_avg': round(duration / timed, 1) if timed else 0,
+        },
+        'form_stats': _form_stats(forms),
+        'snapshot': data['snapshot'],
+    }
+
+
+def _admin_report(user, qs_req, date_from, date_to, status, student_id):
+    'Статистика обращений для админа: закрытые месяцы — из снимков, при фильтре по статусу или учащемуся — по qs_req.'
+    data = _snapshot_report(user, date_from, date_to, status, student_id)
+    if data is None:
+        return {**_admin_request_stats(qs_req), 'report_snapshot': None}
+    return {**_admin_snapshot_stats(data), 'report_snapshot': data['snapshot']}
+
+
 def _get_students_queryset_for_psychologist(user, date_from, date_to, status, student_id):
     'Учащиеся по фильтрам для отчёта психолога (свои обращения/консультации).'
     qs_req, qs_cons = _get_psychologist_querysets(user, date_from, date_to, status, student_id)
@@ -1170,9 +1696,11 @@ def _get_consultations_queryset_for_admin(date_from, date_to, status, student_id
     return qs_cons.select_related('request__student', 'request__psychologist', 'form').prefetch_related('students').order_by('-date')[:2000]
 
 
+REPORT_MONTHS = ('', 'январь', 'февраль', 'март', 'апрель', 'май', 'июнь', 'июль', 'август', 'сентябрь', 'октябрь', 'ноябрь', 'декабрь')
+
+
 def _get_request_dynamics_data(qs_req):
     'Динамика обращений по месяцам: новые, в работе, завершённые, отменённые.'
-    months_ru = ('', 'январь', 'февраль', 'март', 'апрель', 'май', 'июнь', 'июль', 'август', 'сентябрь', 'октябрь', 'ноябрь', 'декабрь')
     month_counts = {}  # (year, month) -> {'req_new': N, 'req_in_progress': N, 'req_completed': N, 'req_cancelled': N}
 
     def _norm(m):
@@ -1193,11 +1721,14 @@ def _get_request_dynamics_data(qs_req):
                 month_counts[key]['req_completed'] = d['cnt']
             elif status_name == 'cancelled':
                 month_counts[key]['req_cancelled'] = d['cnt']
+    return _request_dynamics_rows(month_counts)
+
 
+def _request_dynamics_rows(month_counts):
     result = []
     for (year, month) in sorted(month_counts.keys()):
         r = month_counts[(year, month)]
-        lbl = f"{months_ru[month]} {year}" if month < len(months_ru) else f"{month:02d}.{year}"
+        lbl = f"{REPORT_MONTHS[month]} {year}" if month < len(REPORT_MONTHS) else f"{month:02d}.{year}"
         req_total = r['req_new'] + r['req_in_progress'] + r['req_completed'] + r['req_cancelled']
         result.append({
             'label': lbl,
@@ -1212,7 +1743,6 @@ def _get_request_dynamics_data(qs_req):
 
 def _get_consultation_dynamics_data(qs_cons):
     'Динамика консультаций по месяцам: завершённые, отменённые.'
-    months_ru = ('', 'январь', 'февраль', 'март', 'апрель', 'май', 'июнь', 'июль', 'август', 'сентябрь', 'октябрь', 'ноябрь', 'декабрь')
     month_counts = {}  # (year, month) -> {'cons_completed': N, 'cons_cancelled': N}
 
     def _norm(m):
@@ -1231,11 +1761,14 @@ def _get_consultation_dynamics_data(qs_cons):
                 'cons_completed': d['cons_completed'] or 0,
                 'cons_cancelled': d['cons_cancelled'] or 0
             }
+    return _consultation_dynamics_rows(month_counts)
+
 
+def _consultation_dynamics_rows(month_counts):
     result = []
     for (year, month) in sorted(month_counts.keys()):
         r = month_counts[(year, month)]
-        lbl = f"{months_ru[month]} {year}" if month < len(months_ru) else f"{month:02d}.{year}"
+        lbl = f"{REPORT_MONTHS[month]} {year}" if month < len(REPORT_MONTHS) else f"{month:02d}.{year}"
         total = r['cons_completed'] + r['cons_cancelled']
         result.append({
             'label': lbl,
@@ -1260,15 +1793,24 @@ def _students_chart_rows(data_list, limit=10):
 
 def _consultations_form_stats(consultations):
     """Агрегация консультаций по форме (индивидуальная/групповая)."""
-    stats = {'Индивидуальная': 0, 'Групповая': 0, 'Другое': 0}
+    counts = {}
     for c in consultations:
-        name = (getattr(getattr(c, 'form', None), 'name', '') or '').strip()
+        name = getattr(getattr(c, 'form', None), 'name', '')
+        counts[name] = counts.get(name, 0) + 1
+    return _form_stats(counts)
+
+
+def _form_stats(counts):
+    """То же по готовым счётчикам {название формы: число консультаций}."""
+    stats = {'Индивидуальная': 0, 'Групповая': 0, 'Другое': 0}
+    for name, cnt in counts.items():
+        name = (name or '').strip()
         if name == 'individual':
-            stats['Индивидуальная'] += 1
+            stats['Индивидуальная'] += cnt
         elif name == 'group':
-            stats['Групповая'] += 1
+            stats['Групповая'] += cnt
         else:
-            stats['Другое'] += 1
+            stats['Другое'] += cnt
     return stats
 
 
@@ -1330,15 +1872,14 @@ def _chart_max_value(series, extra=1):
     return max(vals or [0]) + extra
 
 
-class ExportStudentsReportPDFView(PsychologistRequiredMixin, View):
+class ExportStudentsReportPDFView(PsychologistRequiredMixin, ReplicaReadMixin, View):
     'Экспорт отчёта «Обращения и консультации по учащимся» в PDF.'
     def get(self, request):
         if request.user.role_name != 'psychologist':
             from django.core.exceptions import PermissionDenied
             raise PermissionDenied('Доступно только психологу.')
         date_from, date_to, status, student_id = _report_filters(request)
-        qs_req, qs_cons = _get_psychologist_querysets(request.user, date_from, date_to, status, student_id)
-        data_list = _get_students_report_data(qs_req, qs_cons)
+        data_list = _psychologist_report(request.user, date_from, date_to, status, student_id)['students']
 
         from reportlab.lib import colors
         from reportlab.lib.pagesizes import A4
@@ -1404,15 +1945,14 @@ class ExportStudentsReportPDFView(PsychologistRequiredMixin, View):
         return response
 
 
-class ExportStudentsReportExcelView(PsychologistRequiredMixin, View):
+class ExportStudentsReportExcelView(PsychologistRequiredMixin, ReplicaReadMixin, View):
     'Экспорт отчёта «Обращения и консультации по учащимся» в Excel.'
     def get(self, request):
         if request.user.role_name != 'psychologist':
             from django.core.exceptions import PermissionDenied
             raise PermissionDenied('Доступно только психологу.')
         date_from, date_to, status, student_id = _report_filters(request)
-        qs_req, qs_cons = _get_psychologist_querysets(request.user, date_from, date_to, status, student_id)
-        data_list = _get_students_report_data(qs_req, qs_cons)
+        data_list = _psychologist_report(request.user, date_from, date_to, status, student_id)['students']
 
         from openpyxl import Workbook
         from openpyxl.styles import Font
@@ -1460,16 +2000,16 @@ class ExportStudentsReportExcelView(PsychologistRequiredMixin, View):
         return response
 
 
-class ExportDynamicsPDFView(PsychologistRequiredMixin, View):
+class ExportDynamicsPDFView(PsychologistRequiredMixin, ReplicaReadMixin, View):
     'Экспорт отчётов «Динамика обращений» и «Динамика консультаций» в PDF.'
     def get(self, request):
         if request.user.role_name != 'psychologist':
             from django.core.exceptions import PermissionDenied
             raise PermissionDenied('Доступно только психологу.')
         date_from, date_to, status, student_id = _report_filters(request)
-        qs_req, qs_cons = _get_psychologist_querysets(request.user, date_from, date_to, status, student_id)
-        request_dynamics = _get_request_dynamics_data(qs_req)
-        consultation_dynamics = _get_consultation_dynamics_data(qs_cons)
+        report = _psychologist_report(request.user, date_from, date_to, status, student_id)
+        request_dynamics = report['request_dynamics']
+        consultation_dynamics = report['consultation_dynamics']
 
         from reportlab.lib import colors
         from reportlab.lib.pagesizes import A4
@@ -1575,16 +2115,16 @@ class ExportDynamicsPDFView(PsychologistRequiredMixin, View):
         return response
 
 
-class ExportDynamicsExcelView(PsychologistRequiredMixin, View):
+class ExportDynamicsExcelView(PsychologistRequiredMixin, ReplicaReadMixin, View):
     'Экспорт отчётов «Динамика обращений» и «Динамика консультаций» в Excel.'
     def get(self, request):
         if request.user.role_name != 'psychologist':
             from django.core.exceptions import PermissionDenied
             raise PermissionDenied('Доступно только психологу.')
         date_from, date_to, status, student_id = _report_filters(request)
-        qs_req, qs_cons = _get_psychologist_querysets(request.user, date_from, date_to, status, student_id)
-        request_dynamics = _get_request_dynamics_data(qs_req)
-        consultation_dynamics = _get_consultation_dynamics_data(qs_cons)
+        report = _psychologist_report(request.user, date_from, date_to, status, student_id)
+        request_dynamics = report['request_dynamics']
+        consultation_dynamics = report['consultation_dynamics']
 
         from openpyxl import Workbook
         from openpyxl.styles import Font
@@ -1653,16 +2193,15 @@ class ExportDynamicsExcelView(PsychologistRequiredMixin, View):
         return response
 
 
-class ExportWorkloadPDFView(PsychologistRequiredMixin, View):
+class ExportWorkloadPDFView(PsychologistRequiredMixin, ReplicaReadMixin, View):
     'Экспорт отчёта «Нагрузка школьного психолога» в PDF.'
     def get(self, request):
         if request.user.role_name != 'psychologist':
             from django.core.exceptions import PermissionDenied
             raise PermissionDenied('Доступно только психологу.')
         date_from, date_to, status, student_id = _report_filters(request)
-        qs_req, qs_cons = _get_psychologist_querysets(request.user, date_from, date_to, status, student_id)
-        completed_cons = qs_cons.filter(completed_at__isnull=False)
-        dur_agg = completed_cons.aggregate(total=Sum('duration'), avg=Avg('duration'))
+        report = _psychologist_report(request.user, date_from, date_to, status, student_id)
+        workload = report['workload']
 
         from reportlab.lib import colors
         from reportlab.lib.pagesizes import A4
@@ -1684,10 +2223,10 @@ class ExportWorkloadPDFView(PsychologistRequiredMixin, View):
         elements.append(Paragraph(_pdf_period_label(date_from, date_to), styles['Normal']))
         tbl_data = [
             ['Показатель', 'Значение'],
-            ['Количество обращений', str(qs_req.count())],
-            ['Количество консультаций', str(qs_cons.count())],
-            ['Суммарная длительность (мин)', str(dur_agg['total'] or 0)],
-            ['Средняя длительность (мин)', str(round(dur_agg['avg'], 1) if dur_agg['avg'] is not None else 0)],
+            ['Количество обращений', str(workload['requests'])],
+            ['Количество консультаций', str(workload['consultations'])],
+            ['Суммарная длительность (мин)', str(workload['duration_total'])],
+            ['Средняя длительность (мин)', str(workload['duration_avg'])],
         ]
         t = Table(tbl_data)
         t.setStyle(TableStyle([
@@ -1699,7 +2238,7 @@ class ExportWorkloadPDFView(PsychologistRequiredMixin, View):
             ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#E7E6E6')]),
         ]))
         elements.append(t)
-        form_stats = _consultations_form_stats(qs_cons)
+        form_stats = report['form_stats']
         chart_items = [(k, v) for k, v in form_stats.items() if v > 0]
         if chart_items:
             elements.append(Paragraph('Распределение консультаций по форме', styles['Normal']))
@@ -1738,7 +2277,7 @@ class ExportStudentsExcelView(PsychologistRequiredMixin, View):
         return redirect('consultations:export_students_report_excel' + ('?' + request.GET.urlencode() if request.GET else ''))
 
 
-class ExportConsultationsPDFView(AdminRequiredMixin, View):
+class ExportConsultationsPDFView(AdminRequiredMixin, ReplicaReadMixin, View):
     'Экспорт отчёта по консультациям в PDF (админ).'
     def get(self, request):
         date_from, date_to, status, student_id = _report_filters(request)
@@ -1808,7 +2347,7 @@ class ExportConsultationsPDFView(AdminRequiredMixin, View):
         return response
 
 
-class ExportConsultationsExcelView(AdminRequiredMixin, View):
+class ExportConsultationsExcelView(AdminRequiredMixin, ReplicaReadMixin, View):
     'Экспорт отчёта по консультациям в Excel (админ).'
     def get(self, request):
         date_from, date_to, status, student_id = _report_filters(request)
@@ -1881,99 +2420,189 @@ def _resolve_psychologist_for_student(student_id):
     return User.objects.filter(role__name='admin', is_active=True).order_by('id').first()
 
 
-def _mark_chat_messages_read_for_user(chat_id, user_id):
-    """Отмечает сообщения чата как прочитанные конкретным пользователем (персонально)."""
-    unread_ids = list(
-        ChatMessage.objects
-        .filter(chat_id=chat_id)
+def _read_by_user(user_id):
+    """Exists «сообщение прочитано пользователем»: по обоим ключам, чтобы поиск шёл в секции месяца сообщения."""
+    return Exists(ChatMessageRead.objects.filter(
+        message_id=OuterRef('pk'), message_created_at=OuterRef('created_at'), user_id=user_id,
+    ))
+
+
+def annotate_chat_activity(chats, user_id):
+    """Чаты с last_message_at и unread_count (непрочитанные пользователем user_id) за окно CHAT_RECENT_MONTHS."""
+    since = partitions.recent_since(settings.CHAT_RECENT_MONTHS)
+    recent = ChatMessage.objects.filter(chat_id=OuterRef('pk'))
+    if since is not None:
+        # Непрочитанное и последнее сообщение ищутся только в секциях окна CHAT_RECENT_MONTHS
+        recent = recent.filter(created_at__gte=since)
+    unread_subquery = (
+        recent
         .exclude(author_id=user_id)
-        .exclude(read_marks__user_id=user_id)
-        .values_list('id', flat=True)
+        .filter(~_read_by_user(user_id))
+        .values('chat_id')
+        .annotate(cnt=Count('id'))
+        .values('cnt')[:1]
+    )
+    last_message_subquery = recent.order_by('-created_at').values('created_at')[:1]
+    return chats.annotate(
+        last_message_at=Subquery(last_message_subquery),
+        unread_count=Coalesce(Subquery(unread_subquery, output_field=IntegerField()), Value(0)),
     )
-    if not unread_ids:
+
+
+def _chat_window(request, chat):
+    """
+    Граница показа переписки: последние CHAT_RECENT_MONTHS месяцев (их секции), ?all=1 — вся история.
+    Возвращает (начало окна или None, есть ли более ранняя переписка).
+    """
+    since = partitions.recent_since(settings.CHAT_RECENT_MONTHS)
+    if since is None or request.GET.get('all') == '1':
+        return None, False
+    return since, bool(chat and chat.created_at and chat.created_at < since)
+
+
+def _mark_chat_messages_read_for_user(chat_id, user_id, since=None):
+    """Отмечает сообщения чата как прочитанные конкретным пользователем (персонально)."""
+    qs = ChatMessage.objects.filter(chat_id=chat_id).exclude(author_id=user_id)
+    if since is not None:
+        qs = qs.filter(created_at__gte=since)
+    unread = list(qs.filter(~_read_by_user(user_id)).values_list('id', 'created_at'))
+    if not unread:
         return
     now = timezone.now()
     ChatMessageRead.objects.bulk_create(
-        [ChatMessageRead(message_id=mid, user_id=user_id, read_at=now) for mid in unread_ids],
+        [
+            ChatMessageRead(message_id=mid, message_created_at=created_at, user_id=user_id, read_at=now)
+            for mid, created_at in unread
+        ],
         ignore_conflicts=True,
     )
+    summary.touch_chat(chat_id)
+
+
+# ——— Async-представления портала учащегося ———
+# Под ASGI (config/asgi.py) они не занимают поток воркера на время запросов к БД. В Django 4.2 async ORM
+# выполняет SQL через sync_to_async: независимые запросы собираются asyncio.gather, а рендеринг шаблона
+# (контекст-процессоры обращаются к БД) выполняется в потоке.
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+
+async def _arender(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context)
 
 
-class StudentChatView(StudentRequiredMixin, View):
+class _Counted:
+    """Для Paginator: число объектов уже посчитано асинхронно."""
+
+    def __init__(self, count):
+        self._count = count
+
+    def count(self):
+        return self._count
+
+
+async def _apaginate(request, queryset, per_page):
+    """Аналог ListView.paginate_queryset: страница из ?page= (или last), неверный номер — 404."""
+    paginator = Paginator(_Counted(await queryset.acount()), per_page)
+    page = request.GET.get('page') or 1
+    try:
+        number = paginator.num_pages if page == 'last' else int(page)
+        number = paginator.validate_number(number)
+    except (ValueError, InvalidPage):
+        raise Http404('Неверная страница.')
+    bottom = (number - 1) * per_page
+    page_obj = Page(await _alist(queryset[bottom:bottom + per_page]), number, paginator)
+    return {
+        'paginator': paginator,
+        'page_obj': page_obj,
+        'is_paginated': paginator.num_pages > 1,
+        'object_list': page_obj.object_list,
+    }
+
+
+class StudentChatView(AsyncStudentRequiredMixin, View):
     """Личный чат учащегося с психологом."""
     template_name = 'consultations/student_chat.html'
 
-    def _get_chat(self, request):
+    async def _get_chat(self, request):
         sid = getattr(request.user, 'student_id', None)
         if not sid:
             return None
-        return (
+        return await (
             StudentPsychologistChat.objects
             .select_related('student', 'psychologist')
             .filter(student_id=sid)
-            .first()
+            .afirst()
         )
 
-    def _ensure_chat(self, request):
-        chat = self._get_chat(request)
+    async def _ensure_chat(self, request):
+        chat = await self._get_chat(request)
         if chat:
             return chat
-        psychologist = _resolve_psychologist_for_student(request.user.student_id)
+        psychologist = await sync_to_async(_resolve_psychologist_for_student)(request.user.student_id)
         if not psychologist:
             return None
         try:
-            return StudentPsychologistChat.objects.create(
+            return await StudentPsychologistChat.objects.acreate(
                 student_id=request.user.student_id,
                 psychologist_id=psychologist.pk,
             )
         except Exception:
-            return self._get_chat(request)
+            return await self._get_chat(request)
 
-    def _build_context(self, request, form=None):
-        chat = self._ensure_chat(request)
-        messages_qs = ChatMessage.objects.none()
+    async def _build_context(self, request, form=None):
+        chat = await self._ensure_chat(request)
+        messages_list = []
+        since, has_older = _chat_window(request, chat)
         if chat:
             messages_qs = ChatMessage.objects.filter(chat_id=chat.pk).select_related('author').order_by('created_at')
-            _mark_chat_messages_read_for_user(chat.pk, request.user.id)
+            if since is not None:
+                messages_qs = messages_qs.filter(created_at__gte=since)
+            messages_list = await _alist(messages_qs)
+            await sync_to_async(_mark_chat_messages_read_for_user)(chat.pk, request.user.id, since)
         return {
             'chat': chat,
-            'messages_list': messages_qs,
+            'messages_list': messages_list,
+            'has_older_messages': has_older,
             'form': form or ChatMessageForm(),
             'has_profile': bool(getattr(request.user, 'student_id', None)),
         }
 
-    def get(self, request):
+    async def get(self, request):
         if not getattr(request.user, 'student_id', None):
             messages.error(request, 'Ваш аккаунт не привязан к карточке учащегося.')
             return redirect('consultations:student_dashboard')
-        return render(request, self.template_name, self._build_context(request))
+        return await _arender(request, self.template_name, await self._build_context(request))
 
-    def post(self, request):
+    async def post(self, request):
         if not getattr(request.user, 'student_id', None):
             return redirect('consultations:student_dashboard')
         form = ChatMessageForm(request.POST)
-        chat = self._ensure_chat(request)
+        chat = await self._ensure_chat(request)
         if not chat:
             messages.error(request, 'Сейчас нет доступного психолога для чата. Обратитесь к администратору.')
-            return render(request, self.template_name, self._build_context(request, form=form))
+            return await _arender(request, self.template_name, await self._build_context(request, form=form))
         if not form.is_valid():
-            return render(request, self.template_name, self._build_context(request, form=form))
-        ChatMessage.objects.create(
+            return await _arender(request, self.template_name, await self._build_context(request, form=form))
+        await ChatMessage.objects.acreate(
             chat_id=chat.pk,
             author_id=request.user.pk,
             text=form.cleaned_data['text'],
         )
-        chat.save(update_fields=['updated_at'])
+        await chat.asave(update_fields=['updated_at'])
         messages.success(request, 'Сообщение отправлено.')
         return redirect('consultations:student_chat')
 
 
-class PsychologistChatListView(PsychologistRequiredMixin, ListView):
+class PsychologistChatListView(PsychologistRequiredMixin, KeysetPaginationMixin, ListView):
     """Список личных чатов учащихся для психолога."""
     model = StudentPsychologistChat
     template_name = 'consultations/psychologist_chat_list.html'
     context_object_name = 'chats'
     paginate_by = 30
+    # Чаты без сообщений в окне (last_message_at NULL) — в конце списка
+    keyset_ordering = ('-last_message_at', '-updated_at', '-created_at', '-id')
 
     def get_queryset(self):
         qs = StudentPsychologistChat.objects.select_related('student', 'student__classroom', 'psychologist')
@@ -1985,20 +2614,7 @@ class PsychologistChatListView(PsychologistRequiredMixin, ListView):
                 Q(student__last_name__icontains=q)
                 | Q(student__first_name__icontains=q)
             )
-        unread_subquery = (
-            ChatMessage.objects
-            .filter(chat_id=OuterRef('pk'))
-            .exclude(author_id=self.request.user.id)
-            .exclude(read_marks__user_id=self.request.user.id)
-            .values('chat_id')
-            .annotate(cnt=Count('id', distinct=True))
-            .values('cnt')[:1]
-        )
-        qs = qs.annotate(
-            last_message_at=Max('messages__created_at'),
-            unread_count=Coalesce(Subquery(unread_subquery, output_field=IntegerField()), Value(0)),
-        ).order_by('-last_message_at', '-updated_at', '-created_at')
-        return qs
+        return annotate_chat_activity(qs, self.request.user.id)
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
@@ -2017,11 +2633,15 @@ class PsychologistChatDetailView(PsychologistRequiredMixin, View):
         return get_object_or_404(qs, pk=pk)
 
     def _build_context(self, request, chat, form=None):
+        since, has_older = _chat_window(request, chat)
         messages_qs = ChatMessage.objects.filter(chat_id=chat.pk).select_related('author').order_by('created_at')
-        _mark_chat_messages_read_for_user(chat.pk, request.user.id)
+        if since is not None:
+            messages_qs = messages_qs.filter(created_at__gte=since)
+        _mark_chat_messages_read_for_user(chat.pk, request.user.id, since)
         return {
             'chat': chat,
             'messages_list': messages_qs,
+            'has_older_messages': has_older,
             'form': form or ChatMessageForm(),
             'can_send': request.user.role_name == 'psychologist',
         }
@@ -2048,55 +2668,56 @@ class PsychologistChatDetailView(PsychologistRequiredMixin, View):
         return redirect('consultations:psychologist_chat_detail', pk=chat.pk)
 
 
-class StudentDashboardView(StudentRequiredMixin, TemplateView):
+class StudentDashboardView(AsyncStudentRequiredMixin, View):
     'Главная страница для учащегося: приветствие и быстрые действия.'
     template_name = 'consultations/student_dashboard.html'
 
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        user = self.request.user
-        user.refresh_from_db()  # подтянуть актуальную привязку учащегося из БД
-        student = getattr(user, 'student', None)
-        ctx['student'] = student
-        ctx['has_profile'] = student is not None
+    async def get(self, request, *args, **kwargs):
+        user = request.user
+        await user.arefresh_from_db(fields=['student_id'])  # подтянуть актуальную привязку учащегося из БД
+        student = None
+        if user.student_id:
+            student = await Student.objects.filter(pk=user.student_id).afirst()
+        ctx = {
+            'student': student,
+            'has_profile': student is not None,
+            'recent_requests': [],
+            'request_count': 0,
+            'notifications': [],
+        }
         if student:
-            recent = Request.objects.filter(student_id=user.student_id).order_by('-created_at')[:5]
-            ctx['recent_requests'] = recent
-            ctx['request_count'] = Request.objects.filter(student_id=user.student_id).count()
-            ctx['notifications'] = (
-                StudentNotification.objects
-                .filter(student_id=user.student_id)
-                .select_related('consultation', 'request__status')
-                .order_by('-created_at')[:30]
+            requests_qs = Request.objects.filter(student_id=user.student_id)
+            notifications = StudentNotification.objects.filter(student_id=user.student_id)
+            since = partitions.recent_since(settings.NOTIFICATION_RECENT_MONTHS)
+            if since is not None:
+                notifications = notifications.filter(created_at__gte=since)
+            ctx['recent_requests'], ctx['request_count'], ctx['notifications'] = await asyncio.gather(
+                _alist(requests_qs.select_related('status').order_by('-created_at')[:5]),
+                requests_qs.acount(),
+                _alist(notifications.select_related('consultation', 'request__status').order_by('-created_at')[:30]),
             )
-        else:
-            ctx['recent_requests'] = []
-            ctx['request_count'] = 0
-            ctx['notifications'] = []
-        return ctx
+        return await _arender(request, self.template_name, ctx)
 
 
-class MyRequestListView(StudentRequiredMixin, ListView):
+class MyRequestListView(AsyncStudentRequiredMixin, View):
     'Список обращений учащегося (только свои).'
-    model = Request
     template_name = 'consultations/my_request_list.html'
-    context_object_name = 'requests'
     paginate_by = 10
 
-    def get_queryset(self):
-        if not getattr(self.request.user, 'student_id', None):
-            return Request.objects.none()
-        return (
-            Request.objects
-            .filter(student_id=self.request.user.student_id)
-            .select_related('status')
-            .order_by('-created_at')
-        )
-
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        ctx['has_profile'] = self.request.user.student_id is not None
-        return ctx
+    async def get(self, request, *args, **kwargs):
+        if not getattr(request.user, 'student_id', None):
+            qs = Request.objects.none()
+        else:
+            qs = (
+                Request.objects
+                .filter(student_id=request.user.student_id)
+                .select_related('status')
+            )
+        page = await pagination.apaginate(request, qs, ('-created_at', '-id'), self.paginate_by)
+        ctx = pagination.page_context(page)
+        ctx['requests'] = ctx['object_list']
+        ctx['has_profile'] = request.user.student_id is not None
+        return await _arender(request, self.template_name, ctx)
 
 
 class MyRequestCreateView(StudentRequiredMixin, View):
@@ -2135,6 +2756,17 @@ class MyRequestCreateView(StudentRequiredMixin, View):
         return redirect('consultations:my_request_list')
 
 
+def _my_request_version(request, pk):
+    if not getattr(request.user, 'student_id', None):
+        return None
+    return (
+        Request.objects.filter(pk=pk, student_id=request.user.student_id)
+        .values_list('updated_at', 'student__updated_at')
+        .first()
+    )
+
+
+@method_decorator(conditional_page(_my_request_version), name='get')
 class MyRequestDetailView(StudentRequiredMixin, DetailView):
     'Просмотр учащимся своего обращения (без редактирования/удаления).'
     model = Request
@@ -2167,108 +2799,86 @@ class MyRequestCancelView(StudentRequiredMixin, View):
     def post(self, request, pk):
         if not getattr(request.user, 'student_id', None):
             return redirect('consultations:student_dashboard')
-        request_obj = get_object_or_404(
-            Request.objects.filter(student_id=request.user.student_id),
-            pk=pk
-        )
-        if request_obj.status.name == 'completed':
+        result = transitions.cancel_request(pk, student_id=request.user.student_id)
+        if result.state is None:
+            raise Http404
+        if result.state == 'completed':
             messages.warning(request, 'Завершённое обращение отменить нельзя.')
             return redirect('consultations:my_request_detail', pk=pk)
-        cancelled_status = RequestStatus.objects.filter(name='cancelled').first()
-        if not cancelled_status:
-            messages.error(request, 'В системе не найден статус «Отменено». Обратитесь к администратору.')
-            return redirect('consultations:my_request_detail', pk=pk)
-        request_obj.status = cancelled_status
-        request_obj.save(update_fields=['status_id'])
-        notify_request_status_changed(request_obj)
-        messages.success(request, 'Обращение отменено.')
+        messages.success(request, 'Обращение отменено.' if result.applied else 'Обращение уже отменено.')
         return redirect('consultations:my_request_list')
 
 
-class MyConsultationListView(StudentRequiredMixin, ListView):
+class MyConsultationListView(AsyncStudentRequiredMixin, View):
     'Список консультаций учащегося (только свои).'
-    model = Consultation
     template_name = 'consultations/my_consultation_list.html'
-    context_object_name = 'consultations'
     paginate_by = 10
 
-    def get_queryset(self):
-        if not getattr(self.request.user, 'student_id', None):
-            return Consultation.objects.none()
-        return (
-            Consultation.objects
-            .filter(
-                Q(request__student_id=self.request.user.student_id)
-                | Q(students__id=self.request.user.student_id)
+    async def get(self, request, *args, **kwargs):
+        sid = getattr(request.user, 'student_id', None)
+        if not sid:
+            qs = Consultation.objects.none()
+        else:
+            qs = (
+                Consultation.objects
+                .filter(Q(request__student_id=sid) | Q(students__id=sid))
+                .select_related('form')
+                .distinct()
+                .order_by('-date', '-created_at')
             )
-            .select_related('form', 'request')
-            .prefetch_related('consultation_students')
-            .distinct()
-            .order_by('-date', '-created_at')
-        )
-
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        ctx['has_profile'] = self.request.user.student_id is not None
-        ctx['student_id'] = getattr(self.request.user, 'student_id', None)
-        # Подтверждение участия текущего учащегося по каждой консультации
-        sid = ctx['student_id']
-        if sid and 'consultations' in ctx:
+        ctx = await _apaginate(request, qs, self.paginate_by)
+        ctx['consultations'] = ctx['object_list']
+        ctx['has_profile'] = sid is not None
+        ctx['student_id'] = sid
+        # Подтверждение участия текущего учащегося по консультациям страницы — одним запросом
+        if sid and ctx['consultations']:
+            participation = {
+                cs.consultation_id: cs
+                async for cs in ConsultationStudent.objects.filter(
+                    consultation_id__in=[c.pk for c in ctx['consultations']], student_id=sid,
+                )
+            }
             for c in ctx['consultations']:
-                cs = ConsultationStudent.objects.filter(consultation=c, student_id=sid).first()
+                cs = participation.get(c.pk)
                 c.my_participation_confirmed_at = cs.participation_confirmed_at if cs else None
                 c.my_participation_cancelled_at = cs.participation_cancelled_at if cs else None
-        return ctx
+        return await _arender(request, self.template_name, ctx)
 
 
 class MyConsultationConfirmParticipationView(StudentRequiredMixin, View):
     'Подтверждение участия в консультации учащимся.'
+    # Почему подтверждение не применилось (transitions.confirm_participation) → (уровень, сообщение)
+    REFUSALS = {
+        'cancelled': (messages.WARNING, 'Нельзя подтвердить участие в отменённой консультации.'),
+        'completed': (messages.WARNING, 'Нельзя подтвердить участие в уже завершённой консультации.'),
+        'participation_cancelled': (messages.WARNING, 'Участие было окончательно отменено. Подтвердить снова нельзя.'),
+        'confirmed': (messages.INFO, 'Участие уже подтверждено.'),
+        'not_participant': (messages.INFO, 'Вы не записаны на эту консультацию.'),
+    }
+
     def post(self, request, pk):
         if not getattr(request.user, 'student_id', None):
             return redirect('consultations:student_dashboard')
-        consultation = get_object_or_404(
-            Consultation.objects.filter(
-                Q(request__student_id=request.user.student_id)
-                | Q(students__id=request.user.student_id)
-            ).distinct(),
-            pk=pk
-        )
-        if consultation.cancelled_at:
-            messages.warning(request, 'Нельзя подтвердить участие в отменённой консультации.')
-            return redirect('consultations:my_consultation_list')
-        if consultation.completed_at:
-            messages.warning(request, 'Нельзя подтвердить участие в уже завершённой консультации.')
-            return redirect('consultations:my_consultation_list')
-        cs = ConsultationStudent.objects.filter(
-            consultation_id=pk,
-            student_id=request.user.student_id
-        ).first()
-        if not cs:
-            # Учащийся в консультации через request, но не в M2M — создаём запись через add
-            consultation.students.add(request.user.student_id)
-            cs = ConsultationStudent.objects.get(consultation_id=pk, student_id=request.user.student_id)
-        if cs.participation_cancelled_at:
-            messages.warning(request, 'Участие было окончательно отменено. Подтвердить снова нельзя.')
-            return redirect('consultations:my_consultation_list')
-        if cs.participation_confirmed_at:
-            messages.info(request, 'Участие уже подтверждено.')
-        else:
-            cs.participation_confirmed_at = timezone.now()
-            cs.save(update_fields=['participation_confirmed_at'])
+        result = transitions.confirm_participation(pk, request.user.student_id)
+        if result.state is None:
+            raise Http404
+        if result.applied:
             messages.success(request, 'Участие в консультации подтверждено.')
+        else:
+            level, text = self.REFUSALS.get(result.state, (messages.INFO, 'Участие не изменено.'))
+            messages.add_message(request, level, text)
         return redirect('consultations:my_consultation_list')
 
 
 class MyConsultationCancelParticipationView(StudentRequiredMixin, View):
     'Отмена участия в консультации учащимся: страница подтверждения и снятие подтверждения.'
-    def get(self, request, pk):
-        if not getattr(request.user, 'student_id', None):
-            return redirect('consultations:student_dashboard')
+    def refuse(self, request, pk, queryset=Consultation.objects.all()):
+        'Редирект с объяснением, если отменить участие нельзя; None — можно.'
         consultation = get_object_or_404(
-            Consultation.objects.filter(
+            queryset.filter(
                 Q(request__student_id=request.user.student_id)
                 | Q(students__id=request.user.student_id)
-            ).select_related('form').distinct(),
+            ).distinct(),
             pk=pk
         )
         if consultation.cancelled_at:
@@ -2287,50 +2897,30 @@ class MyConsultationCancelParticipationView(StudentRequiredMixin, View):
         if cs.participation_cancelled_at:
             messages.info(request, 'Участие уже отменено.')
             return redirect('consultations:my_consultation_list')
+        self.consultation = consultation
+        return None
+
+    def get(self, request, pk):
+        if not getattr(request.user, 'student_id', None):
+            return redirect('consultations:student_dashboard')
+        refused = self.refuse(request, pk, Consultation.objects.select_related('form'))
+        if refused:
+            return refused
         return render(
             request,
             'consultations/my_consultation_cancel_confirm.html',
-            {'consultation': consultation}
+            {'consultation': self.consultation}
         )
 
     def post(self, request, pk):
         if not getattr(request.user, 'student_id', None):
             return redirect('consultations:student_dashboard')
-        consultation = get_object_or_404(
-            Consultation.objects.filter(
-                Q(request__student_id=request.user.student_id)
-                | Q(students__id=request.user.student_id)
-            ).distinct(),
-            pk=pk
-        )
-        if consultation.cancelled_at:
-            messages.warning(request, 'Нельзя отменить участие в уже отменённой консультации.')
-            return redirect('consultations:my_consultation_list')
-        if consultation.completed_at:
-            messages.warning(request, 'Нельзя отменить участие в уже завершённой консультации.')
-            return redirect('consultations:my_consultation_list')
-        cs = ConsultationStudent.objects.filter(
-            consultation_id=pk,
-            student_id=request.user.student_id
-        ).first()
-        if not cs:
-            messages.info(request, 'Вы не записаны на эту консультацию.')
-            return redirect('consultations:my_consultation_list')
-        if cs.participation_cancelled_at:
-            messages.info(request, 'Участие уже отменено.')
-            return redirect('consultations:my_consultation_list')
-        cs.participation_confirmed_at = None
-        cs.participation_cancelled_at = timezone.now()
-        cs.save(update_fields=['participation_confirmed_at', 'participation_cancelled_at'])
-        # Консультация получает статус «Отменена»
-        consultation.cancelled_at = timezone.now()
-        consultation.save(update_fields=['cancelled_at'])
-        # Обращение по этой консультации тоже переводим в «Отменённые»
-        if consultation.request_id:
-            cancelled_status = RequestStatus.objects.filter(name='cancelled').first()
-            if cancelled_status:
-                consultation.request.status = cancelled_status
-                consultation.request.save(update_fields=['status_id'])
-                notify_request_status_changed(consultation.request)
-        messages.success(request, 'Участие в консультации окончательно отменено. Консультация и обращение отменены.')
+        # Участие, консультация и обращение отменяются одной транзакцией (transitions.cancel_participation)
+        result = transitions.cancel_participation(pk, request.user.student_id)
+        if not result.applied:
+            return self.refuse(request, pk) or redirect('consultations:my_consultation_list')
+        if result.request_cancelled:
+            messages.success(request, 'Участие в консультации окончательно отменено. Консультация и обращение отменены.')
+        else:
+            messages.success(request, 'Участие в консультации окончательно отменено. Консультация отменена.')
         return redirect('consultations:my_consultation_list')
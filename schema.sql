@@ -41,8 +41,11 @@ CREATE TABLE IF NOT EXISTS students (
     last_name VARCHAR(50) NOT NULL,
     class_id INTEGER REFERENCES classrooms(id),
     birth_date DATE NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+-- Индексы под keyset-пагинацию списков (config/pagination.py)
+CREATE INDEX IF NOT EXISTS idx_students_name_id ON students(last_name, first_name, id);
 
 -- ===============================
 -- ПОЛЬЗОВАТЕЛИ (Django: + is_active, last_login, is_staff, is_superuser)
@@ -92,8 +95,11 @@ CREATE TABLE IF NOT EXISTS requests (
     psychologist_id INTEGER REFERENCES users(id),
     source VARCHAR(20) CHECK (source IN ('student', 'parent', 'teacher')),
     status_id INTEGER REFERENCES request_statuses(id),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE INDEX IF NOT EXISTS idx_requests_updated_at ON requests(updated_at);
+CREATE INDEX IF NOT EXISTS idx_requests_student_created ON requests(student_id, created_at DESC NULLS LAST, id DESC);
 
 -- ===============================
 -- ФОРМЫ КОНСУЛЬТАЦИЙ
@@ -106,18 +112,80 @@ CREATE TABLE IF NOT EXISTS consultation_forms (
 INSERT INTO consultation_forms (name) VALUES ('individual'), ('group')
 ON CONFLICT (name) DO NOTHING;
 
+-- ===============================
+-- СЕРИИ КОНСУЛЬТАЦИЙ
+-- ===============================
+-- Повторяющиеся консультации (еженедельно или раз в две недели) с date_from по date_until
+CREATE TABLE IF NOT EXISTS consultation_series (
+    id SERIAL PRIMARY KEY,
+    psychologist_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    request_id INTEGER REFERENCES requests(id) ON DELETE SET NULL,
+    form_id INTEGER NOT NULL REFERENCES consultation_forms(id),
+    start_time TIME NOT NULL,
+    end_time TIME NOT NULL,
+    interval_weeks SMALLINT NOT NULL DEFAULT 1 CHECK (interval_weeks IN (1, 2)),
+    date_from DATE NOT NULL,
+    date_until DATE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    cancelled_at TIMESTAMP NULL
+);
+CREATE INDEX IF NOT EXISTS idx_consultation_series_psychologist ON consultation_series(psychologist_id);
+
 -- ===============================
 -- КОНСУЛЬТАЦИИ
 -- ===============================
+-- psychologist_id — психолог, у которого консультация стоит в расписании (consultations/schedule.py)
 CREATE TABLE IF NOT EXISTS consultations (
     id SERIAL PRIMARY KEY,
-    request_id INTEGER NOT NULL REFERENCES requests(id) ON DELETE CASCADE,
+    request_id INTEGER REFERENCES requests(id) ON DELETE CASCADE,
     form_id INTEGER REFERENCES consultation_forms(id),
+    psychologist_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    series_id INTEGER REFERENCES consultation_series(id) ON DELETE SET NULL,
     date DATE NOT NULL,
+    start_time TIME,
+    end_time TIME,
     duration INTEGER NOT NULL,
     result TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    completed_at TIMESTAMP,
+    cancelled_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE INDEX IF NOT EXISTS idx_consultations_updated_at ON consultations(updated_at);
+CREATE INDEX IF NOT EXISTS idx_consultations_schedule ON consultations(date, psychologist_id) WHERE cancelled_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_consultations_series ON consultations(series_id, date);
+CREATE INDEX IF NOT EXISTS idx_consultations_date_id ON consultations(date, id);
+
+-- Запрет пересечений в расписании психолога: интервалы [date + start_time, date + end_time)
+-- неотменённых консультаций не пересекаются. btree_gist — для psychologist_id в GiST-индексе
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'consultations_no_overlap') THEN
+        ALTER TABLE consultations ADD CONSTRAINT consultations_no_overlap EXCLUDE USING gist (
+            psychologist_id WITH =,
+            tsrange(date + start_time, date + end_time) WITH &&
+        ) WHERE (
+            cancelled_at IS NULL AND psychologist_id IS NOT NULL
+            AND start_time IS NOT NULL AND end_time IS NOT NULL AND end_time > start_time
+        );
+    END IF;
+END;
+$$;
+
+-- ===============================
+-- УЧАСТНИКИ КОНСУЛЬТАЦИЙ
+-- ===============================
+CREATE TABLE IF NOT EXISTS consultation_students (
+    id SERIAL PRIMARY KEY,
+    consultation_id INTEGER NOT NULL REFERENCES consultations(id) ON DELETE CASCADE,
+    student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+    participation_confirmed_at TIMESTAMP NULL,
+    participation_cancelled_at TIMESTAMP NULL,
+    UNIQUE(consultation_id, student_id)
+);
+CREATE INDEX IF NOT EXISTS idx_consultation_students_consultation ON consultation_students(consultation_id);
+CREATE INDEX IF NOT EXISTS idx_consultation_students_student ON consultation_students(student_id);
 
 -- ===============================
 -- ЗАМЕТКИ
@@ -137,9 +205,15 @@ CREATE TABLE IF NOT EXISTS attachments (
     id SERIAL PRIMARY KEY,
     consultation_id INTEGER REFERENCES consultations(id) ON DELETE CASCADE,
     file_path VARCHAR(255),
+    original_name VARCHAR(255),
+    content_type VARCHAR(100),
+    sha256 CHAR(64),
+    size BIGINT,
     description TEXT,
     uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE INDEX IF NOT EXISTS idx_attachments_consultation ON attachments(consultation_id);
+CREATE INDEX IF NOT EXISTS idx_attachments_sha256 ON attachments(sha256);
 
 -- ===============================
 -- СОБЫТИЯ
@@ -162,29 +236,44 @@ CREATE TABLE IF NOT EXISTS reports (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     report_data JSONB
 );
+-- Снимки отчётов (consultations/snapshots.py): одна строка на область и месяц
+CREATE UNIQUE INDEX IF NOT EXISTS uq_reports_snapshot_name ON reports(report_name) WHERE report_name LIKE 'snapshot:%';
 
 -- ===============================
 -- ЛОГИ
 -- ===============================
+-- Секционирована по месяцам: секции logs_yYYYYmMM создаёт и снимает consultations/partitions.py
+-- (PARTITION_MONTHS_AHEAD, AUDIT_RETENTION_MONTHS); строки вне секций попадают в logs_default
 CREATE TABLE IF NOT EXISTS logs (
-    id SERIAL PRIMARY KEY,
-    user_id INTEGER REFERENCES users(id),
+    id BIGSERIAL,
+    user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
     action VARCHAR(100),
-    action_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    action_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    object_id INTEGER,
+    ip_address VARCHAR(45),
+    details JSONB,
+    PRIMARY KEY (id, action_date)
+) PARTITION BY RANGE (action_date);
+CREATE TABLE IF NOT EXISTS logs_default PARTITION OF logs DEFAULT;
+CREATE INDEX IF NOT EXISTS idx_logs_action_date ON logs(action_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_user_date ON logs(user_id, action_date DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_action ON logs(action, action_date DESC);
 
 -- ===============================
 -- УВЕДОМЛЕНИЯ УЧАЩЕГОСЯ
 -- ===============================
+-- Секционирована по месяцам (NOTIFICATION_RETENTION_MONTHS), см. consultations/partitions.py
 CREATE TABLE IF NOT EXISTS student_notifications (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
     kind VARCHAR(30) NOT NULL,
     consultation_id INTEGER REFERENCES consultations(id) ON DELETE SET NULL,
     request_id INTEGER REFERENCES requests(id) ON DELETE SET NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-CREATE INDEX IF NOT EXISTS idx_student_notifications_student ON student_notifications(student_id);
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE IF NOT EXISTS student_notifications_default PARTITION OF student_notifications DEFAULT;
+CREATE INDEX IF NOT EXISTS idx_student_notifications_student ON student_notifications(student_id, created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_student_notifications_created ON student_notifications(created_at DESC);
 
 -- ===============================
@@ -213,18 +302,82 @@ CREATE TABLE IF NOT EXISTS student_psychologist_chats (
 CREATE INDEX IF NOT EXISTS idx_sp_chats_psychologist ON student_psychologist_chats(psychologist_id);
 CREATE INDEX IF NOT EXISTS idx_sp_chats_updated ON student_psychologist_chats(updated_at DESC);
 
+-- Сообщения и отметки о прочтении секционированы по месяцам (CHAT_RETENTION_MONTHS); отметка хранит
+-- дату сообщения, поэтому лежит в секции того же месяца и ссылается на составной ключ (id, created_at)
 CREATE TABLE IF NOT EXISTS chat_messages (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     chat_id INTEGER NOT NULL REFERENCES student_psychologist_chats(id) ON DELETE CASCADE,
     author_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
     text TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    read_at TIMESTAMP NULL
-);
-CREATE INDEX IF NOT EXISTS idx_chat_messages_chat ON chat_messages(chat_id);
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    read_at TIMESTAMP NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE IF NOT EXISTS chat_messages_default PARTITION OF chat_messages DEFAULT;
+CREATE INDEX IF NOT EXISTS idx_chat_messages_chat ON chat_messages(chat_id, created_at);
 CREATE INDEX IF NOT EXISTS idx_chat_messages_created ON chat_messages(created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_chat_messages_read_at ON chat_messages(read_at);
 
+CREATE TABLE IF NOT EXISTS chat_message_reads (
+    id SERIAL,
+    message_id INTEGER NOT NULL,
+    message_created_at TIMESTAMP NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    read_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, message_created_at),
+    UNIQUE (message_id, message_created_at, user_id),
+    FOREIGN KEY (message_id, message_created_at) REFERENCES chat_messages(id, created_at) ON DELETE CASCADE
+) PARTITION BY RANGE (message_created_at);
+CREATE TABLE IF NOT EXISTS chat_message_reads_default PARTITION OF chat_message_reads DEFAULT;
+CREATE INDEX IF NOT EXISTS idx_chat_message_reads_user ON chat_message_reads(user_id);
+
+-- Профили HTTP-запросов (config/instrumentation.py): агрегаты по имени URL за день
+CREATE TABLE IF NOT EXISTS request_profiles (
+    id SERIAL PRIMARY KEY,
+    url_name VARCHAR(200) NOT NULL,
+    method VARCHAR(10) NOT NULL,
+    day DATE NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    total_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    max_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    db_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    queries BIGINT NOT NULL DEFAULT 0,
+    max_queries INTEGER NOT NULL DEFAULT 0,
+    template_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    over_budget INTEGER NOT NULL DEFAULT 0,
+    n_plus_one INTEGER NOT NULL DEFAULT 0,
+    slowest_sql TEXT,
+    slowest_sql_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    top_fingerprint TEXT,
+    top_fingerprint_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_request_profiles_url_method_day ON request_profiles(url_name, method, day);
+CREATE INDEX IF NOT EXISTS idx_request_profiles_day ON request_profiles(day);
+
+-- ===============================
+-- СВОДКА ПО УЧАЩЕМУСЯ
+-- ===============================
+-- Ведёт consultations/summary.py (пересчёт затронутых учащихся и ночная сверка); индексы по каждой
+-- колонке — сортировка списка учащихся без сортировки всех строк
+CREATE TABLE IF NOT EXISTS student_summary (
+    student_id INTEGER PRIMARY KEY REFERENCES students(id) ON DELETE CASCADE,
+    open_requests INTEGER NOT NULL DEFAULT 0,
+    total_requests INTEGER NOT NULL DEFAULT 0,
+    consultations INTEGER NOT NULL DEFAULT 0,
+    last_consultation_date DATE NULL,
+    last_message_at TIMESTAMP NULL,
+    unread_messages INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NULL
+);
+CREATE INDEX IF NOT EXISTS idx_student_summary_open_requests ON student_summary(open_requests DESC NULLS LAST, student_id);
+CREATE INDEX IF NOT EXISTS idx_student_summary_total_requests ON student_summary(total_requests DESC NULLS LAST, student_id);
+CREATE INDEX IF NOT EXISTS idx_student_summary_consultations ON student_summary(consultations DESC NULLS LAST, student_id);
+CREATE INDEX IF NOT EXISTS idx_student_summary_last_consultation_date ON student_summary(last_consultation_date DESC NULLS LAST, student_id);
+CREATE INDEX IF NOT EXISTS idx_student_summary_last_message_at ON student_summary(last_message_at DESC NULLS LAST, student_id);
+CREATE INDEX IF NOT EXISTS idx_student_summary_unread_messages ON student_summary(unread_messages DESC NULLS LAST, student_id);
+CREATE INDEX IF NOT EXISTS idx_requests_student ON requests(student_id);
+CREATE INDEX IF NOT EXISTS idx_consultations_request ON consultations(request_id);
+
 -- ===============================
 -- ПРОЦЕДУРЫ
 -- ===============================
@@ -330,6 +483,77 @@ CREATE TRIGGER log_consultation
 AFTER INSERT ON consultations
 FOR EACH ROW EXECUTE FUNCTION trg_log_consultation();
 
+-- Версия строки (updated_at) для ETag и условных ответов: любой UPDATE, не задавший updated_at сам,
+-- получает время записи
+CREATE OR REPLACE FUNCTION trg_touch_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at THEN
+        NEW.updated_at := clock_timestamp()::timestamp;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS touch_updated_at ON students;
+CREATE TRIGGER touch_updated_at
+BEFORE UPDATE ON students
+FOR EACH ROW EXECUTE FUNCTION trg_touch_updated_at();
+
+DROP TRIGGER IF EXISTS touch_updated_at ON requests;
+CREATE TRIGGER touch_updated_at
+BEFORE UPDATE ON requests
+FOR EACH ROW EXECUTE FUNCTION trg_touch_updated_at();
+
+DROP TRIGGER IF EXISTS touch_updated_at ON consultations;
+CREATE TRIGGER touch_updated_at
+BEFORE UPDATE ON consultations
+FOR EACH ROW EXECUTE FUNCTION trg_touch_updated_at();
+
+-- Изменение дочерней строки меняет версию родительской; аргументы: родительская таблица, столбец ссылки
+CREATE OR REPLACE FUNCTION trg_touch_parent()
+RETURNS TRIGGER AS $$
+DECLARE
+    new_id BIGINT;
+    old_id BIGINT;
+BEGIN
+    IF TG_OP <> 'DELETE' THEN
+        new_id := (to_jsonb(NEW) ->> TG_ARGV[1])::bigint;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        old_id := (to_jsonb(OLD) ->> TG_ARGV[1])::bigint;
+    END IF;
+    EXECUTE format('UPDATE %I SET updated_at = clock_timestamp()::timestamp WHERE id IN ($1, $2)', TG_ARGV[0])
+        USING new_id, old_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS touch_consultations ON consultation_students;
+CREATE TRIGGER touch_consultations
+AFTER INSERT OR UPDATE OR DELETE ON consultation_students
+FOR EACH ROW EXECUTE FUNCTION trg_touch_parent('consultations', 'consultation_id');
+
+DROP TRIGGER IF EXISTS touch_consultations ON notes;
+CREATE TRIGGER touch_consultations
+AFTER INSERT OR UPDATE OR DELETE ON notes
+FOR EACH ROW EXECUTE FUNCTION trg_touch_parent('consultations', 'consultation_id');
+
+DROP TRIGGER IF EXISTS touch_consultations ON attachments;
+CREATE TRIGGER touch_consultations
+AFTER INSERT OR UPDATE OR DELETE ON attachments
+FOR EACH ROW EXECUTE FUNCTION trg_touch_parent('consultations', 'consultation_id');
+
+DROP TRIGGER IF EXISTS touch_requests ON request_notes;
+CREATE TRIGGER touch_requests
+AFTER INSERT OR UPDATE OR DELETE ON request_notes
+FOR EACH ROW EXECUTE FUNCTION trg_touch_parent('requests', 'request_id');
+
+DROP TRIGGER IF EXISTS touch_requests ON consultations;
+CREATE TRIGGER touch_requests
+AFTER INSERT OR UPDATE OR DELETE ON consultations
+FOR EACH ROW EXECUTE FUNCTION trg_touch_parent('requests', 'request_id');
+
 -- ===============================
 -- ПРЕДСТАВЛЕНИЯ
 -- ===============================
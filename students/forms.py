@@ -79,3 +79,22 @@ class StudentForm(forms.ModelForm):
         if commit:
             obj.save()
         return obj
+
+
+class StudentImportForm(forms.Form):
+    file = forms.FileField(
+        label='Файл CSV или XLSX',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.xlsx'}),
+    )
+    dry_run = forms.BooleanField(
+        label='Пробный прогон (только проверить, ничего не записывать)',
+        required=False,
+        initial=True,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+    )
+
+    def clean_file(self):
+        f = self.cleaned_data['file']
+        if not f.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError('Поддерживаются файлы CSV и XLSX.')
+        return f
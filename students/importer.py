@@ -0,0 +1,413 @@
+"""
+Массовый импорт учащихся (с классами, классными руководителями и родителями) из CSV/XLSX.
+Файл читается потоком, строки проверяются пачками по правилам config.input_validation,
+дубликаты ищутся по индексу в памяти (один запрос), принятые строки загружаются через COPY
+во временные таблицы и сливаются в основные одной транзакцией.
+"""
+import csv
+import io
+import zipfile
+from contextlib import nullcontext
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+
+from config.input_validation import normalize_spaces, validate_cyrillic_name, validate_student_birth_date
+
+from .models import Classroom, Student, Teacher
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ROWS = 500
+DATE_FORMATS = ('%d.%m.%Y', '%Y-%m-%d', '%d/%m/%Y')
+
+# Имена столбцов файла (в нижнем регистре) → поле импорта
+COLUMN_ALIASES = {
+    'last_name': ('last_name', 'фамилия'),
+    'first_name': ('first_name', 'имя'),
+    'middle_name': ('middle_name', 'отчество'),
+    'birth_date': ('birth_date', 'дата рождения'),
+    'class_name': ('class', 'class_name', 'класс'),
+    'teacher_last_name': ('teacher_last_name', 'фамилия классного руководителя'),
+    'teacher_first_name': ('teacher_first_name', 'имя классного руководителя'),
+    'teacher_subject': ('teacher_subject', 'предмет классного руководителя'),
+    'teacher_email': ('teacher_email', 'email классного руководителя'),
+    'parent_last_name': ('parent_last_name', 'фамилия родителя'),
+    'parent_first_name': ('parent_first_name', 'имя родителя'),
+    'parent_phone': ('parent_phone', 'телефон родителя'),
+    'parent_email': ('parent_email', 'email родителя'),
+}
+REQUIRED_COLUMNS = ('last_name', 'first_name', 'middle_name', 'birth_date')
+
+_STAGING_SQL = (
+    "CREATE TEMP TABLE staging_teachers ("
+    " id INTEGER DEFAULT nextval(pg_get_serial_sequence('teachers', 'id')),"
+    " key TEXT, first_name VARCHAR(50), last_name VARCHAR(50), subject VARCHAR(50), email VARCHAR(50)"
+    ") ON COMMIT DROP",
+    "CREATE TEMP TABLE staging_classrooms ("
+    " name VARCHAR(10), teacher_id INTEGER, teacher_key TEXT"
+    ") ON COMMIT DROP",
+    "CREATE TEMP TABLE staging_students ("
+    " id INTEGER DEFAULT nextval(pg_get_serial_sequence('students', 'id')),"
+    " row_no INTEGER, first_name VARCHAR(50), last_name VARCHAR(50), class_name VARCHAR(10), birth_date DATE"
+    ") ON COMMIT DROP",
+    "CREATE TEMP TABLE staging_parents ("
+    " row_no INTEGER, first_name VARCHAR(50), last_name VARCHAR(50), phone VARCHAR(20), email VARCHAR(50)"
+    ") ON COMMIT DROP",
+)
+
+_MERGE_SQL = (
+    "INSERT INTO teachers (id, first_name, last_name, subject, email) "
+    "SELECT id, first_name, last_name, subject, email FROM staging_teachers",
+    # Существующему классу руководитель назначается, только если его ещё не было
+    "INSERT INTO classrooms (name, teacher_id) "
+    "SELECT c.name, COALESCE(c.teacher_id, t.id) FROM staging_classrooms c "
+    "LEFT JOIN staging_teachers t ON t.key = c.teacher_key "
+    "ON CONFLICT (name) DO UPDATE SET teacher_id = COALESCE(classrooms.teacher_id, EXCLUDED.teacher_id)",
+    "INSERT INTO students (id, first_name, last_name, class_id, birth_date) "
+    "SELECT s.id, s.first_name, s.last_name, c.id, s.birth_date FROM staging_students s "
+    "LEFT JOIN classrooms c ON c.name = s.class_name ORDER BY s.row_no",
+    "INSERT INTO parents (student_id, first_name, last_name, phone, email) "
+    "SELECT s.id, p.first_name, p.last_name, p.phone, p.email FROM staging_parents p "
+    "JOIN staging_students s ON s.row_no = p.row_no",
+    # Пустая сводка (consultations.summary): у новых учащихся ещё нет обращений и консультаций
+    "INSERT INTO student_summary (student_id) SELECT id FROM staging_students",
+)
+
+
+class ImportFileError(Exception):
+    """Файл нельзя импортировать целиком (формат, заголовок)."""
+
+
+# ——— Чтение файла ———
+
+def _map_header(header):
+    aliases = {alias: field for field, names in COLUMN_ALIASES.items() for alias in names}
+    mapping = {}
+    for idx, title in enumerate(header):
+        field = aliases.get(normalize_spaces(str(title or '')).lower())
+        if field and field not in mapping:
+            mapping[field] = idx
+    missing = [f for f in REQUIRED_COLUMNS if f not in mapping]
+    if missing:
+        labels = ', '.join(COLUMN_ALIASES[f][1] for f in missing)
+        raise ImportFileError(f'В файле нет обязательных столбцов: {labels}.')
+    return mapping
+
+
+def _iter_csv(fileobj, encoding='utf-8-sig', delimiter=None):
+    # Файл декодируется по мере чтения: ошибка кодировки возможна в любой строке, не только в заголовке
+    text = io.TextIOWrapper(fileobj, encoding=encoding, newline='')
+    try:
+        if not delimiter:
+            sample = text.read(4096)
+            text.seek(0)
+            try:
+                delimiter = csv.Sniffer().sniff(sample, delimiters=';,\t').delimiter
+            except csv.Error:
+                delimiter = ';'
+        yield from csv.reader(text, delimiter=delimiter)
+    except UnicodeDecodeError:
+        raise ImportFileError(f'Не удалось прочитать файл в кодировке {encoding}.')
+    except csv.Error as e:
+        raise ImportFileError(f'Файл CSV повреждён: {e}.')
+
+
+def _iter_xlsx(fileobj):
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        # KeyError — zip-архив без частей книги Excel
+        raise ImportFileError('Файл не является книгой Excel (XLSX) или повреждён.')
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def iter_rows(fileobj, filename, encoding='utf-8-sig', delimiter=None):
+    """Строки файла как (номер строки, {поле: значение}); первая строка — заголовок."""
+    if filename.lower().endswith('.xlsx'):
+        rows = _iter_xlsx(fileobj)
+    elif filename.lower().endswith(('.csv', '.txt')):
+        rows = _iter_csv(fileobj, encoding=encoding, delimiter=delimiter)
+    else:
+        raise ImportFileError('Поддерживаются файлы CSV и XLSX.')
+    try:
+        header = next(rows)
+    except StopIteration:
+        raise ImportFileError('Файл пуст.')
+    mapping = _map_header(header)
+    for row_no, values in enumerate(rows, start=2):
+        if not any(v not in (None, '') for v in values):
+            continue
+        yield row_no, {field: values[idx] if idx < len(values) else None for field, idx in mapping.items()}
+
+
+# ——— Проверка строк ———
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return normalize_spaces(str(value))
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = _text(value)
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValidationError('Дата рождения должна быть в формате ДД.ММ.ГГГГ.')
+
+
+class RowValidator:
+    """
+    Проверка строк пачкой. Одинаковые значения (имена, даты, классы) повторяются тысячи раз,
+    поэтому результат проверки каждого значения кэшируется.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def _check(self, kind, value, func):
+        key = (kind, value)
+        if key not in self._cache:
+            try:
+                self._cache[key] = (func(value), None)
+            except ValidationError as e:
+                self._cache[key] = (None, ' '.join(e.messages))
+        return self._cache[key]
+
+    def _name(self, value, label, errors, required=True):
+        value = _text(value)
+        if not value and not required:
+            return None
+        cleaned, error = self._check(label, value, lambda v: validate_cyrillic_name(v, label))
+        if error:
+            errors.append(error)
+        return cleaned
+
+    def _optional(self, kind, value, func, errors):
+        value = _text(value)
+        if not value:
+            return None
+        cleaned, error = self._check(kind, value, func)
+        if error:
+            errors.append(error)
+        return cleaned
+
+    def validate(self, raw):
+        """Возвращает (очищенная строка, список ошибок)."""
+        errors = []
+        row = {
+            'last_name': self._name(raw.get('last_name'), 'Фамилия', errors),
+            'first_name': self._name(raw.get('first_name'), 'Имя', errors),
+            'middle_name': self._name(raw.get('middle_name'), 'Отчество', errors),
+        }
+        birth_date = raw.get('birth_date')
+        row['birth_date'], error = self._check(
+            'birth_date', birth_date if isinstance(birth_date, date) else _text(birth_date),
+            lambda v: validate_student_birth_date(_parse_date(v) if v else None),
+        )
+        if error:
+            errors.append(error)
+        row['class_name'] = self._optional('class_name', raw.get('class_name'), _clean_class_name, errors)
+
+        teacher_last = self._name(raw.get('teacher_last_name'), 'Фамилия классного руководителя', errors, required=False)
+        teacher_first = self._name(raw.get('teacher_first_name'), 'Имя классного руководителя', errors, required=False)
+        teacher_email = self._optional('email', raw.get('teacher_email'), _clean_email, errors)
+        row['teacher'] = None
+        if teacher_last or teacher_email:
+            if not row['class_name']:
+                errors.append('Классный руководитель указан без класса.')
+            row['teacher'] = {
+                'last_name': teacher_last,
+                'first_name': teacher_first,
+                'subject': _text(raw.get('teacher_subject'))[:50] or None,
+                'email': teacher_email,
+            }
+
+        parent_last = self._name(raw.get('parent_last_name'), 'Фамилия родителя', errors, required=False)
+        parent_first = self._name(raw.get('parent_first_name'), 'Имя родителя', errors, required=False)
+        parent_phone = self._optional('phone', raw.get('parent_phone'), _clean_phone, errors)
+        parent_email = self._optional('email', raw.get('parent_email'), _clean_email, errors)
+        row['parent'] = None
+        if parent_last or parent_first or parent_phone or parent_email:
+            row['parent'] = {
+                'last_name': parent_last,
+                'first_name': parent_first,
+                'phone': parent_phone,
+                'email': parent_email,
+            }
+        if row['first_name'] and row['middle_name']:
+            row['full_first_name'] = f"{row['first_name']} {row['middle_name']}"
+            if len(row['full_first_name']) > 50:
+                errors.append('Имя с отчеством не должно превышать 50 символов.')
+        return row, errors
+
+
+def _clean_class_name(value):
+    value = value.replace(' ', '').upper()
+    if len(value) > 10:
+        raise ValidationError('Название класса не должно превышать 10 символов.')
+    return value
+
+
+def _clean_email(value):
+    if len(value) > 50:
+        raise ValidationError('Email не должен превышать 50 символов.')
+    validate_email(value)
+    return value.lower()
+
+
+def _clean_phone(value):
+    digits = ''.join(ch for ch in value if ch.isdigit())
+    if len(value) > 20 or not 5 <= len(digits) <= 15 or value.strip('+()- 0123456789'):
+        raise ValidationError('Укажите корректный телефон родителя.')
+    return value
+
+
+def teacher_key(teacher):
+    if teacher.get('email'):
+        return teacher['email'].lower()
+    return f"{(teacher.get('last_name') or '').lower()} {(teacher.get('first_name') or '').lower()}".strip()
+
+
+# ——— Индексы существующих данных (по одному запросу) ———
+
+def _student_key(last_name, first_name):
+    return (last_name or '').strip().lower(), (first_name or '').strip().lower()
+
+
+def load_indexes():
+    students = {_student_key(ln, fn) for ln, fn in Student.objects.values_list('last_name', 'first_name')}
+    classrooms = dict(Classroom.objects.values_list('name', 'teacher_id'))
+    teachers = {}
+    for pk, first_name, last_name, email in Teacher.objects.values_list('pk', 'first_name', 'last_name', 'email'):
+        teachers.setdefault(teacher_key({'first_name': first_name, 'last_name': last_name, 'email': email}), pk)
+        if email:
+            teachers.setdefault(teacher_key({'first_name': first_name, 'last_name': last_name}), pk)
+    return students, classrooms, teachers
+
+
+# ——— Загрузка ———
+
+def _copy_rows(cursor, table, columns, rows):
+    if not rows:
+        return
+    with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+
+
+class _Batch:
+    """Принятые строки учащихся и родителей, ожидающие COPY."""
+
+    def __init__(self):
+        self.students = []
+        self.parents = []
+
+    def __len__(self):
+        return len(self.students)
+
+    def flush(self, cursor):
+        _copy_rows(
+            cursor, 'staging_students', ('row_no', 'first_name', 'last_name', 'class_name', 'birth_date'), self.students
+        )
+        _copy_rows(cursor, 'staging_parents', ('row_no', 'first_name', 'last_name', 'phone', 'email'), self.parents)
+        self.students, self.parents = [], []
+
+
+def import_students(fileobj, filename, dry_run=False, encoding='utf-8-sig', delimiter=None, batch_size=BATCH_SIZE):
+    """
+    Импорт файла. При dry_run ничего не записывается: возвращается только отчёт.
+    Отчёт (dict): total, accepted, rejected, rejected_rows [{row, errors}], new_classrooms, new_teachers,
+    parents, dry_run.
+    """
+    if not dry_run and connection.vendor != 'postgresql':
+        raise ImportFileError('Загрузка через COPY доступна только для PostgreSQL; используйте пробный прогон.')
+    students_index, classrooms_index, teachers_index = load_indexes()
+    validator = RowValidator()
+    report = {
+        'total': 0, 'accepted': 0, 'rejected': 0, 'rejected_rows': [],
+        'new_classrooms': 0, 'new_teachers': 0, 'parents': 0, 'dry_run': dry_run,
+    }
+    # Классов и учителей немного — они копятся в памяти и загружаются в конце
+    new_teachers = {}
+    classrooms = {}
+    batch = _Batch()
+
+    with transaction.atomic(), (nullcontext() if dry_run else connection.cursor()) as cursor:
+        if cursor:
+            for statement in _STAGING_SQL:
+                cursor.execute(statement)
+
+        for row_no, raw in iter_rows(fileobj, filename, encoding=encoding, delimiter=delimiter):
+            report['total'] += 1
+            row, errors = validator.validate(raw)
+            if not errors:
+                key = _student_key(row['last_name'], row['full_first_name'])
+                if key in students_index:
+                    errors.append('Учащийся с таким ФИО уже существует.')
+                else:
+                    students_index.add(key)
+            if errors:
+                report['rejected'] += 1
+                if len(report['rejected_rows']) < MAX_REPORTED_ROWS:
+                    report['rejected_rows'].append({'row': row_no, 'errors': errors})
+                continue
+
+            report['accepted'] += 1
+            class_name = row['class_name']
+            teacher = row['teacher']
+            if teacher:
+                t_key = teacher_key(teacher)
+                if t_key not in teachers_index:
+                    new_teachers.setdefault(t_key, teacher)
+                if not classrooms_index.get(class_name) and not classrooms.get(class_name):
+                    classrooms[class_name] = t_key
+            if class_name and class_name not in classrooms_index:
+                classrooms.setdefault(class_name, None)
+            batch.students.append((row_no, row['full_first_name'], row['last_name'], class_name, row['birth_date']))
+            if row['parent']:
+                parent = row['parent']
+                report['parents'] += 1
+                batch.parents.append((row_no, parent['first_name'], parent['last_name'], parent['phone'], parent['email']))
+            if cursor and len(batch) >= batch_size:
+                batch.flush(cursor)
+
+        report['new_teachers'] = len(new_teachers)
+        report['new_classrooms'] = sum(1 for name in classrooms if name not in classrooms_index)
+        if cursor:
+            batch.flush(cursor)
+            _copy_rows(
+                cursor, 'staging_teachers', ('key', 'first_name', 'last_name', 'subject', 'email'),
+                [(k, t['first_name'], t['last_name'], t['subject'], t['email']) for k, t in new_teachers.items()],
+            )
+            _copy_rows(
+                cursor, 'staging_classrooms', ('name', 'teacher_id', 'teacher_key'),
+                [(name, teachers_index.get(k), k) for name, k in classrooms.items()],
+            )
+            for statement in _MERGE_SQL:
+                cursor.execute(statement)
+    return report
+
+
+def write_rejected_csv(report, fileobj):
+    """Отклонённые строки в CSV (для отчёта пробного прогона)."""
+    writer = csv.writer(fileobj, delimiter=';')
+    writer.writerow(['Строка', 'Ошибки'])
+    for item in report['rejected_rows']:
+        writer.writerow([item['row'], '; '.join(item['errors'])])
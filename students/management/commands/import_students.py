@@ -0,0 +1,52 @@
+"""
+Массовый импорт учащихся из CSV/XLSX (классы, классные руководители и родители создаются при необходимости).
+Использование: python manage.py import_students students_2026.xlsx --dry-run
+             python manage.py import_students students.csv --delimiter ";" --report rejected.csv
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from students import importer
+
+
+class Command(BaseCommand):
+    help = 'Импортирует учащихся из CSV/XLSX через COPY во временные таблицы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл CSV или XLSX; первая строка — заголовок')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить файл, ничего не записывая')
+        parser.add_argument('--report', default=None, help='Сохранить отклонённые строки в CSV')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Кодировка CSV (по умолчанию utf-8-sig)')
+        parser.add_argument('--delimiter', default=None, help='Разделитель CSV (по умолчанию определяется сам)')
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE, help='Строк в одной пачке COPY')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            with open(path, 'rb') as fh:
+                report = importer.import_students(
+                    fh,
+                    path,
+                    dry_run=options['dry_run'],
+                    encoding=options['encoding'],
+                    delimiter=options['delimiter'],
+                    batch_size=max(1, options['batch_size']),
+                )
+        except OSError as e:
+            raise CommandError(f'Не удалось открыть файл: {e}')
+        except importer.ImportFileError as e:
+            raise CommandError(str(e))
+
+        for item in report['rejected_rows'][:50]:
+            self.stdout.write(self.style.WARNING(f"Строка {item['row']}: {'; '.join(item['errors'])}"))
+        if report['rejected'] > 50:
+            self.stdout.write(f"… и ещё {report['rejected'] - 50} отклонённых строк")
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8-sig', newline='') as out:
+                importer.write_rejected_csv(report, out)
+
+        prefix = 'Пробный прогон: будет загружено' if report['dry_run'] else 'Загружено'
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} учащихся: {report['accepted']} из {report['total']}, отклонено: {report['rejected']}. "
+            f"Новых классов: {report['new_classrooms']}, учителей: {report['new_teachers']}, "
+            f"родителей: {report['parents']}."
+        ))
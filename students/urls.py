@@ -6,6 +6,7 @@ app_name = 'students'
 urlpatterns = [
     path('', views.StudentListView.as_view(), name='student_list'),
     path('create/', views.StudentCreateView.as_view(), name='student_create'),
+    path('import/', views.StudentImportView.as_view(), name='student_import'),
     path('my-profile/', views.StudentMyProfileView.as_view(), name='my_profile'),
     path('<int:pk>/', views.StudentDetailView.as_view(), name='student_detail'),
     path('<int:pk>/edit/', views.StudentUpdateView.as_view(), name='student_edit'),
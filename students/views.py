@@ -3,24 +3,48 @@ CRUD учащихся. Доступ: психолог, администрато
 """
 from django.db.models import Q
 from django.contrib import messages
-from django.shortcuts import redirect, get_object_or_404
+from django.shortcuts import redirect
 from django.urls import reverse_lazy
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
+from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView, FormView
 
 from users.decorators import AdminRequiredMixin, PsychologistRequiredMixin, StudentRequiredMixin
 from .models import Student
-from .forms import StudentForm
+from .forms import StudentForm, StudentImportForm
+from . import importer
+from config.pagination import KeysetPaginationMixin
 from consultations.models import Note, RequestNote
 
 
-class StudentListView(PsychologistRequiredMixin, ListView):
+class StudentListView(PsychologistRequiredMixin, KeysetPaginationMixin, ListView):
+    """
+    Список учащихся со сводкой по обращениям, консультациям и чату (student_summary).
+    Сортировка по колонке сводки — по убыванию, пустые значения и учащиеся без сводки в конце;
+    страницы — keyset (config.pagination).
+    """
     model = Student
     template_name = 'students/student_list.html'
     context_object_name = 'students'
     paginate_by = 10
+    # ?sort= → поле сводки; по показателям — по убыванию, пустые даты в конце
+    SORTS = {
+        'open': ('summary__open_requests', 'Открытые обращения'),
+        'requests': ('summary__total_requests', 'Всего обращений'),
+        'consultations': ('summary__consultations', 'Консультации'),
+        'last_consultation': ('summary__last_consultation_date', 'Последняя консультация'),
+        'last_message': ('summary__last_message_at', 'Последнее сообщение'),
+        'unread': ('summary__unread_messages', 'Непрочитанные'),
+    }
+    FILTERS = {
+        'open': ('summary__open_requests__gt', 'С открытыми обращениями'),
+        'unread': ('summary__unread_messages__gt', 'С непрочитанными сообщениями'),
+    }
+
+    def get_sort(self):
+        sort = self.request.GET.get('sort', '')
+        return sort if sort in self.SORTS else 'name'
 
     def get_queryset(self):
-        qs = Student.objects.all().order_by('last_name', 'first_name')
+        qs = Student.objects.select_related('classroom', 'summary')
         q = self.request.GET.get('q', '').strip()
         if q:
             qs = qs.filter(
@@ -28,11 +52,25 @@ class StudentListView(PsychologistRequiredMixin, ListView):
                 | Q(first_name__icontains=q)
                 | Q(classroom__name__icontains=q)
             )
+        only = self.request.GET.get('only', '')
+        if only in self.FILTERS:
+            qs = qs.filter(**{self.FILTERS[only][0]: 0})
         return qs
 
+    def get_keyset_ordering(self):
+        sort = self.get_sort()
+        if sort == 'name':
+            return ('last_name', 'first_name', 'id')
+        # LEFT JOIN сводки: учащиеся без строки student_summary остаются в списке, в конце (NULLS LAST)
+        return ('-' + self.SORTS[sort][0], 'id')
+
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         ctx['search_q'] = self.request.GET.get('q', '')
+        ctx['sort'] = self.get_sort()
+        ctx['only'] = self.request.GET.get('only', '')
+        ctx['sort_choices'] = [('name', 'ФИО')] + [(key, label) for key, (_, label) in self.SORTS.items()]
+        ctx['only_choices'] = [(key, label) for key, (_, label) in self.FILTERS.items()]
         return ctx
 
 
@@ -126,6 +164,24 @@ class StudentDeleteView(AdminRequiredMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 
+class StudentImportView(AdminRequiredMixin, FormView):
+    """Массовый импорт учащихся из CSV/XLSX с пробным прогоном."""
+    form_class = StudentImportForm
+    template_name = 'students/student_import.html'
+
+    def form_valid(self, form):
+        upload = form.cleaned_data['file']
+        dry_run = form.cleaned_data['dry_run']
+        try:
+            report = importer.import_students(upload.file, upload.name, dry_run=dry_run)
+        except importer.ImportFileError as e:
+            form.add_error('file', str(e))
+            return self.form_invalid(form)
+        if not dry_run:
+            messages.success(self.request, f"Импорт завершён: загружено учащихся {report['accepted']} из {report['total']}.")
+        return self.render_to_response(self.get_context_data(form=form, report=report))
+
+
 class StudentMyProfileView(StudentRequiredMixin, TemplateView):
     """Просмотр учащимся своей карточки (только чтение)."""
     template_name = 'students/student_my_profile.html'
@@ -2,9 +2,10 @@
 Декораторы и миксины для контроля доступа по ролям (psychologist, admin).
 """
 from functools import wraps
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.mixins import AccessMixin, LoginRequiredMixin, UserPassesTestMixin
 
 
 def role_required(*role_names):
@@ -40,3 +41,21 @@ class StudentRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
     """Доступ: только учащийся (роль student)."""
     def test_func(self):
         return self.request.user.role_name == 'student'
+
+
+def _load_user(request):
+    """Загружает request.user вместе с ролью (ленивый объект нельзя раскрывать в event loop)."""
+    user = request.user
+    if user.is_authenticated:
+        user.role_name
+    return user
+
+
+class AsyncStudentRequiredMixin(AccessMixin):
+    """То же, что StudentRequiredMixin, для async-представлений: пользователь загружается через sync_to_async."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await sync_to_async(_load_user)(request)
+        if not user.is_authenticated or user.role_name != 'student':
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
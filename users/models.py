@@ -8,6 +8,10 @@ from django.db import models
 class Role(models.Model):
     name = models.CharField(max_length=20, unique=True)
 
+    # Справочник ролей не меняется во время работы: имена по id кэшируются в процессе
+    # при первом обращении, и role_name не стоит запроса на каждой странице
+    _names = {}
+
     class Meta:
         db_table = 'roles'
         managed = False
@@ -15,6 +19,19 @@ class Role(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def load_names(cls):
+        cls._names = dict(cls.objects.values_list('id', 'name'))
+        return cls._names
+
+    @classmethod
+    def name_of(cls, role_id):
+        if role_id is None:
+            return None
+        if role_id not in cls._names:
+            cls.load_names()
+        return cls._names.get(role_id)
+
 
 class UserManager(BaseUserManager):
     def create_user(self, username, password=None, **kwargs):
@@ -68,11 +85,11 @@ class User(AbstractBaseUser):
 
     @property
     def is_administrator(self):
-        return self.role.name == 'admin'
+        return self.role_name == 'admin'
 
     @property
     def role_name(self):
-        return self.role.name if self.role_id else None
+        return Role.name_of(self.role_id)
 
     def get_role_display(self):
         return {'admin': 'Администратор', 'psychologist': 'Школьный психолог', 'student': 'Учащийся'}.get(self.role_name, self.role_name or '—')
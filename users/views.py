@@ -5,11 +5,12 @@ from django.contrib import messages
 from django.contrib.auth import login, logout
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.hashers import check_password, make_password
-from django.db.models import Case, Q, Value, When
+from django.db.models import Case, Value, When
 from django.shortcuts import redirect, render
 from django.urls import reverse_lazy
 from django.views.generic import CreateView, DeleteView, ListView, UpdateView
 
+from config.pagination import KeysetPaginationMixin
 from students.models import Student
 
 from .decorators import AdminRequiredMixin
@@ -120,14 +121,15 @@ def password_recovery_view(request):
 
 # --- Администратор: управление пользователями ---
 
-class UserListView(AdminRequiredMixin, ListView):
+class UserListView(AdminRequiredMixin, KeysetPaginationMixin, ListView):
     model = User
     template_name = 'users/user_list.html'
     context_object_name = 'users'
     paginate_by = 20
+    keyset_ordering = ('username', 'id')
 
     def get_queryset(self):
-        qs = User.objects.all().order_by('username')
+        qs = User.objects.all()
         q = self.request.GET.get('q', '').strip()
         if q:
             qs = qs.filter(username__icontains=q)